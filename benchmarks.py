@@ -0,0 +1,630 @@
+# benchmarks.py
+# Offline timings for the analytics kernels in main.py. No Google Sheets access is needed:
+# importing main under plain `python` runs Streamlit in bare mode and the app shows its
+# "secrets not found" path, which is fine for these pure functions. Loaders, the statement
+# parser (fed by statement_generator.py), the import/dedup path and the chunked, resumable import run against FakeGspreadClient,
+# an in-memory stand-in that charges latency, transfer time and per-minute quota to a simulated
+# clock (no real sleeping).
+# Every run is appended to a history file and compared with earlier runs of the same size.
+#
+# Usage: python benchmarks.py [rows] [--sheet-rows N] [--latency-ms MS] [--quota N]
+#                             [--history PATH | --no-history] [--tolerance 0.25] [--fail-on-regression]
+
+import io
+import sys
+import time
+import json
+import argparse
+import contextlib
+import collections
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import gspread
+
+import main
+import statement_generator
+
+
+def _best_of(fn, repeats=3):
+    # Best wall time over a few runs (seconds) and the last result
+    best_time, result = float('inf'), None
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        result = fn()
+        best_time = min(best_time, time.perf_counter() - t_start)
+    return best_time, result
+
+
+def _max_drawdown_loop(pnl_values, initial_balance):
+    # The per-row loop the AI Assistant used before compute_equity_drawdown, kept as the reference
+    current_balance_sim = initial_balance
+    peak_balance_sim = initial_balance
+    max_drawdown_sim = 0.0
+    for pnl_val in pnl_values:
+        current_balance_sim += pnl_val
+        if current_balance_sim > peak_balance_sim: peak_balance_sim = current_balance_sim
+        drawdown_val = peak_balance_sim - current_balance_sim
+        if drawdown_val > max_drawdown_sim: max_drawdown_sim = drawdown_val
+    return max_drawdown_sim
+
+
+def bench_equity_drawdown(n_rows=1_000_000, initial_balance=10000.0, seed=42):
+    rng = np.random.default_rng(seed)
+    pnl = rng.normal(2.0, 100.0, n_rows)
+    pnl_list = pnl.tolist()
+
+    loop_time, loop_max_dd = _best_of(lambda: _max_drawdown_loop(pnl_list, initial_balance), repeats=1)
+    kernel_time, kernel_stats = _best_of(lambda: main.compute_equity_drawdown(pnl, initial_balance))
+
+    if not np.isclose(loop_max_dd, kernel_stats['max_drawdown']):
+        raise AssertionError(f"Max drawdown mismatch: loop={loop_max_dd} kernel={kernel_stats['max_drawdown']}")
+    print(f"equity/drawdown rows={n_rows:,}")
+    print(f"  python loop (max DD only): {loop_time * 1000:10.1f} ms")
+    print(f"  compute_equity_drawdown  : {kernel_time * 1000:10.1f} ms  ({loop_time / kernel_time:,.1f}x)")
+    print(f"  max DD {kernel_stats['max_drawdown']:,.2f} ({kernel_stats['max_drawdown_pct']:.2f}%), "
+          f"longest underwater {kernel_stats['max_underwater_trades']:,} trades")
+    return {'rows': n_rows, 'loop_s': loop_time, 'kernel_s': kernel_time}
+
+
+def _synthetic_deals(n_deals, seed=42):
+    # Hedging-style deal log: every 'in' deal is later closed by one or two 'out' deals on the same symbol/side
+    rng = np.random.default_rng(seed)
+    n_positions = n_deals // 3
+    symbols = rng.choice(['XAUUSD', 'EURUSD', 'GBPUSD', 'USDJPY'], n_positions)
+    sides = rng.choice(['buy', 'sell'], n_positions)
+    volumes = rng.choice([0.02, 0.1, 0.5, 1.0], n_positions)
+    open_minutes = np.sort(rng.integers(0, n_positions * 10, n_positions))
+    first_close = open_minutes + rng.integers(1, 600, n_positions)
+    second_close = first_close + rng.integers(1, 600, n_positions)
+    close_sides = np.where(sides == 'buy', 'sell', 'buy')
+    base_time = np.datetime64('2025-01-01T00:00')
+    deals = pd.DataFrame({
+        'Time_Deal': np.concatenate([open_minutes, first_close, second_close]).astype('timedelta64[m]') + base_time,
+        'Symbol_Deal': np.concatenate([symbols, symbols, symbols]),
+        'Type_Deal': np.concatenate([sides, close_sides, close_sides]),
+        'Direction_Deal': np.repeat(['in', 'out', 'out'], n_positions),
+        'Volume_Deal': np.concatenate([volumes, volumes / 2, volumes / 2]),
+        'Price_Deal': rng.normal(100, 1, n_positions * 3),
+        'Commission_Deal': -rng.uniform(0, 5, n_positions * 3),
+        'Fee_Deal': 0.0, 'Swap_Deal': 0.0,
+        'Profit_Deal': np.concatenate([np.zeros(n_positions), rng.normal(0, 50, n_positions * 2)]),
+        'PortfolioID': 'bench'
+    }).sort_values('Time_Deal', kind='stable').reset_index(drop=True)
+    deals['Deal_ID'] = np.arange(1, len(deals) + 1)
+    return deals
+
+
+def _check_orphan_exit_round_trip():
+    # An exit whose entry is not in the data (opened before the import window) must not close the next entry
+    deals = pd.DataFrame({
+        'Time_Deal': pd.to_datetime(['2025-01-02 09:00', '2025-01-02 10:00', '2025-01-02 11:00']),
+        'Symbol_Deal': 'EURUSD', 'Type_Deal': ['sell', 'buy', 'sell'], 'Direction_Deal': ['out', 'in', 'out'],
+        'Volume_Deal': 1.0, 'Price_Deal': [1.11, 1.10, 1.12], 'Commission_Deal': 0.0, 'Fee_Deal': 0.0, 'Swap_Deal': 0.0,
+        'Profit_Deal': [50.0, 0.0, 200.0], 'PortfolioID': 'bench', 'Deal_ID': [1, 2, 3]
+    })
+    trades = main.reconstruct_round_trip_trades(deals)
+    closed = trades[trades['Status'] == 'Closed']
+    if len(closed) != 1 or (closed['ExitTime'] < closed['EntryTime']).any() or not np.isclose(closed['Profit'].iloc[0], 200.0):
+        raise AssertionError(f"Orphan exit matched to a later entry:\n{trades}")
+
+
+def bench_round_trips(n_deals=300_000):
+    _check_orphan_exit_round_trip()
+    deals = _synthetic_deals(n_deals)
+    recon_time, trades = _best_of(lambda: main.reconstruct_round_trip_trades(deals))
+    print(f"round-trip reconstruction deals={len(deals):,}")
+    print(f"  reconstruct_round_trip_trades: {recon_time * 1000:10.1f} ms -> {len(trades):,} trades ({(trades['Status'] == 'Closed').sum():,} closed)")
+    return {'rows': len(deals), 'reconstruct_s': recon_time}
+
+
+def bench_search(n_rows=500_000, append_rows=10_000, seed=42):
+    rng = np.random.default_rng(seed)
+    deals = _synthetic_deals(n_rows * 3 // 2).head(n_rows).copy()
+    deals['Comment_Deal'] = rng.choice(['sl 2345.10', 'tp 2401.5', '[sl]', '', 'manual close'], len(deals))
+    deals['PortfolioName'] = rng.choice(['Main FTMO', 'Prop Two', 'Personal'], len(deals))
+    deals['ImportBatchID'] = 'bench'
+    search_index = main._new_search_index('actual')
+    build_time, _ = _best_of(lambda: main.update_search_index(search_index, deals.iloc[:len(deals) - append_rows]), repeats=1)
+    append_time, _ = _best_of(lambda: main.update_search_index(search_index, deals), repeats=1)
+    print(f"log/deal search rows={len(deals):,}")
+    print(f"  initial index build: {build_time * 1000:10.1f} ms, append {append_rows:,} rows: {append_time * 1000:8.1f} ms")
+    query_times = {}
+    for query in ['xau', 'xau sl profit<0', 'ftmo lot>=0.5', 'profit:-10..10 out', 'eurusd personal tp lot=0.1']:
+        query_time, (rows, _) = _best_of(lambda: main.search_rows(search_index, query))
+        query_times[query] = query_time
+        print(f"  {query!r:32}: {query_time * 1000:8.2f} ms -> {len(rows):,} rows")
+    return {'rows': len(deals), 'build_s': build_time, 'append_s': append_time, 'query_s': query_times}
+
+
+def bench_excursions(n_trades=30_000, n_bars=1_000_000, seed=42):
+    rng = np.random.default_rng(seed)
+    bar_times = pd.date_range('2024-01-01', periods=n_bars, freq='min')
+    close = 100 + np.cumsum(rng.normal(0, 0.05, n_bars))
+    entry_times = bar_times[0] + pd.to_timedelta(rng.uniform(0, n_bars * 60 * 0.95, n_trades), unit='s')
+    entry_price = rng.normal(100, 2, n_trades)
+    trips = pd.DataFrame({'EntryDealID': np.arange(n_trades), 'PortfolioID': 'bench', 'Symbol': 'XAUUSD', 'Side': rng.choice(['Long', 'Short'], n_trades),
+                          'EntryTime': entry_times, 'ExitTime': entry_times + pd.to_timedelta(rng.uniform(60, 2 * 86400, n_trades), unit='s'),
+                          'EntryPrice': entry_price, 'ExitPrice': entry_price, 'NetPL': rng.normal(0, 10, n_trades), 'Status': 'Closed'})
+    with tempfile.TemporaryDirectory() as store_dir:
+        main.append_bars('XAUUSD', pd.DataFrame({'Time': bar_times, 'Open': close, 'High': close + 0.02, 'Low': close - 0.02, 'Close': close, 'Volume': 1.0}), store_dir)
+        exc_time, excursions = _best_of(lambda: main.compute_trade_excursions(trips, None, 24.0, store_dir))
+    print(f"trade excursions trades={n_trades:,} over {n_bars:,} M1 bars")
+    print(f"  compute_trade_excursions: {exc_time * 1000:10.1f} ms ({excursions['MAE'].notna().sum():,} with bars)")
+    return {'trades': n_trades, 'bars': n_bars, 'excursions_s': exc_time}
+
+
+# --- Offline Google Sheets stand-in -------------------------------------------------------------
+
+DEAL_SHEET_HEADERS = ["Time_Deal", "Deal_ID", "Symbol_Deal", "Type_Deal", "Direction_Deal", "Volume_Deal", "Price_Deal", "Order_ID_Deal",
+                      "Commission_Deal", "Fee_Deal", "Swap_Deal", "Profit_Deal", "Balance_Deal", "Comment_Deal",
+                      "PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID"]
+PLAN_SHEET_HEADERS = ["LogID", "PortfolioID", "PortfolioName", "Timestamp", "Asset", "Mode", "Direction",
+                      "Risk %", "Fibo Level", "Entry", "SL", "TP", "Lot", "Risk $", "RR"]
+PORTFOLIO_SHEET_HEADERS = ["PortfolioID", "PortfolioName", "ProgramType", "Status", "InitialBalance", "CreationDate",
+                           "ProfitTargetPercent", "DailyLossLimitPercent", "TotalStopoutPercent", "EnableScaling", "ScalingCheckFrequency",
+                           "MinRiskPercentAllowed", "MaxRiskPercentAllowed", "CurrentRiskPercent"]
+SUMMARY_SHEET_HEADERS = ["Timestamp", "PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID", "Balance", "Equity"]
+
+
+class FakeQuotaExceeded(gspread.exceptions.GSpreadException):
+    pass
+
+
+class _SizedPayload:
+    # Stands in for response.content / request.body; only len() is read (main's telemetry byte counts)
+    def __init__(self, n_bytes):
+        self.n_bytes = int(n_bytes)
+
+    def __len__(self):
+        return self.n_bytes
+
+    def __bool__(self):
+        return self.n_bytes > 0
+
+
+class _FakeResponse:
+    def __init__(self, sent_bytes, received_bytes):
+        self.content = _SizedPayload(received_bytes)
+        self.request = type('FakePreparedRequest', (), {'body': _SizedPayload(sent_bytes)})()
+
+
+class FakeSheetsHTTP:
+    # Simulated clock: every request costs latency_ms plus its bytes over bandwidth_kb_s. Past quota_per_minute requests
+    # in a rolling simulated minute it either waits for the window to reopen (on_quota="wait") or raises FakeQuotaExceeded.
+    def __init__(self, latency_ms=150.0, bandwidth_kb_s=4000.0, quota_per_minute=60, on_quota="wait"):
+        self.latency_ms, self.bandwidth_kb_s = latency_ms, bandwidth_kb_s
+        self.quota_per_minute, self.on_quota = quota_per_minute, on_quota
+        self.clock_s, self.calls, self.bytes, self.quota_waits = 0.0, 0, 0, 0
+        self._recent_starts = []
+
+    def request(self, method, endpoint, sent_bytes=0, received_bytes=0):
+        self._recent_starts = [t for t in self._recent_starts if self.clock_s - t < 60.0]
+        while self.quota_per_minute and len(self._recent_starts) >= self.quota_per_minute:
+            if self.on_quota == "raise":
+                raise FakeQuotaExceeded(f"{method} {endpoint}: over {self.quota_per_minute} requests/minute")
+            self.quota_waits += 1
+            self.clock_s = self._recent_starts.pop(0) + 60.0
+        self._recent_starts.append(self.clock_s)
+        self.clock_s += self.latency_ms / 1000.0 + (sent_bytes + received_bytes) / (self.bandwidth_kb_s * 1024.0)
+        self.calls += 1
+        self.bytes += sent_bytes + received_bytes
+        return _FakeResponse(sent_bytes, received_bytes)
+
+    def snapshot(self):
+        return {'calls': self.calls, 'bytes': self.bytes, 'simulated_s': self.clock_s, 'quota_waits': self.quota_waits}
+
+
+def _cells_bytes(rows):
+    # Approximate JSON payload of a block of rows; large blocks are sampled so accounting stays cheap at 1M rows
+    if not rows:
+        return 0
+    sample = rows if len(rows) <= 200 else rows[::max(1, len(rows) // 200)]
+    sample_bytes = sum(sum(len(str(cell)) + 3 for cell in row) + 2 for row in sample)
+    return int(sample_bytes * len(rows) / len(sample))
+
+
+class FakeWorksheet:
+    # The slice of gspread.Worksheet that main.py uses; values are kept as strings like the Sheets API returns them
+    def __init__(self, http, title, values=None):
+        self._http, self.title = http, title
+        self._values = [list(row) for row in (values or [])]
+
+    @property
+    def row_count(self):
+        return max(len(self._values), 1000) # A new sheet has a 1000-row grid
+
+    def _request(self, method, endpoint, sent_rows=None, received_rows=None):
+        # Goes through the (possibly telemetry-wrapped) http_client attribute, like gspread does
+        return self._http.request(method, f"{self.title}!{endpoint}", _cells_bytes(sent_rows), _cells_bytes(received_rows))
+
+    def row_values(self, row):
+        values = list(self._values[row - 1]) if len(self._values) >= row else []
+        self._request("GET", f"{row}:{row}", received_rows=[values])
+        return values
+
+    def col_values(self, col):
+        values = [row[col - 1] if len(row) >= col else "" for row in self._values]
+        while values and values[-1] == "":
+            values.pop()
+        self._request("GET", f"col {col}", received_rows=[[v] for v in values])
+        return values
+
+    def get_all_values(self, **kwargs):
+        self._request("GET", "values", received_rows=self._values)
+        return [list(row) for row in self._values]
+
+    def get_all_records(self, expected_headers=None, numericise_ignore=None, **kwargs):
+        # main always passes numericise_ignore=['all'], so cells stay strings
+        all_values = self.get_all_values()
+        if not all_values:
+            return []
+        headers = all_values[0]
+        return [dict(zip(headers, row + [""] * (len(headers) - len(row)))) for row in all_values[1:]]
+
+    def _write(self, start_row, start_col, values):
+        for row_offset, row_values in enumerate(values):
+            row_index = start_row - 1 + row_offset
+            while len(self._values) <= row_index:
+                self._values.append([])
+            target_row = self._values[row_index]
+            if len(target_row) < start_col - 1 + len(row_values):
+                target_row.extend([""] * (start_col - 1 + len(row_values) - len(target_row)))
+            target_row[start_col - 1:start_col - 1 + len(row_values)] = [str(v) for v in row_values]
+
+    def update(self, values=None, range_name=None, value_input_option=None, **kwargs):
+        start_row, start_col = gspread.utils.a1_to_rowcol((range_name or "A1").split(':')[0])
+        self._request("PUT", range_name or "A1", sent_rows=values)
+        self._write(start_row, start_col, values)
+
+    def batch_update(self, data, value_input_option=None, **kwargs):
+        self._request("POST", "values:batchUpdate", sent_rows=[row for item in data for row in item['values']])
+        for item in data:
+            self._write(*gspread.utils.a1_to_rowcol(item['range'].split(':')[0]), item['values'])
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        self.append_rows([values], value_input_option=value_input_option)
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        self._request("POST", "values:append", sent_rows=values)
+        self._values.extend([str(v) for v in row] for row in values)
+
+
+class FakeSpreadsheet:
+    def __init__(self, http, worksheets):
+        self._http, self._worksheets = http, worksheets
+
+    def worksheet(self, title):
+        self._http.request("GET", "spreadsheet metadata", 0, 200 * len(self._worksheets))
+        if title not in self._worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self._http.request("POST", "spreadsheet batchUpdate", 100, 200)
+        self._worksheets[title] = FakeWorksheet(self._http, title)
+        return self._worksheets[title]
+
+
+class FakeGspreadClient:
+    # One spreadsheet behind every title; `open` costs a request like gspread's Drive lookup
+    def __init__(self, sheet_values, **http_options):
+        self.http_client = FakeSheetsHTTP(**http_options)
+        self._spreadsheet = FakeSpreadsheet(self.http_client, {title: FakeWorksheet(self.http_client, title, values)
+                                                               for title, values in sheet_values.items()})
+
+    def open(self, title):
+        self.http_client.request("GET", f"drive files ({title})", 0, 500)
+        return self._spreadsheet
+
+
+@contextlib.contextmanager
+def fake_sheets_backend(client):
+    # Points main's loaders / savers at the fake client (wrapped by main's telemetry) with cold caches
+    original_client_fn = main.get_gspread_client
+    main.get_gspread_client = lambda: main.instrument_gspread_client(client)
+    _clear_main_caches()
+    try:
+        yield client
+    finally:
+        main.get_gspread_client = original_client_fn
+        _clear_main_caches()
+
+
+def _clear_main_caches():
+    for attr_name in dir(main):
+        if attr_name.startswith('load_') and hasattr(getattr(main, attr_name), 'clear'):
+            getattr(main, attr_name).clear()
+
+
+def _as_sheet_rows(df, headers):
+    return [list(headers)] + df.reindex(columns=headers).fillna("").astype(str).values.tolist()
+
+
+def _synthetic_plans(n_logs, n_portfolios=3, seed=42):
+    rng = np.random.default_rng(seed)
+    portfolio_idx = rng.integers(0, n_portfolios, n_logs)
+    entry = np.round(rng.normal(2300, 40, n_logs), 2)
+    direction = rng.choice(['Long', 'Short'], n_logs)
+    stop_distance = rng.uniform(2, 10, n_logs)
+    return pd.DataFrame({
+        'LogID': [f"L{i}" for i in range(n_logs)], 'PortfolioID': [f"bench-{i}" for i in portfolio_idx],
+        'PortfolioName': [f"Bench {i}" for i in portfolio_idx],
+        'Timestamp': (np.datetime64('2025-01-01T00:00') + np.sort(rng.integers(0, n_logs * 30, n_logs)).astype('timedelta64[m]')),
+        'Asset': rng.choice(['XAUUSD', 'EURUSD'], n_logs), 'Mode': rng.choice(['FIBO', 'CUSTOM'], n_logs), 'Direction': direction,
+        'Risk %': 1.0, 'Fibo Level': 0.382, 'Entry': entry,
+        'SL': np.round(np.where(direction == 'Long', entry - stop_distance, entry + stop_distance), 2),
+        'TP': np.round(np.where(direction == 'Long', entry + 2 * stop_distance, entry - 2 * stop_distance), 2),
+        'Lot': 0.1, 'Risk $': np.round(rng.normal(5, 100, n_logs), 2), 'RR': 2.0})
+
+
+def _synthetic_portfolios(n_portfolios=3):
+    return pd.DataFrame({
+        'PortfolioID': [f"bench-{i}" for i in range(n_portfolios)], 'PortfolioName': [f"Bench {i}" for i in range(n_portfolios)],
+        'ProgramType': "Prop Firm Challenge", 'Status': "Active", 'InitialBalance': 10000.0, 'CreationDate': "2025-01-01 00:00:00",
+        'ProfitTargetPercent': 8.0, 'DailyLossLimitPercent': 5.0, 'TotalStopoutPercent': 10.0, 'EnableScaling': True,
+        'ScalingCheckFrequency': "Weekly", 'MinRiskPercentAllowed': 0.25, 'MaxRiskPercentAllowed': 2.0, 'CurrentRiskPercent': 1.0})
+
+
+def build_fake_trade_log(n_sheet_rows, n_portfolios=3, seed=42, **http_options):
+    # A TradeLog spreadsheet with n_sheet_rows deals and plans spread over n_portfolios
+    deals = _synthetic_deals(n_sheet_rows * 3 // 2 + 3, seed=seed).head(n_sheet_rows).copy()
+    deals['Time_Deal'] = deals['Time_Deal'].dt.strftime('%Y.%m.%d %H:%M:%S')
+    deals['PortfolioID'] = [f"bench-{i % n_portfolios}" for i in range(len(deals))]
+    deals['PortfolioName'] = deals['PortfolioID'].str.replace("bench-", "Bench ")
+    deals['Balance_Deal'] = 10000.0 + deals['Profit_Deal'].cumsum().round(2)
+    deals[['SourceFile', 'ImportBatchID', 'Comment_Deal']] = ["bench.csv", "bench-batch", ""]
+    summaries = pd.DataFrame({'Timestamp': "2025-06-01 00:00:00", 'PortfolioID': [f"bench-{i}" for i in range(n_portfolios)],
+                              'PortfolioName': "", 'SourceFile': "bench.csv", 'ImportBatchID': "bench-batch", 'Balance': 10000.0, 'Equity': 10100.0})
+    sheet_values = {
+        main.WORKSHEET_PORTFOLIOS: _as_sheet_rows(_synthetic_portfolios(n_portfolios), PORTFOLIO_SHEET_HEADERS),
+        main.WORKSHEET_PLANNED_LOGS: _as_sheet_rows(_synthetic_plans(n_sheet_rows, n_portfolios, seed), PLAN_SHEET_HEADERS),
+        main.WORKSHEET_ACTUAL_TRADES: _as_sheet_rows(deals, DEAL_SHEET_HEADERS),
+        main.WORKSHEET_STATEMENT_SUMMARIES: _as_sheet_rows(summaries, SUMMARY_SHEET_HEADERS),
+        main.WORKSHEET_UPLOAD_HISTORY: [["UploadTimestamp", "PortfolioID", "PortfolioName", "FileName", "FileSize", "FileHash", "Status", "ImportBatchID", "Notes"]],
+        main.WORKSHEET_ACTUAL_ORDERS: [], main.WORKSHEET_ACTUAL_POSITIONS: []
+    }
+    return FakeGspreadClient(sheet_values, **http_options)
+
+
+def _api_delta(before, after):
+    return {key: after[key] - before[key] for key in before}
+
+
+def bench_sheet_loaders(n_sheet_rows=10_000, http_options=None):
+    client = build_fake_trade_log(n_sheet_rows, **(http_options or {}))
+    results = {'rows': n_sheet_rows}
+    print(f"sheet loaders rows={n_sheet_rows:,} (fake Sheets: {client.http_client.latency_ms:g} ms latency, {client.http_client.quota_per_minute} req/min)")
+    with fake_sheets_backend(client):
+        for loader in [main.load_portfolios_from_gsheets, main.load_all_planned_trade_logs_from_gsheets,
+                       main.load_actual_trades_from_gsheets, main.load_statement_summaries_from_gsheets]:
+            api_before = client.http_client.snapshot()
+            cold_time, df_loaded = _best_of(loader, repeats=1)
+            api_used = _api_delta(api_before, client.http_client.snapshot())
+            hit_time, _ = _best_of(loader)
+            print(f"  {loader.__name__:42}: {cold_time * 1000:9.1f} ms cold, {hit_time * 1000:7.2f} ms cache hit, "
+                  f"{api_used['simulated_s']:6.2f} s simulated API ({api_used['calls']} calls, {api_used['bytes'] / 1024:,.0f} KB) -> {len(df_loaded):,} rows")
+            results[loader.__name__] = {'cold_s': cold_time, 'hit_s': hit_time, 'api_simulated_s': api_used['simulated_s'], 'api_calls': api_used['calls']}
+    return results
+
+
+def bench_statement_parse(n_deals=100_000):
+    gen_time, (statement_text, _) = _best_of(lambda: statement_generator.statement_text(n_deals), repeats=1)
+    parse_time, extracted = _best_of(lambda: main.extract_data_from_report_content_sec6(statement_text), repeats=1)
+    if len(extracted['deals']) != n_deals:
+        raise AssertionError(f"Parser returned {len(extracted['deals'])} deals for {n_deals} generated")
+    print(f"statement parse deals={n_deals:,} ({len(statement_text) / 1e6:,.1f} MB, generated in {gen_time * 1000:,.0f} ms)")
+    print(f"  extract_data_from_report_content_sec6: {parse_time * 1000:10.1f} ms ({n_deals / parse_time:,.0f} deals/s, "
+          f"{len(extracted['positions']):,} positions, {len(extracted['orders']):,} orders)")
+    return {'deals': n_deals, 'parse_s': parse_time}
+
+
+def bench_statement_import(n_deals=20_000, n_sheet_rows=100_000, http_options=None):
+    # Dedup path of import_statement_chunked_sec6 (the SEC 6 import): half the statement is already in ActualTrades for this portfolio
+    statement_bytes = statement_generator.statement_text(n_deals)[0].encode('utf-8')
+    df_statement_deals = main.extract_data_from_report_content_sec6(statement_bytes)['deals']
+    client = build_fake_trade_log(n_sheet_rows, **(http_options or {}))
+    spreadsheet = client.open(main.GOOGLE_SHEET_NAME)
+    ws_by_table = {table: spreadsheet.worksheet(spec['worksheet']) for table, spec in main.STATEMENT_IMPORT_TABLES.items()}
+    ws_deals = ws_by_table['deals']
+    df_already = df_statement_deals.iloc[:n_deals // 2].assign(PortfolioID="bench-import", PortfolioName="Bench Import", SourceFile="old.csv", ImportBatchID="old")
+    ws_deals._values.extend(_as_sheet_rows(df_already, DEAL_SHEET_HEADERS)[1:])
+    print(f"statement import deals={n_deals:,} into ActualTrades with {len(ws_deals._values) - 1:,} rows")
+    results = {'deals': n_deals, 'sheet_rows': len(ws_deals._values) - 1}
+    with fake_sheets_backend(client):
+        for run_label in ['first', 'repeat']:
+            api_before = client.http_client.snapshot()
+            import_time, import_result = _best_of(lambda: main.import_statement_chunked_sec6(
+                io.BytesIO(statement_bytes), ws_by_table, "bench-import", "Bench Import", "bench.csv", f"batch-{run_label}"), repeats=1)
+            api_used = _api_delta(api_before, client.http_client.snapshot())
+            n_new, n_dup = import_result['tables']['deals']['new'], import_result['tables']['deals']['skipped']
+            if import_result['error'] or n_new + n_dup != len(df_statement_deals):
+                raise AssertionError(f"Import {run_label}: error={import_result['error']} new={n_new} dup={n_dup} of {len(df_statement_deals)}")
+            print(f"  import_statement_chunked_sec6 ({run_label:6}): {import_time * 1000:10.1f} ms, {api_used['simulated_s']:6.2f} s simulated API "
+                  f"({api_used['calls']} calls, {api_used['bytes'] / 1024:,.0f} KB) -> {n_new:,} new, {n_dup:,} duplicate deals")
+            results[run_label] = {'import_s': import_time, 'api_simulated_s': api_used['simulated_s'], 'api_calls': api_used['calls']}
+    return results
+
+
+def bench_chunked_import(n_deals=20_000, chunk_rows=1_000, http_options=None):
+    # import_statement_chunked_sec6 with a quota that raises: every failed run is resumed from the checkpoint it left in
+    # UploadHistory until the statement is in, then each deal must be in ActualTrades exactly once. Also compares peak traced
+    # memory of the streamed parse with the whole-file parse.
+    statement_bytes = statement_generator.statement_text(n_deals)[0].encode('utf-8')
+    expected_deal_ids = main.extract_data_from_report_content_sec6(statement_bytes)['deals']['Deal_ID'].astype(str).str.strip()
+    client = build_fake_trade_log(1_000, **{**(http_options or {}), 'on_quota': "raise"})
+    spreadsheet = client.open(main.GOOGLE_SHEET_NAME)
+    ws_by_table = {table: spreadsheet.worksheet(spec['worksheet']) for table, spec in main.STATEMENT_IMPORT_TABLES.items()}
+    ws_history = spreadsheet.worksheet(main.WORKSHEET_UPLOAD_HISTORY)
+    ws_history._values.append(["2025-06-01 00:00:00", "bench-import", "Bench Import", "bench.csv", len(statement_bytes), "", "Processing", "bench-chunked", ""])
+
+    def save_checkpoint(checkpoint):
+        try: ws_history.batch_update([{'range': f'I{len(ws_history._values)}', 'values': [[main.format_import_checkpoint(checkpoint)]]}])
+        except FakeQuotaExceeded: pass # Like SEC 6: a lost checkpoint only means that chunk is re-sent and deduplicated
+
+    print(f"chunked statement import deals={n_deals:,} in {chunk_rows:,}-row chunks ({client.http_client.quota_per_minute} req/min, raising)")
+    results = {'deals': n_deals, 'runs': 0, 'import_s': 0.0, 'api_simulated_s': 0.0}
+    with fake_sheets_backend(client):
+        checkpoint = {'rows': chunk_rows}
+        while results['runs'] < 1_000:
+            api_before = client.http_client.snapshot()
+            run_time, import_result = _best_of(lambda: main.import_statement_chunked_sec6(
+                io.BytesIO(statement_bytes), ws_by_table, "bench-import", "Bench Import", "bench.csv", "bench-chunked",
+                checkpoint=checkpoint, save_checkpoint=save_checkpoint), repeats=1)
+            results['runs'] += 1; results['import_s'] += run_time
+            results['api_simulated_s'] += _api_delta(api_before, client.http_client.snapshot())['simulated_s']
+            if not import_result['error']:
+                break
+            checkpoint = main.parse_import_checkpoint(ws_history._values[-1][8]) or checkpoint
+            client.http_client.clock_s += 60.0 # The user re-uploads after the quota window has passed
+    stored_deal_ids = [row[1] for row in ws_by_table['deals']._values[1:] if row[14] == "bench-import"]
+    if import_result['error'] or sorted(stored_deal_ids) != sorted(expected_deal_ids):
+        raise AssertionError(f"Resumed import stored {len(stored_deal_ids)} deals ({len(set(stored_deal_ids))} unique) for {len(expected_deal_ids)} parsed: {import_result['error']}")
+    print(f"  import_statement_chunked_sec6: {results['runs']} runs, {results['import_s'] * 1000:10.1f} ms total, "
+          f"{results['api_simulated_s']:6.2f} s simulated API -> {len(stored_deal_ids):,} deals once each")
+
+    stream_parse = lambda: collections.deque(main.iter_statement_chunks_sec6(io.BytesIO(statement_bytes), chunk_rows), maxlen=0)
+    results['stream_parse_s'], _ = _best_of(stream_parse, repeats=1)
+    for label, parse in [('whole_file', lambda: main.extract_data_from_report_content_sec6(statement_bytes)), ('streamed', stream_parse)]:
+        tracemalloc.start()
+        parse()
+        results[f'{label}_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    print(f"  iter_statement_chunks_sec6: {results['stream_parse_s'] * 1000:10.1f} ms, peak traced {results['streamed_peak_mb']:,.1f} MB "
+          f"vs {results['whole_file_peak_mb']:,.1f} MB whole-file ({len(statement_bytes) / 1e6:,.1f} MB statement)")
+    return results
+
+
+def bench_planners(n_logs=200_000, append_rows=1_000):
+    # Scaling planner (performance windows + per-portfolio rules) and plan-vs-actual matching on synthetic logs
+    df_plans = _synthetic_plans(n_logs)
+    df_portfolios = _synthetic_portfolios()
+    build_time, window_state = _best_of(lambda: main.update_performance_windows(None, df_plans.iloc[:n_logs - append_rows]), repeats=1)
+    append_time, window_state = _best_of(lambda: main.update_performance_windows(window_state, df_plans), repeats=1)
+    rules_time, df_rules = _best_of(lambda: main.evaluate_scaling_rules(df_portfolios, window_state))
+    n_deals = max(3, n_logs // 2)
+    df_deals = _synthetic_deals(n_deals)
+    filled_plans = df_plans.iloc[::2].head(len(df_deals)) # Every other plan gets a fill a few minutes later so matches exist
+    df_deals = df_deals.head(len(filled_plans)).assign(
+        Time_Deal=(filled_plans['Timestamp'] + pd.Timedelta(minutes=5)).to_numpy(), PortfolioID=filled_plans['PortfolioID'].to_numpy(), Symbol_Deal=filled_plans['Asset'].to_numpy(),
+        Type_Deal=np.where(filled_plans['Direction'] == 'Long', 'buy', 'sell'), Direction_Deal='in',
+        Price_Deal=(filled_plans['Entry'] * 1.0005).to_numpy())
+    match_time, (df_matches, _) = _best_of(lambda: main.match_plans_to_deals(df_plans, df_deals), repeats=1)
+    print(f"planners logs={n_logs:,}")
+    print(f"  update_performance_windows: {build_time * 1000:10.1f} ms build, {append_time * 1000:8.1f} ms append {append_rows:,}")
+    print(f"  evaluate_scaling_rules    : {rules_time * 1000:10.2f} ms ({len(df_rules)} portfolios)")
+    print(f"  match_plans_to_deals      : {match_time * 1000:10.1f} ms ({len(df_deals):,} deals -> {len(df_matches):,} matches)")
+    return {'rows': n_logs, 'windows_build_s': build_time, 'windows_append_s': append_time, 'rules_s': rules_time, 'match_s': match_time}
+
+
+def bench_ai_metrics(n_rows=500_000, append_rows=1_000):
+    df_plans = _synthetic_plans(n_rows)
+    df_deals = _synthetic_deals(n_rows).assign(ImportBatchID="bench")
+    results = {'rows': n_rows}
+    print(f"AI metrics rows={n_rows:,}")
+    for source, df_source in [('planned', df_plans), ('actual', df_deals)]:
+        metrics_state = main._new_ai_metrics_state()
+        build_time, _ = _best_of(lambda: main.update_ai_metrics(metrics_state, source, df_source.iloc[:len(df_source) - append_rows]), repeats=1)
+        append_time, _ = _best_of(lambda: main.update_ai_metrics(metrics_state, source, df_source), repeats=1)
+        summary_time, _ = _best_of(lambda: main.summarize_ai_metrics(metrics_state, source, main.PERF_WINDOW_ALL_KEY))
+        print(f"  update_ai_metrics ({source:7}): {build_time * 1000:10.1f} ms build, {append_time * 1000:8.1f} ms append {append_rows:,}, "
+              f"summary {summary_time * 1000:6.2f} ms")
+        results[source] = {'build_s': build_time, 'append_s': append_time, 'summary_s': summary_time}
+    return results
+
+
+# --- Regression tracking ------------------------------------------------------------------------
+
+def _flatten_timings(results, prefix=""):
+    # {"bench.key": seconds} for every *_s value (nested dicts included; children of a *_s dict are all timings)
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten_timings(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and (str(key).endswith('_s') or prefix.endswith('_s.')):
+            flat[f"{prefix}{key}"] = float(value)
+    return flat
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def track_regressions(all_results, config, history_path, tolerance=0.25, baseline_runs=5, min_delta_s=0.002):
+    # Compares with the median of the last baseline_runs entries of the same config, then appends this run
+    timings = {}
+    for bench_name, bench_results in all_results.items():
+        timings.update(_flatten_timings(bench_results, f"{bench_name}."))
+    history = []
+    try:
+        with open(history_path, encoding="utf-8") as history_file:
+            history = [json.loads(line) for line in history_file if line.strip()]
+    except FileNotFoundError:
+        pass
+    comparable = [entry for entry in history if entry.get('config') == config][-baseline_runs:]
+    regressions = []
+    for metric, value in timings.items():
+        previous = [entry['timings'][metric] for entry in comparable if metric in entry['timings']]
+        if not previous:
+            continue
+        baseline = float(np.median(previous))
+        if value > baseline * (1 + tolerance) and value - baseline > min_delta_s: # Sub-ms jitter is not a regression
+            regressions.append((metric, baseline, value))
+    if not comparable:
+        print(f"regressions: no earlier runs with this configuration in {history_path}; this run becomes the baseline")
+    elif regressions:
+        print(f"regressions: {len(regressions)} timings above {1 + tolerance:.2f}x the median of the last {len(comparable)} runs")
+        for metric, baseline, value in regressions:
+            print(f"  {metric:60}: {baseline * 1000:10.2f} ms -> {value * 1000:10.2f} ms ({value / baseline:.2f}x)")
+    else:
+        print(f"regressions: none ({len(timings)} timings within {1 + tolerance:.2f}x of the last {len(comparable)} runs)")
+    with open(history_path, "a", encoding="utf-8") as history_file:
+        history_file.write(json.dumps({'time': datetime.now().isoformat(timespec='seconds'), 'git': _git_revision(),
+                                       'config': config, 'timings': timings}) + "\n")
+    return regressions
+
+
+def run_benchmarks(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for main.py")
+    parser.add_argument('rows', nargs='?', type=int, default=1_000_000, help="scale of the kernel benchmarks")
+    parser.add_argument('--sheet-rows', type=int, default=None, help="rows per fake sheet (default rows/10, 1k..1M)")
+    parser.add_argument('--latency-ms', type=float, default=150.0, help="simulated latency per Sheets request")
+    parser.add_argument('--quota', type=int, default=60, help="simulated Sheets requests per minute (0 = unlimited)")
+    parser.add_argument('--history', default="bench_history.jsonl", help="JSON-lines file the results are appended to")
+    parser.add_argument('--no-history', action='store_true', help="do not compare with / append to the history file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="slowdown ratio above the baseline that counts as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 when a regression is found")
+    args = parser.parse_args(argv)
+
+    rows_arg = args.rows
+    sheet_rows = args.sheet_rows or min(1_000_000, max(1_000, rows_arg // 10))
+    http_options = {'latency_ms': args.latency_ms, 'quota_per_minute': args.quota}
+    all_results = {
+        'equity_drawdown': bench_equity_drawdown(rows_arg),
+        'round_trips': bench_round_trips(max(3, rows_arg * 3 // 10)),
+        'search': bench_search(max(20_000, rows_arg // 2)),
+        'excursions': bench_excursions(max(1_000, rows_arg // 30), max(10_000, rows_arg)),
+        'sheet_loaders': bench_sheet_loaders(sheet_rows, http_options),
+        'statement_parse': bench_statement_parse(max(1_000, rows_arg // 10)),
+        'statement_import': bench_statement_import(max(1_000, rows_arg // 50), sheet_rows, http_options),
+        'chunked_import': bench_chunked_import(max(1_000, rows_arg // 50), http_options=http_options),
+        'planners': bench_planners(max(2_000, rows_arg // 5)),
+        'ai_metrics': bench_ai_metrics(max(2_000, rows_arg // 2)),
+    }
+    if args.no_history:
+        return all_results
+    config = {'rows': rows_arg, 'sheet_rows': sheet_rows, 'latency_ms': args.latency_ms, 'quota': args.quota}
+    regressions = track_regressions(all_results, config, args.history, tolerance=args.tolerance)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+    return all_results
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -6,18 +6,200 @@
 # ==================================================================
 
 # ============== PART 1.1: IMPORTS ==============
+import time
+STARTUP_T0 = time.perf_counter() # Start of this script run (PART 1.1.1 reports imports / loaders / sections against it)
 import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime, date
-import plotly.express as px
 # import google.generativeai as genai #  Removed if not used, or keep if planned
-import gspread
-import plotly.graph_objects as go
 import random
 import io
 import uuid
 import hashlib
+import itertools
+import multiprocessing
+import concurrent.futures
+import re
+import os
+import json
+import importlib
+import functools
+import collections
+
+# ============== PART 1.1.1: STARTUP PROFILER, TELEMETRY & LAZY IMPORTS ==============
+# Per-run timings of imports, the gspread client, every load_*/save_* (profile_call) and every SEC section
+# (mark_startup_section under each SEC header). Each event also carries rows moved and the Google API calls / bytes
+# counted by the instrumented gspread client. SEC 8 pushes the finished run into a per-session ring buffer
+# (telemetry_runs_v1) that the SEC 6 debug panel reads; the startup report itself is shown with ?profile=1 in the URL
+# or ULTIMATE_CHART_PROFILE=1. plotly and gspread are imported on first use, so a run that draws no chart or never
+# reaches Google Sheets does not pay for them.
+STARTUP_PROFILE_ENV_VAR = "ULTIMATE_CHART_PROFILE"
+TELEMETRY_RING_SIZE = 200 # Completed reruns kept per session
+STARTUP_PROFILE_EVENTS = [] # One dict per event; the script re-executes on every rerun, so this is per run
+_telemetry_call_stack = [] # Names of the profiled calls currently running (nested loaders -> flame paths)
+
+@st.cache_resource
+def get_gsheets_api_counters():
+    # Survives reruns (module globals do not), so the wrapped request of the cached gspread client keeps counting here
+    return {'calls': 0, 'bytes': 0}
+
+GSHEETS_API_COUNTERS = get_gsheets_api_counters()
+_startup_section_state = {'name': "PART 1", 'start': STARTUP_T0, 'api': (GSHEETS_API_COUNTERS['calls'], GSHEETS_API_COUNTERS['bytes'])} # Counters are cumulative across reruns
+
+def instrument_gspread_client(gc):
+    # Counts every HTTP request the client makes (worksheets share the client's http_client) and the bytes sent/received
+    http_client = getattr(gc, 'http_client', None)
+    if http_client is None or getattr(http_client, 'telemetry_wrapped', False):
+        return gc
+    raw_request = http_client.request
+    api_counters = GSHEETS_API_COUNTERS
+
+    def counted_request(*args, **kwargs):
+        api_counters['calls'] += 1
+        response = raw_request(*args, **kwargs)
+        sent_body = getattr(getattr(response, 'request', None), 'body', None) # Already serialized by requests
+        api_counters['bytes'] += len(getattr(response, 'content', b'') or b'') + (len(sent_body) if sent_body else 0)
+        return response
+
+    http_client.request = counted_request
+    http_client.telemetry_wrapped = True
+    return gc
+
+def _telemetry_api_snapshot():
+    return GSHEETS_API_COUNTERS['calls'], GSHEETS_API_COUNTERS['bytes']
+
+def _telemetry_rows(args, result):
+    # Rows moved by a call: the returned frame(s) for loaders / the parser, the first frame / list / dict argument for saves
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, (tuple, dict)):
+        result_parts = result.values() if isinstance(result, dict) else result
+        if any(isinstance(part, pd.DataFrame) for part in result_parts):
+            return sum(len(part) for part in result_parts if isinstance(part, pd.DataFrame))
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, list)):
+            return len(arg)
+        if isinstance(arg, dict):
+            return 1
+    return 0
+
+def _telemetry_event(kind, name, section_name, path, ms, end_ms, rows=0, api_delta=(0, 0)):
+    return {'Kind': kind, 'Name': name, 'Section': section_name, 'Path': path, 'ms': ms, 'EndMs': end_ms,
+            'Rows': rows, 'ApiCalls': api_delta[0], 'Bytes': api_delta[1]}
+
+def record_startup_event(kind, name, seconds, rows=0, api_delta=(0, 0)):
+    section_name = _startup_section_state['name']
+    path_parts = [section_name] + _telemetry_call_stack + ([name] if kind != 'section' else [])
+    STARTUP_PROFILE_EVENTS.append(_telemetry_event(kind, name, section_name, " / ".join(str(part) for part in path_parts), seconds * 1000.0,
+                                                   (time.perf_counter() - STARTUP_T0) * 1000.0, rows, api_delta))
+
+def mark_startup_section(section_name):
+    # Closes the running section and opens the next; a section's time includes the loaders called inside it
+    now, api_now = time.perf_counter(), _telemetry_api_snapshot()
+    if _startup_section_state['name'] is not None:
+        api_start = _startup_section_state['api']
+        record_startup_event('section', _startup_section_state['name'], now - _startup_section_state['start'],
+                             api_delta=(api_now[0] - api_start[0], api_now[1] - api_start[1]))
+    _startup_section_state.update(name=section_name, start=now, api=api_now)
+
+def profile_call(kind):
+    # Decorator timing every call, cache hits included (st.cache_data hits still copy the frame)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t_start, api_start = time.perf_counter(), _telemetry_api_snapshot()
+            result = None
+            _telemetry_call_stack.append(fn.__name__)
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            finally:
+                _telemetry_call_stack.pop()
+                api_end = _telemetry_api_snapshot()
+                record_startup_event(kind, fn.__name__, time.perf_counter() - t_start, rows=_telemetry_rows(args, result),
+                                     api_delta=(api_end[0] - api_start[0], api_end[1] - api_start[1]))
+        if hasattr(fn, 'clear'): # Keep st.cache_* .clear() reachable for the `hasattr(loader, 'clear')` call sites
+            wrapper.clear = fn.clear
+        return wrapper
+    return decorator
+
+def _telemetry_run_record(events, total_ms, started_at, interrupted=False):
+    return {'Time': started_at, 'TotalMs': total_ms, 'Events': events, 'Interrupted': interrupted,
+            'ApiCalls': sum(e['ApiCalls'] for e in events if e['Kind'] == 'section'),
+            'Bytes': sum(e['Bytes'] for e in events if e['Kind'] == 'section'),
+            'Rows': sum(e['Rows'] for e in events if e['Kind'] in ('loader', 'save') and e['Path'].count(" / ") == 1)} # Outermost calls only
+
+def start_telemetry_run():
+    # Registers this run as pending. A run cut short by st.rerun() (saves usually end with one) or by a widget
+    # interaction never reaches SEC 8, so the next run closes its open section and files it as interrupted.
+    if 'telemetry_runs_v1' not in st.session_state:
+        st.session_state.telemetry_runs_v1 = collections.deque(maxlen=TELEMETRY_RING_SIZE)
+    pending_run = st.session_state.get('telemetry_pending_run_v1')
+    if pending_run is not None:
+        section_state = pending_run['SectionState']
+        section_start_ms = (section_state['start'] - pending_run['T0']) * 1000.0
+        end_ms = max([e['EndMs'] for e in pending_run['Events']] + [section_start_ms])
+        if section_state['name'] is not None:
+            api_now = _telemetry_api_snapshot()
+            pending_run['Events'].append(_telemetry_event('section', section_state['name'], section_state['name'], str(section_state['name']), end_ms - section_start_ms, end_ms,
+                                                          api_delta=(api_now[0] - section_state['api'][0], api_now[1] - section_state['api'][1])))
+        st.session_state.telemetry_runs_v1.append(_telemetry_run_record(pending_run['Events'], end_ms, pending_run['Time'], interrupted=True))
+    st.session_state.telemetry_pending_run_v1 = {'Time': datetime.now(), 'T0': STARTUP_T0, 'Events': STARTUP_PROFILE_EVENTS, 'SectionState': _startup_section_state}
+
+def finish_telemetry_run():
+    mark_startup_section(None) # Closes the last section
+    total_ms = (time.perf_counter() - STARTUP_T0) * 1000.0
+    pending_run = st.session_state.get('telemetry_pending_run_v1') or {}
+    st.session_state.telemetry_pending_run_v1 = None
+    st.session_state.telemetry_runs_v1.append(_telemetry_run_record(STARTUP_PROFILE_EVENTS, total_ms, pending_run.get('Time', datetime.now())))
+    return total_ms
+
+def summarize_telemetry_runs(telemetry_runs):
+    # (per-run frame, per-call frame) over the ring buffer: rerun latency series and p50/p95 per load_*/save_*
+    df_runs = pd.DataFrame([{k: run[k] for k in ['Time', 'TotalMs', 'ApiCalls', 'Bytes', 'Rows', 'Interrupted']} for run in telemetry_runs],
+                           columns=['Time', 'TotalMs', 'ApiCalls', 'Bytes', 'Rows', 'Interrupted'])
+    df_calls = pd.DataFrame([event for run in telemetry_runs for event in run['Events'] if event['Kind'] != 'section'],
+                            columns=['Kind', 'Name', 'Section', 'Path', 'ms', 'EndMs', 'Rows', 'ApiCalls', 'Bytes'])
+    if df_calls.empty:
+        return df_runs, pd.DataFrame(columns=['Kind', 'Name', 'Calls', 'p50 ms', 'p95 ms', 'Rows', 'ApiCalls', 'Bytes'])
+    df_call_stats = df_calls.groupby(['Kind', 'Name'], sort=False).agg(
+        Calls=('ms', 'count'), p50_ms=('ms', lambda v: np.percentile(v, 50)), p95_ms=('ms', lambda v: np.percentile(v, 95)),
+        Rows=('Rows', 'sum'), ApiCalls=('ApiCalls', 'sum'), Bytes=('Bytes', 'sum')).reset_index()
+    df_call_stats = df_call_stats.rename(columns={'p50_ms': 'p50 ms', 'p95_ms': 'p95 ms'})
+    return df_runs, df_call_stats.sort_values('p95 ms', ascending=False).reset_index(drop=True)
+
+def build_telemetry_flame(run_record):
+    # Icicle nodes (ids / parents / values) for one run: run -> sections -> nested calls, repeated calls summed per path.
+    # Every call is timed inside its caller / section, so a parent's value always covers its children ('total' branch values).
+    df_events = pd.DataFrame(run_record['Events'])
+    if df_events.empty:
+        return pd.DataFrame(columns=['id', 'parent', 'label', 'ms'])
+    df_nodes = df_events.groupby('Path', sort=False)['ms'].sum().reset_index()
+    df_nodes['parent'] = df_nodes['Path'].str.rpartition(" / ")[0].replace("", "run")
+    df_nodes['label'] = df_nodes['Path'].str.rpartition(" / ")[2]
+    df_nodes = df_nodes.rename(columns={'Path': 'id'})
+    return pd.concat([pd.DataFrame([{'id': "run", 'parent': "", 'label': f"rerun {run_record['TotalMs']:,.0f} ms", 'ms': run_record['TotalMs']}]),
+                      df_nodes[['id', 'parent', 'label', 'ms']]], ignore_index=True)
+
+class LazyModule:
+    # Stand-in for `import x as y`: the real import happens (and is timed) on the first attribute access
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attr_name):
+        if self._module is None:
+            t_start = time.perf_counter()
+            self._module = importlib.import_module(self._module_name)
+            record_startup_event('import', self._module_name, time.perf_counter() - t_start)
+        return getattr(self._module, attr_name)
+
+px = LazyModule("plotly.express")
+go = LazyModule("plotly.graph_objects")
+gspread = LazyModule("gspread")
+record_startup_event('import', "module imports", time.perf_counter() - STARTUP_T0)
+start_telemetry_run()
 
 # ============== PART 1.2: PAGE CONFIGURATION ==============
 st.set_page_config(page_title="Ultimate-Chart", layout="wide")
@@ -51,6 +233,10 @@ if 'current_portfolio_details' not in st.session_state:
     st.session_state.current_portfolio_details = None
 if 'plot_data' not in st.session_state:
     st.session_state.plot_data = None
+if 'perf_window_state' not in st.session_state: # Incremental performance windows for the Scaling Manager (PART 1.7)
+    st.session_state.perf_window_state = None
+if 'ai_metrics_state' not in st.session_state: # Materialized AI Assistant metrics (PART 1.12)
+    st.session_state.ai_metrics_state = None
 
 # Initializing other session states if they are commonly used across sections or reset
 # For trade planning inputs (FIBO)
@@ -76,19 +262,33 @@ if 'exp_pf_type_select_v8_key' not in st.session_state:
 
 
 # ============== PART 1.5: GOOGLE SHEETS UTILITY FUNCTIONS ==============
+@profile_call("client")
 @st.cache_resource # Use cache_resource for gspread client object
 def get_gspread_client():
     try:
         if "gcp_service_account" not in st.secrets:
             st.warning("⚠️ โปรดตั้งค่า 'gcp_service_account' ใน `.streamlit/secrets.toml` เพื่อเชื่อมต่อ Google Sheets.")
             return None
-        return gspread.service_account_from_dict(st.secrets["gcp_service_account"])
+        return instrument_gspread_client(gspread.service_account_from_dict(st.secrets["gcp_service_account"])) # API calls / bytes feed the telemetry (PART 1.1.1)
     except Exception as e:
         st.error(f"❌ เกิดข้อผิดพลาดในการเชื่อมต่อ Google Sheets: {e}")
         st.info("ตรวจสอบว่า 'gcp_service_account' ใน secrets.toml ถูกต้อง และได้แชร์ Sheet กับ Service Account แล้ว")
         return None
 
-@st.cache_data(ttl=300) # Cache ข้อมูลไว้ 5 นาที
+PORTFOLIO_NUMERIC_COLUMN_TYPES = {
+    'InitialBalance': float, 'ProfitTargetPercent': float, 
+    'DailyLossLimitPercent': float, 'TotalStopoutPercent': float,
+    'Leverage': float, 'MinTradingDays': int,
+    'OverallProfitTarget': float, 'WeeklyProfitTarget': float, 'DailyProfitTarget': float,
+    'MaxAcceptableDrawdownOverall': float, 'MaxAcceptableDrawdownDaily': float,
+    'ScaleUp_MinWinRate': float, 'ScaleUp_MinGainPercent': float, 'ScaleUp_RiskIncrementPercent': float,
+    'ScaleDown_MaxLossPercent': float, 'ScaleDown_LowWinRate': float, 'ScaleDown_RiskDecrementPercent': float,
+    'MinRiskPercentAllowed': float, 'MaxRiskPercentAllowed': float, 'CurrentRiskPercent': float
+}
+PORTFOLIO_BOOL_MAP = {'TRUE': True, 'YES': True, '1': True, 'FALSE': False, 'NO': False, '0': False}
+
+@profile_call("loader")
+@st.cache_resource(ttl=300) # Cache ข้อมูลไว้ 5 นาที; shared frame (not copied per call) so update_portfolio_in_gsheets can patch it in place
 def load_portfolios_from_gsheets():
     gc = get_gspread_client()
     if gc is None:
@@ -107,17 +307,7 @@ def load_portfolios_from_gsheets():
         
         df_portfolios = pd.DataFrame(records) #
         
-        cols_to_numeric_type = {
-            'InitialBalance': float, 'ProfitTargetPercent': float, 
-            'DailyLossLimitPercent': float, 'TotalStopoutPercent': float,
-            'Leverage': float, 'MinTradingDays': int,
-            'OverallProfitTarget': float, 'WeeklyProfitTarget': float, 'DailyProfitTarget': float,
-            'MaxAcceptableDrawdownOverall': float, 'MaxAcceptableDrawdownDaily': float,
-            'ScaleUp_MinWinRate': float, 'ScaleUp_MinGainPercent': float, 'ScaleUp_RiskIncrementPercent': float,
-            'ScaleDown_MaxLossPercent': float, 'ScaleDown_LowWinRate': float, 'ScaleDown_RiskDecrementPercent': float,
-            'MinRiskPercentAllowed': float, 'MaxRiskPercentAllowed': float, 'CurrentRiskPercent': float
-        }
-        for col, target_type in cols_to_numeric_type.items():
+        for col, target_type in PORTFOLIO_NUMERIC_COLUMN_TYPES.items():
             if col in df_portfolios.columns:
                 # Replace empty strings with NaN before converting to numeric
                 df_portfolios[col] = df_portfolios[col].replace('', np.nan) #
@@ -126,7 +316,7 @@ def load_portfolios_from_gsheets():
                     df_portfolios[col] = df_portfolios[col].astype(int) #
 
         if 'EnableScaling' in df_portfolios.columns:
-             df_portfolios['EnableScaling'] = df_portfolios['EnableScaling'].astype(str).str.upper().map({'TRUE': True, 'YES': True, '1': True, 'FALSE': False, 'NO': False, '0': False}).fillna(False) #
+             df_portfolios['EnableScaling'] = df_portfolios['EnableScaling'].astype(str).str.upper().map(PORTFOLIO_BOOL_MAP).fillna(False) #
 
         date_cols = ['CompetitionEndDate', 'TargetEndDate', 'CreationDate'] #
         for col in date_cols:
@@ -146,6 +336,7 @@ def load_portfolios_from_gsheets():
         st.error(f"❌ เกิดข้อผิดพลาดในการโหลด Portfolios: {e}") #
         return pd.DataFrame()
 
+@profile_call("loader")
 @st.cache_data(ttl=180)
 def load_all_planned_trade_logs_from_gsheets():
     gc = get_gspread_client()
@@ -190,6 +381,7 @@ def load_all_planned_trade_logs_from_gsheets():
         print(f"Unexpected error loading all planned trade logs: {e}") #
         return pd.DataFrame()
 
+@profile_call("loader")
 @st.cache_data(ttl=180)
 def load_actual_trades_from_gsheets(): # Loads "Deals"
     gc = get_gspread_client()
@@ -236,6 +428,7 @@ def load_actual_trades_from_gsheets(): # Loads "Deals"
         return pd.DataFrame()
 
 # +++ FUNCTION TO LOAD STATEMENT SUMMARIES (NEW) +++
+@profile_call("loader")
 @st.cache_data(ttl=180) # Cache for 3 minutes
 def load_statement_summaries_from_gsheets():
     gc = get_gspread_client()
@@ -310,34 +503,17 @@ def get_today_drawdown(log_source_df):
 def get_performance(log_source_df, mode="week"):
     if log_source_df.empty: return 0.0, 0.0, 0 #
     try:
-        if 'Timestamp' not in log_source_df.columns or not pd.api.types.is_datetime64_any_dtype(log_source_df['Timestamp']):
-            log_source_df['Timestamp'] = pd.to_datetime(log_source_df['Timestamp'], errors='coerce') #
-        
-        log_source_df_cleaned = log_source_df.dropna(subset=['Timestamp']) #
-        if 'Risk $' not in log_source_df_cleaned.columns:
-            return 0.0, 0.0, 0 #
-
-        now = datetime.now() #
-        if mode == "week":
-            week_start_date = now - pd.Timedelta(days=now.weekday()) #
-            df_period = log_source_df_cleaned[log_source_df_cleaned["Timestamp"] >= week_start_date.replace(hour=0, minute=0, second=0, microsecond=0)] #
-        else:  # month
-            month_start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0) #
-            df_period = log_source_df_cleaned[log_source_df_cleaned["Timestamp"] >= month_start_date] #
-        
-        win = df_period[df_period["Risk $"] > 0].shape[0] #
-        loss = df_period[df_period["Risk $"] <= 0].shape[0] # Assuming 0 or negative is a loss or break-even
-        total_trades = win + loss #
-        winrate = (100 * win / total_trades) if total_trades > 0 else 0.0 #
-        gain = df_period["Risk $"].sum() #
-        return float(winrate), float(gain) if pd.notna(gain) else 0.0, int(total_trades)
-    except KeyError as e: 
+        # One-shot build of the performance windows (PART 1.7); SEC 2.4.1 keeps its windows in session_state instead
+        window_state_once = update_performance_windows(None, log_source_df)
+        return query_performance_window(window_state_once, PERF_WINDOW_ALL_KEY, mode=mode)
+    except KeyError as e:
         print(f"KeyError in get_performance: {e}") #
         return 0.0, 0.0, 0
     except Exception as e: 
         print(f"Exception in get_performance: {e}") #
         return 0.0, 0.0, 0
 
+@profile_call("save")
 def save_plan_to_gsheets(plan_data_list, trade_mode_arg, asset_name, risk_percentage, trade_direction, portfolio_id, portfolio_name):
     gc = get_gspread_client()
     if not gc:
@@ -390,6 +566,7 @@ def save_plan_to_gsheets(plan_data_list, trade_mode_arg, asset_name, risk_percen
         st.error(f"❌ เกิดข้อผิดพลาดในการบันทึกแผน: {e}") #
         return False
 
+@profile_call("save")
 def save_new_portfolio_to_gsheets(portfolio_data_dict):
     gc = get_gspread_client() 
     if not gc:
@@ -427,6 +604,8 @@ def save_new_portfolio_to_gsheets(portfolio_data_dict):
         # Clear cache for portfolios after saving new one
         if hasattr(load_portfolios_from_gsheets, 'clear'):
             load_portfolios_from_gsheets.clear() #
+        if hasattr(load_portfolio_row_index, 'clear'):
+            load_portfolio_row_index.clear()
         return True
     except gspread.exceptions.WorksheetNotFound:
         st.error(f"❌ ไม่พบ Worksheet ชื่อ '{WORKSHEET_PORTFOLIOS}'. กรุณาสร้างชีตนี้ก่อน และใส่ Headers ให้ถูกต้อง") #
@@ -436,7 +615,2003 @@ def save_new_portfolio_to_gsheets(portfolio_data_dict):
         st.exception(e)  #
         return False
 
+def run_in_process_pool(worker_fn, task_args_list, n_jobs=1):
+    # Runs worker_fn(*args) for every args tuple, optionally across processes. A fork context is used so functions
+    # defined in this script stay picklable under `streamlit run`; anything that prevents a pool falls back to serial.
+    if not n_jobs or n_jobs <= 1 or len(task_args_list) <= 1:
+        return [worker_fn(*task_args) for task_args in task_args_list]
+    try:
+        fork_ctx = multiprocessing.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(n_jobs, len(task_args_list)), mp_context=fork_ctx) as pool:
+            futures = [pool.submit(worker_fn, *task_args) for task_args in task_args_list]
+            return [future.result() for future in futures]
+    except Exception as e_pool: # Pickling / fork problems; a genuine worker error re-raises from the serial run below
+        print(f"Warning: Process pool unavailable ({type(e_pool).__name__}: {e_pool}). Running {len(task_args_list)} chunks serially.")
+        return [worker_fn(*task_args) for task_args in task_args_list]
+
+# ============== PART 1.7: PERFORMANCE WINDOWS (Scaling Manager) ==============
+# Daily aggregates (count / wins / P/L sum) per portfolio from PlannedTradeLogs.
+# The state lives in st.session_state and is only extended with rows appended to the sheet since the
+# last rerun; back-dated appends or rows edited in place (row-hash fingerprint) rebuild it in Timestamp order.
+# Any window (day / week / month / last N trades) is the difference of two cumulative sums.
+PERF_WINDOW_ALL_KEY = "__ALL__" # Aggregate over every portfolio (used when no active portfolio is selected)
+PERF_WINDOW_MODES = ["day", "week", "month", "trades", "all"]
+PERF_WINDOW_HASH_COLUMNS = ['PortfolioID', 'Timestamp', 'Risk $'] # The columns the windows are built from
+
+def _new_performance_window_state():
+    return {'rows_seen': 0, 'anchor_log_id': None, 'content_hash': 0, 'last_time': None, 'portfolios': {}}
+
+def _row_content_hashes(df_rows, columns):
+    # One uint64 per row over the given columns; cheaper than re-parsing, used to notice rows edited in place
+    hash_cols = [c for c in columns if c in df_rows.columns]
+    if df_rows.empty or not hash_cols:
+        return np.zeros(len(df_rows), dtype=np.uint64)
+    return pd.util.hash_pandas_object(df_rows[hash_cols], index=False, categorize=False).values
+
+def _combine_row_hashes(row_hashes):
+    # Position-weighted sum (wraps around in uint64), so reordered rows change it too
+    return int((row_hashes * np.arange(1, len(row_hashes) + 1, dtype=np.uint64)).sum(dtype=np.uint64))
+
+def _new_performance_portfolio_state():
+    return {
+        'base_day': None, # Day number (days since epoch) of index 0 in the dense daily arrays
+        'day_count': np.zeros(0, dtype=np.int64), 'day_wins': np.zeros(0, dtype=np.int64), 'day_pnl': np.zeros(0, dtype=float),
+        'cum_count': np.zeros(1, dtype=np.int64), 'cum_wins': np.zeros(1, dtype=np.int64), 'cum_pnl': np.zeros(1, dtype=float),
+        'trade_cum_wins': np.zeros(1, dtype=np.int64), 'trade_cum_pnl': np.zeros(1, dtype=float) # Per trade, in time order
+    }
+
+def _extend_performance_portfolio_state(pf_state, day_numbers, pnl_values):
+    # day_numbers / pnl_values must already be in chronological order
+    if len(day_numbers) == 0:
+        return pf_state
+    old_len = len(pf_state['day_count'])
+    old_base = pf_state['base_day'] if pf_state['base_day'] is not None else int(day_numbers.min())
+    new_base = min(old_base, int(day_numbers.min()))
+    new_len = max(old_base + old_len, int(day_numbers.max()) + 1) - new_base
+    front_pad = old_base - new_base
+
+    win_flags = (pnl_values > 0).astype(np.int64)
+    day_idx = day_numbers - new_base
+    for key_arr, add_values in (('day_count', None), ('day_wins', win_flags), ('day_pnl', pnl_values)):
+        old_arr = pf_state[key_arr]
+        new_arr = np.zeros(new_len, dtype=old_arr.dtype)
+        new_arr[front_pad:front_pad + old_len] = old_arr
+        new_arr += np.bincount(day_idx, weights=add_values, minlength=new_len).astype(old_arr.dtype)
+        pf_state[key_arr] = new_arr
+
+    pf_state['base_day'] = new_base
+    pf_state['cum_count'] = np.concatenate(([0], np.cumsum(pf_state['day_count'])))
+    pf_state['cum_wins'] = np.concatenate(([0], np.cumsum(pf_state['day_wins'])))
+    pf_state['cum_pnl'] = np.concatenate(([0.0], np.cumsum(pf_state['day_pnl'])))
+    pf_state['trade_cum_wins'] = np.concatenate((pf_state['trade_cum_wins'], pf_state['trade_cum_wins'][-1] + np.cumsum(win_flags)))
+    pf_state['trade_cum_pnl'] = np.concatenate((pf_state['trade_cum_pnl'], pf_state['trade_cum_pnl'][-1] + np.cumsum(pnl_values)))
+    return pf_state
+
+def update_performance_windows(window_state, df_logs):
+    if window_state is None:
+        window_state = _new_performance_window_state()
+    if df_logs is None or df_logs.empty or 'Timestamp' not in df_logs.columns or 'Risk $' not in df_logs.columns:
+        return _new_performance_window_state()
+
+    n_rows = len(df_logs)
+    rows_seen = window_state['rows_seen']
+    has_log_id = 'LogID' in df_logs.columns
+    row_hashes = _row_content_hashes(df_logs, PERF_WINDOW_HASH_COLUMNS)
+    # PlannedTradeLogs is append-only: rows beyond rows_seen are new, as long as the rows we saw are unchanged
+    can_extend = 0 < rows_seen <= n_rows and (not has_log_id or str(df_logs['LogID'].iloc[rows_seen - 1]) == window_state['anchor_log_id']) \
+                 and _combine_row_hashes(row_hashes[:rows_seen]) == window_state.get('content_hash')
+    if not can_extend:
+        window_state = _new_performance_window_state()
+        rows_seen = 0
+    if rows_seen == n_rows:
+        return window_state
+
+    df_new_rows = df_logs.iloc[rows_seen:]
+    ts_new = pd.to_datetime(df_new_rows['Timestamp'], errors='coerce')
+    valid_mask = ts_new.notna().values
+    ts_values = ts_new.values[valid_mask]
+    if rows_seen > 0 and window_state.get('last_time') is not None and len(ts_values) > 0 and ts_values.min() < window_state['last_time']:
+        # Back-dated rows belong inside the "last N trades" sequence, not at its end: rebuild in Timestamp order
+        return update_performance_windows(None, df_logs)
+    pnl_new = pd.to_numeric(df_new_rows['Risk $'], errors='coerce').fillna(0.0).values[valid_mask].astype(float)
+    chrono_order = np.argsort(ts_values, kind='stable')
+    day_numbers = ts_values[chrono_order].astype('datetime64[D]').astype(np.int64)
+    pnl_new = pnl_new[chrono_order]
+
+    portfolios_state = window_state['portfolios']
+    all_state = portfolios_state.setdefault(PERF_WINDOW_ALL_KEY, _new_performance_portfolio_state())
+    _extend_performance_portfolio_state(all_state, day_numbers, pnl_new)
+
+    if 'PortfolioID' in df_new_rows.columns:
+        pid_values = df_new_rows['PortfolioID'].astype(str).values[valid_mask][chrono_order]
+        pid_codes, pid_uniques = pd.factorize(pid_values)
+        group_order = np.argsort(pid_codes, kind='stable') # Keeps chronological order inside each portfolio
+        group_bounds = np.searchsorted(pid_codes[group_order], np.arange(len(pid_uniques) + 1))
+        for code, pid in enumerate(pid_uniques):
+            rows_in_group = group_order[group_bounds[code]:group_bounds[code + 1]]
+            pf_state = portfolios_state.setdefault(str(pid), _new_performance_portfolio_state())
+            _extend_performance_portfolio_state(pf_state, day_numbers[rows_in_group], pnl_new[rows_in_group])
+
+    window_state['rows_seen'] = n_rows
+    window_state['anchor_log_id'] = str(df_logs['LogID'].iloc[-1]) if has_log_id else None
+    window_state['content_hash'] = _combine_row_hashes(row_hashes)
+    if len(ts_values) > 0:
+        window_state['last_time'] = ts_values.max() if window_state.get('last_time') is None else max(window_state['last_time'], ts_values.max())
+    return window_state
+
+def query_performance_window(window_state, portfolio_key, mode="week", n_trades=20, now=None):
+    # Returns (winrate %, gain, total trades) like get_performance
+    pf_state = (window_state or {}).get('portfolios', {}).get(str(portfolio_key))
+    if pf_state is None or pf_state['base_day'] is None:
+        return 0.0, 0.0, 0
+
+    if mode == "trades":
+        total_trades = len(pf_state['trade_cum_wins']) - 1
+        n_window = max(0, min(int(n_trades), total_trades))
+        wins = pf_state['trade_cum_wins'][-1] - pf_state['trade_cum_wins'][-1 - n_window]
+        gain = pf_state['trade_cum_pnl'][-1] - pf_state['trade_cum_pnl'][-1 - n_window]
+        count = n_window
+    else:
+        now = now or datetime.now()
+        if mode == "day":
+            window_start = now.date()
+        elif mode == "week":
+            window_start = (now - pd.Timedelta(days=now.weekday())).date()
+        elif mode == "month":
+            window_start = now.date().replace(day=1)
+        else: # "all"
+            window_start = None
+        start_idx = 0
+        if window_start is not None:
+            start_day = int(np.datetime64(window_start, 'D').astype(np.int64))
+            start_idx = int(np.clip(start_day - pf_state['base_day'], 0, len(pf_state['day_count'])))
+        count = pf_state['cum_count'][-1] - pf_state['cum_count'][start_idx]
+        wins = pf_state['cum_wins'][-1] - pf_state['cum_wins'][start_idx]
+        gain = pf_state['cum_pnl'][-1] - pf_state['cum_pnl'][start_idx]
+
+    winrate = (100 * wins / count) if count > 0 else 0.0
+    return float(winrate), float(gain), int(count)
+
+# ============== PART 1.8: SCALING RULE ENGINE ==============
+# Scores every portfolio against its own ScaleUp_/ScaleDown_ rules over the performance windows (PART 1.7)
+# in one vectorized pass. Blank rule cells load as 0 and fall back to SCALING_RULE_DEFAULTS (the old hard-coded logic).
+SCALING_RULE_DEFAULTS = {
+    'ScaleUp_MinWinRate': 55.0, 'ScaleUp_MinGainPercent': 2.0, 'ScaleUp_RiskIncrementPercent': 0.25,
+    'ScaleDown_MaxLossPercent': 0.0, 'ScaleDown_LowWinRate': 45.0, 'ScaleDown_RiskDecrementPercent': 0.25,
+    'MinRiskPercentAllowed': 0.5, 'MaxRiskPercentAllowed': 5.0, 'CurrentRiskPercent': DEFAULT_RISK_PERCENT
+}
+SCALING_FREQUENCY_TO_WINDOW = {"daily": "day", "weekly": "week", "monthly": "month"}
+SCALING_WINDOW_LABELS = {"day": "วันนี้", "week": "สัปดาห์", "month": "เดือน"}
+
+def evaluate_scaling_rules(df_portfolios, window_state, overrides=None, fallback_rules=None, now=None):
+    # overrides: {PortfolioID: {column: value}} e.g. the live risk % / balance of the active portfolio from the sidebar.
+    # An override key that is not in df_portfolios (e.g. PERF_WINDOW_ALL_KEY) is scored with fallback rules only.
+    rule_defaults = dict(SCALING_RULE_DEFAULTS)
+    rule_defaults.update(fallback_rules or {})
+    rule_cols = list(SCALING_RULE_DEFAULTS.keys())
+    input_cols = rule_cols + ['InitialBalance', 'ScalingCheckFrequency', 'EnableScaling']
+
+    if df_portfolios is not None and not df_portfolios.empty and 'PortfolioID' in df_portfolios.columns:
+        df_rules = df_portfolios.drop_duplicates(subset='PortfolioID').reindex(columns=input_cols)
+        df_rules.index = df_portfolios['PortfolioID'].drop_duplicates().astype(str).values
+    else:
+        df_rules = pd.DataFrame(columns=input_cols)
+    df_rules = df_rules.astype(object)
+    df_rules['Balance'] = np.nan
+
+    for pid_override, values_override in (overrides or {}).items():
+        pid_override = str(pid_override)
+        if pid_override not in df_rules.index:
+            df_rules.loc[pid_override] = np.nan
+        for col_override, val_override in values_override.items():
+            df_rules.loc[pid_override, col_override] = val_override
+
+    if df_rules.empty:
+        return pd.DataFrame(columns=['Window', 'Trades', 'WinRate', 'Gain', 'GainPercent', 'Action', 'EnableScaling', 'CurrentRiskPercent', 'SuggestedRiskPercent'])
+
+    rule_values = {}
+    for col in rule_cols:
+        col_vals = pd.to_numeric(df_rules[col], errors='coerce').values.astype(float)
+        rule_values[col] = np.where(np.isnan(col_vals) | (col_vals == 0), rule_defaults[col], col_vals)
+
+    balance_vals = pd.to_numeric(df_rules['Balance'], errors='coerce').values.astype(float)
+    initial_balance_vals = pd.to_numeric(df_rules['InitialBalance'], errors='coerce').values.astype(float)
+    balance_vals = np.where(np.isnan(balance_vals), initial_balance_vals, balance_vals)
+    balance_vals = np.where(np.isnan(balance_vals) | (balance_vals <= 0), DEFAULT_ACCOUNT_BALANCE, balance_vals)
+
+    window_modes = df_rules['ScalingCheckFrequency'].astype(str).str.strip().str.lower().map(SCALING_FREQUENCY_TO_WINDOW).fillna("week").values
+    window_stats = np.array([query_performance_window(window_state, pid, mode=mode_w, now=now) for pid, mode_w in zip(df_rules.index, window_modes)], dtype=float).reshape(-1, 3)
+    winrate_vals, gain_vals, trades_vals = window_stats[:, 0], window_stats[:, 1], window_stats[:, 2]
+    gain_pct_vals = gain_vals / balance_vals * 100
+
+    current_risk = rule_values['CurrentRiskPercent']
+    max_loss_pct = rule_values['ScaleDown_MaxLossPercent']
+    has_trades = trades_vals > 0
+    # Strictly above both thresholds, like the original sidebar rule (winrate > 55 and gain > 2%)
+    scale_up = has_trades & (winrate_vals > rule_values['ScaleUp_MinWinRate']) & (gain_pct_vals > rule_values['ScaleUp_MinGainPercent'])
+    loss_breached = np.where(max_loss_pct < 0, gain_pct_vals <= max_loss_pct, gain_pct_vals < 0)
+    scale_down = has_trades & ~scale_up & ((winrate_vals < rule_values['ScaleDown_LowWinRate']) | loss_breached)
+
+    suggested_risk = np.select(
+        [scale_up, scale_down],
+        [np.minimum(current_risk + rule_values['ScaleUp_RiskIncrementPercent'], rule_values['MaxRiskPercentAllowed']),
+         np.maximum(current_risk - rule_values['ScaleDown_RiskDecrementPercent'], rule_values['MinRiskPercentAllowed'])],
+        current_risk
+    )
+
+    return pd.DataFrame({
+        'Window': window_modes, 'Trades': trades_vals.astype(int), 'WinRate': winrate_vals, 'Gain': gain_vals,
+        'GainPercent': gain_pct_vals, 'Action': np.select([scale_up, scale_down], ["up", "down"], "hold"),
+        'EnableScaling': df_rules['EnableScaling'].values,
+        'CurrentRiskPercent': current_risk, 'SuggestedRiskPercent': suggested_risk
+    }, index=df_rules.index)
+
+# ============== PART 1.9: SCALING POLICY BACKTEST ==============
+# Replays historical trades through Auto-mode scaling policies. Each trade is expressed as an R multiple
+# (P/L per unit of risk taken), so a policy's risk % can be re-applied to it. Policies are columns of one
+# NumPy matrix: the Python loop only walks check periods, every policy advances in the same array operation.
+SCALING_BACKTEST_POLICY_COLUMNS = [
+    'InitialRiskPercent', 'StepPercent', 'MinRiskPercent', 'MaxRiskPercent',
+    'ScaleUpWinRate', 'ScaleUpGainPercent', 'ScaleDownWinRate', 'ScaleDownLossPercent'
+]
+DEAL_NON_TRADING_TYPES = ['balance', 'credit', 'deposit', 'withdrawal', 'correction', 'initial_deposit']
+
+def prepare_scaling_backtest_trades(df_source, source="planned", reference_balance=DEFAULT_ACCOUNT_BALANCE, reference_risk_pct=DEFAULT_RISK_PERCENT):
+    # Returns DataFrame [Time, R] in chronological order.
+    # planned: P/L is "Risk $" (same convention as get_performance), risk taken is reference_balance * "Risk %".
+    # actual:  one trade per closed round trip (PART 1.13), at its exit time: NetPL relative to the balance at the entry
+    #          deal at reference_risk_pct. Per-deal P/L would count commission-only entry deals as small losses.
+    empty_trades = pd.DataFrame({'Time': pd.Series(dtype='datetime64[ns]'), 'R': pd.Series(dtype=float)})
+    if df_source is None or df_source.empty:
+        return empty_trades
+    if source == "planned":
+        if 'Timestamp' not in df_source.columns or 'Risk $' not in df_source.columns:
+            return empty_trades
+        time_vals = pd.to_datetime(df_source['Timestamp'], errors='coerce')
+        pnl_vals = pd.to_numeric(df_source['Risk $'], errors='coerce').fillna(0.0)
+        hist_risk_pct = pd.to_numeric(df_source['Risk %'], errors='coerce') if 'Risk %' in df_source.columns else pd.Series(np.nan, index=df_source.index)
+        hist_risk_pct = hist_risk_pct.where(hist_risk_pct > 0, reference_risk_pct)
+        r_vals = pnl_vals / (reference_balance * hist_risk_pct / 100.0)
+    else:
+        if 'Time_Deal' not in df_source.columns or 'Profit_Deal' not in df_source.columns:
+            return empty_trades
+        df_trips_bt = reconstruct_round_trip_trades(df_source)
+        df_trips_bt = df_trips_bt[df_trips_bt['Status'] == 'Closed']
+        time_vals = pd.to_datetime(df_trips_bt['ExitTime'], errors='coerce')
+        r_vals = df_trips_bt['NetPL'].astype(float) / (_round_trip_entry_balances(df_trips_bt, df_source, reference_balance) * reference_risk_pct / 100.0)
+    df_trades_bt = pd.DataFrame({'Time': time_vals.values, 'R': r_vals.values.astype(float)})
+    df_trades_bt = df_trades_bt.dropna(subset=['Time'])
+    df_trades_bt = df_trades_bt[df_trades_bt['R'] != 0]
+    return df_trades_bt.sort_values('Time', kind='stable').reset_index(drop=True)
+
+def build_scaling_policy_grid(**param_values):
+    # Cartesian product of parameter lists, e.g. build_scaling_policy_grid(StepPercent=[0.1, 0.25], MaxRiskPercent=[2, 3])
+    # Parameters not given use the scaling defaults (SCALING_RULE_DEFAULTS).
+    defaults_grid = {
+        'InitialRiskPercent': [DEFAULT_RISK_PERCENT], 'StepPercent': [SCALING_RULE_DEFAULTS['ScaleUp_RiskIncrementPercent']],
+        'MinRiskPercent': [SCALING_RULE_DEFAULTS['MinRiskPercentAllowed']], 'MaxRiskPercent': [SCALING_RULE_DEFAULTS['MaxRiskPercentAllowed']],
+        'ScaleUpWinRate': [SCALING_RULE_DEFAULTS['ScaleUp_MinWinRate']], 'ScaleUpGainPercent': [SCALING_RULE_DEFAULTS['ScaleUp_MinGainPercent']],
+        'ScaleDownWinRate': [SCALING_RULE_DEFAULTS['ScaleDown_LowWinRate']], 'ScaleDownLossPercent': [SCALING_RULE_DEFAULTS['ScaleDown_MaxLossPercent']]
+    }
+    defaults_grid.update({k: list(v) for k, v in param_values.items() if v is not None and len(v) > 0})
+    grid_rows = list(itertools.product(*[defaults_grid[c] for c in SCALING_BACKTEST_POLICY_COLUMNS]))
+    return pd.DataFrame(grid_rows, columns=SCALING_BACKTEST_POLICY_COLUMNS, dtype=float)
+
+def run_scaling_policy_backtest(trade_r, trade_period, policies, initial_balance=DEFAULT_ACCOUNT_BALANCE, return_paths=False):
+    # trade_r: R multiples in time order; trade_period: non-decreasing period id per trade (scaling is checked
+    # at the end of each period, like Auto mode re-evaluating every week). policies: DataFrame of SCALING_BACKTEST_POLICY_COLUMNS.
+    trade_r = np.asarray(trade_r, dtype=float)
+    trade_period = np.asarray(trade_period)
+    pol = {c: policies[c].to_numpy(dtype=float) for c in SCALING_BACKTEST_POLICY_COLUMNS}
+    n_policies = len(policies)
+
+    risk_now = np.clip(pol['InitialRiskPercent'], pol['MinRiskPercent'], np.maximum(pol['MaxRiskPercent'], pol['MinRiskPercent']))
+    balance_now = np.full(n_policies, float(initial_balance))
+    peak_now = balance_now.copy()
+    max_dd = np.zeros(n_policies); max_dd_pct = np.zeros(n_policies)
+    risk_sum = np.zeros(n_policies)
+    period_starts = np.concatenate(([0], np.flatnonzero(trade_period[1:] != trade_period[:-1]) + 1)) if len(trade_r) else np.zeros(0, dtype=int)
+    period_ends = np.append(period_starts[1:], len(trade_r))
+    risk_path = np.empty((len(period_starts), n_policies)) if return_paths else None
+    equity_path = np.empty((len(trade_r) + 1, n_policies)) if return_paths else None
+    if return_paths: equity_path[0] = balance_now
+
+    for k, (p_start, p_end) in enumerate(zip(period_starts, period_ends)):
+        r_block = trade_r[p_start:p_end]
+        if return_paths: risk_path[k] = risk_now
+        risk_sum += risk_now * len(r_block)
+        growth = np.maximum(1.0 + np.outer(r_block, risk_now / 100.0), 0.0) # An account cannot go below zero
+        equity_block = balance_now * np.cumprod(growth, axis=0)
+        running_peak = np.maximum(peak_now, np.maximum.accumulate(equity_block, axis=0))
+        dd_block = running_peak - equity_block
+        max_dd = np.maximum(max_dd, dd_block.max(axis=0))
+        max_dd_pct = np.maximum(max_dd_pct, (dd_block / np.where(running_peak > 0, running_peak, 1.0)).max(axis=0) * 100)
+        if return_paths: equity_path[p_start + 1:p_end + 1] = equity_block
+
+        period_winrate = 100.0 * np.count_nonzero(r_block > 0) / len(r_block) # Same for every policy
+        period_gain_pct = np.where(balance_now > 0, (equity_block[-1] / np.where(balance_now > 0, balance_now, 1.0) - 1.0) * 100, 0.0)
+        balance_now = equity_block[-1]
+        peak_now = running_peak[-1]
+
+        scale_up = (period_winrate > pol['ScaleUpWinRate']) & (period_gain_pct > pol['ScaleUpGainPercent']) # Same strict rule as evaluate_scaling_rules
+        loss_breached = np.where(pol['ScaleDownLossPercent'] < 0, period_gain_pct <= pol['ScaleDownLossPercent'], period_gain_pct < 0)
+        scale_down = ~scale_up & ((period_winrate < pol['ScaleDownWinRate']) | loss_breached)
+        risk_now = np.where(scale_up, np.minimum(risk_now + pol['StepPercent'], pol['MaxRiskPercent']),
+                            np.where(scale_down, np.maximum(risk_now - pol['StepPercent'], pol['MinRiskPercent']), risk_now))
+
+    df_summary = policies.reset_index(drop=True).copy()
+    df_summary['FinalBalance'] = balance_now
+    df_summary['ReturnPercent'] = (balance_now / float(initial_balance) - 1.0) * 100 if initial_balance else 0.0
+    df_summary['MaxDrawdown'] = max_dd
+    df_summary['MaxDrawdownPercent'] = max_dd_pct
+    df_summary['AvgRiskPercent'] = risk_sum / len(trade_r) if len(trade_r) else risk_now
+    df_summary['FinalRiskPercent'] = risk_now
+    result = {'summary': df_summary, 'n_trades': len(trade_r), 'n_periods': len(period_starts)}
+    if return_paths:
+        result.update({'risk_path': risk_path, 'equity_path': equity_path, 'period_starts': period_starts})
+    return result
+
+def backtest_scaling_policy_grid(df_trades_bt, policies, initial_balance=DEFAULT_ACCOUNT_BALANCE, check_frequency="Weekly", n_jobs=1, chunk_size=2000):
+    # Splits the policy grid into chunks (optionally across a process pool) and concatenates the summaries
+    if df_trades_bt is None or df_trades_bt.empty or policies is None or policies.empty:
+        return pd.DataFrame()
+    period_freq = {"daily": "D", "weekly": "W", "monthly": "M"}.get(str(check_frequency).strip().lower(), "W")
+    trade_period = df_trades_bt['Time'].dt.to_period(period_freq).astype('int64').to_numpy()
+    trade_r = df_trades_bt['R'].to_numpy(dtype=float)
+    policy_chunks = [policies.iloc[i:i + chunk_size] for i in range(0, len(policies), chunk_size)]
+    chunk_results = run_in_process_pool(run_scaling_policy_backtest, [(trade_r, trade_period, chunk, initial_balance) for chunk in policy_chunks], n_jobs=n_jobs)
+    return pd.concat([res['summary'] for res in chunk_results], ignore_index=True)
+
+# ============== PART 1.10: EQUITY & DRAWDOWN KERNEL ==============
+# Shared by the AI Assistant, statement analytics and dashboards. Everything is cumsum / maximum.accumulate,
+# no per-row Python, so a million trades takes milliseconds (see benchmarks.py).
+def compute_equity_drawdown(pnl, initial_balance=0.0):
+    # pnl: P/L per trade in time order. Drawdown is measured from the running peak, which starts at initial_balance.
+    # Durations are in trades; *_idx values are positions in pnl (-1 = the starting balance, None = not recovered).
+    pnl = np.nan_to_num(np.asarray(pnl, dtype=float))
+    initial_balance = float(initial_balance)
+    equity = initial_balance + np.cumsum(pnl)
+    peak = np.maximum(np.maximum.accumulate(equity), initial_balance) if len(equity) else equity
+    drawdown = peak - equity
+    drawdown_pct = np.divide(drawdown, peak, out=np.zeros_like(drawdown), where=peak > 0) * 100
+    result = {
+        'equity': equity, 'peak': peak, 'drawdown': drawdown, 'drawdown_pct': drawdown_pct,
+        'final_balance': float(equity[-1]) if len(equity) else initial_balance,
+        'max_drawdown': 0.0, 'max_drawdown_pct': 0.0,
+        'max_dd_peak_idx': None, 'max_dd_trough_idx': None, 'recovery_idx': None, 'recovery_trades': None,
+        'max_underwater_trades': 0, 'current_underwater_trades': 0
+    }
+    if not len(equity) or drawdown.max() <= 0:
+        return result
+
+    trough_idx = int(np.argmax(drawdown))
+    peak_value = peak[trough_idx]
+    at_peak_before = np.flatnonzero(equity[:trough_idx] >= peak_value)
+    recovered_after = np.flatnonzero(equity[trough_idx + 1:] >= peak_value)
+
+    # Underwater run length at every position: distance back to the most recent point at a peak
+    positions = np.arange(len(equity))
+    last_at_peak = np.maximum.accumulate(np.where(drawdown <= 0, positions, -1))
+    underwater_run = np.where(drawdown > 0, positions - last_at_peak, 0)
+
+    result.update({
+        'max_drawdown': float(drawdown[trough_idx]), 'max_drawdown_pct': float(drawdown_pct.max()),
+        'max_dd_peak_idx': int(at_peak_before[-1]) if len(at_peak_before) else -1, 'max_dd_trough_idx': trough_idx,
+        'recovery_idx': int(trough_idx + 1 + recovered_after[0]) if len(recovered_after) else None,
+        'recovery_trades': int(recovered_after[0] + 1) if len(recovered_after) else None,
+        'max_underwater_trades': int(underwater_run.max()), 'current_underwater_trades': int(underwater_run[-1])
+    })
+    return result
+
+# ============== PART 1.11: MONTE CARLO RISK OF RUIN ==============
+# Simulates many future trade sequences at the current risk % and measures how often the portfolio's
+# prop-firm limits are breached. Trades are drawn as R multiples either by bootstrapping closed round trips
+# (round_trip_r_multiples, PART 1.13) or from a win rate / RR. Each chunk is one (paths x trades) matrix.
+def _simulate_risk_of_ruin_chunk(r_sample, win_rate, avg_rr, risk_pct, n_paths, n_trades, trades_per_day,
+                                 daily_loss_limit_pct, stopout_level, target_level, seed):
+    # Returns per-path arrays: end event (0 none, 1 daily breach, 2 total stopout, 3 target), event trade, max DD %, final return %
+    rng = np.random.default_rng(seed)
+    if r_sample is not None and len(r_sample) > 0:
+        r_matrix = rng.choice(np.asarray(r_sample, dtype=float), size=(n_paths, n_trades))
+    else:
+        r_matrix = np.where(rng.random((n_paths, n_trades)) < win_rate / 100.0, avg_rr, -1.0)
+    growth = np.maximum(1.0 + r_matrix * (risk_pct / 100.0), 0.0)
+    equity = np.cumprod(growth, axis=1) # Relative to a starting balance of 1.0
+    equity_full = np.hstack([np.ones((n_paths, 1)), equity])
+
+    no_event = np.full(n_paths, n_trades, dtype=np.int64)
+    def first_true(mask_2d):
+        return np.where(mask_2d.any(axis=1), mask_2d.argmax(axis=1), no_event)
+
+    trade_positions = np.arange(n_trades)
+    day_start_equity = equity_full[:, (trade_positions // trades_per_day) * trades_per_day]
+    daily_idx = first_true(equity <= day_start_equity * (1 - daily_loss_limit_pct / 100.0)) if daily_loss_limit_pct > 0 else no_event
+    total_idx = first_true(equity <= stopout_level)
+    target_idx = first_true(equity >= target_level) if target_level is not None else no_event
+
+    # The earliest event ends the path; a breach on the same trade as the target counts as a breach
+    event_idx = np.minimum(np.minimum(daily_idx, total_idx), target_idx)
+    event_type = np.select([event_idx == n_trades, total_idx == event_idx, daily_idx == event_idx], [0, 2, 1], default=3)
+
+    # Freeze equity after the ending event, then measure drawdown on the truncated path
+    frozen_equity = np.where(trade_positions[None, :] <= event_idx[:, None], equity,
+                             np.take_along_axis(equity, np.minimum(event_idx, n_trades - 1)[:, None], axis=1))
+    running_peak = np.maximum(np.maximum.accumulate(frozen_equity, axis=1), 1.0)
+    max_dd_pct = ((running_peak - frozen_equity) / running_peak).max(axis=1) * 100
+    return event_type, event_idx, max_dd_pct, (frozen_equity[:, -1] - 1.0) * 100
+
+def simulate_risk_of_ruin(risk_pct, balance, initial_balance=None, r_sample=None, win_rate=50.0, avg_rr=1.0, daily_loss_limit_pct=0.0,
+                          total_stopout_pct=0.0, profit_target_pct=0.0, n_paths=100000, n_trades=100, trades_per_day=3, seed=None, n_jobs=1):
+    # Stopout and target are measured from initial_balance (prop-firm style), the simulation starts at balance.
+    # Limits <= 0 are treated as not set (a total stopout then means the balance reaching zero).
+    n_paths, n_trades, trades_per_day = int(n_paths), int(n_trades), max(1, int(trades_per_day))
+    if n_paths <= 0 or n_trades <= 0 or risk_pct <= 0 or balance <= 0:
+        return {}
+    limit_base_ratio = (initial_balance if initial_balance and initial_balance > 0 else balance) / balance
+    stopout_level = limit_base_ratio * (1 - total_stopout_pct / 100.0) if total_stopout_pct > 0 else 0.0
+    target_level = limit_base_ratio * (1 + profit_target_pct / 100.0) if profit_target_pct > 0 else None
+    chunk_paths = max(1000, 4_000_000 // n_trades) # Keeps each chunk's matrices to a few tens of MB
+    chunk_sizes = [min(chunk_paths, n_paths - start) for start in range(0, n_paths, chunk_paths)]
+    chunk_seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    chunk_args = [(r_sample, win_rate, avg_rr, risk_pct, size, n_trades, trades_per_day,
+                   daily_loss_limit_pct, stopout_level, target_level, chunk_seed) for size, chunk_seed in zip(chunk_sizes, chunk_seeds)]
+    chunk_results = run_in_process_pool(_simulate_risk_of_ruin_chunk, chunk_args, n_jobs=n_jobs)
+    event_type, event_idx, max_dd_pct, final_return_pct = [np.concatenate(parts) for parts in zip(*chunk_results)]
+
+    target_trades = event_idx[event_type == 3] + 1
+    percentiles = [50, 75, 90, 95, 99]
+    return {
+        'n_paths': n_paths, 'n_trades': n_trades, 'trades_per_day': trades_per_day,
+        'prob_daily_breach': float(np.mean(event_type == 1)),
+        'prob_total_breach': float(np.mean(event_type == 2)),
+        'prob_any_breach': float(np.mean((event_type == 1) | (event_type == 2))),
+        'prob_target': float(np.mean(event_type == 3)),
+        'target_trades_percentiles': {p: float(np.percentile(target_trades, p)) for p in percentiles} if len(target_trades) else {},
+        'max_dd_pct_percentiles': {p: float(np.percentile(max_dd_pct, p)) for p in percentiles},
+        'final_return_pct_percentiles': {p: float(np.percentile(final_return_pct, p)) for p in [5, 25, 50, 75, 95]}
+    }
+
+# ============== PART 1.12: AI ASSISTANT METRICS (MATERIALIZED) ==============
+# The AI Assistant renders from small per-portfolio accumulators instead of re-scanning the full logs.
+# Like PART 1.7, sheets are treated as append-only: new rows are folded in, anything else (including a row edited in
+# place, caught by a content hash of the rows already folded in) rebuilds.
+# Drawdown is kept relative to the starting balance, so the accumulators do not depend on the balance used.
+AI_METRICS_SOURCES = {
+    'planned': {'id_cols': ['LogID'], 'time_col': 'Timestamp', 'hash_cols': ['PortfolioID', 'Timestamp', 'Risk $', 'RR']},
+    'actual': {'id_cols': ['Deal_ID', 'ImportBatchID'], 'time_col': 'Time_Deal', 'hash_cols': ['PortfolioID', 'Time_Deal', 'Type_Deal', 'Profit_Deal']}
+}
+
+def _new_ai_metrics_state():
+    return {source: {'rows_seen': 0, 'anchor': None, 'content_hash': 0, 'portfolios': {}} for source in AI_METRICS_SOURCES}
+
+def _new_drawdown_accumulator():
+    return {'n': 0, 'cum': 0.0, 'peak': 0.0, 'max_dd': 0.0, 'max_dd_peak_value': 0.0,
+            'recovery_trades': None, 'trough_pos': None, 'last_at_peak': -1, 'max_underwater': 0}
+
+def _extend_drawdown_accumulator(dd_acc, pnl_block):
+    # Same results as compute_equity_drawdown on the concatenated P/L, one block at a time
+    pnl_block = np.nan_to_num(np.asarray(pnl_block, dtype=float))
+    if not len(pnl_block):
+        return dd_acc
+    positions = dd_acc['n'] + np.arange(len(pnl_block))
+    cum_block = dd_acc['cum'] + np.cumsum(pnl_block)
+    peak_block = np.maximum(dd_acc['peak'], np.maximum.accumulate(cum_block))
+    dd_block = peak_block - cum_block
+    block_trough = int(np.argmax(dd_block))
+    if dd_block[block_trough] > dd_acc['max_dd']:
+        dd_acc.update({'max_dd': float(dd_block[block_trough]), 'max_dd_peak_value': float(peak_block[block_trough]),
+                       'trough_pos': int(positions[block_trough]), 'recovery_trades': None})
+        search_from = block_trough + 1
+    else:
+        search_from = 0
+    if dd_acc['max_dd'] > 0 and dd_acc['recovery_trades'] is None:
+        recovered = np.flatnonzero(cum_block[search_from:] >= dd_acc['max_dd_peak_value'])
+        if len(recovered): dd_acc['recovery_trades'] = int(positions[search_from + recovered[0]] - dd_acc['trough_pos'])
+    last_at_peak = np.maximum.accumulate(np.where(dd_block <= 0, positions, dd_acc['last_at_peak']))
+    dd_acc['max_underwater'] = max(dd_acc['max_underwater'], int(np.where(dd_block > 0, positions - last_at_peak, 0).max()))
+    dd_acc.update({'n': dd_acc['n'] + len(pnl_block), 'cum': float(cum_block[-1]), 'peak': float(peak_block[-1]), 'last_at_peak': int(last_at_peak[-1])})
+    return dd_acc
+
+def _new_ai_metrics_accumulator(source):
+    acc = {'rows': 0, 'last_time': None, 'drawdown': _new_drawdown_accumulator()}
+    if source == "planned":
+        acc.update({'wins': 0, 'net_pnl': 0.0, 'rr_count': 0, 'rr_pos_count': 0, 'rr_pos_sum': 0.0,
+                    'weekday_pnl': np.zeros(7), 'weekday_seen': np.zeros(7, dtype=bool), 'has_risk_col': True})
+    else:
+        acc.update({'deals': 0, 'wins': 0, 'losses': 0, 'gross_profit': 0.0, 'gross_loss': 0.0, 'has_profit_col': True})
+    return acc
+
+def _extend_ai_metrics_accumulator(acc, source, df_block):
+    # df_block: new rows for one portfolio key, already in time order
+    time_col = AI_METRICS_SOURCES[source]['time_col']
+    times_block = pd.to_datetime(df_block[time_col], errors='coerce') if time_col in df_block.columns else pd.Series(pd.NaT, index=df_block.index)
+    acc['rows'] += len(df_block)
+    if times_block.notna().any():
+        block_last_time = times_block.max()
+        acc['last_time'] = block_last_time if acc['last_time'] is None else max(acc['last_time'], block_last_time)
+    if source == "planned":
+        acc['has_risk_col'] = acc['has_risk_col'] and 'Risk $' in df_block.columns
+        pnl_block = pd.to_numeric(df_block['Risk $'], errors='coerce').fillna(0.0).to_numpy() if 'Risk $' in df_block.columns else np.zeros(len(df_block))
+        acc['wins'] += int(np.count_nonzero(pnl_block > 0))
+        acc['net_pnl'] += float(pnl_block.sum())
+        if 'RR' in df_block.columns:
+            rr_block = pd.to_numeric(df_block['RR'], errors='coerce').dropna().to_numpy()
+            acc['rr_count'] += len(rr_block)
+            acc['rr_pos_count'] += int(np.count_nonzero(rr_block > 0))
+            acc['rr_pos_sum'] += float(rr_block[rr_block > 0].sum())
+        valid_times = times_block.notna().to_numpy()
+        if valid_times.any():
+            weekday_block = times_block[valid_times].dt.dayofweek.to_numpy()
+            acc['weekday_pnl'] += np.bincount(weekday_block, weights=pnl_block[valid_times], minlength=7)
+            acc['weekday_seen'][np.unique(weekday_block)] = True
+    else:
+        acc['has_profit_col'] = acc['has_profit_col'] and 'Profit_Deal' in df_block.columns
+        if 'Profit_Deal' not in df_block.columns:
+            return acc
+        df_trading_block = df_block
+        if 'Type_Deal' in df_block.columns:
+            df_trading_block = df_block[~df_block['Type_Deal'].astype(str).str.lower().isin(DEAL_NON_TRADING_TYPES)]
+        pnl_block = pd.to_numeric(df_trading_block['Profit_Deal'], errors='coerce').fillna(0.0).to_numpy()
+        acc['deals'] += len(pnl_block)
+        acc['wins'] += int(np.count_nonzero(pnl_block > 0))
+        acc['losses'] += int(np.count_nonzero(pnl_block < 0))
+        acc['gross_profit'] += float(pnl_block[pnl_block > 0].sum())
+        acc['gross_loss'] += float(-pnl_block[pnl_block < 0].sum())
+    _extend_drawdown_accumulator(acc['drawdown'], pnl_block)
+    return acc
+
+def update_ai_metrics(metrics_state, source, df_source):
+    # Folds rows appended since the last call into the ALL key and each PortfolioID key
+    src_state = metrics_state[source]
+    df_source = df_source if df_source is not None else pd.DataFrame()
+    id_cols = [c for c in AI_METRICS_SOURCES[source]['id_cols'] if c in df_source.columns]
+    time_col = AI_METRICS_SOURCES[source]['time_col']
+    anchor_of = lambda pos: tuple(str(df_source[c].iloc[pos]) for c in id_cols)
+
+    n_rows = len(df_source)
+    rows_seen = src_state['rows_seen']
+    row_hashes = _row_content_hashes(df_source, AI_METRICS_SOURCES[source]['hash_cols'])
+    if not (0 < rows_seen <= n_rows and anchor_of(rows_seen - 1) == src_state['anchor']
+            and _combine_row_hashes(row_hashes[:rows_seen]) == src_state.get('content_hash')):
+        src_state.update({'rows_seen': 0, 'anchor': None, 'content_hash': 0, 'portfolios': {}})
+        rows_seen = 0
+    if n_rows == rows_seen:
+        return metrics_state
+
+    df_new = df_source.iloc[rows_seen:]
+    if time_col in df_new.columns:
+        df_new = df_new.assign(_ai_time=pd.to_datetime(df_new[time_col], errors='coerce')).sort_values('_ai_time', kind='stable')
+    key_blocks = [(PERF_WINDOW_ALL_KEY, df_new, None)]
+    if 'PortfolioID' in df_new.columns:
+        key_blocks += [(str(pid), df_pf_new, str(pid)) for pid, df_pf_new in df_new.groupby(df_new['PortfolioID'].astype(str), sort=False)]
+    for key, df_key_new, pid_filter in key_blocks:
+        acc = src_state['portfolios'].get(key)
+        if acc is not None and acc['last_time'] is not None and '_ai_time' in df_key_new.columns and (df_key_new['_ai_time'] < acc['last_time']).any():
+            # Back-dated rows change the time order: rebuild this key from all of its rows
+            df_key_new = df_source if pid_filter is None else df_source[df_source['PortfolioID'].astype(str) == pid_filter]
+            df_key_new = df_key_new.assign(_ai_time=pd.to_datetime(df_key_new[time_col], errors='coerce')).sort_values('_ai_time', kind='stable')
+            acc = None
+        if acc is None: acc = _new_ai_metrics_accumulator(source)
+        src_state['portfolios'][key] = _extend_ai_metrics_accumulator(acc, source, df_key_new)
+
+    src_state['rows_seen'] = n_rows
+    src_state['anchor'] = anchor_of(n_rows - 1)
+    src_state['content_hash'] = _combine_row_hashes(row_hashes)
+    return metrics_state
+
+def summarize_ai_metrics(metrics_state, source, portfolio_key):
+    # O(1) read of one key's report values; None when the key has no rows
+    acc = metrics_state[source]['portfolios'].get(str(portfolio_key))
+    if acc is None:
+        return None
+    dd_acc = acc['drawdown']
+    summary = {'rows': acc['rows'], 'max_drawdown': dd_acc['max_dd'], 'max_underwater_trades': dd_acc['max_underwater'], 'recovery_trades': dd_acc['recovery_trades']}
+    if source == "planned":
+        weekday_names = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+        seen_pnl = np.where(acc['weekday_seen'], acc['weekday_pnl'], np.nan)
+        has_days = acc['weekday_seen'].any()
+        summary.update({
+            'has_risk_col': acc['has_risk_col'], 'total_trades': acc['rows'],
+            'winrate': (100 * acc['wins'] / acc['rows']) if acc['rows'] > 0 else 0.0, 'net_pnl': acc['net_pnl'],
+            'avg_rr': (acc['rr_pos_sum'] / acc['rr_pos_count'] if acc['rr_pos_count'] > 0 else np.nan) if acc['rr_count'] > 0 else None,
+            'best_day': weekday_names[np.nanargmax(seen_pnl)] if has_days and np.nanmax(seen_pnl) > 0 else "-",
+            'worst_day': weekday_names[np.nanargmin(seen_pnl)] if has_days and np.nanmin(seen_pnl) < 0 else "-"
+        })
+    else:
+        summary.update({
+            'has_profit_col': acc['has_profit_col'], 'total_deals': acc['deals'], 'wins': acc['wins'], 'losses': acc['losses'],
+            'win_rate': (100 * acc['wins'] / acc['deals']) if acc['deals'] > 0 else 0.0,
+            'gross_profit': acc['gross_profit'], 'gross_loss': acc['gross_loss'],
+            'profit_factor': acc['gross_profit'] / acc['gross_loss'] if acc['gross_loss'] > 0 else float('inf') if acc['gross_profit'] > 0 else 0.0,
+            'avg_profit': acc['gross_profit'] / acc['wins'] if acc['wins'] > 0 else 0.0,
+            'avg_loss': acc['gross_loss'] / acc['losses'] if acc['losses'] > 0 else 0.0
+        })
+    return summary
+
+# ============== PART 1.13: ROUND-TRIP TRADE RECONSTRUCTION ==============
+# MT5 statements list deals (in / out / in/out / out by) but no position id, so round trips are rebuilt by
+# FIFO per portfolio, symbol and position side. Entry and exit volumes are laid out as intervals on one
+# cumulative-volume axis; the overlaps of those intervals are the FIFO fills, found with searchsorted.
+# Exit volume that finds nothing open at its time (the net volume reflected at zero) is left off the exit axis.
+ROUND_TRIP_VOLUME_SCALE = 10**6 # Volumes are matched as integers (1e-6 lot) to avoid float drift
+
+def _split_deals_into_legs(df_deals):
+    # One row per entry/exit leg: 'in' -> entry, 'out'/'out by' -> exit, 'in/out' -> exit of the open volume + entry of the rest
+    deal_cols = ['Time_Deal', 'Deal_ID', 'Symbol_Deal', 'Type_Deal', 'Direction_Deal', 'Volume_Deal', 'Price_Deal',
+                 'Commission_Deal', 'Fee_Deal', 'Swap_Deal', 'Profit_Deal']
+    df_legs = df_deals.reindex(columns=deal_cols + ['PortfolioID']).reset_index(drop=True)
+    df_legs['PortfolioID'] = df_legs['PortfolioID'].fillna("").astype(str)
+    df_legs['Time_Deal'] = pd.to_datetime(df_legs['Time_Deal'], errors='coerce')
+    for col in ['Volume_Deal', 'Price_Deal', 'Commission_Deal', 'Fee_Deal', 'Swap_Deal', 'Profit_Deal']:
+        df_legs[col] = pd.to_numeric(df_legs[col], errors='coerce').fillna(0.0)
+    deal_type = df_legs['Type_Deal'].astype(str).str.strip().str.lower()
+    direction = df_legs['Direction_Deal'].astype(str).str.strip().str.lower()
+    df_legs = df_legs[deal_type.isin(['buy', 'sell']) & (df_legs['Volume_Deal'] > 0) & df_legs['Time_Deal'].notna()]
+    deal_type, direction = deal_type[df_legs.index], direction[df_legs.index]
+
+    df_legs['Units'] = np.rint(df_legs['Volume_Deal'].to_numpy() * ROUND_TRIP_VOLUME_SCALE).astype(np.int64)
+    df_legs['DealSign'] = np.where(deal_type == 'buy', 1, -1)
+    df_legs['_deal_id_num'] = pd.to_numeric(df_legs['Deal_ID'], errors='coerce')
+    df_legs = df_legs.sort_values(['PortfolioID', 'Symbol_Deal', 'Time_Deal', '_deal_id_num'], kind='stable')
+    direction = direction[df_legs.index]
+
+    is_entry = direction.eq('in').to_numpy()
+    is_reversal = direction.eq('in/out').to_numpy()
+    # Net position before each deal (netting accounts) sizes the closing part of an in/out deal
+    signed_units = df_legs['Units'].to_numpy() * df_legs['DealSign'].to_numpy()
+    net_before = df_legs.assign(_signed=signed_units).groupby(['PortfolioID', 'Symbol_Deal'], sort=False)['_signed'].cumsum().to_numpy() - signed_units
+    close_units = np.where(is_reversal, np.minimum(df_legs['Units'].to_numpy(), np.abs(net_before)), np.where(is_entry, 0, df_legs['Units'].to_numpy()))
+    open_units = df_legs['Units'].to_numpy() - close_units
+
+    df_exit_legs = df_legs[close_units > 0].assign(Units=close_units[close_units > 0], IsEntry=False)
+    df_entry_legs = df_legs[open_units > 0].assign(Units=open_units[open_units > 0], IsEntry=True)
+    # Position side: an entry buy opens a long (+1), an exit sell closes a long (+1)
+    df_entry_legs['Side'] = df_entry_legs['DealSign']
+    df_exit_legs['Side'] = -df_exit_legs['DealSign']
+    # Costs of a split deal are shared across its legs by volume; its profit is realized by the closing leg
+    for df_part in (df_exit_legs, df_entry_legs):
+        leg_share = df_part['Units'] / np.rint(df_part['Volume_Deal'] * ROUND_TRIP_VOLUME_SCALE).clip(lower=1)
+        for col in ['Commission_Deal', 'Fee_Deal', 'Swap_Deal']:
+            df_part[col] = df_part[col] * leg_share
+    df_entry_legs['Profit_Deal'] = df_entry_legs['Profit_Deal'].where(direction[df_entry_legs.index].eq('in'), 0.0)
+    return df_entry_legs, df_exit_legs
+
+def reconstruct_round_trip_trades(df_deals):
+    # Returns one row per entry leg (a position opened by an 'in' deal) with its FIFO-matched exits.
+    # Exit volume with no open entry before it (e.g. opened before the first imported statement) is ignored.
+    trade_cols = ['PortfolioID', 'Symbol', 'Side', 'EntryDealID', 'EntryTime', 'EntryPrice', 'Volume', 'ClosedVolume',
+                  'ExitTime', 'ExitPrice', 'ExitDeals', 'HoldingTime', 'Profit', 'Commission', 'Fee', 'Swap', 'NetPL', 'Status']
+    if df_deals is None or df_deals.empty or 'Direction_Deal' not in df_deals.columns:
+        return pd.DataFrame(columns=trade_cols)
+    df_entry_legs, df_exit_legs = _split_deals_into_legs(df_deals)
+    if df_entry_legs.empty:
+        return pd.DataFrame(columns=trade_cols)
+
+    group_cols = ['PortfolioID', 'Symbol_Deal', 'Side']
+    df_entry_legs = df_entry_legs.reset_index(drop=True)
+    df_exit_legs = df_exit_legs.reset_index(drop=True)
+    group_codes, group_keys = pd.factorize(pd.MultiIndex.from_frame(pd.concat([df_entry_legs[group_cols], df_exit_legs[group_cols]], ignore_index=True)))
+    entry_group, exit_group = group_codes[:len(df_entry_legs)], group_codes[len(df_entry_legs):]
+
+    # Only exit volume covered by open volume at that time is matched: walking each group's legs in time order (an in/out
+    # deal's exit leg before its entry leg), the running shortfall of the net volume below zero is orphan exit volume
+    entry_units, exit_units = df_entry_legs['Units'].to_numpy(), df_exit_legs['Units'].to_numpy()
+    legs_group = np.concatenate([entry_group, exit_group])
+    legs_is_exit = np.r_[np.zeros(len(entry_units), dtype=bool), np.ones(len(exit_units), dtype=bool)]
+    legs_time = np.concatenate([df_entry_legs['Time_Deal'].to_numpy(), df_exit_legs['Time_Deal'].to_numpy()]).astype('datetime64[ns]').astype(np.int64)
+    legs_deal = np.concatenate([df_entry_legs['_deal_id_num'].to_numpy(dtype=float), df_exit_legs['_deal_id_num'].to_numpy(dtype=float)])
+    legs_order = np.lexsort((~legs_is_exit, legs_deal, legs_time, legs_group))
+    legs_signed = np.concatenate([entry_units, -exit_units])[legs_order]
+    net_volume = pd.Series(legs_signed).groupby(legs_group[legs_order]).cumsum()
+    shortfall = (-net_volume.groupby(legs_group[legs_order]).cummin()).clip(lower=0).to_numpy()
+    shortfall_before = np.where(np.r_[True, legs_group[legs_order][1:] != legs_group[legs_order][:-1]], 0, np.r_[0, shortfall[:-1]])
+    orphan_units = np.zeros(len(legs_order), dtype=np.int64)
+    orphan_units[legs_order] = shortfall - shortfall_before
+    matched_exit_units = exit_units - orphan_units[len(entry_units):]
+
+    # Lay each group out on its own stretch of one global volume axis (legs are already in time order)
+    n_groups = len(group_keys)
+    group_span = np.maximum(np.bincount(entry_group, weights=entry_units, minlength=n_groups), np.bincount(exit_group, weights=matched_exit_units, minlength=n_groups)).astype(np.int64)
+    group_offset = np.concatenate(([0], np.cumsum(group_span)[:-1]))
+    def interval_ends(groups, units):
+        order = np.argsort(groups, kind='stable')
+        ends = np.empty(len(units), dtype=np.int64)
+        sorted_units = units[order]
+        group_first = np.r_[True, groups[order][1:] != groups[order][:-1]] if len(units) else np.zeros(0, dtype=bool)
+        run_cum = np.cumsum(sorted_units)
+        run_base = np.maximum.accumulate(np.where(group_first, run_cum - sorted_units, 0)) if len(units) else run_cum
+        ends[order] = group_offset[groups[order]] + run_cum - run_base
+        return ends
+    entry_end, exit_end = interval_ends(entry_group, entry_units), interval_ends(exit_group, matched_exit_units)
+    entry_start, exit_start = entry_end - entry_units, exit_end - matched_exit_units
+
+    # Fills: overlaps of entry and exit intervals in the same group
+    entry_order = np.argsort(entry_end, kind='stable')
+    matched_exits = np.flatnonzero(matched_exit_units > 0) # Fully orphaned exits are empty intervals and must not shadow real ones
+    exit_order = matched_exits[np.argsort(exit_end[matched_exits], kind='stable')]
+    breakpoints = np.unique(np.concatenate([entry_start, entry_end, exit_start, exit_end]))
+    seg_lo, seg_hi = breakpoints[:-1], breakpoints[1:]
+    seg_entry = entry_order[np.minimum(np.searchsorted(entry_end[entry_order], seg_lo, side='right'), len(entry_order) - 1)]
+    if len(exit_order):
+        seg_exit = exit_order[np.minimum(np.searchsorted(exit_end[exit_order], seg_lo, side='right'), len(exit_order) - 1)]
+        is_fill = (entry_start[seg_entry] <= seg_lo) & (entry_end[seg_entry] >= seg_hi) & (exit_start[seg_exit] <= seg_lo) & (exit_end[seg_exit] >= seg_hi)
+    else:
+        seg_exit, is_fill = np.zeros(len(seg_lo), dtype=np.int64), np.zeros(len(seg_lo), dtype=bool)
+    if len(exit_order): # Never close a position before it was opened
+        is_fill &= df_exit_legs['Time_Deal'].to_numpy()[seg_exit] >= df_entry_legs['Time_Deal'].to_numpy()[seg_entry]
+    fill_entry, fill_exit, fill_units = seg_entry[is_fill], seg_exit[is_fill], (seg_hi - seg_lo)[is_fill]
+
+    # Exit amounts are allocated to fills by volume share; entry amounts stay whole on their trade
+    df_fills = pd.DataFrame({'entry': fill_entry, 'units': fill_units})
+    exit_share = fill_units / exit_units[fill_exit]
+    for col in ['Commission_Deal', 'Fee_Deal', 'Swap_Deal', 'Profit_Deal']:
+        df_fills[col] = df_exit_legs[col].to_numpy()[fill_exit] * exit_share
+    df_fills['price_x_units'] = df_exit_legs['Price_Deal'].to_numpy()[fill_exit] * fill_units
+    df_fills['exit_time'] = df_exit_legs['Time_Deal'].to_numpy()[fill_exit]
+    df_fills['exit_deal'] = fill_exit
+    fills_by_entry = df_fills.groupby('entry').agg(
+        ClosedUnits=('units', 'sum'), PriceUnits=('price_x_units', 'sum'), ExitTime=('exit_time', 'max'), ExitDeals=('exit_deal', 'nunique'),
+        Commission=('Commission_Deal', 'sum'), Fee=('Fee_Deal', 'sum'), Swap=('Swap_Deal', 'sum'), Profit=('Profit_Deal', 'sum')
+    ).reindex(np.arange(len(df_entry_legs)))
+
+    df_trades = pd.DataFrame({
+        'PortfolioID': df_entry_legs['PortfolioID'], 'Symbol': df_entry_legs['Symbol_Deal'],
+        'Side': np.where(df_entry_legs['Side'] > 0, 'Long', 'Short'), 'EntryDealID': df_entry_legs['Deal_ID'],
+        'EntryTime': df_entry_legs['Time_Deal'], 'EntryPrice': df_entry_legs['Price_Deal'],
+        'Volume': entry_units / ROUND_TRIP_VOLUME_SCALE, 'ClosedVolume': fills_by_entry['ClosedUnits'].fillna(0).to_numpy() / ROUND_TRIP_VOLUME_SCALE,
+        'ExitTime': fills_by_entry['ExitTime'].to_numpy(),
+        'ExitPrice': (fills_by_entry['PriceUnits'] / fills_by_entry['ClosedUnits']).to_numpy(),
+        'ExitDeals': fills_by_entry['ExitDeals'].fillna(0).astype(int).to_numpy()
+    })
+    df_trades['HoldingTime'] = df_trades['ExitTime'] - df_trades['EntryTime']
+    for out_col, deal_col in [('Profit', 'Profit_Deal'), ('Commission', 'Commission_Deal'), ('Fee', 'Fee_Deal'), ('Swap', 'Swap_Deal')]:
+        df_trades[out_col] = fills_by_entry[out_col].fillna(0.0).to_numpy() + df_entry_legs[deal_col].to_numpy()
+    df_trades['NetPL'] = df_trades[['Profit', 'Commission', 'Fee', 'Swap']].sum(axis=1)
+    df_trades['Status'] = np.select([df_trades['ClosedVolume'] <= 0, df_trades['ClosedVolume'] < df_trades['Volume']], ['Open', 'Partial'], default='Closed')
+    return df_trades.sort_values('EntryTime', kind='stable').reset_index(drop=True)[trade_cols]
+
+def _round_trip_entry_balances(df_trips, df_deals, reference_balance=DEFAULT_ACCOUNT_BALANCE):
+    # Account balance at each round trip's entry deal (Balance_Deal of EntryDealID), reference_balance where unknown
+    balance_at_entry = pd.Series(np.nan, index=df_trips.index)
+    if df_deals is not None and not df_deals.empty and {'Deal_ID', 'Balance_Deal'}.issubset(df_deals.columns):
+        deal_keys = df_deals.get('PortfolioID', pd.Series("", index=df_deals.index)).fillna("").astype(str) + "|" + df_deals['Deal_ID'].astype(str).str.strip()
+        balance_by_deal = pd.Series(pd.to_numeric(df_deals['Balance_Deal'], errors='coerce').values, index=deal_keys.values)
+        balance_by_deal = balance_by_deal[~balance_by_deal.index.duplicated(keep='last')]
+        trade_keys = df_trips['PortfolioID'].astype(str) + "|" + df_trips['EntryDealID'].astype(str).str.strip()
+        balance_at_entry = pd.Series(balance_by_deal.reindex(trade_keys.values).values, index=df_trips.index)
+    return balance_at_entry.where(balance_at_entry > 0, reference_balance)
+
+def round_trip_r_multiples(df_trades, df_deals, historical_risk_pct, reference_balance=DEFAULT_ACCOUNT_BALANCE):
+    # One R per closed round trip: NetPL over the risk taken when it was opened (balance at the entry deal x
+    # historical_risk_pct). simulate_risk_of_ruin (PART 1.11) then applies the simulated risk % to these R values.
+    if df_trades is None or df_trades.empty or not historical_risk_pct or historical_risk_pct <= 0:
+        return np.zeros(0)
+    df_closed = df_trades[df_trades['Status'] == 'Closed']
+    r_vals = df_closed['NetPL'].astype(float) / (_round_trip_entry_balances(df_closed, df_deals, reference_balance) * historical_risk_pct / 100.0)
+    return r_vals.dropna().to_numpy(dtype=float)
+
+@profile_call("loader")
+@st.cache_data(ttl=180)
+def load_round_trip_trades_from_gsheets():
+    # Round trips for every portfolio, rebuilt from the (cached) ActualTrades sheet
+    return reconstruct_round_trip_trades(load_actual_trades_from_gsheets())
+
+# ============== PART 1.14: PLAN VS ACTUAL MATCHING ==============
+# Links entry deals to planned legs (one PlannedTradeLogs row = one leg) with the same portfolio, symbol and
+# side, placed up to window_hours after the plan and within price_tol_pct of the leg's Entry. Plans are sorted
+# once by (key, time); each deal finds its candidate range with two searchsorted calls, no nested loops.
+def _normalize_symbol(symbol_series):
+    # "xauusd", "XAUUSD.", "XAU/USD" -> "XAUUSD"
+    return symbol_series.astype(str).str.upper().str.replace(r'[^A-Z0-9]', '', regex=True)
+
+def match_plans_to_deals(df_plans, df_deals, window_hours=24.0, price_tol_pct=0.3):
+    # Returns one row per matched entry deal (best = closest price, then closest time) and the unmatched entry deals
+    match_cols = ['LogID', 'PortfolioID', 'Symbol', 'Side', 'PlanTime', 'DealTime', 'DelayMinutes', 'PlanEntry', 'FillPrice',
+                  'Slippage', 'SlippageR', 'PlanSL', 'PlanTP', 'PlanLot', 'FillVolume', 'Deal_ID']
+    empty_result = (pd.DataFrame(columns=match_cols), pd.DataFrame())
+    plan_needed, deal_needed = ['LogID', 'Timestamp', 'Asset', 'Direction', 'Entry'], ['Time_Deal', 'Symbol_Deal', 'Type_Deal', 'Price_Deal']
+    if df_plans is None or df_deals is None or df_plans.empty or df_deals.empty or \
+       any(c not in df_plans.columns for c in plan_needed) or any(c not in df_deals.columns for c in deal_needed):
+        return empty_result
+
+    plans = pd.DataFrame({
+        'LogID': df_plans['LogID'].astype(str),
+        'PortfolioID': df_plans['PortfolioID'].astype(str) if 'PortfolioID' in df_plans.columns else "",
+        'Symbol': _normalize_symbol(df_plans['Asset']),
+        'Side': np.where(df_plans['Direction'].astype(str).str.strip().str.lower() == 'long', 1, -1),
+        'PlanTime': pd.to_datetime(df_plans['Timestamp'], errors='coerce'),
+        'PlanEntry': pd.to_numeric(df_plans['Entry'], errors='coerce'),
+        'PlanSL': pd.to_numeric(df_plans['SL'], errors='coerce') if 'SL' in df_plans.columns else np.nan,
+        'PlanTP': pd.to_numeric(df_plans['TP'], errors='coerce') if 'TP' in df_plans.columns else np.nan,
+        'PlanLot': pd.to_numeric(df_plans['Lot'], errors='coerce') if 'Lot' in df_plans.columns else np.nan
+    }).dropna(subset=['PlanTime', 'PlanEntry']).reset_index(drop=True)
+
+    df_deals = df_deals.reset_index(drop=True)
+    deal_type = df_deals['Type_Deal'].astype(str).str.strip().str.lower()
+    deal_direction = df_deals['Direction_Deal'].astype(str).str.strip().str.lower() if 'Direction_Deal' in df_deals.columns else pd.Series('in', index=df_deals.index)
+    df_entry_deals = df_deals[deal_type.isin(['buy', 'sell']) & deal_direction.isin(['in', 'in/out'])]
+    deals = pd.DataFrame({
+        'Deal_ID': df_entry_deals['Deal_ID'].astype(str) if 'Deal_ID' in df_entry_deals.columns else df_entry_deals.index.astype(str),
+        'PortfolioID': df_entry_deals['PortfolioID'].astype(str) if 'PortfolioID' in df_entry_deals.columns else "",
+        'Symbol': _normalize_symbol(df_entry_deals['Symbol_Deal']),
+        'Side': np.where(deal_type[df_entry_deals.index] == 'buy', 1, -1),
+        'DealTime': pd.to_datetime(df_entry_deals['Time_Deal'], errors='coerce'),
+        'FillPrice': pd.to_numeric(df_entry_deals['Price_Deal'], errors='coerce'),
+        'FillVolume': pd.to_numeric(df_entry_deals['Volume_Deal'], errors='coerce') if 'Volume_Deal' in df_entry_deals.columns else np.nan
+    }).dropna(subset=['DealTime', 'FillPrice']).reset_index(drop=True)
+    if plans.empty or deals.empty:
+        return empty_result[0], deals
+
+    # One integer per (portfolio, symbol, side) shared by both frames, then a sortable (key, seconds) index
+    key_codes, _ = pd.factorize(pd.MultiIndex.from_frame(pd.concat([plans[['PortfolioID', 'Symbol', 'Side']], deals[['PortfolioID', 'Symbol', 'Side']]], ignore_index=True)))
+    key_codes = key_codes.astype(np.int64)
+    base_time = min(plans['PlanTime'].min(), deals['DealTime'].min())
+    key_stride = np.int64(10**11) # Seconds span of any realistic log is far below this
+    plan_index = key_codes[:len(plans)] * key_stride + ((plans['PlanTime'] - base_time).dt.total_seconds().to_numpy().astype(np.int64))
+    deal_index = key_codes[len(plans):] * key_stride + ((deals['DealTime'] - base_time).dt.total_seconds().to_numpy().astype(np.int64))
+    plan_order = np.argsort(plan_index, kind='stable')
+    sorted_plan_index = plan_index[plan_order]
+    range_lo = np.searchsorted(sorted_plan_index, deal_index - int(window_hours * 3600), side='left')
+    range_hi = np.searchsorted(sorted_plan_index, deal_index, side='right')
+    range_len = range_hi - range_lo # Keys are strided apart, so a range never crosses into another key
+
+    # Expand (deal, candidate plan) pairs, keep those within price tolerance, pick the best per deal
+    pair_deal = np.repeat(np.arange(len(deals)), range_len)
+    pair_plan = plan_order[np.repeat(range_lo - np.concatenate(([0], np.cumsum(range_len)[:-1])), range_len) + np.arange(range_len.sum())]
+    plan_entry_arr = plans['PlanEntry'].to_numpy()
+    price_gap = np.abs(deals['FillPrice'].to_numpy()[pair_deal] - plan_entry_arr[pair_plan])
+    in_tolerance = price_gap <= np.abs(plan_entry_arr[pair_plan]) * price_tol_pct / 100.0
+    df_pairs = pd.DataFrame({'deal': pair_deal[in_tolerance], 'plan': pair_plan[in_tolerance], 'gap': price_gap[in_tolerance],
+                             'delay': (deal_index[pair_deal] - plan_index[pair_plan])[in_tolerance]})
+    df_best = df_pairs.sort_values(['deal', 'gap', 'delay'], kind='stable').drop_duplicates('deal')
+
+    matched_deals, matched_plans = deals.iloc[df_best['deal'].to_numpy()].reset_index(drop=True), plans.iloc[df_best['plan'].to_numpy()].reset_index(drop=True)
+    df_matches = matched_plans[['LogID', 'PortfolioID', 'Symbol', 'Side', 'PlanTime', 'PlanEntry', 'PlanSL', 'PlanTP', 'PlanLot']].copy()
+    df_matches[['Deal_ID', 'DealTime', 'FillPrice', 'FillVolume']] = matched_deals[['Deal_ID', 'DealTime', 'FillPrice', 'FillVolume']]
+    df_matches['DelayMinutes'] = (df_matches['DealTime'] - df_matches['PlanTime']).dt.total_seconds() / 60
+    # Positive slippage = filled at a worse price than planned (higher for Long, lower for Short)
+    df_matches['Slippage'] = (df_matches['FillPrice'] - df_matches['PlanEntry']) * df_matches['Side']
+    sl_distance = (df_matches['PlanEntry'] - df_matches['PlanSL']).abs()
+    df_matches['SlippageR'] = df_matches['Slippage'] / sl_distance.where(sl_distance > 0)
+    df_matches['Side'] = np.where(df_matches['Side'] > 0, 'Long', 'Short')
+    df_unmatched = deals.drop(index=df_best['deal'].to_numpy())
+    df_unmatched['Side'] = np.where(df_unmatched['Side'] > 0, 'Long', 'Short')
+    return df_matches[match_cols], df_unmatched.reset_index(drop=True)
+
+def summarize_plan_adherence(df_plans, df_matches, df_unmatched, lot_tolerance_pct=10.0):
+    # Per-portfolio execution / slippage / size adherence
+    report_cols = ['PlannedLegs', 'ExecutedLegs', 'ExecutionRate', 'MatchedDeals', 'UnplannedDeals', 'AvgSlippage', 'MedianSlippageR',
+                   'WorseFillRate', 'LotAdherenceRate', 'MedianDelayMinutes']
+    if df_plans is None or df_plans.empty or 'PortfolioID' not in df_plans.columns:
+        return pd.DataFrame(columns=report_cols)
+    planned_legs = df_plans.groupby(df_plans['PortfolioID'].astype(str)).size()
+    df_report = pd.DataFrame({'PlannedLegs': planned_legs})
+    if not df_matches.empty:
+        fill_vs_plan = df_matches.groupby(['PortfolioID', 'LogID'])[['FillVolume', 'PlanLot']].agg({'FillVolume': 'sum', 'PlanLot': 'first'})
+        lot_ok = ((fill_vs_plan['FillVolume'] - fill_vs_plan['PlanLot']).abs() <= fill_vs_plan['PlanLot'].abs() * lot_tolerance_pct / 100.0)
+        by_portfolio = df_matches.groupby('PortfolioID')
+        df_report = df_report.join(pd.DataFrame({
+            'ExecutedLegs': by_portfolio['LogID'].nunique(), 'MatchedDeals': by_portfolio.size(),
+            'AvgSlippage': by_portfolio['Slippage'].mean(), 'MedianSlippageR': by_portfolio['SlippageR'].median(),
+            'WorseFillRate': by_portfolio['Slippage'].apply(lambda s: 100 * (s > 0).mean()),
+            'LotAdherenceRate': lot_ok.groupby(level='PortfolioID').mean() * 100,
+            'MedianDelayMinutes': by_portfolio['DelayMinutes'].median()
+        }), how='left')
+    if df_unmatched is not None and not df_unmatched.empty:
+        df_report = df_report.join(df_unmatched.groupby('PortfolioID').size().rename('UnplannedDeals'), how='left')
+    df_report = df_report.reindex(columns=report_cols)
+    df_report[['ExecutedLegs', 'MatchedDeals', 'UnplannedDeals']] = df_report[['ExecutedLegs', 'MatchedDeals', 'UnplannedDeals']].fillna(0).astype(int)
+    df_report['ExecutionRate'] = 100 * df_report['ExecutedLegs'] / df_report['PlannedLegs']
+    return df_report
+
+@profile_call("loader")
+@st.cache_data(ttl=180)
+def load_plan_vs_actual_from_gsheets(window_hours=24.0, price_tol_pct=0.3):
+    # (matches, unmatched entry deals) for every portfolio, from the cached sheets
+    return match_plans_to_deals(load_all_planned_trade_logs_from_gsheets(), load_actual_trades_from_gsheets(), window_hours, price_tol_pct)
+
+# ============== PART 1.15: STATEMENT METRICS FROM DEALS ==============
+# Recomputes the MT5 "Results" block (same keys as results_summary_dict in extract_data_from_report_content_sec6)
+# from the deals table, for any date range / symbol subset. As in MT5, a trade is a closing deal
+# (out, in/out, out by) and its result is Profit + Commission + Fee + Swap; entry-deal costs count toward net profit.
+def _streak_stats(trade_results):
+    # Runs of consecutive wins / losses: (wins, losses) DataFrames with Count and Amount per run
+    signs = np.sign(trade_results)
+    run_id = np.cumsum(np.r_[True, signs[1:] != signs[:-1]]) if len(signs) else np.zeros(0, dtype=int)
+    df_runs = pd.DataFrame({'run': run_id, 'sign': signs, 'amount': trade_results}).groupby('run').agg(
+        sign=('sign', 'first'), Count=('amount', 'size'), Amount=('amount', 'sum'))
+    return df_runs[df_runs['sign'] > 0], df_runs[df_runs['sign'] < 0]
+
+def compute_statement_metrics(df_deals, start=None, end=None, symbols=None, initial_balance=None):
+    if df_deals is None or df_deals.empty or 'Profit_Deal' not in df_deals.columns:
+        return {}
+    df_calc = df_deals.reset_index(drop=True)
+    deal_time = pd.to_datetime(df_calc['Time_Deal'], errors='coerce') if 'Time_Deal' in df_calc.columns else pd.Series(pd.NaT, index=df_calc.index)
+    deal_type = df_calc['Type_Deal'].astype(str).str.strip().str.lower() if 'Type_Deal' in df_calc.columns else pd.Series('', index=df_calc.index)
+    deal_direction = df_calc['Direction_Deal'].astype(str).str.strip().str.lower() if 'Direction_Deal' in df_calc.columns else pd.Series('out', index=df_calc.index)
+    deal_net = sum(pd.to_numeric(df_calc[c], errors='coerce').fillna(0.0) for c in ['Profit_Deal', 'Commission_Deal', 'Fee_Deal', 'Swap_Deal'] if c in df_calc.columns)
+
+    in_scope = deal_type.isin(['buy', 'sell'])
+    if start is not None: in_scope &= deal_time >= pd.Timestamp(start)
+    if end is not None: in_scope &= deal_time <= pd.Timestamp(end)
+    if symbols: in_scope &= df_calc['Symbol_Deal'].astype(str).isin([str(s) for s in symbols])
+    order = np.lexsort((pd.to_numeric(df_calc.get('Deal_ID', pd.Series(0, index=df_calc.index)), errors='coerce').fillna(0).to_numpy(),
+                        deal_time.fillna(pd.Timestamp.min).to_numpy()))
+    order = order[in_scope.to_numpy()[order]]
+    if not len(order):
+        return {}
+    is_trade = deal_direction.isin(['out', 'in/out', 'out by']).to_numpy()[order]
+    net_sorted = deal_net.to_numpy()[order]
+    trade_results = net_sorted[is_trade]
+    closes_long = (deal_type.to_numpy()[order][is_trade] == 'sell') # A sell that closes is the exit of a Long
+
+    # Balance curve: starts from the account balance before the first deal in scope (MT5 Balance column) unless given
+    if initial_balance is None:
+        balance_col = pd.to_numeric(df_calc['Balance_Deal'], errors='coerce').to_numpy()[order] if 'Balance_Deal' in df_calc.columns else np.array([np.nan])
+        initial_balance = float(balance_col[0] - net_sorted[0]) if pd.notna(balance_col[0]) else DEFAULT_ACCOUNT_BALANCE
+    dd_stats = compute_equity_drawdown(net_sorted, initial_balance)
+    balance_curve = dd_stats['equity']
+    rel_dd_idx = int(np.argmax(dd_stats['drawdown_pct']))
+    max_dd_idx = dd_stats['max_dd_trough_idx']
+
+    n_trades = len(trade_results)
+    wins, losses = trade_results[trade_results > 0], trade_results[trade_results < 0]
+    gross_profit, gross_loss = float(wins.sum()), float(losses.sum())
+    net_profit = float(net_sorted.sum())
+    balance_before = (balance_curve - net_sorted)[is_trade]
+    trade_returns = np.divide(trade_results, balance_before, out=np.zeros(n_trades), where=balance_before > 0)
+    win_runs, loss_runs = _streak_stats(trade_results)
+    longest_win = win_runs.sort_values(['Count', 'Amount'], ascending=[False, False]).head(1)
+    richest_win = win_runs.sort_values(['Amount', 'Count'], ascending=[False, False]).head(1)
+    longest_loss = loss_runs.sort_values(['Count', 'Amount'], ascending=[False, True]).head(1)
+    deepest_loss = loss_runs.sort_values(['Amount', 'Count'], ascending=[True, False]).head(1)
+    first_or_zero = lambda df_run, col: float(df_run[col].iloc[0]) if not df_run.empty else 0.0
+
+    return {
+        "Total_Net_Profit": net_profit, "Gross_Profit": gross_profit, "Gross_Loss": gross_loss,
+        "Profit_Factor": gross_profit / abs(gross_loss) if gross_loss < 0 else 0.0,
+        "Expected_Payoff": float(trade_results.mean()) if n_trades else 0.0,
+        "Recovery_Factor": net_profit / dd_stats['max_drawdown'] if dd_stats['max_drawdown'] > 0 else 0.0,
+        "Sharpe_Ratio": float(trade_returns.mean() / trade_returns.std()) if n_trades > 1 and trade_returns.std() > 0 else 0.0,
+        "Balance_Drawdown_Absolute": float(max(0.0, initial_balance - balance_curve.min())),
+        "Balance_Drawdown_Maximal": dd_stats['max_drawdown'],
+        "Balance_Drawdown_Maximal_Percent": float(dd_stats['drawdown_pct'][max_dd_idx]) if max_dd_idx is not None else 0.0,
+        "Balance_Drawdown_Relative_Percent": dd_stats['max_drawdown_pct'],
+        "Balance_Drawdown_Relative_Amount": float(dd_stats['drawdown'][rel_dd_idx]) if dd_stats['max_drawdown_pct'] > 0 else 0.0,
+        "Total_Trades": n_trades,
+        "Short_Trades": int((~closes_long).sum()), "Short_Trades_won_Percent": float(100 * (trade_results[~closes_long] > 0).mean()) if (~closes_long).any() else 0.0,
+        "Long_Trades": int(closes_long.sum()), "Long_Trades_won_Percent": float(100 * (trade_results[closes_long] > 0).mean()) if closes_long.any() else 0.0,
+        "Profit_Trades": len(wins), "Profit_Trades_Percent_of_total": 100 * len(wins) / n_trades if n_trades else 0.0,
+        "Loss_Trades": len(losses), "Loss_Trades_Percent_of_total": 100 * len(losses) / n_trades if n_trades else 0.0,
+        "Largest_profit_trade": float(wins.max()) if len(wins) else 0.0, "Largest_loss_trade": float(losses.min()) if len(losses) else 0.0,
+        "Average_profit_trade": float(wins.mean()) if len(wins) else 0.0, "Average_loss_trade": float(losses.mean()) if len(losses) else 0.0,
+        "Maximum_consecutive_wins_Count": int(first_or_zero(longest_win, 'Count')), "Maximum_consecutive_wins_Profit": first_or_zero(longest_win, 'Amount'),
+        "Maximal_consecutive_profit_Amount": first_or_zero(richest_win, 'Amount'), "Maximal_consecutive_profit_Count": int(first_or_zero(richest_win, 'Count')),
+        "Maximum_consecutive_losses_Count": int(first_or_zero(longest_loss, 'Count')), "Maximum_consecutive_losses_Profit": first_or_zero(longest_loss, 'Amount'),
+        "Maximal_consecutive_loss_Amount": first_or_zero(deepest_loss, 'Amount'), "Maximal_consecutive_loss_Count": int(first_or_zero(deepest_loss, 'Count')),
+        "Average_consecutive_wins": float(win_runs['Count'].mean()) if not win_runs.empty else 0.0,
+        "Average_consecutive_losses": float(loss_runs['Count'].mean()) if not loss_runs.empty else 0.0
+    }
+
+@profile_call("loader")
+@st.cache_data(ttl=180)
+def load_statement_metrics_for_range(portfolio_id=None, start=None, end=None, symbols=None):
+    # Cached per (portfolio, range, symbols); symbols must be a tuple so the key is hashable
+    df_deals_range = load_actual_trades_from_gsheets()
+    if portfolio_id and not df_deals_range.empty and 'PortfolioID' in df_deals_range.columns:
+        df_deals_range = df_deals_range[df_deals_range['PortfolioID'] == str(portfolio_id)]
+    return compute_statement_metrics(df_deals_range, start=start, end=end, symbols=list(symbols) if symbols else None)
+
+# ============== PART 1.16: LOG VIEWER INDEX ==============
+# Built once per data version of the viewer frame: one packed row bitmap per category value and a sorted
+# timestamp array for range queries. A filter combination is a bitwise AND of bitmaps, not a pass over the frame.
+LOG_VIEWER_INDEX_COLUMNS = ['PortfolioName', 'Mode', 'Asset']
+
+def log_viewer_data_version(df_logs):
+    # Cheap fingerprint of the loaded frame; the index is rebuilt when it changes. The content hash over the indexed
+    # columns catches rows edited in place, which keep the row count and the first/last LogID
+    if df_logs is None or df_logs.empty:
+        return (0,)
+    edge_ids = (str(df_logs['LogID'].iloc[0]), str(df_logs['LogID'].iloc[-1])) if 'LogID' in df_logs.columns else ()
+    content_hash = _combine_row_hashes(_row_content_hashes(df_logs, LOG_VIEWER_INDEX_COLUMNS + ['Timestamp']))
+    return (len(df_logs),) + edge_ids + tuple(df_logs.columns) + (content_hash,)
+
+def build_log_viewer_index(df_logs):
+    n_rows = len(df_logs)
+    index = {'version': log_viewer_data_version(df_logs), 'n_rows': n_rows, 'categories': {}, 'time_sorted': None, 'time_order': None}
+    for col in LOG_VIEWER_INDEX_COLUMNS:
+        if col not in df_logs.columns:
+            continue
+        codes, values = pd.factorize(df_logs[col].where(df_logs[col].isna(), df_logs[col].astype(str)), sort=True)
+        valid_rows = np.flatnonzero(codes >= 0)
+        rows_by_code = np.split(valid_rows[np.argsort(codes[valid_rows], kind='stable')], np.cumsum(np.bincount(codes[valid_rows], minlength=len(values)))[:-1])
+        bitmaps = {}
+        for value, rows in zip(values, rows_by_code):
+            row_mask = np.zeros(n_rows, dtype=bool)
+            row_mask[rows] = True
+            bitmaps[value] = np.packbits(row_mask)
+        index['categories'][col] = {'options': list(values), 'bitmaps': bitmaps}
+    if 'Timestamp' in df_logs.columns:
+        time_ns = pd.to_datetime(df_logs['Timestamp'], errors='coerce')
+        valid_time_rows = np.flatnonzero(time_ns.notna().to_numpy())
+        time_values = time_ns.to_numpy()[valid_time_rows].astype('datetime64[ns]').astype(np.int64)
+        time_order = np.argsort(time_values, kind='stable')
+        index['time_sorted'], index['time_order'] = time_values[time_order], valid_time_rows[time_order]
+    return index
+
+def query_log_viewer_index(index, category_filters=None, date_from=None, date_to=None):
+    # category_filters: {column: value}; dates are inclusive calendar days. Returns matching row positions (ascending).
+    n_rows = index['n_rows']
+    result_bitmap = None
+    for col, value in (category_filters or {}).items():
+        col_index = index['categories'].get(col)
+        if col_index is None:
+            continue
+        value_bitmap = col_index['bitmaps'].get(str(value))
+        if value_bitmap is None:
+            return np.zeros(0, dtype=np.int64)
+        result_bitmap = value_bitmap if result_bitmap is None else np.bitwise_and(result_bitmap, value_bitmap)
+    if (date_from is not None or date_to is not None) and index['time_sorted'] is not None:
+        range_lo = np.searchsorted(index['time_sorted'], pd.Timestamp(date_from).value, side='left') if date_from is not None else 0
+        range_hi = np.searchsorted(index['time_sorted'], (pd.Timestamp(date_to) + pd.Timedelta(days=1)).value, side='left') if date_to is not None else len(index['time_sorted'])
+        range_mask = np.zeros(n_rows, dtype=bool)
+        range_mask[index['time_order'][range_lo:range_hi]] = True
+        range_bitmap = np.packbits(range_mask)
+        result_bitmap = range_bitmap if result_bitmap is None else np.bitwise_and(result_bitmap, range_bitmap)
+    if result_bitmap is None:
+        return np.arange(n_rows)
+    return np.flatnonzero(np.unpackbits(result_bitmap, count=n_rows))
+
+# ============== PART 1.17: LOG & DEAL SEARCH ==============
+# Inverted index (token -> row positions) over text columns plus sorted (value, row) arrays per numeric column.
+# Appended rows are tokenized / merged in on the next call (append-only, like PART 1.7); other changes, including rows
+# edited in place (content hash of the indexed rows), rebuild.
+# Query syntax: words are prefix-matched and AND-ed, e.g. "xau sl risk>50 rr>=2 profit<0 lot=0.1 rr:1..3"
+SEARCH_SOURCES = {
+    'planned': {'id_cols': ['LogID'], 'text_cols': ['Asset', 'PortfolioName', 'Mode', 'Direction'],
+                'numeric_cols': {'risk': 'Risk $', 'rr': 'RR', 'lot': 'Lot', 'entry': 'Entry'}},
+    'actual': {'id_cols': ['Deal_ID', 'ImportBatchID'], 'text_cols': ['Symbol_Deal', 'Comment_Deal', 'PortfolioName', 'Type_Deal', 'Direction_Deal'],
+               'numeric_cols': {'profit': 'Profit_Deal', 'lot': 'Volume_Deal', 'volume': 'Volume_Deal', 'price': 'Price_Deal'}}
+}
+SEARCH_TOKEN_PATTERN = r'[a-z0-9_.#$/-]+'
+SEARCH_PREDICATE_PATTERN = r'^([a-z$]+)(>=|<=|>|<|=|:)(-?[0-9]*\.?[0-9]*)(?:\.\.(-?[0-9]*\.?[0-9]+))?$'
+
+def _new_search_index(source):
+    return {'source': source, 'rows_seen': 0, 'anchor': None, 'content_hash': 0, 'postings': {}, 'vocab_sorted': np.array([], dtype=object),
+            'vocab_dirty': False, 'numeric': {col: {'values': np.zeros(0), 'rows': np.zeros(0, dtype=np.int64)} for col in set(SEARCH_SOURCES[source]['numeric_cols'].values())}}
+
+def _index_search_block(search_index, df_block, row_offset):
+    source_cfg = SEARCH_SOURCES[search_index['source']]
+    token_parts, row_parts = [], []
+    for col in source_cfg['text_cols']:
+        if col not in df_block.columns:
+            continue
+        # Tokenize each distinct value once, then fan tokens out to the rows holding that value
+        codes, uniques = pd.factorize(df_block[col].astype(str).str.lower())
+        tokens_per_unique = pd.Series(uniques).str.findall(SEARCH_TOKEN_PATTERN).explode().dropna()
+        if tokens_per_unique.empty:
+            continue
+        rows_by_code_order = np.argsort(codes, kind='stable')
+        code_counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        code_starts = np.concatenate(([0], np.cumsum(code_counts)[:-1]))
+        pair_codes = tokens_per_unique.index.to_numpy()
+        pair_counts = code_counts[pair_codes]
+        take_positions = np.repeat(code_starts[pair_codes] - np.concatenate(([0], np.cumsum(pair_counts)[:-1])), pair_counts) + np.arange(pair_counts.sum())
+        token_parts.append(np.repeat(tokens_per_unique.to_numpy(), pair_counts))
+        row_parts.append(rows_by_code_order[take_positions] + row_offset)
+    if token_parts:
+        df_pairs = pd.DataFrame({'token': np.concatenate(token_parts), 'row': np.concatenate(row_parts)}).drop_duplicates()
+        for token, rows in df_pairs.groupby('token', sort=False)['row']:
+            if token not in search_index['postings']:
+                search_index['postings'][token] = []
+                search_index['vocab_dirty'] = True
+            search_index['postings'][token].append(np.sort(rows.to_numpy()))
+    for col, num_index in search_index['numeric'].items():
+        if col not in df_block.columns:
+            continue
+        block_values = pd.to_numeric(df_block[col], errors='coerce').to_numpy(dtype=float)
+        valid = ~np.isnan(block_values)
+        block_order = np.argsort(block_values[valid], kind='stable')
+        new_values, new_rows = block_values[valid][block_order], (np.flatnonzero(valid) + row_offset)[block_order]
+        insert_at = np.searchsorted(num_index['values'], new_values, side='right')
+        num_index['values'] = np.insert(num_index['values'], insert_at, new_values)
+        num_index['rows'] = np.insert(num_index['rows'], insert_at, new_rows)
+
+def update_search_index(search_index, df_source):
+    source_cfg = SEARCH_SOURCES[search_index['source']]
+    df_source = df_source if df_source is not None else pd.DataFrame()
+    id_cols = [c for c in source_cfg['id_cols'] if c in df_source.columns]
+    anchor_of = lambda pos: tuple(str(df_source[c].iloc[pos]) for c in id_cols)
+    n_rows, rows_seen = len(df_source), search_index['rows_seen']
+    row_hashes = _row_content_hashes(df_source, source_cfg['text_cols'] + list(dict.fromkeys(source_cfg['numeric_cols'].values())))
+    if not (0 < rows_seen <= n_rows and anchor_of(rows_seen - 1) == search_index['anchor']
+            and _combine_row_hashes(row_hashes[:rows_seen]) == search_index.get('content_hash')):
+        search_index.update(_new_search_index(search_index['source']))
+        rows_seen = 0
+    if n_rows > rows_seen:
+        _index_search_block(search_index, df_source.iloc[rows_seen:], rows_seen)
+        search_index['rows_seen'] = n_rows
+        search_index['anchor'] = anchor_of(n_rows - 1)
+        search_index['content_hash'] = _combine_row_hashes(row_hashes)
+    return search_index
+
+def _search_token_rows(search_index, term):
+    # Rows containing any token that starts with term
+    if search_index['vocab_dirty']:
+        search_index['vocab_sorted'] = np.array(sorted(search_index['postings']), dtype=object)
+        search_index['vocab_dirty'] = False
+    vocab = search_index['vocab_sorted']
+    lo, hi = np.searchsorted(vocab, term, side='left'), np.searchsorted(vocab, term + '\uffff', side='left')
+    row_arrays = []
+    for token in vocab[lo:hi]:
+        chunks = search_index['postings'][token]
+        if len(chunks) > 1: search_index['postings'][token] = chunks = [np.concatenate(chunks)] # Compact appended chunks
+        row_arrays.append(chunks[0])
+    return np.concatenate(row_arrays) if row_arrays else np.zeros(0, dtype=np.int64)
+
+def search_rows(search_index, query):
+    # Returns (matching row positions ascending, list of query parts that were not understood)
+    n_rows = search_index['rows_seen']
+    numeric_aliases = SEARCH_SOURCES[search_index['source']]['numeric_cols']
+    result_mask = np.ones(n_rows, dtype=bool)
+    ignored_parts = []
+    for part in str(query).lower().split():
+        predicate = re.match(SEARCH_PREDICATE_PATTERN, part)
+        if predicate and predicate.group(1) in numeric_aliases and (predicate.group(3) or predicate.group(4)):
+            num_index = search_index['numeric'][numeric_aliases[predicate.group(1)]]
+            op, low_text, high_text = predicate.group(2), predicate.group(3), predicate.group(4)
+            try:
+                low_val = float(low_text) if low_text else -np.inf
+                high_val = float(high_text) if high_text else None
+            except ValueError:
+                ignored_parts.append(part); continue
+            values = num_index['values']
+            if op == ':' and high_val is not None: lo, hi = np.searchsorted(values, low_val, 'left'), np.searchsorted(values, high_val, 'right')
+            elif op in ('=', ':'): lo, hi = np.searchsorted(values, low_val, 'left'), np.searchsorted(values, low_val, 'right')
+            elif op == '>': lo, hi = np.searchsorted(values, low_val, 'right'), len(values)
+            elif op == '>=': lo, hi = np.searchsorted(values, low_val, 'left'), len(values)
+            elif op == '<': lo, hi = 0, np.searchsorted(values, low_val, 'left')
+            else: lo, hi = 0, np.searchsorted(values, low_val, 'right')
+            term_rows = num_index['rows'][lo:hi]
+        elif (predicate and predicate.group(1) in numeric_aliases) or re.search(r'[<>=]', part):
+            ignored_parts.append(part); continue # Unknown field / malformed range, tokens never contain <>=
+        else:
+            # Split the word exactly as the indexed text was split ("[sl]" -> "sl", "sl,tp" -> "sl" and "tp")
+            part_tokens = re.findall(SEARCH_TOKEN_PATTERN, part)
+            if not part_tokens:
+                ignored_parts.append(part); continue
+            term_rows = _search_token_rows(search_index, part_tokens[0])
+            for token in part_tokens[1:]:
+                term_rows = np.intersect1d(term_rows, _search_token_rows(search_index, token))
+        term_mask = np.zeros(n_rows, dtype=bool)
+        term_mask[term_rows] = True
+        result_mask &= term_mask
+    return np.flatnonzero(result_mask), ignored_parts
+
+# ============== PART 1.18: LOCAL OHLC CHART ENGINE ==============
+# Candles come from files in OHLC_DATA_DIR named after the symbol (XAUUSD.parquet, XAUUSD_M1.csv, MT5 "Export bars" CSV ...);
+# with several files for a symbol the finest timeframe suffix wins (no suffix counts as M1), then parquet over CSV.
+# Only the visible range is sliced (binary search on time) and reduced to at most max_points before Plotly sees it.
+OHLC_DATA_DIR = "ohlc_data"
+OHLC_FILE_EXTENSIONS = ('.parquet', '.csv')
+
+@functools.lru_cache(maxsize=1)
+def _parquet_engine_available():
+    # pd.read_parquet needs pyarrow or fastparquet (see requirements.txt); without one, .parquet files are skipped
+    try:
+        pd.io.parquet.get_engine('auto')
+        return True
+    except ImportError:
+        return False
+
+OHLC_TIMEFRAME_SECONDS = {'M': 60, 'H': 3600, 'D': 86400, 'W': 7 * 86400, 'MN': 30 * 86400} # MT5 period prefixes (M1, H4, MN1 ...)
+
+def _ohlc_file_timeframe_seconds(stem):
+    # Bar size from the suffix after the symbol (XAUUSD_H1, XAUUSD_M1_2024...); no suffix is taken as M1, an unknown one ranks last
+    name_parts = stem.split('_')
+    if len(name_parts) < 2:
+        return OHLC_TIMEFRAME_SECONDS['M']
+    timeframe_match = re.fullmatch(r'(MN|[MHDW])(\d+)', name_parts[1].strip().upper())
+    return OHLC_TIMEFRAME_SECONDS[timeframe_match.group(1)] * int(timeframe_match.group(2)) if timeframe_match else float('inf')
+
+def find_local_ohlc_file(symbol, data_dir=OHLC_DATA_DIR):
+    symbol_key = _normalize_symbol(pd.Series([symbol])).iloc[0]
+    if not symbol_key or not os.path.isdir(data_dir):
+        return None
+    candidates = []
+    for file_name in os.listdir(data_dir):
+        stem, ext = os.path.splitext(file_name)
+        if ext.lower() in OHLC_FILE_EXTENSIONS and _normalize_symbol(pd.Series([stem.split('_')[0]])).iloc[0] == symbol_key:
+            candidates.append((_ohlc_file_timeframe_seconds(stem), OHLC_FILE_EXTENSIONS.index(ext.lower()), file_name)) # Finest bars first, then parquet first
+    if any(c[-1].lower().endswith('.parquet') for c in candidates) and not _parquet_engine_available():
+        print(f"Warning: pyarrow/fastparquet not installed, ignoring .parquet OHLC files for {symbol} and falling back to CSV")
+        candidates = [c for c in candidates if not c[-1].lower().endswith('.parquet')]
+    return os.path.join(data_dir, min(candidates)[-1]) if candidates else None
+
+def _sniff_csv_separator(header_line):
+    # MT5 exports are tab separated; some locales save ';'
+    return '\t' if '\t' in header_line else (';' if header_line.count(';') > header_line.count(',') else ',')
+
+def _normalize_ohlc_frame(df_raw):
+    # Accepts Time/Datetime/Timestamp or MT5's <DATE> + <TIME>; returns Time, Open, High, Low, Close, Volume sorted by Time
+    df_raw = df_raw.rename(columns=lambda c: str(c).strip().strip('<>').lower())
+    if 'date' in df_raw.columns and 'time' in df_raw.columns:
+        bar_time = pd.to_datetime(df_raw['date'].astype(str).str.replace('.', '-', regex=False) + ' ' + df_raw['time'].astype(str), errors='coerce')
+    else:
+        time_col = next((c for c in ['time', 'datetime', 'timestamp', 'date'] if c in df_raw.columns), None)
+        if time_col is None:
+            raise ValueError("OHLC file has no time column")
+        bar_time = df_raw[time_col]
+        if pd.api.types.is_datetime64_any_dtype(bar_time): bar_time = bar_time.dt.tz_localize(None) if bar_time.dt.tz is not None else bar_time
+        elif pd.api.types.is_numeric_dtype(bar_time): bar_time = pd.to_datetime(bar_time, unit='s', errors='coerce') # Unix seconds (MT5 copy_rates)
+        else: bar_time = pd.to_datetime(bar_time.astype(str).str.replace('.', '-', regex=False), errors='coerce')
+    df_bars = pd.DataFrame({'Time': bar_time})
+    for col in ['open', 'high', 'low', 'close']:
+        if col not in df_raw.columns:
+            raise ValueError(f"OHLC file has no '{col}' column")
+        df_bars[col.capitalize()] = pd.to_numeric(df_raw[col], errors='coerce').to_numpy(dtype=float)
+    volume_col = next((c for c in ['tickvol', 'tick_volume', 'volume', 'vol'] if c in df_raw.columns), None)
+    df_bars['Volume'] = pd.to_numeric(df_raw[volume_col], errors='coerce').fillna(0).to_numpy(dtype=float) if volume_col else 0.0
+    df_bars = df_bars.dropna(subset=['Time', 'Open', 'High', 'Low', 'Close'])
+    if not df_bars['Time'].is_monotonic_increasing:
+        df_bars = df_bars.sort_values('Time', kind='stable')
+    return df_bars.drop_duplicates(subset='Time', keep='last').reset_index(drop=True)
+
+@profile_call("loader")
+@st.cache_data(ttl=600, max_entries=4)
+def load_local_ohlc(file_path, file_mtime=None): # file_mtime only keys the cache so an updated file is re-read
+    try:
+        if file_path.lower().endswith('.parquet'):
+            df_raw = pd.read_parquet(file_path)
+        else:
+            with open(file_path, 'r', encoding='utf-8-sig', errors='ignore') as f:
+                header_line = f.readline()
+            df_raw = pd.read_csv(file_path, sep=_sniff_csv_separator(header_line), encoding='utf-8-sig')
+        return _normalize_ohlc_frame(df_raw)
+    except ImportError as e:
+        print(f"Warning: Parquet support not installed ({e}), cannot read {file_path}")
+    except Exception as e:
+        print(f"Warning: Could not load OHLC file {file_path}: {e}")
+    return pd.DataFrame(columns=['Time', 'Open', 'High', 'Low', 'Close', 'Volume'])
+
+def slice_ohlc(df_bars, start=None, end=None):
+    # [start, end) by binary search on the sorted Time column
+    bar_times = df_bars['Time'].to_numpy()
+    lo = np.searchsorted(bar_times, np.datetime64(pd.Timestamp(start)), side='left') if start is not None else 0
+    hi = np.searchsorted(bar_times, np.datetime64(pd.Timestamp(end)), side='left') if end is not None else len(bar_times)
+    return df_bars.iloc[lo:hi]
+
+def downsample_ohlc_minmax(df_bars, max_points=3000):
+    # Merges consecutive bars into at most max_points buckets; every bucket keeps first open, max high, min low, last close
+    n_bars = len(df_bars)
+    if n_bars <= max_points:
+        return df_bars
+    bucket_starts = np.unique(np.linspace(0, n_bars, max_points + 1).astype(np.int64)[:-1])
+    bucket_ends = np.append(bucket_starts[1:], n_bars) - 1
+    return pd.DataFrame({
+        'Time': df_bars['Time'].to_numpy()[bucket_starts],
+        'Open': df_bars['Open'].to_numpy()[bucket_starts],
+        'High': np.maximum.reduceat(df_bars['High'].to_numpy(), bucket_starts),
+        'Low': np.minimum.reduceat(df_bars['Low'].to_numpy(), bucket_starts),
+        'Close': df_bars['Close'].to_numpy()[bucket_ends],
+        'Volume': np.add.reduceat(df_bars['Volume'].to_numpy(), bucket_starts)
+    })
+
+def lttb_downsample_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: positions of the n_out points that best keep the visual shape of y(x)
+    n_points = len(x)
+    if n_out >= n_points or n_out < 3:
+        return np.arange(n_points)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    bucket_size = (n_points - 2) / (n_out - 2)
+    edges = (np.arange(n_out - 1) * bucket_size).astype(np.int64) + 1
+    edges[-1] = n_points - 1
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n_points - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n_points
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+    return selected
+
+def build_ohlc_figure(df_bars, chart_style="candles", plan_levels=None, df_deals=None, title=""):
+    fig = go.Figure()
+    if chart_style == "line":
+        fig.add_trace(go.Scattergl(x=df_bars['Time'], y=df_bars['Close'], mode='lines', name='Close', line=dict(width=1)))
+    else:
+        fig.add_trace(go.Candlestick(x=df_bars['Time'], open=df_bars['Open'], high=df_bars['High'], low=df_bars['Low'], close=df_bars['Close'], name='OHLC'))
+    level_colors = {'Entry': 'royalblue', 'SL': 'red', 'TP': 'green'}
+    plan_levels = plan_levels or {}
+    for level_name, level_color in level_colors.items():
+        level_value = pd.to_numeric(plan_levels.get(level_name), errors='coerce')
+        if pd.notna(level_value):
+            fig.add_hline(y=float(level_value), line_dash="dash", line_color=level_color, annotation_text=f"{level_name} {float(level_value):g}", annotation_position="right")
+    plan_time = pd.to_datetime(plan_levels.get('Timestamp'), errors='coerce')
+    if pd.notna(plan_time):
+        fig.add_vline(x=plan_time, line_dash="dot", line_color="gray")
+    if df_deals is not None and not df_deals.empty:
+        for deal_side, marker_symbol, marker_color in [('buy', 'triangle-up', 'lime'), ('sell', 'triangle-down', 'orangered')]:
+            df_side = df_deals[df_deals['Type_Deal'].astype(str).str.lower() == deal_side]
+            if not df_side.empty:
+                fig.add_trace(go.Scattergl(x=df_side['Time_Deal'], y=df_side['Price_Deal'], mode='markers', name=f"Deal {deal_side}",
+                                           marker=dict(symbol=marker_symbol, size=11, color=marker_color, line=dict(width=1, color='black')),
+                                           text=df_side.get('Direction_Deal', None), hovertemplate="%{x}<br>%{y}<br>%{text}<extra></extra>"))
+    fig.update_layout(title=title, template="plotly_dark", height=600, xaxis_rangeslider_visible=False, margin=dict(l=10, r=10, t=40, b=10), uirevision=title)
+    return fig
+
+# ============== PART 1.19: OHLC BAR STORE (MEMORY-MAPPED) ==============
+# bar_store/<SYMBOL>/<TF>/<Column>.bin are raw little-endian arrays (Time = int64 ns, prices/volume = float64) plus meta.json
+# with the committed row count. Readers np.memmap the files, so slicing a range only touches the pages it needs.
+# M1 is the source of truth; M5/M15/H1/D1 are appended from M1 after every import (only the last, possibly partial, bucket is rebuilt).
+BAR_STORE_DIR = "bar_store"
+BAR_STORE_TIMEFRAMES = {'M1': 60, 'M5': 300, 'M15': 900, 'H1': 3600, 'D1': 86400} # seconds
+BAR_STORE_COLUMNS = {'Time': '<i8', 'Open': '<f8', 'High': '<f8', 'Low': '<f8', 'Close': '<f8', 'Volume': '<f8'}
+
+def _bar_store_dir(symbol, timeframe, store_dir=BAR_STORE_DIR):
+    return os.path.join(store_dir, _normalize_symbol(pd.Series([symbol])).iloc[0], timeframe)
+
+def open_bar_store(symbol, timeframe='M1', store_dir=BAR_STORE_DIR):
+    # Dict of read-only memmaps (empty arrays when nothing is stored yet)
+    tf_dir = _bar_store_dir(symbol, timeframe, store_dir)
+    try:
+        with open(os.path.join(tf_dir, 'meta.json'), 'r') as f:
+            n_rows = int(json.load(f).get('rows', 0))
+        n_rows = min([n_rows] + [os.path.getsize(os.path.join(tf_dir, f"{col}.bin")) // 8 for col in BAR_STORE_COLUMNS]) # Ignore a torn trailing write
+    except (OSError, ValueError):
+        n_rows = 0
+    if n_rows <= 0:
+        return {col: np.zeros(0, dtype=dtype) for col, dtype in BAR_STORE_COLUMNS.items()}
+    return {col: np.memmap(os.path.join(tf_dir, f"{col}.bin"), dtype=dtype, mode='r', shape=(n_rows,)) for col, dtype in BAR_STORE_COLUMNS.items()}
+
+def _write_bar_store_rows(symbol, timeframe, keep_rows, new_columns, store_dir=BAR_STORE_DIR):
+    # Truncates each column file to keep_rows, appends new_columns and commits the new count to meta.json last
+    tf_dir = _bar_store_dir(symbol, timeframe, store_dir)
+    os.makedirs(tf_dir, exist_ok=True)
+    for col, dtype in BAR_STORE_COLUMNS.items():
+        col_path = os.path.join(tf_dir, f"{col}.bin")
+        with open(col_path, 'ab') as f:
+            f.truncate(keep_rows * 8)
+            f.write(np.ascontiguousarray(new_columns[col], dtype=dtype).tobytes())
+    meta_path = os.path.join(tf_dir, 'meta.json')
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'rows': int(keep_rows + len(new_columns['Time'])), 'updated': datetime.now().isoformat()}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def _resample_bar_columns(bar_columns, timeframe_seconds):
+    bucket_ids = bar_columns['Time'] // (timeframe_seconds * 10**9)
+    bucket_starts = np.flatnonzero(np.r_[True, bucket_ids[1:] != bucket_ids[:-1]])
+    bucket_ends = np.append(bucket_starts[1:], len(bucket_ids)) - 1
+    return {
+        'Time': bucket_ids[bucket_starts] * (timeframe_seconds * 10**9),
+        'Open': bar_columns['Open'][bucket_starts], 'Close': bar_columns['Close'][bucket_ends],
+        'High': np.maximum.reduceat(bar_columns['High'], bucket_starts), 'Low': np.minimum.reduceat(bar_columns['Low'], bucket_starts),
+        'Volume': np.add.reduceat(bar_columns['Volume'], bucket_starts)
+    }
+
+def update_bar_store_resamples(symbol, store_dir=BAR_STORE_DIR):
+    m1_bars = open_bar_store(symbol, 'M1', store_dir)
+    if len(m1_bars['Time']) == 0:
+        return
+    for timeframe, timeframe_seconds in BAR_STORE_TIMEFRAMES.items():
+        if timeframe == 'M1':
+            continue
+        tf_bars = open_bar_store(symbol, timeframe, store_dir)
+        n_tf_rows = len(tf_bars['Time'])
+        keep_rows = max(n_tf_rows - 1, 0) # Last bucket may have been partial, rebuild it from its first M1 bar
+        m1_from = np.searchsorted(m1_bars['Time'], tf_bars['Time'][-1], side='left') if n_tf_rows > 0 else 0
+        new_columns = _resample_bar_columns({col: np.asarray(m1_bars[col][m1_from:]) for col in BAR_STORE_COLUMNS}, timeframe_seconds)
+        del tf_bars # Release the memmaps before truncating on platforms that lock mapped files
+        _write_bar_store_rows(symbol, timeframe, keep_rows, new_columns, store_dir)
+
+def append_bars(symbol, df_bars, store_dir=BAR_STORE_DIR, update_resamples=True):
+    # df_bars as returned by _normalize_ohlc_frame; bars at or before the last stored M1 bar are skipped (no rewrites of history)
+    m1_bars = open_bar_store(symbol, 'M1', store_dir)
+    n_stored = len(m1_bars['Time'])
+    bar_times = df_bars['Time'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+    new_mask = bar_times > m1_bars['Time'][-1] if n_stored > 0 else np.ones(len(bar_times), dtype=bool)
+    n_new = int(new_mask.sum())
+    del m1_bars
+    if n_new > 0:
+        new_columns = {'Time': bar_times[new_mask]}
+        for col in ['Open', 'High', 'Low', 'Close', 'Volume']:
+            new_columns[col] = df_bars[col].to_numpy(dtype=float)[new_mask]
+        _write_bar_store_rows(symbol, 'M1', n_stored, new_columns, store_dir)
+        if update_resamples:
+            update_bar_store_resamples(symbol, store_dir)
+    return {'appended': n_new, 'skipped': len(bar_times) - n_new}
+
+def slice_bars(symbol, start=None, end=None, timeframe='M1', store_dir=BAR_STORE_DIR):
+    # [start, end) as a DataFrame with the same columns as load_local_ohlc
+    stored = open_bar_store(symbol, timeframe, store_dir)
+    lo = np.searchsorted(stored['Time'], pd.Timestamp(start).value, side='left') if start is not None else 0
+    hi = np.searchsorted(stored['Time'], pd.Timestamp(end).value, side='left') if end is not None else len(stored['Time'])
+    df_slice = pd.DataFrame({col: np.array(stored[col][lo:hi]) for col in BAR_STORE_COLUMNS})
+    df_slice['Time'] = df_slice['Time'].astype('datetime64[ns]')
+    return df_slice
+
+def choose_bar_store_timeframe(symbol, start, end, max_points, store_dir=BAR_STORE_DIR):
+    # Finest stored timeframe that fits max_points over [start, end), else the coarsest one
+    for timeframe in BAR_STORE_TIMEFRAMES:
+        stored_times = open_bar_store(symbol, timeframe, store_dir)['Time']
+        n_in_range = np.searchsorted(stored_times, pd.Timestamp(end).value) - np.searchsorted(stored_times, pd.Timestamp(start).value)
+        if len(stored_times) > 0 and n_in_range <= max_points:
+            return timeframe
+    return list(BAR_STORE_TIMEFRAMES)[-1]
+
+def bar_store_summary(store_dir=BAR_STORE_DIR):
+    summary_rows = []
+    if os.path.isdir(store_dir):
+        for symbol in sorted(os.listdir(store_dir)):
+            for timeframe in BAR_STORE_TIMEFRAMES:
+                stored_times = open_bar_store(symbol, timeframe, store_dir)['Time']
+                if len(stored_times) > 0:
+                    summary_rows.append({'Symbol': symbol, 'Timeframe': timeframe, 'Bars': len(stored_times),
+                                         'From': pd.Timestamp(int(stored_times[0])), 'To': pd.Timestamp(int(stored_times[-1]))})
+    return pd.DataFrame(summary_rows, columns=['Symbol', 'Timeframe', 'Bars', 'From', 'To'])
+
+def bar_store_version(store_dir=BAR_STORE_DIR):
+    # (symbol, M1 meta.json mtime) per stored symbol; changes whenever bars are committed, used to key caches built on the store
+    version = []
+    if os.path.isdir(store_dir):
+        for symbol in sorted(os.listdir(store_dir)):
+            try:
+                version.append((symbol, os.path.getmtime(os.path.join(store_dir, symbol, 'M1', 'meta.json'))))
+            except OSError:
+                continue
+    return tuple(version)
+
+def import_mt5_history_csv(csv_source, symbol, chunk_rows=500_000, store_dir=BAR_STORE_DIR):
+    # Streams an MT5 "Export bars" CSV (path or uploaded file) into the M1 store chunk by chunk, then refreshes the resamples once
+    if isinstance(csv_source, str):
+        with open(csv_source, 'r', encoding='utf-8-sig', errors='ignore') as f:
+            header_line = f.readline()
+    else:
+        header_line = csv_source.readline()
+        header_line = header_line.decode('utf-8-sig', errors='ignore') if isinstance(header_line, bytes) else header_line
+        csv_source.seek(0)
+    import_stats = {'rows_read': 0, 'appended': 0, 'skipped': 0, 'chunks': 0}
+    for df_chunk in pd.read_csv(csv_source, sep=_sniff_csv_separator(header_line), chunksize=chunk_rows, encoding='utf-8-sig'):
+        chunk_result = append_bars(symbol, _normalize_ohlc_frame(df_chunk), store_dir, update_resamples=False)
+        import_stats['rows_read'] += len(df_chunk)
+        import_stats['appended'] += chunk_result['appended']
+        import_stats['skipped'] += chunk_result['skipped']
+        import_stats['chunks'] += 1
+    if import_stats['appended'] > 0:
+        update_bar_store_resamples(symbol, store_dir)
+    return import_stats
+
+# ============== PART 1.20: TRADE EXCURSIONS (MAE / MFE) ==============
+# Max adverse / favorable excursion of each closed round trip (PART 1.13) from the M1 bar store (PART 1.19),
+# plus the path for post_exit_hours after the exit, compared with the matched plan's SL/TP (PART 1.14).
+EXCURSION_COLUMNS = ['EntryDealID', 'PortfolioID', 'Symbol', 'Side', 'EntryTime', 'ExitTime', 'EntryPrice', 'ExitPrice', 'NetPL',
+                     'BarsInTrade', 'MAE', 'MFE', 'PostExitHigh', 'PostExitLow', 'PlanEntry', 'PlanSL', 'PlanTP',
+                     'MAE_R', 'MFE_R', 'MFE_TPShare', 'HitTP', 'TPAfterExit']
+
+def compute_window_extrema(bar_times, highs, lows, window_starts, window_ends, bar_seconds=60):
+    # Max high / min low / bar count over every bar overlapping [start, end] (ns timestamps); NaN where no bar overlaps.
+    # Windows become (lo, hi) pairs in one interleaved index so a single reduceat covers all of them; pairs are
+    # ordered by lo so the in-between segments reduceat also visits stay disjoint (total work ~ bars + window lengths).
+    n_windows = len(window_starts)
+    max_high, min_low = np.full(n_windows, np.nan), np.full(n_windows, np.nan)
+    lo = np.searchsorted(bar_times, np.asarray(window_starts, dtype=np.int64) - bar_seconds * 10**9, side='right')
+    hi = np.searchsorted(bar_times, np.asarray(window_ends, dtype=np.int64), side='right')
+    n_bars = np.maximum(hi - lo, 0)
+    valid = n_bars > 0
+    if valid.any():
+        valid_windows = np.flatnonzero(valid)
+        valid_windows = valid_windows[np.argsort(lo[valid_windows], kind='stable')]
+        pair_idx = np.column_stack([lo[valid_windows], hi[valid_windows]]).ravel()
+        max_high[valid_windows] = np.maximum.reduceat(np.append(np.asarray(highs, dtype=float), np.nan), pair_idx)[::2]
+        min_low[valid_windows] = np.minimum.reduceat(np.append(np.asarray(lows, dtype=float), np.nan), pair_idx)[::2]
+    return max_high, min_low, n_bars
+
+def compute_trade_excursions(df_trips, df_matches=None, post_exit_hours=24.0, store_dir=BAR_STORE_DIR):
+    if df_trips is None or df_trips.empty or 'Status' not in df_trips.columns:
+        return pd.DataFrame(columns=EXCURSION_COLUMNS)
+    df_exc = df_trips[df_trips['Status'] == 'Closed'][['EntryDealID', 'PortfolioID', 'Symbol', 'Side', 'EntryTime', 'ExitTime', 'EntryPrice', 'ExitPrice', 'NetPL']].reset_index(drop=True)
+    for col in ['BarsInTrade', 'MaxHigh', 'MinLow', 'PostExitHigh', 'PostExitLow']:
+        df_exc[col] = np.nan
+    entry_ns = df_exc['EntryTime'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+    exit_ns = df_exc['ExitTime'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+    post_exit_ns = exit_ns + int(post_exit_hours * 3600 * 10**9)
+    for symbol, symbol_rows in df_exc.groupby(_normalize_symbol(df_exc['Symbol'])).indices.items():
+        m1_bars = open_bar_store(symbol, 'M1', store_dir)
+        if len(m1_bars['Time']) == 0:
+            continue
+        trade_high, trade_low, trade_bars = compute_window_extrema(m1_bars['Time'], m1_bars['High'], m1_bars['Low'], entry_ns[symbol_rows], exit_ns[symbol_rows])
+        after_high, after_low, _ = compute_window_extrema(m1_bars['Time'], m1_bars['High'], m1_bars['Low'], exit_ns[symbol_rows], post_exit_ns[symbol_rows])
+        df_exc.loc[symbol_rows, ['BarsInTrade', 'MaxHigh', 'MinLow', 'PostExitHigh', 'PostExitLow']] = np.column_stack([trade_bars, trade_high, trade_low, after_high, after_low])
+    is_long = (df_exc['Side'] == 'Long').to_numpy()
+    entry_price = df_exc['EntryPrice'].to_numpy(dtype=float)
+    # The entry bar's range before the fill counts too, so both excursions are floored at 0
+    df_exc['MAE'] = np.maximum(np.where(is_long, entry_price - df_exc['MinLow'], df_exc['MaxHigh'] - entry_price), 0)
+    df_exc['MFE'] = np.maximum(np.where(is_long, df_exc['MaxHigh'] - entry_price, entry_price - df_exc['MinLow']), 0)
+    df_exc.loc[df_exc['BarsInTrade'].fillna(0) == 0, ['MAE', 'MFE']] = np.nan
+
+    # Planned SL/TP from the matched plan leg, by entry deal
+    df_exc['PlanEntry'], df_exc['PlanSL'], df_exc['PlanTP'] = np.nan, np.nan, np.nan
+    if df_matches is not None and not df_matches.empty and 'Deal_ID' in df_matches.columns:
+        plan_by_deal = df_matches.assign(_deal_key=df_matches['Deal_ID'].astype(str)).drop_duplicates('_deal_key').set_index('_deal_key')
+        deal_keys = df_exc['EntryDealID'].astype(str)
+        for col in ['PlanEntry', 'PlanSL', 'PlanTP']:
+            df_exc[col] = pd.to_numeric(deal_keys.map(plan_by_deal[col]), errors='coerce').to_numpy()
+    sl_distance = (df_exc['PlanEntry'] - df_exc['PlanSL']).abs().replace(0, np.nan)
+    tp_distance = (df_exc['PlanTP'] - df_exc['PlanEntry']).abs().replace(0, np.nan)
+    df_exc['MAE_R'] = df_exc['MAE'] / sl_distance
+    df_exc['MFE_R'] = df_exc['MFE'] / sl_distance
+    df_exc['MFE_TPShare'] = df_exc['MFE'] / tp_distance
+    # TP level touched inside the trade / within post_exit_hours after the exit
+    df_exc['HitTP'] = np.where(is_long, df_exc['MaxHigh'] >= df_exc['PlanTP'], df_exc['MinLow'] <= df_exc['PlanTP']) & df_exc['PlanTP'].notna()
+    df_exc['TPAfterExit'] = np.where(is_long, df_exc['PostExitHigh'] >= df_exc['PlanTP'], df_exc['PostExitLow'] <= df_exc['PlanTP']) & df_exc['PlanTP'].notna()
+    return df_exc[EXCURSION_COLUMNS]
+
+def summarize_trade_excursions(df_exc, post_exit_hours=24.0, stop_mae_r=0.9, near_sl_mae_r=0.8, min_trades=5):
+    # Stats + Thai insight strings ("SL too tight" / "TP too far") for the AI Assistant; None when nothing has bars
+    if df_exc is None or df_exc.empty or df_exc['MAE'].notna().sum() == 0:
+        return None
+    df_planned = df_exc[df_exc['MAE'].notna() & df_exc['MAE_R'].notna()]
+    df_stopped = df_planned[(df_planned['NetPL'] < 0) & (df_planned['MAE_R'] >= stop_mae_r)]
+    df_winners = df_planned[df_planned['NetPL'] > 0]
+    df_with_tp = df_planned[df_planned['MFE_TPShare'].notna()]
+    df_missed_tp = df_with_tp[~df_with_tp['HitTP']]
+    summary = {
+        'trades_with_bars': int(df_exc['MAE'].notna().sum()), 'trades_with_plan': len(df_planned),
+        'median_mae_r': df_planned['MAE_R'].median(), 'median_mfe_r': df_planned['MFE_R'].median(),
+        'stopped_trades': len(df_stopped), 'stopped_then_tp_rate': 100 * df_stopped['TPAfterExit'].mean() if len(df_stopped) else np.nan,
+        'winners_near_sl_rate': 100 * (df_winners['MAE_R'] >= near_sl_mae_r).mean() if len(df_winners) else np.nan,
+        'tp_hit_rate': 100 * df_with_tp['HitTP'].mean() if len(df_with_tp) else np.nan,
+        'missed_tp_median_share': df_missed_tp['MFE_TPShare'].median() if len(df_missed_tp) else np.nan,
+        'missed_tp_median_mfe_r': df_missed_tp['MFE_R'].median() if len(df_missed_tp) else np.nan,
+        'insights': []
+    }
+    if len(df_stopped) >= min_trades and summary['stopped_then_tp_rate'] >= 30:
+        summary['insights'].append(f"⚠️ SL อาจแคบเกินไป: {summary['stopped_then_tp_rate']:.0f}% ของไม้ที่โดน SL ({int(df_stopped['TPAfterExit'].sum())}/{len(df_stopped)}) ราคาวิ่งไปถึง TP ภายใน {post_exit_hours:g} ชม. หลังปิด")
+    if len(df_winners) >= min_trades and summary['winners_near_sl_rate'] >= 30:
+        summary['insights'].append(f"⚠️ SL อาจแคบเกินไป: {summary['winners_near_sl_rate']:.0f}% ของไม้ที่ชนะเคยติดลบเกิน {near_sl_mae_r:g}R ก่อนกลับมา (MAE มัธยฐาน {summary['median_mae_r']:.2f}R)")
+    if len(df_with_tp) >= min_trades and summary['tp_hit_rate'] < 30 and summary['missed_tp_median_share'] < 0.6:
+        summary['insights'].append(f"📉 TP อาจไกลเกินไป: ราคาไปถึง TP เพียง {summary['tp_hit_rate']:.0f}% ของไม้ ไม้ที่ไม่ถึง TP ไปได้มัธยฐาน {summary['missed_tp_median_share'] * 100:.0f}% ของระยะ TP (≈ {summary['missed_tp_median_mfe_r']:.2f}R)")
+    if len(df_planned) >= min_trades and not summary['insights']:
+        summary['insights'].append(f"✅ ระยะ SL/TP สอดคล้องกับการเคลื่อนที่ของราคา (MAE มัธยฐาน {summary['median_mae_r']:.2f}R, MFE มัธยฐาน {summary['median_mfe_r']:.2f}R)")
+    return summary
+
+@profile_call("loader")
+@st.cache_data(ttl=180)
+def load_trade_excursions(post_exit_hours=24.0, store_version=None): # store_version (bar_store_version()) only keys the cache so imported bars are used
+    # Every portfolio's closed round trips with MAE/MFE and plan levels, from the cached sheets + local bar store
+    df_pva_matches_exc, _ = load_plan_vs_actual_from_gsheets()
+    return compute_trade_excursions(load_round_trip_trades_from_gsheets(), df_pva_matches_exc, post_exit_hours)
+
+# ============== PART 1.21: MULTI-PORTFOLIO OVERVIEW ==============
+# One pass over the cached Portfolios / StatementSummaries / ActualTrades tables for every account at once.
+# Limits follow the usual prop-firm reading: daily loss and total stopout are % of InitialBalance; 0 in the sheet = no limit.
+PORTFOLIO_OVERVIEW_COLUMNS = ['PortfolioID', 'PortfolioName', 'ProgramType', 'Status', 'InitialBalance', 'Equity', 'EquitySource', 'TodayPL',
+                              'DailyLossUsedPct', 'DailyLossLimitPercent', 'DailyLimitUsage', 'TotalDrawdownPct', 'TotalStopoutPercent', 'StopoutUsage',
+                              'MaxDrawdownPct', 'GainPct', 'ProfitTargetPercent', 'TargetProgress', 'Deals', 'Alert']
+PORTFOLIO_NEAR_LIMIT_USAGE = 80.0 # % of a limit used before an account is flagged
+PORTFOLIO_ALERT_LEVELS = ["🔴 เกินลิมิต", "🟠 ใกล้ลิมิต", "🏁 ถึงเป้า", "🟢 ปกติ"] # Most urgent first
+
+def latest_summary_by_portfolio(df_summaries):
+    # Latest (by Timestamp) StatementSummaries row per PortfolioID with a valid Equity
+    if df_summaries is None or df_summaries.empty or not {'PortfolioID', 'Equity', 'Timestamp'}.issubset(df_summaries.columns):
+        return pd.DataFrame()
+    df_valid = df_summaries[df_summaries['Equity'].notna() & df_summaries['Timestamp'].notna()]
+    if df_valid.empty:
+        return pd.DataFrame()
+    return df_valid.loc[df_valid.groupby(df_valid['PortfolioID'].astype(str))['Timestamp'].idxmax()].set_index('PortfolioID', drop=False)
+
+def compute_portfolio_overview(df_portfolios, df_summaries, df_deals, today=None):
+    if df_portfolios is None or df_portfolios.empty or 'PortfolioID' not in df_portfolios.columns:
+        return pd.DataFrame(columns=PORTFOLIO_OVERVIEW_COLUMNS)
+    today = pd.Timestamp(today if today is not None else datetime.now()).normalize()
+    df_overview = df_portfolios.reindex(columns=['PortfolioID', 'PortfolioName', 'ProgramType', 'Status', 'InitialBalance',
+                                                 'DailyLossLimitPercent', 'TotalStopoutPercent', 'ProfitTargetPercent']).copy()
+    df_overview['PortfolioID'] = df_overview['PortfolioID'].astype(str)
+    df_overview = df_overview.drop_duplicates('PortfolioID').set_index('PortfolioID', drop=False)
+    initial_balance = pd.to_numeric(df_overview['InitialBalance'], errors='coerce')
+
+    # Deals: net P/L, today's P/L, count and max drawdown of the deal-by-deal balance, all grouped per portfolio in one sort order
+    deal_stats = pd.DataFrame(index=df_overview.index, columns=['NetPL', 'TodayPL', 'Deals', 'MaxDrawdown'], dtype=float)
+    if df_deals is not None and not df_deals.empty and {'PortfolioID', 'Time_Deal', 'Profit_Deal'}.issubset(df_deals.columns):
+        df_trading = df_deals
+        if 'Type_Deal' in df_trading.columns:
+            df_trading = df_trading[~df_trading['Type_Deal'].astype(str).str.lower().isin(DEAL_NON_TRADING_TYPES)]
+        df_trading = df_trading[df_trading['Time_Deal'].notna()].sort_values('Time_Deal', kind='stable')
+        deal_net = sum(pd.to_numeric(df_trading[c], errors='coerce').fillna(0) for c in ['Profit_Deal', 'Commission_Deal', 'Fee_Deal', 'Swap_Deal'] if c in df_trading.columns)
+        deal_pid = df_trading['PortfolioID'].astype(str)
+        running_balance = deal_net.groupby(deal_pid).cumsum() + deal_pid.map(initial_balance).fillna(0).to_numpy()
+        df_deal_frame = pd.DataFrame({'PortfolioID': deal_pid, 'NetPL': deal_net, 'TodayPL': deal_net.where(df_trading['Time_Deal'] >= today, 0.0),
+                                      'Drawdown': running_balance.groupby(deal_pid).cummax().clip(lower=deal_pid.map(initial_balance).fillna(0).to_numpy()) - running_balance})
+        deal_stats = df_deal_frame.groupby('PortfolioID').agg(NetPL=('NetPL', 'sum'), TodayPL=('TodayPL', 'sum'), Deals=('NetPL', 'size'), MaxDrawdown=('Drawdown', 'max')).reindex(df_overview.index)
+
+    df_latest_summary = latest_summary_by_portfolio(df_summaries)
+    statement_equity = df_latest_summary['Equity'].reindex(df_overview.index) if not df_latest_summary.empty else pd.Series(np.nan, index=df_overview.index)
+    deals_equity = initial_balance + deal_stats['NetPL']
+    df_overview['Equity'] = statement_equity.fillna(deals_equity).fillna(initial_balance)
+    df_overview['EquitySource'] = np.where(statement_equity.notna(), 'Statement', np.where(deals_equity.notna(), 'Deals', 'Initial'))
+    df_overview['TodayPL'] = deal_stats['TodayPL'].fillna(0.0)
+    df_overview['Deals'] = deal_stats['Deals'].fillna(0).astype(int)
+
+    safe_initial = initial_balance.where(initial_balance > 0)
+    limit_or_nan = lambda col: pd.to_numeric(df_overview[col], errors='coerce').where(lambda v: v > 0)
+    df_overview['DailyLossUsedPct'] = df_overview['TodayPL'].clip(upper=0).abs() / safe_initial * 100
+    df_overview['DailyLimitUsage'] = df_overview['DailyLossUsedPct'] / limit_or_nan('DailyLossLimitPercent') * 100
+    df_overview['TotalDrawdownPct'] = ((safe_initial - df_overview['Equity']) / safe_initial * 100).clip(lower=0)
+    df_overview['StopoutUsage'] = df_overview['TotalDrawdownPct'] / limit_or_nan('TotalStopoutPercent') * 100
+    df_overview['MaxDrawdownPct'] = deal_stats['MaxDrawdown'] / safe_initial * 100
+    df_overview['GainPct'] = (df_overview['Equity'] - safe_initial) / safe_initial * 100
+    df_overview['TargetProgress'] = (df_overview['GainPct'] / limit_or_nan('ProfitTargetPercent') * 100).clip(lower=0)
+
+    worst_usage = df_overview[['DailyLimitUsage', 'StopoutUsage']].max(axis=1)
+    df_overview['Alert'] = np.select([worst_usage >= 100, worst_usage >= PORTFOLIO_NEAR_LIMIT_USAGE, df_overview['TargetProgress'] >= 100],
+                                     PORTFOLIO_ALERT_LEVELS[:3], default=PORTFOLIO_ALERT_LEVELS[3])
+    return df_overview[PORTFOLIO_OVERVIEW_COLUMNS].reset_index(drop=True)
+
+@profile_call("loader")
+@st.cache_data(ttl=180)
+def load_portfolio_overview(today_key=None): # today_key (date string) keys the cache so "today" rolls over
+    return compute_portfolio_overview(load_portfolios_from_gsheets(), load_statement_summaries_from_gsheets(), load_actual_trades_from_gsheets(), today_key)
+
+# ============== PART 1.22: LATEST EQUITY INDEX ==============
+# PortfolioID -> latest StatementSummaries Equity, built with one groupby idxmax (PART 1.21) per summaries load and
+# patched in place when SEC 6 saves a new summary. SEC 1 portfolio switches are then a dict lookup.
+def build_latest_equity_index(df_summaries):
+    df_latest = latest_summary_by_portfolio(df_summaries)
+    if df_latest.empty:
+        return {}
+    return {pid: {'Equity': float(equity), 'Timestamp': ts} for pid, equity, ts in zip(df_latest['PortfolioID'].astype(str), df_latest['Equity'], df_latest['Timestamp'])}
+
+def record_latest_equity(equity_index, portfolio_id, equity, timestamp=None):
+    # Keeps the newest entry per portfolio; returns True when the index changed
+    timestamp = pd.Timestamp(timestamp if timestamp is not None else datetime.now())
+    current_entry = equity_index.get(str(portfolio_id))
+    if current_entry is not None and pd.notna(current_entry['Timestamp']) and current_entry['Timestamp'] > timestamp:
+        return False
+    equity_index[str(portfolio_id)] = {'Equity': float(equity), 'Timestamp': timestamp}
+    return True
+
+@profile_call("loader")
+@st.cache_resource(ttl=180) # Shared mutable dict (not copied per call) so record_latest_equity updates are seen by every reader
+def load_latest_equity_index():
+    return build_latest_equity_index(load_statement_summaries_from_gsheets())
+
+# ============== PART 1.23: PROP-FIRM RULE ENGINE ==============
+# Per-portfolio rule state folded from ActualTrades (closed deal P/L) and StatementSummaries (equity snapshots).
+# Like PART 1.12 the sheets are treated as append-only: only new rows are processed, back-dated deals rebuild that
+# portfolio and a row edited in place (content hash of the rows already folded in) rebuilds everything. Balances are kept relative to the start (cum P/L), so InitialBalance / limits are applied at evaluation.
+PROP_RULE_SOURCES = {
+    'deals': {'id_cols': ['Deal_ID', 'ImportBatchID'], 'time_col': 'Time_Deal',
+              'hash_cols': ['PortfolioID', 'Time_Deal', 'Type_Deal', 'Profit_Deal', 'Commission_Deal', 'Fee_Deal', 'Swap_Deal']},
+    'snapshots': {'id_cols': ['Timestamp', 'PortfolioID', 'ImportBatchID'], 'time_col': 'Timestamp', 'hash_cols': ['PortfolioID', 'Timestamp', 'Equity']}
+}
+PROP_RULE_STATUS_ORDER = ["Breach", "Near", "Pending", "OK", "Passed"]
+
+def _new_prop_rule_state():
+    rule_state = {source: {'rows_seen': 0, 'anchor': None, 'content_hash': 0} for source in PROP_RULE_SOURCES}
+    rule_state['portfolios'] = {}
+    return rule_state
+
+def _new_prop_rule_accumulator():
+    return {'deals': 0, 'cum': 0.0, 'hwm': 0.0, 'min_cum': 0.0, 'max_trailing_dd': 0.0, 'last_time': None,
+            'trading_days': 0, 'last_day': None, 'day_start_cum': 0.0, 'day_min_cum': 0.0, 'worst_day_loss': 0.0, 'worst_day': None,
+            'last_equity': None, 'last_equity_time': None, 'min_equity': None, 'max_equity': None}
+
+def _extend_prop_rule_deals(acc, day_numbers, pnl_block):
+    # day_numbers (days since epoch) / pnl_block in time order
+    if len(pnl_block) == 0:
+        return acc
+    cum_block = acc['cum'] + np.cumsum(pnl_block)
+    hwm_block = np.maximum(acc['hwm'], np.maximum.accumulate(cum_block))
+    acc['max_trailing_dd'] = max(acc['max_trailing_dd'], float((hwm_block - cum_block).max()))
+    acc['min_cum'] = min(acc['min_cum'], float(cum_block.min()))
+
+    # Daily loss = day's starting balance - lowest balance that day, one reduceat over the day runs
+    day_starts = np.flatnonzero(np.r_[True, day_numbers[1:] != day_numbers[:-1]])
+    start_cum = np.r_[acc['cum'], cum_block[:-1]][day_starts]
+    day_min = np.minimum(np.minimum.reduceat(cum_block, day_starts), start_cum)
+    if acc['last_day'] is not None and day_numbers[0] == acc['last_day']: # Block continues the previous block's day
+        start_cum[0] = acc['day_start_cum']
+        day_min[0] = min(day_min[0], acc['day_min_cum'])
+    else:
+        acc['trading_days'] += 1
+    acc['trading_days'] += len(day_starts) - 1
+    day_loss = start_cum - day_min
+    worst_idx = int(np.argmax(day_loss))
+    if day_loss[worst_idx] > acc['worst_day_loss']:
+        acc['worst_day_loss'], acc['worst_day'] = float(day_loss[worst_idx]), int(day_numbers[day_starts[worst_idx]])
+    acc.update({'deals': acc['deals'] + len(pnl_block), 'cum': float(cum_block[-1]), 'hwm': float(hwm_block[-1]),
+                'last_day': int(day_numbers[-1]), 'day_start_cum': float(start_cum[-1]), 'day_min_cum': float(day_min[-1])})
+    return acc
+
+def _deal_day_numbers_and_pnl(df_deals_block):
+    # df_deals_block: trading deals with _rule_time, in time order
+    deal_net = sum(pd.to_numeric(df_deals_block[c], errors='coerce').fillna(0) for c in ['Profit_Deal', 'Commission_Deal', 'Fee_Deal', 'Swap_Deal'] if c in df_deals_block.columns)
+    day_numbers = df_deals_block['_rule_time'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    return day_numbers, np.asarray(deal_net, dtype=float)
+
+def _prop_rule_anchor(df_source, source, pos):
+    return tuple(str(df_source[c].iloc[pos]) for c in PROP_RULE_SOURCES[source]['id_cols'] if c in df_source.columns)
+
+def update_prop_rule_state(rule_state, df_deals, df_summaries):
+    # Folds rows appended to either sheet since the last call into each PortfolioID's accumulator
+    sources = {'deals': df_deals if df_deals is not None else pd.DataFrame(), 'snapshots': df_summaries if df_summaries is not None else pd.DataFrame()}
+    row_hashes = {source: _row_content_hashes(df_source, PROP_RULE_SOURCES[source]['hash_cols']) for source, df_source in sources.items()}
+    for source, df_source in sources.items():
+        rows_seen = rule_state[source]['rows_seen']
+        if rows_seen > 0 and not (rows_seen <= len(df_source) and _prop_rule_anchor(df_source, source, rows_seen - 1) == rule_state[source]['anchor']
+                                  and _combine_row_hashes(row_hashes[source][:rows_seen]) == rule_state[source].get('content_hash')):
+            rule_state.update(_new_prop_rule_state()) # Edited / shrunk sheet: start over for both sources
+            break
+    for source, df_source in sources.items():
+        if {'PortfolioID', PROP_RULE_SOURCES[source]['time_col']}.issubset(df_source.columns):
+            _fold_prop_rule_rows(rule_state, source, df_source)
+            rule_state[source]['content_hash'] = _combine_row_hashes(row_hashes[source])
+    return rule_state
+
+def _select_trading_rows(df_rows, time_col):
+    df_rows = df_rows.assign(_rule_time=pd.to_datetime(df_rows[time_col], errors='coerce')).dropna(subset=['_rule_time'])
+    if 'Type_Deal' in df_rows.columns:
+        df_rows = df_rows[~df_rows['Type_Deal'].astype(str).str.lower().isin(DEAL_NON_TRADING_TYPES)]
+    return df_rows.sort_values('_rule_time', kind='stable')
+
+def _fold_prop_rule_rows(rule_state, source, df_source):
+    n_rows, rows_seen = len(df_source), rule_state[source]['rows_seen']
+    if n_rows <= rows_seen:
+        return rule_state
+    time_col = PROP_RULE_SOURCES[source]['time_col']
+    df_new = _select_trading_rows(df_source.iloc[rows_seen:], time_col)
+    for pid, df_pf_new in df_new.groupby(df_new['PortfolioID'].astype(str), sort=False):
+        acc = rule_state['portfolios'].setdefault(pid, _new_prop_rule_accumulator())
+        if source == 'deals':
+            if acc['last_time'] is not None and (df_pf_new['_rule_time'] < acc['last_time']).any():
+                # Back-dated deals: replay this portfolio's deals, keep its equity snapshots
+                df_pf_new = _select_trading_rows(df_source[df_source['PortfolioID'].astype(str) == pid], time_col)
+                rebuilt_acc = _new_prop_rule_accumulator()
+                rebuilt_acc.update({k: acc[k] for k in ['last_equity', 'last_equity_time', 'min_equity', 'max_equity']})
+                acc = rule_state['portfolios'][pid] = rebuilt_acc
+            _extend_prop_rule_deals(acc, *_deal_day_numbers_and_pnl(df_pf_new))
+            acc['last_time'] = df_pf_new['_rule_time'].max() if acc['last_time'] is None else max(acc['last_time'], df_pf_new['_rule_time'].max())
+        else:
+            equity_values = pd.to_numeric(df_pf_new['Equity'].astype(str).str.replace(',', '', regex=False), errors='coerce') if 'Equity' in df_pf_new.columns else pd.Series(np.nan, index=df_pf_new.index)
+            df_pf_new = df_pf_new.assign(_equity=equity_values).dropna(subset=['_equity'])
+            if df_pf_new.empty:
+                continue
+            acc['min_equity'] = min(v for v in [acc['min_equity'], float(df_pf_new['_equity'].min())] if v is not None)
+            acc['max_equity'] = max(v for v in [acc['max_equity'], float(df_pf_new['_equity'].max())] if v is not None)
+            newest_snapshot = df_pf_new.iloc[-1]
+            if acc['last_equity_time'] is None or newest_snapshot['_rule_time'] >= acc['last_equity_time']:
+                acc['last_equity'], acc['last_equity_time'] = float(newest_snapshot['_equity']), newest_snapshot['_rule_time']
+    rule_state[source]['rows_seen'] = n_rows
+    rule_state[source]['anchor'] = _prop_rule_anchor(df_source, source, n_rows - 1)
+    return rule_state
+
+def evaluate_prop_firm_rules(acc, portfolio_details, today=None, near_usage_pct=None):
+    # One row per rule: Rule, Value, Limit, Usage (% of limit / target), Status (PROP_RULE_STATUS_ORDER), Detail (Thai)
+    near_usage_pct = PORTFOLIO_NEAR_LIMIT_USAGE if near_usage_pct is None else near_usage_pct
+    acc = acc or _new_prop_rule_accumulator()
+    today = pd.Timestamp(today if today is not None else datetime.now()).normalize()
+    number_of = lambda key: pd.to_numeric(pd.Series([portfolio_details.get(key)]), errors='coerce').iloc[0]
+    initial_balance = number_of('InitialBalance')
+    if pd.isna(initial_balance) or initial_balance <= 0:
+        return pd.DataFrame(columns=['Rule', 'Value', 'Limit', 'Usage', 'Status', 'Detail'])
+    balance_now = initial_balance + acc['cum']
+    equity_now = acc['last_equity'] if acc['last_equity'] is not None and acc['last_equity_time'] is not None and acc['last_time'] is not None and acc['last_equity_time'] >= acc['last_time'] else balance_now
+    limit_status = lambda usage: "Breach" if usage >= 100 else ("Near" if usage >= near_usage_pct else "OK")
+    rule_rows = []
+
+    daily_limit_pct = number_of('DailyLossLimitPercent')
+    if pd.notna(daily_limit_pct) and daily_limit_pct > 0:
+        daily_limit = initial_balance * daily_limit_pct / 100
+        # Today's start = last closed balance before today; low = worst closed balance today or a lower equity snapshot taken today
+        is_today = acc['last_day'] is not None and acc['last_day'] == int(np.datetime64(today.date(), 'D').astype(np.int64))
+        day_start_balance = initial_balance + (acc['day_start_cum'] if is_today else acc['cum'])
+        day_low = initial_balance + (acc['day_min_cum'] if is_today else acc['cum'])
+        if acc['last_equity_time'] is not None and acc['last_equity_time'] >= today: day_low = min(day_low, acc['last_equity'])
+        today_loss = max(day_start_balance - day_low, 0.0)
+        rule_rows.append({'Rule': 'Daily Loss (วันนี้)', 'Value': today_loss, 'Limit': daily_limit, 'Usage': 100 * today_loss / daily_limit,
+                          'Status': limit_status(100 * today_loss / daily_limit), 'Detail': f"ขาดทุนวันนี้จากยอดต้นวัน {today_loss:,.2f} / {daily_limit:,.2f} USD"})
+        worst_day_text = str(np.datetime64(acc['worst_day'], 'D')) if acc['worst_day'] is not None else "-"
+        rule_rows.append({'Rule': 'Daily Loss (วันที่แย่ที่สุด)', 'Value': acc['worst_day_loss'], 'Limit': daily_limit, 'Usage': 100 * acc['worst_day_loss'] / daily_limit,
+                          'Status': "Breach" if acc['worst_day_loss'] >= daily_limit else "OK", 'Detail': f"วันที่ขาดทุนมากที่สุด {worst_day_text}: {acc['worst_day_loss']:,.2f} USD"})
+
+    stopout_pct = number_of('TotalStopoutPercent')
+    if pd.notna(stopout_pct) and stopout_pct > 0:
+        stopout_limit = initial_balance * stopout_pct / 100
+        lowest_value = min(v for v in [initial_balance + acc['min_cum'], acc['min_equity'], equity_now] if v is not None)
+        total_loss = max(initial_balance - lowest_value, 0.0)
+        rule_rows.append({'Rule': 'Max Loss (Total Stopout)', 'Value': total_loss, 'Limit': stopout_limit, 'Usage': 100 * total_loss / stopout_limit,
+                          'Status': limit_status(100 * total_loss / stopout_limit), 'Detail': f"ต่ำสุด {lowest_value:,.2f} เทียบ Initial {initial_balance:,.2f} (ห้ามต่ำกว่า {initial_balance - stopout_limit:,.2f})"})
+
+    target_pct = number_of('ProfitTargetPercent')
+    if pd.notna(target_pct) and target_pct > 0:
+        target_amount = initial_balance * target_pct / 100
+        gain_now = equity_now - initial_balance
+        rule_rows.append({'Rule': 'Profit Target', 'Value': gain_now, 'Limit': target_amount, 'Usage': max(100 * gain_now / target_amount, 0.0),
+                          'Status': "Passed" if gain_now >= target_amount else "Pending", 'Detail': f"กำไร {gain_now:,.2f} / เป้า {target_amount:,.2f} USD"})
+
+    min_days = number_of('MinTradingDays')
+    if pd.notna(min_days) and min_days > 0:
+        rule_rows.append({'Rule': 'Min Trading Days', 'Value': acc['trading_days'], 'Limit': int(min_days), 'Usage': 100 * acc['trading_days'] / min_days,
+                          'Status': "Passed" if acc['trading_days'] >= min_days else "Pending", 'Detail': f"เทรดแล้ว {acc['trading_days']} / {int(min_days)} วัน"})
+
+    end_date = pd.to_datetime(portfolio_details.get('CompetitionEndDate'), errors='coerce')
+    if pd.notna(end_date):
+        days_left = (end_date.normalize() - today).days
+        if pd.isna(target_pct) or target_pct <= 0: # Nothing to reach: the period is only over (Passed) once the end date is behind us
+            end_status = "Passed" if days_left < 0 else "OK"
+        else:
+            target_met = (equity_now - initial_balance) >= initial_balance * target_pct / 100
+            end_status = "Passed" if target_met else ("Breach" if days_left < 0 else ("Near" if days_left <= 3 else "Pending"))
+        rule_rows.append({'Rule': 'End Date', 'Value': days_left, 'Limit': 0, 'Usage': np.nan, 'Status': end_status,
+                          'Detail': f"สิ้นสุด {end_date.date()} (เหลือ {days_left} วัน)" if days_left >= 0 else f"เลยวันสิ้นสุด {end_date.date()} แล้ว {-days_left} วัน"})
+    return pd.DataFrame(rule_rows, columns=['Rule', 'Value', 'Limit', 'Usage', 'Status', 'Detail'])
+
+def evaluate_all_prop_firm_rules(rule_state, df_portfolios, today=None):
+    # Rules of every portfolio stacked, most urgent first
+    if df_portfolios is None or df_portfolios.empty or 'PortfolioID' not in df_portfolios.columns:
+        return pd.DataFrame(columns=['PortfolioID', 'PortfolioName', 'Rule', 'Value', 'Limit', 'Usage', 'Status', 'Detail'])
+    rule_frames = []
+    for portfolio_details in df_portfolios.to_dict('records'):
+        df_pf_rules = evaluate_prop_firm_rules(rule_state['portfolios'].get(str(portfolio_details['PortfolioID'])), portfolio_details, today)
+        if not df_pf_rules.empty:
+            rule_frames.append(df_pf_rules.assign(PortfolioID=str(portfolio_details['PortfolioID']), PortfolioName=portfolio_details.get('PortfolioName')))
+    if not rule_frames:
+        return pd.DataFrame(columns=['PortfolioID', 'PortfolioName', 'Rule', 'Value', 'Limit', 'Usage', 'Status', 'Detail'])
+    df_all_rules = pd.concat(rule_frames, ignore_index=True)[['PortfolioID', 'PortfolioName', 'Rule', 'Value', 'Limit', 'Usage', 'Status', 'Detail']]
+    return df_all_rules.sort_values('Status', key=lambda col: col.map(PROP_RULE_STATUS_ORDER.index), kind='stable').reset_index(drop=True)
+
+# ============== PART 1.24: PORTFOLIO EDITING ==============
+# PortfolioID -> sheet row from the header row and the PortfolioID column (two reads), cached like the portfolio frame;
+# the row's PortfolioID cell is re-read before writing and the index rebuilt if the sheet moved underneath it.
+# An edit writes only the cells whose typed value differs, in one batch_update, then patches the shared portfolio
+# frame (load_portfolios_from_gsheets) and the active portfolio details in place instead of reloading the sheet.
+PORTFOLIO_READONLY_COLUMNS = ['PortfolioID', 'CreationDate']
+PORTFOLIO_DATE_COLUMNS = ['CompetitionEndDate', 'TargetEndDate', 'CreationDate']
+
+@profile_call("loader")
+@st.cache_resource(ttl=300) # Same lifetime as load_portfolios_from_gsheets; cleared when save_new_portfolio_to_gsheets appends a row
+def load_portfolio_row_index():
+    gc = get_gspread_client()
+    if gc is None:
+        print("Error: GSpread client not available for the portfolio row index.")
+        return None
+    try:
+        ws = gc.open(GOOGLE_SHEET_NAME).worksheet(WORKSHEET_PORTFOLIOS)
+        sheet_headers = ws.row_values(1)
+        if 'PortfolioID' not in sheet_headers:
+            print(f"Warning: No 'PortfolioID' header in Worksheet '{WORKSHEET_PORTFOLIOS}'.")
+            return None
+        row_index = {}
+        for row_number, pid in enumerate(ws.col_values(sheet_headers.index('PortfolioID') + 1)[1:], start=2):
+            if str(pid).strip():
+                row_index.setdefault(str(pid).strip(), row_number)
+        return {'headers': sheet_headers, 'rows': row_index}
+    except Exception as e:
+        print(f"Warning: Could not build the portfolio row index: {e}")
+        return None
+
+def _lookup_portfolio_row(portfolio_id):
+    row_index = load_portfolio_row_index()
+    if row_index is None or str(portfolio_id) not in row_index['rows']:
+        load_portfolio_row_index.clear() # Row added from elsewhere (or an earlier failure): rebuild once
+        row_index = load_portfolio_row_index()
+    if row_index is None:
+        return None, None
+    return row_index['headers'], row_index['rows'].get(str(portfolio_id))
+
+def _portfolio_cell_text(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (bool, np.bool_)):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    return str(value).strip()
+
+def _coerce_portfolio_value(col, value):
+    # The typing load_portfolios_from_gsheets applies to a cell on load
+    cell_text = _portfolio_cell_text(value)
+    if col in PORTFOLIO_NUMERIC_COLUMN_TYPES:
+        num_value = pd.to_numeric(cell_text, errors='coerce') if cell_text else np.nan
+        num_value = 0 if pd.isna(num_value) else num_value
+        return int(num_value) if PORTFOLIO_NUMERIC_COLUMN_TYPES[col] == int else float(num_value)
+    if col == 'EnableScaling':
+        return PORTFOLIO_BOOL_MAP.get(cell_text.upper(), False)
+    if col in PORTFOLIO_DATE_COLUMNS:
+        ts_value = pd.to_datetime(cell_text, errors='coerce') if cell_text else pd.NaT
+        return ts_value.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(ts_value) else np.nan
+    return cell_text
+
+def _same_portfolio_value(old_value, new_value):
+    old_missing = old_value is None or (not isinstance(old_value, str) and pd.isna(old_value))
+    new_missing = new_value is None or (not isinstance(new_value, str) and pd.isna(new_value))
+    if old_missing or new_missing:
+        return old_missing and new_missing
+    if isinstance(new_value, (int, float)) and not isinstance(new_value, bool):
+        old_num = pd.to_numeric(old_value, errors='coerce')
+        return pd.notna(old_num) and abs(float(old_num) - float(new_value)) < 1e-9
+    return str(old_value) == str(new_value)
+
+def diff_portfolio_changes(current_details, changes, sheet_headers):
+    # {column: cell text} for the columns whose value changes once typed like the loader; unknown / read-only columns are skipped
+    cell_changes = {}
+    for col, new_value in changes.items():
+        if col not in sheet_headers or col in PORTFOLIO_READONLY_COLUMNS:
+            print(f"Warning: Portfolio column '{col}' is not editable (missing from the sheet or read-only); skipped.")
+            continue
+        if not _same_portfolio_value((current_details or {}).get(col), _coerce_portfolio_value(col, new_value)):
+            cell_changes[col] = _portfolio_cell_text(new_value)
+    return cell_changes
+
+def apply_portfolio_changes(df_portfolios, portfolio_id, cell_changes):
+    if df_portfolios is None or df_portfolios.empty or 'PortfolioID' not in df_portfolios.columns:
+        return
+    row_mask = df_portfolios['PortfolioID'].astype(str) == str(portfolio_id)
+    for col, cell_text in cell_changes.items():
+        if col in df_portfolios.columns:
+            if PORTFOLIO_NUMERIC_COLUMN_TYPES.get(col) == float and df_portfolios[col].dtype.kind != 'f':
+                df_portfolios[col] = df_portfolios[col].astype(float) # to_numeric leaves whole-number columns as int64
+            df_portfolios.loc[row_mask, col] = _coerce_portfolio_value(col, cell_text)
+
+@profile_call("save")
+def update_portfolio_in_gsheets(portfolio_id, changes, df_portfolios=None):
+    # Returns the columns written ([] when nothing differs) or None on failure
+    gc = get_gspread_client()
+    if not gc:
+        st.error("ไม่สามารถเชื่อมต่อ Google Sheets Client เพื่อแก้ไขพอร์ตได้")
+        return None
+    if df_portfolios is None:
+        df_portfolios = load_portfolios_from_gsheets()
+    try:
+        sheet_headers, row_number = _lookup_portfolio_row(portfolio_id)
+        if row_number is None:
+            st.error(f"❌ ไม่พบ PortfolioID '{portfolio_id}' ใน Worksheet '{WORKSHEET_PORTFOLIOS}'")
+            return None
+        current_details = {}
+        if not df_portfolios.empty and 'PortfolioID' in df_portfolios.columns:
+            df_current_row = df_portfolios[df_portfolios['PortfolioID'].astype(str) == str(portfolio_id)]
+            if not df_current_row.empty:
+                current_details = df_current_row.iloc[0].to_dict()
+        cell_changes = diff_portfolio_changes(current_details, changes, sheet_headers)
+        if not cell_changes:
+            return []
+
+        ws = gc.open(GOOGLE_SHEET_NAME).worksheet(WORKSHEET_PORTFOLIOS)
+        # The cached row index may predate rows inserted / deleted / sorted in the sheet: confirm the row still holds this
+        # PortfolioID (one cell read) and rebuild the index once if it does not
+        if str(ws.cell(row_number, sheet_headers.index('PortfolioID') + 1).value or '').strip() != str(portfolio_id):
+            load_portfolio_row_index.clear()
+            sheet_headers, row_number = _lookup_portfolio_row(portfolio_id)
+            if row_number is None:
+                st.error(f"❌ ไม่พบ PortfolioID '{portfolio_id}' ใน Worksheet '{WORKSHEET_PORTFOLIOS}'")
+                return None
+            cell_changes = diff_portfolio_changes(current_details, changes, sheet_headers)
+            if not cell_changes:
+                return []
+        ws.batch_update([{'range': gspread.utils.rowcol_to_a1(row_number, sheet_headers.index(col) + 1), 'values': [[cell_text]]}
+                         for col, cell_text in cell_changes.items()], value_input_option='USER_ENTERED')
+
+        apply_portfolio_changes(df_portfolios, portfolio_id, cell_changes)
+        active_details = st.session_state.get('current_portfolio_details')
+        if active_details and str(active_details.get('PortfolioID')) == str(portfolio_id):
+            active_details.update({col: _coerce_portfolio_value(col, cell_text) for col, cell_text in cell_changes.items()})
+        if hasattr(load_portfolio_overview, 'clear'):
+            load_portfolio_overview.clear()
+        return list(cell_changes)
+    except gspread.exceptions.WorksheetNotFound:
+        st.error(f"❌ ไม่พบ Worksheet ชื่อ '{WORKSHEET_PORTFOLIOS}'.")
+        return None
+    except Exception as e:
+        st.error(f"❌ เกิดข้อผิดพลาดในการแก้ไขพอร์ตใน Google Sheets: {e}")
+        return None
+
 # ===================== SEC 1: PORTFOLIO SELECTION (Sidebar) =======================
+mark_startup_section("SEC 1")
 df_portfolios_gs = load_portfolios_from_gsheets() #
 
 st.sidebar.markdown("---") #
@@ -478,48 +2653,17 @@ if selected_portfolio_name_gs != previous_portfolio_name_gs:
                 st.session_state.current_portfolio_details = selected_portfolio_row_df.iloc[0].to_dict() #
                 st.session_state.active_portfolio_id_gs = st.session_state.current_portfolio_details.get('PortfolioID', None) #
                 
-                # +++ NEW: Attempt to load latest equity from StatementSummaries for the NEWLY selected portfolio +++
+                # Latest equity from StatementSummaries for the NEWLY selected portfolio: O(1) lookup in the maintained index (PART 1.22)
                 if st.session_state.active_portfolio_id_gs:
-                    df_all_summaries = load_statement_summaries_from_gsheets() # Calls the new cached function
-                    if not df_all_summaries.empty and \
-                       'PortfolioID' in df_all_summaries.columns and \
-                       'Equity' in df_all_summaries.columns and \
-                       'Timestamp' in df_all_summaries.columns:
-                        
-                        # Ensure columns are of correct type for filtering and sorting
-                        # This was already handled in load_statement_summaries_from_gsheets, but defensive check is okay
-                        if not pd.api.types.is_string_dtype(df_all_summaries['PortfolioID']):
-                             df_all_summaries['PortfolioID'] = df_all_summaries['PortfolioID'].astype(str)
-                        if not pd.api.types.is_numeric_dtype(df_all_summaries['Equity']):
-                             df_all_summaries['Equity'] = pd.to_numeric(df_all_summaries['Equity'].astype(str).str.replace(',', '', regex=False), errors='coerce')
-                        if not pd.api.types.is_datetime64_any_dtype(df_all_summaries['Timestamp']):
-                             df_all_summaries['Timestamp'] = pd.to_datetime(df_all_summaries['Timestamp'], errors='coerce')
-                        
-                        df_portfolio_specific_summaries = df_all_summaries[
-                            (df_all_summaries['PortfolioID'] == str(st.session_state.active_portfolio_id_gs)) &
-                            (df_all_summaries['Equity'].notna()) &
-                            (df_all_summaries['Timestamp'].notna()) # Ensure timestamp is valid for sorting
-                        ].copy() # Use .copy() to avoid SettingWithCopyWarning
-
-                        if not df_portfolio_specific_summaries.empty:
-                            # Sort by Timestamp to get the latest
-                            df_portfolio_specific_summaries.sort_values(by='Timestamp', ascending=False, inplace=True)
-                            latest_equity_value = df_portfolio_specific_summaries.iloc[0]['Equity']
-                            if pd.notna(latest_equity_value):
-                                st.session_state.latest_statement_equity = float(latest_equity_value)
-                                print(f"SEC 1 (Portfolio Change): Loaded latest equity {latest_equity_value} for portfolio '{selected_portfolio_name_gs}' from summaries.")
-                            else:
-                                st.session_state.latest_statement_equity = None
-                                print(f"SEC 1 (Portfolio Change): Latest equity value from summary is NaN for portfolio '{selected_portfolio_name_gs}'.")
-                        else:
-                            st.session_state.latest_statement_equity = None 
-                            print(f"SEC 1 (Portfolio Change): No valid equity summary found for portfolio '{selected_portfolio_name_gs}'.")
+                    latest_equity_entry = load_latest_equity_index().get(str(st.session_state.active_portfolio_id_gs))
+                    if latest_equity_entry is not None:
+                        st.session_state.latest_statement_equity = latest_equity_entry['Equity']
+                        print(f"SEC 1 (Portfolio Change): Loaded latest equity {latest_equity_entry['Equity']:g} for portfolio '{selected_portfolio_name_gs}' from summaries.")
                     else:
                         st.session_state.latest_statement_equity = None
-                        print(f"SEC 1 (Portfolio Change): StatementSummaries sheet empty or missing required columns for portfolio '{selected_portfolio_name_gs}'.")
+                        print(f"SEC 1 (Portfolio Change): No valid equity summary found for portfolio '{selected_portfolio_name_gs}'.")
                 else: 
                     st.session_state.latest_statement_equity = None
-                # +++ END NEW +++
 
                 # Set current_account_balance: Prioritize latest_statement_equity, then InitialBalance from portfolio details
                 if st.session_state.latest_statement_equity is not None:
@@ -571,233 +2715,369 @@ if st.session_state.current_portfolio_details:
         if pd.notna(details.get('DailyLossLimitPercent')): st.sidebar.write(f"- Daily Loss Limit: {float(details['DailyLossLimitPercent']):.1f}%") #
         if pd.notna(details.get('TotalStopoutPercent')): st.sidebar.write(f"- Total Stopout: {float(details['TotalStopoutPercent']):.1f}%") #
 
+        # Firm-rule breaches / near-breaches from deals + equity snapshots (PART 1.23, only new rows are folded in)
+        if st.session_state.get('prop_rule_state_v1') is None:
+            st.session_state.prop_rule_state_v1 = _new_prop_rule_state()
+        update_prop_rule_state(st.session_state.prop_rule_state_v1, load_actual_trades_from_gsheets(), load_statement_summaries_from_gsheets())
+        df_active_rules = evaluate_prop_firm_rules(st.session_state.prop_rule_state_v1['portfolios'].get(str(details.get('PortfolioID'))), details)
+        for rule_alert in df_active_rules[df_active_rules['Status'].isin(["Breach", "Near"])].itertuples():
+            if rule_alert.Status == "Breach": st.sidebar.error(f"🚨 ผิดกฎ {rule_alert.Rule}: {rule_alert.Detail}")
+            else: st.sidebar.warning(f"⚠️ ใกล้ผิดกฎ {rule_alert.Rule}: {rule_alert.Detail}")
+
 elif not df_portfolios_gs.empty and selected_portfolio_name_gs == "": # Corrected key
      st.sidebar.info("กรุณาเลือกพอร์ตที่ใช้งานจากรายการ") #
 elif df_portfolios_gs.empty:
     st.sidebar.warning("ไม่พบข้อมูล Portfolio ใน Google Sheets หรือเกิดข้อผิดพลาดในการโหลด.") #
 
 # ===================== SEC 1.5: PORTFOLIO MANAGEMENT UI (Main Area) =======================
+mark_startup_section("SEC 1.5")
 def on_program_type_change_v8(): # This callback seems to be defined but its key might have changed or it might need adjustment based on usage
     st.session_state.exp_pf_type_select_v8_key = st.session_state.exp_pf_type_selector_widget_v8
 
-with st.expander("💼 จัดการพอร์ต (เพิ่ม/ดูพอร์ต)", expanded=False): # Setting expanded=True for easier testing
-    st.subheader("พอร์ตทั้งหมดของคุณ")
-    # df_portfolios_gs should be loaded globally/module level before this UI section
-    # Ensure df_portfolios_gs is available. It is loaded at the beginning of SEC 1.
-    if df_portfolios_gs.empty: # Check if df_portfolios_gs is empty (loaded in SEC 1)
-        st.info("ยังไม่มีข้อมูลพอร์ต หรือยังไม่ได้โหลดข้อมูลพอร์ต โปรดเพิ่มพอร์ตใหม่ด้านล่าง หรือตรวจสอบการเชื่อมต่อ Google Sheets")
-    else:
-        cols_to_display_pf_table = ['PortfolioID', 'PortfolioName', 'ProgramType', 'EvaluationStep', 'Status', 'InitialBalance']
-        # Filter out columns that might not exist in the DataFrame to prevent KeyErrors
-        cols_exist_pf_table = [col for col in cols_to_display_pf_table if col in df_portfolios_gs.columns]
-        if cols_exist_pf_table:
-            st.dataframe(df_portfolios_gs[cols_exist_pf_table], use_container_width=True, hide_index=True)
+portfolio_management_expander = st.expander("💼 จัดการพอร์ต (เพิ่ม/แก้ไข/ดูพอร์ต)", expanded=False, key="portfolio_management_expander_v1", on_change="rerun")
+if portfolio_management_expander.open: # Forms are only built while the expander is open
+    with portfolio_management_expander:
+        st.subheader("พอร์ตทั้งหมดของคุณ")
+        # df_portfolios_gs should be loaded globally/module level before this UI section
+        # Ensure df_portfolios_gs is available. It is loaded at the beginning of SEC 1.
+        if df_portfolios_gs.empty: # Check if df_portfolios_gs is empty (loaded in SEC 1)
+            st.info("ยังไม่มีข้อมูลพอร์ต หรือยังไม่ได้โหลดข้อมูลพอร์ต โปรดเพิ่มพอร์ตใหม่ด้านล่าง หรือตรวจสอบการเชื่อมต่อ Google Sheets")
         else:
-            st.info("ไม่พบคอลัมน์ที่ต้องการแสดงในตารางพอร์ต (ตรวจสอบ df_portfolios_gs และการโหลดข้อมูล)")
+            cols_to_display_pf_table = ['PortfolioID', 'PortfolioName', 'ProgramType', 'EvaluationStep', 'Status', 'InitialBalance']
+            # Filter out columns that might not exist in the DataFrame to prevent KeyErrors
+            cols_exist_pf_table = [col for col in cols_to_display_pf_table if col in df_portfolios_gs.columns]
+            if cols_exist_pf_table:
+                st.dataframe(df_portfolios_gs[cols_exist_pf_table], use_container_width=True, hide_index=True)
+            else:
+                st.info("ไม่พบคอลัมน์ที่ต้องการแสดงในตารางพอร์ต (ตรวจสอบ df_portfolios_gs และการโหลดข้อมูล)")
+
+        st.markdown("---")
+        st.subheader("✏️ แก้ไขพอร์ต")
+        if not df_portfolios_gs.empty and {'PortfolioID', 'PortfolioName'}.issubset(df_portfolios_gs.columns):
+            edit_pf_names = df_portfolios_gs['PortfolioName'].astype(str).tolist()
+            edit_pf_default = st.session_state.get('active_portfolio_name_gs')
+            edit_pf_name = st.selectbox("เลือกพอร์ตที่จะแก้ไข", options=edit_pf_names,
+                                        index=edit_pf_names.index(edit_pf_default) if edit_pf_default in edit_pf_names else 0, key="edit_pf_select_v1")
+            edit_pf = df_portfolios_gs[df_portfolios_gs['PortfolioName'].astype(str) == edit_pf_name].iloc[0].to_dict()
+            edit_pf_id = str(edit_pf['PortfolioID'])
+
+            def edit_pf_number(col, default=0.0):
+                num_value = pd.to_numeric(edit_pf.get(col), errors='coerce')
+                return float(num_value) if pd.notna(num_value) else default
+
+            # Value each widget starts from: only fields moved away from it are sent, so a blank / unusual cell that a widget
+            # cannot show as-is (e.g. a blank InitialBalance shown as the default) is not overwritten by saving another field
+            edit_pf_shown = {}
+            def edit_pf_start(col, value):
+                edit_pf_shown[col] = value
+                return value
+
+            # Widget keys carry the PortfolioID so switching portfolio shows that portfolio's current values
+            with st.form(f"edit_portfolio_form_{edit_pf_id}_v1"):
+                st.caption(f"PortfolioID: {edit_pf_id} | ประเภท: {edit_pf.get('ProgramType', '')} (ชื่อพอร์ต/ID/วันที่สร้างแก้ไขไม่ได้)")
+                edit_status_options = ["Active", "Inactive", "Pending", "Passed", "Failed"]
+                edit_current_status = _portfolio_cell_text(edit_pf.get('Status'))
+                if edit_current_status not in edit_status_options: # Blank or custom status in the sheet: keep it selectable as-is
+                    edit_status_options = [edit_current_status] + edit_status_options
+                edit_c1, edit_c2 = st.columns(2)
+                with edit_c1:
+                    edit_status = st.selectbox("สถานะพอร์ต (Status)", options=edit_status_options, index=edit_status_options.index(edit_pf_start('Status', edit_current_status)),
+                                               format_func=lambda status: status if status else "(ไม่ระบุ)", key=f"edit_pf_status_{edit_pf_id}_v1")
+                with edit_c2:
+                    edit_initial_balance = st.number_input("บาลานซ์เริ่มต้น (Initial Balance)", min_value=0.01, value=edit_pf_start('InitialBalance', max(edit_pf_number('InitialBalance', DEFAULT_ACCOUNT_BALANCE), 0.01)), format="%.2f", key=f"edit_pf_balance_{edit_pf_id}_v1")
+                edit_changes = {'Status': edit_status, 'InitialBalance': edit_initial_balance}
+
+                if edit_pf.get('ProgramType') in ["Prop Firm Challenge", "Funded Account", "Trading Competition"]:
+                    edit_r1, edit_r2, edit_r3 = st.columns(3)
+                    with edit_r1: edit_changes['ProfitTargetPercent'] = st.number_input("เป้าหมายกำไร %", value=edit_pf_start('ProfitTargetPercent', edit_pf_number('ProfitTargetPercent')), format="%.1f", key=f"edit_pf_profit_{edit_pf_id}_v1")
+                    with edit_r2: edit_changes['DailyLossLimitPercent'] = st.number_input("จำกัดขาดทุนต่อวัน %", value=edit_pf_start('DailyLossLimitPercent', edit_pf_number('DailyLossLimitPercent')), format="%.1f", key=f"edit_pf_dd_{edit_pf_id}_v1")
+                    with edit_r3: edit_changes['TotalStopoutPercent'] = st.number_input("จำกัดขาดทุนรวม %", value=edit_pf_start('TotalStopoutPercent', edit_pf_number('TotalStopoutPercent')), format="%.1f", key=f"edit_pf_maxdd_{edit_pf_id}_v1")
+                    if edit_pf.get('ProgramType') != "Trading Competition":
+                        edit_r4, edit_r5 = st.columns(2)
+                        with edit_r4: edit_changes['Leverage'] = st.number_input("Leverage", value=edit_pf_start('Leverage', edit_pf_number('Leverage')), format="%.0f", key=f"edit_pf_lev_{edit_pf_id}_v1")
+                        with edit_r5: edit_changes['MinTradingDays'] = st.number_input("จำนวนวันเทรดขั้นต่ำ", value=edit_pf_start('MinTradingDays', int(edit_pf_number('MinTradingDays'))), step=1, key=f"edit_pf_mindays_{edit_pf_id}_v1")
+
+                st.markdown("**Scaling Manager:**")
+                edit_changes['EnableScaling'] = st.checkbox("เปิดใช้งาน Scaling Manager?", value=edit_pf_start('EnableScaling', bool(edit_pf.get('EnableScaling', False))), key=f"edit_pf_scale_enable_{edit_pf_id}_v1")
+                edit_s1, edit_s2, edit_s3 = st.columns(3)
+                with edit_s1:
+                    edit_changes['MinRiskPercentAllowed'] = st.number_input("Min Risk % Allowed", value=edit_pf_start('MinRiskPercentAllowed', edit_pf_number('MinRiskPercentAllowed')), format="%.2f", key=f"edit_pf_min_risk_{edit_pf_id}_v1")
+                with edit_s2:
+                    edit_changes['MaxRiskPercentAllowed'] = st.number_input("Max Risk % Allowed", value=edit_pf_start('MaxRiskPercentAllowed', edit_pf_number('MaxRiskPercentAllowed')), format="%.2f", key=f"edit_pf_max_risk_{edit_pf_id}_v1")
+                with edit_s3:
+                    edit_changes['CurrentRiskPercent'] = st.number_input("Current Risk %", value=edit_pf_start('CurrentRiskPercent', edit_pf_number('CurrentRiskPercent')), format="%.2f", key=f"edit_pf_current_risk_{edit_pf_id}_v1")
+                edit_changes['Notes'] = st.text_area("หมายเหตุเพิ่มเติม (Notes)", value=edit_pf_start('Notes', str(edit_pf.get('Notes', '') or '')), key=f"edit_pf_notes_{edit_pf_id}_v1")
+
+                if st.form_submit_button("💾 บันทึกการแก้ไข"):
+                    edit_changes = {col: value for col, value in edit_changes.items() if value != edit_pf_shown.get(col)} # Fields the user actually changed
+                    updated_pf_cols = update_portfolio_in_gsheets(edit_pf_id, edit_changes, df_portfolios_gs) if edit_changes else [] # Only the changed cells are written
+                    if updated_pf_cols:
+                        st.success(f"แก้ไขพอร์ต '{edit_pf_name}' สำเร็จ: {', '.join(updated_pf_cols)}")
+                        st.rerun()
+                    elif updated_pf_cols is not None:
+                        st.info("ไม่มีค่าที่เปลี่ยนแปลง")
+        else:
+            st.info("ยังไม่มีพอร์ตให้แก้ไข")
 
-    st.markdown("---")
-    st.subheader("➕ เพิ่มพอร์ตใหม่")
+        st.markdown("---")
+        st.subheader("➕ เพิ่มพอร์ตใหม่")
 
-    # --- Selectbox for Program Type (OUTSIDE THE FORM for immediate UI update) ---
-    program_type_options_outside = ["", "Personal Account", "Prop Firm Challenge", "Funded Account", "Trading Competition"]
+        # --- Selectbox for Program Type (OUTSIDE THE FORM for immediate UI update) ---
+        program_type_options_outside = ["", "Personal Account", "Prop Firm Challenge", "Funded Account", "Trading Competition"]
     
-    if 'exp_pf_type_select_v8_key' not in st.session_state: 
-        st.session_state.exp_pf_type_select_v8_key = ""
-
-    # Callback function for the program type selectbox
-    # def on_program_type_change_v8(): # Defined globally above the expander now
-    #    st.session_state.exp_pf_type_select_v8_key = st.session_state.exp_pf_type_selector_widget_v8
-
-    # The selectbox that controls the conditional UI
-    st.selectbox(
-        "ประเภทพอร์ต (Program Type)*", 
-        options=program_type_options_outside, 
-        index=program_type_options_outside.index(st.session_state.exp_pf_type_select_v8_key), 
-        key="exp_pf_type_selector_widget_v8", 
-        on_change=on_program_type_change_v8 
-    )
+        if 'exp_pf_type_select_v8_key' not in st.session_state: 
+            st.session_state.exp_pf_type_select_v8_key = ""
+
+        # Callback function for the program type selectbox
+        # def on_program_type_change_v8(): # Defined globally above the expander now
+        #    st.session_state.exp_pf_type_select_v8_key = st.session_state.exp_pf_type_selector_widget_v8
+
+        # The selectbox that controls the conditional UI
+        st.selectbox(
+            "ประเภทพอร์ต (Program Type)*", 
+            options=program_type_options_outside, 
+            index=program_type_options_outside.index(st.session_state.exp_pf_type_select_v8_key), 
+            key="exp_pf_type_selector_widget_v8", 
+            on_change=on_program_type_change_v8 
+        )
     
-    selected_program_type_to_use_in_form = st.session_state.exp_pf_type_select_v8_key
+        selected_program_type_to_use_in_form = st.session_state.exp_pf_type_select_v8_key
 
-    # DEBUG line, can be commented out or removed in production
-    # st.write(f"**[DEBUG - นอก FORM, หลัง Selectbox] `selected_program_type_to_use_in_form` คือ:** `{selected_program_type_to_use_in_form}`")
+        # DEBUG line, can be commented out or removed in production
+        # st.write(f"**[DEBUG - นอก FORM, หลัง Selectbox] `selected_program_type_to_use_in_form` คือ:** `{selected_program_type_to_use_in_form}`")
 
-    with st.form("new_portfolio_form_main_v8_final", clear_on_submit=True): 
-        st.markdown(f"**กรอกข้อมูลพอร์ต (สำหรับประเภท: {selected_program_type_to_use_in_form if selected_program_type_to_use_in_form else 'ยังไม่ได้เลือก'})**")
+        with st.form("new_portfolio_form_main_v8_final", clear_on_submit=True): 
+            st.markdown(f"**กรอกข้อมูลพอร์ต (สำหรับประเภท: {selected_program_type_to_use_in_form if selected_program_type_to_use_in_form else 'ยังไม่ได้เลือก'})**")
         
-        form_c1_in_form, form_c2_in_form = st.columns(2)
-        with form_c1_in_form:
-            form_new_portfolio_name_in_form = st.text_input("ชื่อพอร์ต (Portfolio Name)*", key="form_pf_name_v8")
-        with form_c2_in_form:
-            form_new_initial_balance_in_form = st.number_input("บาลานซ์เริ่มต้น (Initial Balance)*", min_value=0.01, value=10000.0, format="%.2f", key="form_pf_balance_v8")
+            form_c1_in_form, form_c2_in_form = st.columns(2)
+            with form_c1_in_form:
+                form_new_portfolio_name_in_form = st.text_input("ชื่อพอร์ต (Portfolio Name)*", key="form_pf_name_v8")
+            with form_c2_in_form:
+                form_new_initial_balance_in_form = st.number_input("บาลานซ์เริ่มต้น (Initial Balance)*", min_value=0.01, value=10000.0, format="%.2f", key="form_pf_balance_v8")
         
-        form_status_options_in_form = ["Active", "Inactive", "Pending", "Passed", "Failed"]
-        form_new_status_in_form = st.selectbox("สถานะพอร์ต (Status)*", options=form_status_options_in_form, index=0, key="form_pf_status_v8")
+            form_status_options_in_form = ["Active", "Inactive", "Pending", "Passed", "Failed"]
+            form_new_status_in_form = st.selectbox("สถานะพอร์ต (Status)*", options=form_status_options_in_form, index=0, key="form_pf_status_v8")
         
-        form_new_evaluation_step_val_in_form = "" # Initialize
-        if selected_program_type_to_use_in_form == "Prop Firm Challenge":
-            # DEBUG line
-            # st.write(f"**[DEBUG - ใน FORM, ใน IF Evaluation Step] ประเภทคือ:** `{selected_program_type_to_use_in_form}`")
-            evaluation_step_options_in_form = ["", "Phase 1", "Phase 2", "Phase 3", "Verification"]
-            form_new_evaluation_step_val_in_form = st.selectbox("ขั้นตอนการประเมิน (Evaluation Step)", 
-                                                                options=evaluation_step_options_in_form, index=0, 
-                                                                key="form_pf_eval_step_select_v8")
-
-        # --- Conditional Inputs Defaults ---
-        form_profit_target_val = 8.0; form_daily_loss_val = 5.0; form_total_stopout_val = 10.0; form_leverage_val = 100.0; form_min_days_val = 0
-        form_comp_end_date = None; form_comp_goal_metric = ""
-        form_profit_target_val_comp = 20.0 # Default for competition profit target
-        form_daily_loss_val_comp = 5.0    # Default for competition daily loss
-        form_total_stopout_val_comp = 10.0 # Default for competition total stopout
-
-        form_pers_overall_profit_val = 0.0; form_pers_target_end_date = None; form_pers_weekly_profit_val = 0.0; form_pers_daily_profit_val = 0.0
-        form_pers_max_dd_overall_val = 0.0; form_pers_max_dd_daily_val = 0.0
-        form_enable_scaling_checkbox_val = False; form_scaling_freq_val = "Weekly"; form_su_wr_val = 55.0; form_su_gain_val = 2.0; form_su_inc_val = 0.25
-        form_sd_loss_val = -5.0; form_sd_wr_val = 40.0; form_sd_dec_val = 0.25; form_min_risk_val = 0.25; form_max_risk_val = 2.0; form_current_risk_val = 1.0
-        form_notes_val = ""
-
-        if selected_program_type_to_use_in_form in ["Prop Firm Challenge", "Funded Account"]:
-            st.markdown("**กฎเกณฑ์ Prop Firm/Funded:**")
-            f_pf1, f_pf2, f_pf3 = st.columns(3)
-            with f_pf1: form_profit_target_val = st.number_input("เป้าหมายกำไร %*", value=form_profit_target_val, format="%.1f", key="f_pf_profit_v8")
-            with f_pf2: form_daily_loss_val = st.number_input("จำกัดขาดทุนต่อวัน %*", value=form_daily_loss_val, format="%.1f", key="f_pf_dd_v8")
-            with f_pf3: form_total_stopout_val = st.number_input("จำกัดขาดทุนรวม %*", value=form_total_stopout_val, format="%.1f", key="f_pf_maxdd_v8")
-            f_pf_col1, f_pf_col2 = st.columns(2)
-            with f_pf_col1: form_leverage_val = st.number_input("Leverage", value=form_leverage_val, format="%.0f", key="f_pf_lev_v8")
-            with f_pf_col2: form_min_days_val = st.number_input("จำนวนวันเทรดขั้นต่ำ", value=form_min_days_val, step=1, key="f_pf_mindays_v8")
+            form_new_evaluation_step_val_in_form = "" # Initialize
+            if selected_program_type_to_use_in_form == "Prop Firm Challenge":
+                # DEBUG line
+                # st.write(f"**[DEBUG - ใน FORM, ใน IF Evaluation Step] ประเภทคือ:** `{selected_program_type_to_use_in_form}`")
+                evaluation_step_options_in_form = ["", "Phase 1", "Phase 2", "Phase 3", "Verification"]
+                form_new_evaluation_step_val_in_form = st.selectbox("ขั้นตอนการประเมิน (Evaluation Step)", 
+                                                                    options=evaluation_step_options_in_form, index=0, 
+                                                                    key="form_pf_eval_step_select_v8")
+
+            # --- Conditional Inputs Defaults ---
+            form_profit_target_val = 8.0; form_daily_loss_val = 5.0; form_total_stopout_val = 10.0; form_leverage_val = 100.0; form_min_days_val = 0
+            form_comp_end_date = None; form_comp_goal_metric = ""
+            form_profit_target_val_comp = 20.0 # Default for competition profit target
+            form_daily_loss_val_comp = 5.0    # Default for competition daily loss
+            form_total_stopout_val_comp = 10.0 # Default for competition total stopout
+
+            form_pers_overall_profit_val = 0.0; form_pers_target_end_date = None; form_pers_weekly_profit_val = 0.0; form_pers_daily_profit_val = 0.0
+            form_pers_max_dd_overall_val = 0.0; form_pers_max_dd_daily_val = 0.0
+            form_enable_scaling_checkbox_val = False; form_scaling_freq_val = "Weekly"; form_su_wr_val = 55.0; form_su_gain_val = 2.0; form_su_inc_val = 0.25
+            form_sd_loss_val = -5.0; form_sd_wr_val = 40.0; form_sd_dec_val = 0.25; form_min_risk_val = 0.25; form_max_risk_val = 2.0; form_current_risk_val = 1.0
+            form_notes_val = ""
+
+            if selected_program_type_to_use_in_form in ["Prop Firm Challenge", "Funded Account"]:
+                st.markdown("**กฎเกณฑ์ Prop Firm/Funded:**")
+                f_pf1, f_pf2, f_pf3 = st.columns(3)
+                with f_pf1: form_profit_target_val = st.number_input("เป้าหมายกำไร %*", value=form_profit_target_val, format="%.1f", key="f_pf_profit_v8")
+                with f_pf2: form_daily_loss_val = st.number_input("จำกัดขาดทุนต่อวัน %*", value=form_daily_loss_val, format="%.1f", key="f_pf_dd_v8")
+                with f_pf3: form_total_stopout_val = st.number_input("จำกัดขาดทุนรวม %*", value=form_total_stopout_val, format="%.1f", key="f_pf_maxdd_v8")
+                f_pf_col1, f_pf_col2 = st.columns(2)
+                with f_pf_col1: form_leverage_val = st.number_input("Leverage", value=form_leverage_val, format="%.0f", key="f_pf_lev_v8")
+                with f_pf_col2: form_min_days_val = st.number_input("จำนวนวันเทรดขั้นต่ำ", value=form_min_days_val, step=1, key="f_pf_mindays_v8")
         
-        if selected_program_type_to_use_in_form == "Trading Competition":
-            st.markdown("**ข้อมูลการแข่งขัน:**")
-            f_tc1, f_tc2 = st.columns(2)
-            with f_tc1: 
-                form_comp_end_date = st.date_input("วันสิ้นสุดการแข่งขัน", value=form_comp_end_date, key="f_tc_enddate_v8")
-                form_profit_target_val_comp = st.number_input("เป้าหมายกำไร % (Comp)", value=form_profit_target_val_comp, format="%.1f", key="f_tc_profit_v8") 
-            with f_tc2: 
-                form_comp_goal_metric = st.text_input("ตัวชี้วัดเป้าหมาย (Comp)", value=form_comp_goal_metric, help="เช่น %Gain, ROI", key="f_tc_goalmetric_v8")
-                form_daily_loss_val_comp = st.number_input("จำกัดขาดทุนต่อวัน % (Comp)", value=form_daily_loss_val_comp, format="%.1f", key="f_tc_dd_v8")
-                form_total_stopout_val_comp = st.number_input("จำกัดขาดทุนรวม % (Comp)", value=form_total_stopout_val_comp, format="%.1f", key="f_tc_maxdd_v8")
-
-        if selected_program_type_to_use_in_form == "Personal Account":
-            st.markdown("**เป้าหมายส่วนตัว (Optional):**")
-            f_ps1, f_ps2 = st.columns(2)
-            with f_ps1:
-                form_pers_overall_profit_val = st.number_input("เป้าหมายกำไรโดยรวม ($)", value=form_pers_overall_profit_val, format="%.2f", key="f_ps_profit_overall_v8")
-                form_pers_weekly_profit_val = st.number_input("เป้าหมายกำไรรายสัปดาห์ ($)", value=form_pers_weekly_profit_val, format="%.2f", key="f_ps_profit_weekly_v8")
-                form_pers_max_dd_overall_val = st.number_input("Max DD รวมที่ยอมรับได้ ($)", value=form_pers_max_dd_overall_val, format="%.2f", key="f_ps_dd_overall_v8")
-            with f_ps2:
-                form_pers_target_end_date = st.date_input("วันที่คาดว่าจะถึงเป้าหมายรวม", value=form_pers_target_end_date, key="f_ps_enddate_v8")
-                form_pers_daily_profit_val = st.number_input("เป้าหมายกำไรรายวัน ($)", value=form_pers_daily_profit_val, format="%.2f", key="f_ps_profit_daily_v8")
-                form_pers_max_dd_daily_val = st.number_input("Max DD ต่อวันที่ยอมรับได้ ($)", value=form_pers_max_dd_daily_val, format="%.2f", key="f_ps_dd_daily_v8")
-
-        st.markdown("**การตั้งค่า Scaling Manager (Optional):**")
-        form_enable_scaling_checkbox_val = st.checkbox("เปิดใช้งาน Scaling Manager?", value=form_enable_scaling_checkbox_val, key="f_scale_enable_v8")
-        if form_enable_scaling_checkbox_val:
-            f_sc1, f_sc2, f_sc3 = st.columns(3)
-            with f_sc1:
-                form_scaling_freq_val = st.selectbox("ความถี่ตรวจสอบ Scaling", ["Weekly", "Monthly"], index=["Weekly", "Monthly"].index(form_scaling_freq_val), key="f_scale_freq_v8")
-                form_su_wr_val = st.number_input("Scale Up: Min Winrate %", value=form_su_wr_val, format="%.1f", key="f_scale_su_wr_v8")
-                form_sd_loss_val = st.number_input("Scale Down: Max Loss %", value=form_sd_loss_val, format="%.1f", key="f_scale_sd_loss_v8") # Usually a negative value
-            with f_sc2:
-                form_min_risk_val = st.number_input("Min Risk % Allowed", value=form_min_risk_val, format="%.2f", key="f_scale_min_risk_v8")
-                form_su_gain_val = st.number_input("Scale Up: Min Gain %", value=form_su_gain_val, format="%.1f", key="f_scale_su_gain_v8")
-                form_sd_wr_val = st.number_input("Scale Down: Low Winrate %", value=form_sd_wr_val, format="%.1f", key="f_scale_sd_wr_v8")
-            with f_sc3:
-                form_max_risk_val = st.number_input("Max Risk % Allowed", value=form_max_risk_val, format="%.2f", key="f_scale_max_risk_v8")
-                form_su_inc_val = st.number_input("Scale Up: Risk Increment %", value=form_su_inc_val, format="%.2f", key="f_scale_su_inc_v8")
-                form_sd_dec_val = st.number_input("Scale Down: Risk Decrement %", value=form_sd_dec_val, format="%.2f", key="f_scale_sd_dec_v8")
-            form_current_risk_val = st.number_input("Current Risk % (สำหรับ Scaling)", value=form_current_risk_val, format="%.2f", key="f_scale_current_risk_v8")
-
-        form_notes_val = st.text_area("หมายเหตุเพิ่มเติม (Notes)", value=form_notes_val, key="f_pf_notes_v8")
-
-        submitted_add_portfolio_in_form = st.form_submit_button("💾 บันทึกพอร์ตใหม่")
+            if selected_program_type_to_use_in_form == "Trading Competition":
+                st.markdown("**ข้อมูลการแข่งขัน:**")
+                f_tc1, f_tc2 = st.columns(2)
+                with f_tc1: 
+                    form_comp_end_date = st.date_input("วันสิ้นสุดการแข่งขัน", value=form_comp_end_date, key="f_tc_enddate_v8")
+                    form_profit_target_val_comp = st.number_input("เป้าหมายกำไร % (Comp)", value=form_profit_target_val_comp, format="%.1f", key="f_tc_profit_v8") 
+                with f_tc2: 
+                    form_comp_goal_metric = st.text_input("ตัวชี้วัดเป้าหมาย (Comp)", value=form_comp_goal_metric, help="เช่น %Gain, ROI", key="f_tc_goalmetric_v8")
+                    form_daily_loss_val_comp = st.number_input("จำกัดขาดทุนต่อวัน % (Comp)", value=form_daily_loss_val_comp, format="%.1f", key="f_tc_dd_v8")
+                    form_total_stopout_val_comp = st.number_input("จำกัดขาดทุนรวม % (Comp)", value=form_total_stopout_val_comp, format="%.1f", key="f_tc_maxdd_v8")
+
+            if selected_program_type_to_use_in_form == "Personal Account":
+                st.markdown("**เป้าหมายส่วนตัว (Optional):**")
+                f_ps1, f_ps2 = st.columns(2)
+                with f_ps1:
+                    form_pers_overall_profit_val = st.number_input("เป้าหมายกำไรโดยรวม ($)", value=form_pers_overall_profit_val, format="%.2f", key="f_ps_profit_overall_v8")
+                    form_pers_weekly_profit_val = st.number_input("เป้าหมายกำไรรายสัปดาห์ ($)", value=form_pers_weekly_profit_val, format="%.2f", key="f_ps_profit_weekly_v8")
+                    form_pers_max_dd_overall_val = st.number_input("Max DD รวมที่ยอมรับได้ ($)", value=form_pers_max_dd_overall_val, format="%.2f", key="f_ps_dd_overall_v8")
+                with f_ps2:
+                    form_pers_target_end_date = st.date_input("วันที่คาดว่าจะถึงเป้าหมายรวม", value=form_pers_target_end_date, key="f_ps_enddate_v8")
+                    form_pers_daily_profit_val = st.number_input("เป้าหมายกำไรรายวัน ($)", value=form_pers_daily_profit_val, format="%.2f", key="f_ps_profit_daily_v8")
+                    form_pers_max_dd_daily_val = st.number_input("Max DD ต่อวันที่ยอมรับได้ ($)", value=form_pers_max_dd_daily_val, format="%.2f", key="f_ps_dd_daily_v8")
+
+            st.markdown("**การตั้งค่า Scaling Manager (Optional):**")
+            form_enable_scaling_checkbox_val = st.checkbox("เปิดใช้งาน Scaling Manager?", value=form_enable_scaling_checkbox_val, key="f_scale_enable_v8")
+            if form_enable_scaling_checkbox_val:
+                f_sc1, f_sc2, f_sc3 = st.columns(3)
+                with f_sc1:
+                    form_scaling_freq_val = st.selectbox("ความถี่ตรวจสอบ Scaling", ["Weekly", "Monthly"], index=["Weekly", "Monthly"].index(form_scaling_freq_val), key="f_scale_freq_v8")
+                    form_su_wr_val = st.number_input("Scale Up: Min Winrate %", value=form_su_wr_val, format="%.1f", key="f_scale_su_wr_v8")
+                    form_sd_loss_val = st.number_input("Scale Down: Max Loss %", value=form_sd_loss_val, format="%.1f", key="f_scale_sd_loss_v8") # Usually a negative value
+                with f_sc2:
+                    form_min_risk_val = st.number_input("Min Risk % Allowed", value=form_min_risk_val, format="%.2f", key="f_scale_min_risk_v8")
+                    form_su_gain_val = st.number_input("Scale Up: Min Gain %", value=form_su_gain_val, format="%.1f", key="f_scale_su_gain_v8")
+                    form_sd_wr_val = st.number_input("Scale Down: Low Winrate %", value=form_sd_wr_val, format="%.1f", key="f_scale_sd_wr_v8")
+                with f_sc3:
+                    form_max_risk_val = st.number_input("Max Risk % Allowed", value=form_max_risk_val, format="%.2f", key="f_scale_max_risk_v8")
+                    form_su_inc_val = st.number_input("Scale Up: Risk Increment %", value=form_su_inc_val, format="%.2f", key="f_scale_su_inc_v8")
+                    form_sd_dec_val = st.number_input("Scale Down: Risk Decrement %", value=form_sd_dec_val, format="%.2f", key="f_scale_sd_dec_v8")
+                form_current_risk_val = st.number_input("Current Risk % (สำหรับ Scaling)", value=form_current_risk_val, format="%.2f", key="f_scale_current_risk_v8")
+
+            form_notes_val = st.text_area("หมายเหตุเพิ่มเติม (Notes)", value=form_notes_val, key="f_pf_notes_v8")
+
+            submitted_add_portfolio_in_form = st.form_submit_button("💾 บันทึกพอร์ตใหม่")
         
-        if submitted_add_portfolio_in_form:
-            # Validation
-            if not form_new_portfolio_name_in_form or not selected_program_type_to_use_in_form or not form_new_status_in_form or form_new_initial_balance_in_form <= 0:
-                st.warning("กรุณากรอกข้อมูลที่จำเป็น (*) ให้ครบถ้วนและถูกต้อง: ชื่อพอร์ต, ประเภทพอร์ต, สถานะพอร์ต, และยอดเงินเริ่มต้นต้องมากกว่า 0")
-            elif not df_portfolios_gs.empty and form_new_portfolio_name_in_form in df_portfolios_gs['PortfolioName'].astype(str).values: # Check against loaded portfolios
-                st.error(f"ชื่อพอร์ต '{form_new_portfolio_name_in_form}' มีอยู่แล้ว กรุณาใช้ชื่ออื่น")
-            else:
-                new_id_value = str(uuid.uuid4())
+            if submitted_add_portfolio_in_form:
+                # Validation
+                if not form_new_portfolio_name_in_form or not selected_program_type_to_use_in_form or not form_new_status_in_form or form_new_initial_balance_in_form <= 0:
+                    st.warning("กรุณากรอกข้อมูลที่จำเป็น (*) ให้ครบถ้วนและถูกต้อง: ชื่อพอร์ต, ประเภทพอร์ต, สถานะพอร์ต, และยอดเงินเริ่มต้นต้องมากกว่า 0")
+                elif not df_portfolios_gs.empty and form_new_portfolio_name_in_form in df_portfolios_gs['PortfolioName'].astype(str).values: # Check against loaded portfolios
+                    st.error(f"ชื่อพอร์ต '{form_new_portfolio_name_in_form}' มีอยู่แล้ว กรุณาใช้ชื่ออื่น")
+                else:
+                    new_id_value = str(uuid.uuid4())
                 
-                data_to_save = {
-                    'PortfolioID': new_id_value,
-                    'PortfolioName': form_new_portfolio_name_in_form, 
-                    'ProgramType': selected_program_type_to_use_in_form,
-                    'EvaluationStep': form_new_evaluation_step_val_in_form if selected_program_type_to_use_in_form == "Prop Firm Challenge" else "", 
-                    'Status': form_new_status_in_form,
-                    'InitialBalance': form_new_initial_balance_in_form, 
-                    'CreationDate': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'Notes': form_notes_val
-                }
-
-                if selected_program_type_to_use_in_form in ["Prop Firm Challenge", "Funded Account"]:
-                    data_to_save.update({
-                        'ProfitTargetPercent': form_profit_target_val,
-                        'DailyLossLimitPercent': form_daily_loss_val,
-                        'TotalStopoutPercent': form_total_stopout_val,
-                        'Leverage': form_leverage_val,
-                        'MinTradingDays': form_min_days_val
-                    })
+                    data_to_save = {
+                        'PortfolioID': new_id_value,
+                        'PortfolioName': form_new_portfolio_name_in_form, 
+                        'ProgramType': selected_program_type_to_use_in_form,
+                        'EvaluationStep': form_new_evaluation_step_val_in_form if selected_program_type_to_use_in_form == "Prop Firm Challenge" else "", 
+                        'Status': form_new_status_in_form,
+                        'InitialBalance': form_new_initial_balance_in_form, 
+                        'CreationDate': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        'Notes': form_notes_val
+                    }
+
+                    if selected_program_type_to_use_in_form in ["Prop Firm Challenge", "Funded Account"]:
+                        data_to_save.update({
+                            'ProfitTargetPercent': form_profit_target_val,
+                            'DailyLossLimitPercent': form_daily_loss_val,
+                            'TotalStopoutPercent': form_total_stopout_val,
+                            'Leverage': form_leverage_val,
+                            'MinTradingDays': form_min_days_val
+                        })
                 
-                if selected_program_type_to_use_in_form == "Trading Competition":
-                    data_to_save.update({
-                        'CompetitionEndDate': form_comp_end_date.strftime("%Y-%m-%d") if form_comp_end_date else None,
-                        'CompetitionGoalMetric': form_comp_goal_metric,
-                        'ProfitTargetPercent': form_profit_target_val_comp, 
-                        'DailyLossLimitPercent': form_daily_loss_val_comp,
-                        'TotalStopoutPercent': form_total_stopout_val_comp
-                    })
-
-                if selected_program_type_to_use_in_form == "Personal Account":
-                    data_to_save.update({
-                        'OverallProfitTarget': form_pers_overall_profit_val,
-                        'TargetEndDate': form_pers_target_end_date.strftime("%Y-%m-%d") if form_pers_target_end_date else None,
-                        'WeeklyProfitTarget': form_pers_weekly_profit_val,
-                        'DailyProfitTarget': form_pers_daily_profit_val,
-                        'MaxAcceptableDrawdownOverall': form_pers_max_dd_overall_val,
-                        'MaxAcceptableDrawdownDaily': form_pers_max_dd_daily_val
-                    })
-
-                if form_enable_scaling_checkbox_val:
-                    data_to_save.update({
-                        'EnableScaling': True,
-                        'ScalingCheckFrequency': form_scaling_freq_val,
-                        'ScaleUp_MinWinRate': form_su_wr_val,
-                        'ScaleUp_MinGainPercent': form_su_gain_val,
-                        'ScaleUp_RiskIncrementPercent': form_su_inc_val,
-                        'ScaleDown_MaxLossPercent': form_sd_loss_val,
-                        'ScaleDown_LowWinRate': form_sd_wr_val,
-                        'ScaleDown_RiskDecrementPercent': form_sd_dec_val,
-                        'MinRiskPercentAllowed': form_min_risk_val,
-                        'MaxRiskPercentAllowed': form_max_risk_val,
-                        'CurrentRiskPercent': form_current_risk_val
-                    })
-                else:
-                    data_to_save['EnableScaling'] = False
-                    # Set other scaling fields to None or default empty if scaling is disabled
-                    # This ensures that if a user disables scaling later, old values are not mistakenly kept active
-                    # However, the provided GSheet headers expect values or blanks.
-                    # For boolean, False is fine. For others, blank or a defined "not set" value.
-                    # The save_new_portfolio_to_gsheets handles .get(header, "") which results in blanks.
-                    data_to_save['CurrentRiskPercent'] = form_current_risk_val # Still save current risk if entered, even if scaling disabled
-
-                success_save = save_new_portfolio_to_gsheets(data_to_save) 
+                    if selected_program_type_to_use_in_form == "Trading Competition":
+                        data_to_save.update({
+                            'CompetitionEndDate': form_comp_end_date.strftime("%Y-%m-%d") if form_comp_end_date else None,
+                            'CompetitionGoalMetric': form_comp_goal_metric,
+                            'ProfitTargetPercent': form_profit_target_val_comp, 
+                            'DailyLossLimitPercent': form_daily_loss_val_comp,
+                            'TotalStopoutPercent': form_total_stopout_val_comp
+                        })
+
+                    if selected_program_type_to_use_in_form == "Personal Account":
+                        data_to_save.update({
+                            'OverallProfitTarget': form_pers_overall_profit_val,
+                            'TargetEndDate': form_pers_target_end_date.strftime("%Y-%m-%d") if form_pers_target_end_date else None,
+                            'WeeklyProfitTarget': form_pers_weekly_profit_val,
+                            'DailyProfitTarget': form_pers_daily_profit_val,
+                            'MaxAcceptableDrawdownOverall': form_pers_max_dd_overall_val,
+                            'MaxAcceptableDrawdownDaily': form_pers_max_dd_daily_val
+                        })
+
+                    if form_enable_scaling_checkbox_val:
+                        data_to_save.update({
+                            'EnableScaling': True,
+                            'ScalingCheckFrequency': form_scaling_freq_val,
+                            'ScaleUp_MinWinRate': form_su_wr_val,
+                            'ScaleUp_MinGainPercent': form_su_gain_val,
+                            'ScaleUp_RiskIncrementPercent': form_su_inc_val,
+                            'ScaleDown_MaxLossPercent': form_sd_loss_val,
+                            'ScaleDown_LowWinRate': form_sd_wr_val,
+                            'ScaleDown_RiskDecrementPercent': form_sd_dec_val,
+                            'MinRiskPercentAllowed': form_min_risk_val,
+                            'MaxRiskPercentAllowed': form_max_risk_val,
+                            'CurrentRiskPercent': form_current_risk_val
+                        })
+                    else:
+                        data_to_save['EnableScaling'] = False
+                        # Set other scaling fields to None or default empty if scaling is disabled
+                        # This ensures that if a user disables scaling later, old values are not mistakenly kept active
+                        # However, the provided GSheet headers expect values or blanks.
+                        # For boolean, False is fine. For others, blank or a defined "not set" value.
+                        # The save_new_portfolio_to_gsheets handles .get(header, "") which results in blanks.
+                        data_to_save['CurrentRiskPercent'] = form_current_risk_val # Still save current risk if entered, even if scaling disabled
+
+                    success_save = save_new_portfolio_to_gsheets(data_to_save) 
                 
-                if success_save:
-                    st.success(f"เพิ่มพอร์ต '{form_new_portfolio_name_in_form}' (ID: {new_id_value}) สำเร็จ!")
-                    st.session_state.exp_pf_type_select_v8_key = "" # Reset selectboxนอกฟอร์ม
-                    if hasattr(load_portfolios_from_gsheets, 'clear'): # Clear cache for portfolio list
-                         load_portfolios_from_gsheets.clear()
-                    st.rerun()
-                else:
-                    st.error("เกิดข้อผิดพลาดในการบันทึกพอร์ตใหม่ไปยัง Google Sheets")
+                    if success_save:
+                        st.success(f"เพิ่มพอร์ต '{form_new_portfolio_name_in_form}' (ID: {new_id_value}) สำเร็จ!")
+                        st.session_state.exp_pf_type_select_v8_key = "" # Reset selectboxนอกฟอร์ม
+                        if hasattr(load_portfolios_from_gsheets, 'clear'): # Clear cache for portfolio list
+                             load_portfolios_from_gsheets.clear()
+                        st.rerun()
+                    else:
+                        st.error("เกิดข้อผิดพลาดในการบันทึกพอร์ตใหม่ไปยัง Google Sheets")
 
 # ==============================================================================
 # END: ส่วนจัดการ Portfolio (SEC 1.5)
 # ==============================================================================
 
+# ===================== SEC 1.6: PORTFOLIO OVERVIEW (Main Area) =======================
+mark_startup_section("SEC 1.6")
+# Every portfolio in one table (PART 1.21); computed only while the expander is open
+portfolio_overview_expander = st.expander("📊 ภาพรวมทุกพอร์ต (Portfolio Overview)", expanded=False, key="portfolio_overview_expander_v1", on_change="rerun")
+if portfolio_overview_expander.open:
+    with portfolio_overview_expander:
+        df_portfolio_overview = load_portfolio_overview(datetime.now().strftime("%Y-%m-%d")) # Cached per day
+        if df_portfolio_overview.empty:
+            st.info("ยังไม่มีข้อมูลพอร์ต")
+        else:
+            overview_alert_counts = df_portfolio_overview['Alert'].value_counts()
+            ov_col1, ov_col2, ov_col3, ov_col4 = st.columns(4)
+            ov_col1.metric("พอร์ตทั้งหมด", f"{len(df_portfolio_overview):,}")
+            ov_col2.metric("Equity รวม", f"{df_portfolio_overview['Equity'].sum():,.2f}")
+            ov_col3.metric("P/L วันนี้ (รวม)", f"{df_portfolio_overview['TodayPL'].sum():,.2f}")
+            ov_col4.metric("เกิน / ใกล้ลิมิต", f"{overview_alert_counts.get(PORTFOLIO_ALERT_LEVELS[0], 0)} / {overview_alert_counts.get(PORTFOLIO_ALERT_LEVELS[1], 0)}")
+            st.dataframe(
+                df_portfolio_overview.sort_values(['Alert', 'PortfolioName'], key=lambda col: col.map(PORTFOLIO_ALERT_LEVELS.index) if col.name == 'Alert' else col),
+                hide_index=True, use_container_width=True,
+                column_order=['Alert', 'PortfolioName', 'ProgramType', 'Status', 'Equity', 'EquitySource', 'TodayPL', 'DailyLimitUsage',
+                              'StopoutUsage', 'TargetProgress', 'GainPct', 'MaxDrawdownPct', 'Deals'],
+                column_config={
+                    'Alert': st.column_config.TextColumn("สถานะ"), 'PortfolioName': st.column_config.TextColumn("พอร์ต"),
+                    'Equity': st.column_config.NumberColumn("Equity", format="%.2f"), 'EquitySource': st.column_config.TextColumn("ที่มา Equity"),
+                    'TodayPL': st.column_config.NumberColumn("P/L วันนี้", format="%.2f"),
+                    'DailyLimitUsage': st.column_config.ProgressColumn("ใช้ Daily Loss Limit", format="%.0f%%", min_value=0, max_value=100),
+                    'StopoutUsage': st.column_config.ProgressColumn("ใช้ Total Stopout", format="%.0f%%", min_value=0, max_value=100),
+                    'TargetProgress': st.column_config.ProgressColumn("ความคืบหน้าเป้ากำไร", format="%.0f%%", min_value=0, max_value=100),
+                    'GainPct': st.column_config.NumberColumn("กำไร %", format="%.2f%%"), 'MaxDrawdownPct': st.column_config.NumberColumn("Max DD %", format="%.2f%%")
+                }
+            )
+            st.caption(f"Daily Loss / Total Stopout คิดเป็น % ของ InitialBalance | 🟠 = ใช้ลิมิตไปแล้ว ≥ {PORTFOLIO_NEAR_LIMIT_USAGE:.0f}% | Equity จาก Statement ล่าสุด ถ้าไม่มีใช้ InitialBalance + P/L จาก Deals")
+
+# ===================== SEC 1.7: PROP-FIRM RULES (Main Area) =======================
+mark_startup_section("SEC 1.7")
+# Every portfolio's firm rules from the incremental rule state (PART 1.23); computed only while the expander is open
+prop_rules_expander = st.expander("🛡️ กฎ Prop Firm (ทุกพอร์ต)", expanded=False, key="prop_rules_expander_v1", on_change="rerun")
+if prop_rules_expander.open:
+    with prop_rules_expander:
+        if st.session_state.get('prop_rule_state_v1') is None:
+            st.session_state.prop_rule_state_v1 = _new_prop_rule_state()
+        update_prop_rule_state(st.session_state.prop_rule_state_v1, load_actual_trades_from_gsheets(), load_statement_summaries_from_gsheets())
+        df_all_rules = evaluate_all_prop_firm_rules(st.session_state.prop_rule_state_v1, df_portfolios_gs)
+        if df_all_rules.empty:
+            st.info("ยังไม่มีพอร์ตที่ตั้งค่ากฎ (Daily Loss / Total Stopout / Profit Target / Min Trading Days / End Date)")
+        else:
+            rule_status_counts = df_all_rules['Status'].value_counts()
+            st.caption(f"🚨 ผิดกฎ {rule_status_counts.get('Breach', 0)} | ⚠️ ใกล้ผิดกฎ {rule_status_counts.get('Near', 0)} | Daily Loss / Max Loss คิดเป็น % ของ InitialBalance, ใกล้ = ใช้ไปแล้ว ≥ {PORTFOLIO_NEAR_LIMIT_USAGE:.0f}%")
+            if st.toggle("แสดงเฉพาะที่ผิดกฎ / ใกล้ผิดกฎ", value=False, key="prop_rules_alerts_only_v1"):
+                df_all_rules = df_all_rules[df_all_rules['Status'].isin(["Breach", "Near"])]
+            st.dataframe(df_all_rules, hide_index=True, use_container_width=True,
+                         column_order=['Status', 'PortfolioName', 'Rule', 'Detail', 'Usage', 'Value', 'Limit'],
+                         column_config={'Usage': st.column_config.ProgressColumn("ใช้ไป / คืบหน้า", format="%.0f%%", min_value=0, max_value=100),
+                                        'Value': st.column_config.NumberColumn("ค่า", format="%.2f"), 'Limit': st.column_config.NumberColumn("ลิมิต / เป้า", format="%.2f")})
+
 # ===================== SEC 2: COMMON INPUTS, BALANCE DISPLAY & MODE SELECTION (Sidebar) =======================
+mark_startup_section("SEC 2")
 # --- Determine active_balance_to_use and initial_risk_pct_from_portfolio ---
 # This logic prioritizes:
 # 1. Equity from the latest uploaded statement.
@@ -962,6 +3242,7 @@ if st.sidebar.button("🔄 Reset Form & Inputs"):
 # ============== PART 1.6: GENERAL UTILITY FUNCTIONS (หรือส่วนอื่นๆ ที่อยู่ด้านบนของไฟล์) ==============
 # (ฟังก์ชันอื่นๆ เช่น get_today_drawdown, get_performance, save_plan_to_gsheets, save_new_portfolio_to_gsheets จะอยู่ที่นี่)
 
+@profile_call("parse")
 def extract_data_from_report_content_sec6(file_content_str_input):
     extracted_data = {'deals': pd.DataFrame(), 'orders': pd.DataFrame(), 'positions': pd.DataFrame(), 'balance_summary': {}, 'results_summary': {}}
     def safe_float_convert(value_str):
@@ -1112,57 +3393,7 @@ def extract_data_from_report_content_sec6(file_content_str_input):
     extracted_data['results_summary'] = results_summary_dict
     return extracted_data
 
-def save_transactional_data_to_gsheets_sec6(ws, df_input, unique_id_col, expected_headers_with_portfolio, data_type_name, portfolio_id, portfolio_name, source_file_name="N/A", import_batch_id="N/A"):
-    if df_input is None or df_input.empty: return True, 0, 0
-    try:
-        if ws is None: return False, 0, 0
-        current_headers = []; header_check_successful = False
-        if ws.row_count > 0:
-            try: current_headers = ws.row_values(1); header_check_successful = True
-            except Exception: pass
-        if not header_check_successful or not current_headers or all(h == "" for h in current_headers) or set(current_headers) != set(expected_headers_with_portfolio):
-            try: ws.update([expected_headers_with_portfolio], value_input_option='USER_ENTERED')
-            except Exception: return False, 0, 0
-        existing_ids = set()
-        if ws.row_count > 1:
-            try:
-                all_sheet_records = ws.get_all_records(expected_headers=expected_headers_with_portfolio, numericise_ignore=['all'])
-                if all_sheet_records:
-                    df_existing_sheet_data = pd.DataFrame(all_sheet_records)
-                    if 'PortfolioID' in df_existing_sheet_data.columns and unique_id_col in df_existing_sheet_data.columns:
-                        df_existing_sheet_data['PortfolioID'] = df_existing_sheet_data['PortfolioID'].astype(str)
-                        df_portfolio_data = df_existing_sheet_data[df_existing_sheet_data['PortfolioID'] == str(portfolio_id)]
-                        if not df_portfolio_data.empty: existing_ids = set(df_portfolio_data[unique_id_col].astype(str).str.strip().tolist())
-            except Exception as e_get_existing_ids: print(f"Warning ({data_type_name}): Could not get existing IDs from '{ws.title}'. Deduplication incomplete: {e_get_existing_ids}")
-        df_to_check = df_input.copy()
-        if unique_id_col not in df_to_check.columns: new_df = df_to_check
-        else:
-            df_to_check[unique_id_col] = df_to_check[unique_id_col].astype(str).str.strip()
-            new_df = df_to_check[~df_to_check[unique_id_col].isin(existing_ids)]
-        num_new = len(new_df); num_duplicates_skipped = len(df_to_check) - num_new
-        if new_df.empty: return True, num_new, num_duplicates_skipped
-        new_df_to_save = new_df.copy(); new_df_to_save["PortfolioID"] = str(portfolio_id); new_df_to_save["PortfolioName"] = str(portfolio_name); new_df_to_save["SourceFile"] = str(source_file_name); new_df_to_save["ImportBatchID"] = str(import_batch_id)
-        final_df_for_append = pd.DataFrame(columns=expected_headers_with_portfolio)
-        for col_h in expected_headers_with_portfolio:
-            if col_h in new_df_to_save.columns: final_df_for_append[col_h] = new_df_to_save[col_h]
-            else: final_df_for_append[col_h] = ""
-        list_of_lists = final_df_for_append.astype(str).replace('nan', '').replace('None','').fillna("").values.tolist()
-        if list_of_lists: ws.append_rows(list_of_lists, value_input_option='USER_ENTERED')
-        return True, num_new, num_duplicates_skipped
-    except Exception as e_save_trans: print(f"Error saving {data_type_name} to GSheets: {e_save_trans}"); return False, 0, 0
-
-def save_deals_to_actual_trades_sec6(ws, df_deals_input, portfolio_id, portfolio_name, source_file_name="N/A", import_batch_id="N/A"):
-    expected_headers_deals = ["Time_Deal", "Deal_ID", "Symbol_Deal", "Type_Deal", "Direction_Deal", "Volume_Deal", "Price_Deal", "Order_ID_Deal", "Commission_Deal", "Fee_Deal", "Swap_Deal", "Profit_Deal", "Balance_Deal", "Comment_Deal", "PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID"]
-    return save_transactional_data_to_gsheets_sec6(ws, df_deals_input, "Deal_ID", expected_headers_deals, "Deals", portfolio_id, portfolio_name, source_file_name, import_batch_id)
-
-def save_orders_to_gsheets_sec6(ws, df_orders_input, portfolio_id, portfolio_name, source_file_name="N/A", import_batch_id="N/A"):
-    expected_headers_orders = ["Open_Time_Ord", "Order_ID_Ord", "Symbol_Ord", "Type_Ord", "Volume_Ord", "Price_Ord", "S_L_Ord", "T_P_Ord", "Close_Time_Ord", "State_Ord", "Filler_Ord", "Comment_Ord", "PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID"]
-    return save_transactional_data_to_gsheets_sec6(ws, df_orders_input, "Order_ID_Ord", expected_headers_orders, "Orders", portfolio_id, portfolio_name, source_file_name, import_batch_id)
-
-def save_positions_to_gsheets_sec6(ws, df_positions_input, portfolio_id, portfolio_name, source_file_name="N/A", import_batch_id="N/A"):
-    expected_headers_positions = ["Time_Pos", "Position_ID", "Symbol_Pos", "Type_Pos", "Volume_Pos", "Price_Open_Pos", "S_L_Pos", "T_P_Pos", "Time_Close_Pos", "Price_Close_Pos", "Commission_Pos", "Swap_Pos", "Profit_Pos", "PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID"]
-    return save_transactional_data_to_gsheets_sec6(ws, df_positions_input, "Position_ID", expected_headers_positions, "Positions", portfolio_id, portfolio_name, source_file_name, import_batch_id)
-
+@profile_call("save")
 def save_results_summary_to_gsheets_sec6(ws, balance_summary_data, results_summary_data, portfolio_id, portfolio_name, source_file_name="N/A", import_batch_id="N/A"):
     try:
         if ws is None: return False, "Worksheet object is None"
@@ -1204,9 +3435,168 @@ def save_results_summary_to_gsheets_sec6(ws, balance_summary_data, results_summa
         return True, "saved_new"
     except Exception as e_save_summary: print(f"Error saving results summary to GSheet: {e_save_summary}"); return False, f"Exception during save: {e_save_summary}"
 
+# ============== PART 1.25: CHUNKED STATEMENT IMPORT ==============
+# Statements are read line by line and written in bounded chunks instead of one append_rows per table after a full parse.
+# After each committed chunk the batch's UploadHistory Notes get a checkpoint ("Checkpoint:rows=5000;positions=2;..."),
+# so uploading the same file again after a timeout / quota error resumes that ImportBatchID from the last committed chunk.
+# IDs are deduplicated per chunk (existing IDs are read once per table), so a chunk that landed without its checkpoint is
+# not written twice.
+STATEMENT_IMPORT_CHUNK_ROWS = 5000
+STATEMENT_IMPORT_META_COLUMNS = ["PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID"]
+STATEMENT_SECTION_HEADERS = {
+    'positions': "Time,Position,Symbol,Type,Volume,Price,S / L,T / P,Time,Price,Commission,Swap,Profit",
+    'orders': "Open Time,Order,Symbol,Type,Volume,Price,S / L,T / P,Time,State,,Comment",
+    'deals': "Time,Deal,Symbol,Type,Direction,Volume,Price,Order,Commission,Fee,Swap,Profit,Balance,Comment"
+}
+STATEMENT_HEADER_PREFIXES = tuple({header.split(',')[0] for header in STATEMENT_SECTION_HEADERS.values()})
+STATEMENT_IMPORT_TABLES = { # Same columns / IDs as extract_data_from_report_content_sec6
+    'positions': {'worksheet': WORKSHEET_ACTUAL_POSITIONS, 'id_col': "Position_ID", 'label': "Positions",
+                  'columns': ["Time_Pos", "Position_ID", "Symbol_Pos", "Type_Pos", "Volume_Pos", "Price_Open_Pos", "S_L_Pos", "T_P_Pos", "Time_Close_Pos", "Price_Close_Pos", "Commission_Pos", "Swap_Pos", "Profit_Pos"]},
+    'orders': {'worksheet': WORKSHEET_ACTUAL_ORDERS, 'id_col': "Order_ID_Ord", 'label': "Orders",
+               'columns': ["Open_Time_Ord", "Order_ID_Ord", "Symbol_Ord", "Type_Ord", "Volume_Ord", "Price_Ord", "S_L_Ord", "T_P_Ord", "Close_Time_Ord", "State_Ord", "Filler_Ord", "Comment_Ord"]},
+    'deals': {'worksheet': WORKSHEET_ACTUAL_TRADES, 'id_col': "Deal_ID", 'label': "Deals",
+              'columns': ["Time_Deal", "Deal_ID", "Symbol_Deal", "Type_Deal", "Direction_Deal", "Volume_Deal", "Price_Deal", "Order_ID_Deal", "Commission_Deal", "Fee_Deal", "Swap_Deal", "Profit_Deal", "Balance_Deal", "Comment_Deal"]}
+}
+STATEMENT_BALANCE_ROW_TYPES = ['balance', 'credit', 'initial_deposit', 'deposit', 'withdrawal', 'correction']
+STATEMENT_TABLE_END_MARKERS = ("Balance:", "Credit Facility:", "Floating P/L:", "Equity:", "Results", "Total Net Profit:")
+IMPORT_CHECKPOINT_PATTERN = re.compile(r"Checkpoint:([a-z_]+=\d+(?:;[a-z_]+=\d+)*)")
+
+def _iter_statement_lines(content):
+    # Bytes lines split on b"\n" only (like the parser's split('\n')), decoded one by one; content may be a file object
+    if isinstance(content, str): content = content.encode('utf-8')
+    if isinstance(content, (bytes, bytearray)): content = io.BytesIO(content)
+    for raw_line in content:
+        yield raw_line.decode('utf-8', errors='replace') if isinstance(raw_line, bytes) else raw_line
+
+def _statement_chunk_frame(table, data_lines, continues_table=False):
+    # The parser's read_csv call and clean-up, applied to one chunk of a table's rows
+    columns = STATEMENT_IMPORT_TABLES[table]['columns']
+    if continues_table and data_lines and len(data_lines[0].split(',')) > len(columns):
+        # Mid-table, read_csv drops a row with too many fields; as a chunk's first row it would shift every column into the index
+        print(f"Warning: Skipping {table} line with {len(data_lines[0].split(','))} fields (expected {len(columns)}).")
+        data_lines = data_lines[1:]
+    try:
+        with io.StringIO("\n".join(data_lines)) as chunk_buffer: # Closed right away: read_csv's parser keeps a reference cycle to it until the next full GC
+            df_chunk = pd.read_csv(chunk_buffer, header=None, names=columns, skipinitialspace=True, on_bad_lines='warn', engine='python', dtype=str)
+        df_chunk.dropna(how='all', inplace=True)
+        for col in columns:
+            if col not in df_chunk.columns: df_chunk[col] = ""
+        df_chunk = df_chunk[columns]
+        if table == 'deals' and not df_chunk.empty: df_chunk = df_chunk[df_chunk["Symbol_Deal"].astype(str).str.strip() != ""]
+        return df_chunk
+    except Exception as e_chunk:
+        print(f"Warning: Could not parse a {table} chunk of {len(data_lines)} lines: {e_chunk}")
+        return pd.DataFrame(columns=columns)
+
+def iter_statement_chunks_sec6(content, chunk_rows=STATEMENT_IMPORT_CHUNK_ROWS):
+    # Yields (table, DataFrame) chunks of at most chunk_rows rows in file order, then ('summary', {'balance_summary', 'results_summary'}).
+    # Rows follow extract_data_from_report_content_sec6's section and skip rules (for the usual Positions/Orders/Deals order);
+    # the Balance and Results blocks are parsed by that function from the few lines outside the tables.
+    found_tables, current_table, data_lines, other_lines, continues_table = set(), None, [], [], False
+    for line in _iter_statement_lines(content):
+        stripped = line.strip()
+        header_tables = [t for t, header in STATEMENT_SECTION_HEADERS.items() if header in stripped] if stripped.startswith(STATEMENT_HEADER_PREFIXES) else []
+        new_table = next((t for t in header_tables if t not in found_tables), None)
+        ends_table = current_table is not None and (stripped.startswith(STATEMENT_TABLE_END_MARKERS) or any(t != current_table for t in header_tables))
+        if new_table is not None or ends_table:
+            if data_lines:
+                yield current_table, _statement_chunk_frame(current_table, data_lines, continues_table)
+            data_lines, current_table, continues_table = [], new_table, False
+            if new_table is not None:
+                found_tables.add(new_table); continue
+        if current_table is None:
+            other_lines.append(stripped); continue
+        if not stripped: continue # read_csv skips blank lines anyway
+        if current_table == 'deals':
+            cells = [cell.strip() for cell in stripped.split(',')]
+            if (len(cells) > 3 and cells[3].lower() in STATEMENT_BALANCE_ROW_TYPES) or len(cells) < 3 or not cells[0] or not cells[1] or not cells[2]: continue
+        data_lines.append(stripped)
+        if len(data_lines) >= chunk_rows:
+            yield current_table, _statement_chunk_frame(current_table, data_lines, continues_table)
+            data_lines, continues_table = [], True
+    if data_lines:
+        yield current_table, _statement_chunk_frame(current_table, data_lines, continues_table)
+    summary_data = extract_data_from_report_content_sec6("\n".join(other_lines))
+    yield 'summary', {'balance_summary': summary_data['balance_summary'], 'results_summary': summary_data['results_summary']}
+
+def format_import_checkpoint(checkpoint):
+    return "Checkpoint:" + ";".join([f"rows={int(checkpoint.get('rows', STATEMENT_IMPORT_CHUNK_ROWS))}"] + [f"{t}={int(checkpoint.get(t, 0))}" for t in STATEMENT_IMPORT_TABLES])
+
+def parse_import_checkpoint(notes):
+    # {'rows': chunk size, table: chunks committed} from an UploadHistory Notes cell, or None
+    match = IMPORT_CHECKPOINT_PATTERN.search(str(notes or ""))
+    if not match: return None
+    return {key: int(value) for key, value in (item.split('=') for item in match.group(1).split(';')) if key == 'rows' or key in STATEMENT_IMPORT_TABLES}
+
+def find_upload_history_row(ws_history, import_batch_id):
+    # 1-based sheet row of a batch (latest first), read from the ImportBatchID column only
+    batch_ids = ws_history.col_values(8)
+    for row_idx in range(len(batch_ids), 0, -1):
+        if batch_ids[row_idx - 1] == import_batch_id: return row_idx
+    return None
+
+def _prepare_statement_sheet(ws, table, portfolio_id):
+    # Writes the header row if needed and returns the IDs already stored for this portfolio (two column reads, not get_all_records)
+    spec = STATEMENT_IMPORT_TABLES[table]
+    expected_headers = spec['columns'] + STATEMENT_IMPORT_META_COLUMNS
+    current_headers = ws.row_values(1)
+    if not current_headers or all(h == "" for h in current_headers) or set(current_headers) != set(expected_headers):
+        ws.update([expected_headers], value_input_option='USER_ENTERED')
+        current_headers = expected_headers
+    id_values = ws.col_values(current_headers.index(spec['id_col']) + 1)[1:]
+    portfolio_values = ws.col_values(current_headers.index("PortfolioID") + 1)[1:]
+    return {str(row_id).strip() for row_id, row_pid in itertools.zip_longest(id_values, portfolio_values, fillvalue="") if str(row_pid) == str(portfolio_id)}
+
+@profile_call("save")
+def commit_statement_chunk_sec6(ws, df_chunk, table, existing_ids, portfolio_id, portfolio_name, source_file_name="N/A", import_batch_id="N/A"):
+    # Appends the chunk's new rows with one call and returns (num_new, num_duplicates). API errors propagate to the caller
+    spec = STATEMENT_IMPORT_TABLES[table]
+    chunk_ids = df_chunk[spec['id_col']].astype(str).str.strip().tolist()
+    is_new = np.array([row_id not in existing_ids for row_id in chunk_ids], dtype=bool) # Series.isin would copy the whole ID set per chunk
+    df_new = df_chunk[is_new].copy()
+    if df_new.empty: return 0, len(df_chunk)
+    df_new[spec['id_col']] = np.array(chunk_ids, dtype=object)[is_new]
+    df_new["PortfolioID"] = str(portfolio_id); df_new["PortfolioName"] = str(portfolio_name); df_new["SourceFile"] = str(source_file_name); df_new["ImportBatchID"] = str(import_batch_id)
+    df_append = df_new.reindex(columns=spec['columns'] + STATEMENT_IMPORT_META_COLUMNS)
+    ws.append_rows(df_append.astype(str).replace('nan', '').replace('None', '').fillna("").values.tolist(), value_input_option='USER_ENTERED')
+    existing_ids.update(df_new[spec['id_col']])
+    return len(df_new), len(df_chunk) - len(df_new)
+
+def import_statement_chunked_sec6(content, ws_by_table, portfolio_id, portfolio_name, source_file_name, import_batch_id,
+                                  checkpoint=None, save_checkpoint=None, on_chunk=None):
+    # Streams a statement into the Positions / Orders / Deals sheets. checkpoint ({'rows': n, table: chunks committed}) comes
+    # from an earlier run of the same ImportBatchID: those chunks are parsed with the same chunk size but not re-sent.
+    # save_checkpoint(checkpoint) runs after every committed chunk. On a failed write the result's 'error' is set and the
+    # checkpoint still points at the last committed chunk.
+    checkpoint = {'rows': STATEMENT_IMPORT_CHUNK_ROWS, **{t: 0 for t in STATEMENT_IMPORT_TABLES}, **(checkpoint or {})}
+    result = {'tables': {t: {'new': 0, 'skipped': 0, 'resumed': 0, 'chunks': 0} for t in STATEMENT_IMPORT_TABLES},
+              'checkpoint': checkpoint, 'balance_summary': {}, 'results_summary': {}, 'error': None}
+    existing_ids_by_table = {}
+    for table, payload in iter_statement_chunks_sec6(content, checkpoint['rows']):
+        if table == 'summary':
+            result.update(payload); continue
+        table_result = result['tables'][table]
+        chunk_index = table_result['chunks']; table_result['chunks'] += 1
+        if chunk_index < checkpoint[table]:
+            table_result['resumed'] += len(payload); continue
+        try:
+            ws = ws_by_table.get(table)
+            if ws is None: raise ValueError(f"Worksheet '{STATEMENT_IMPORT_TABLES[table]['worksheet']}' is not available")
+            if table not in existing_ids_by_table: existing_ids_by_table[table] = _prepare_statement_sheet(ws, table, portfolio_id)
+            num_new, num_duplicates = commit_statement_chunk_sec6(ws, payload, table, existing_ids_by_table[table], portfolio_id, portfolio_name, source_file_name, import_batch_id)
+        except Exception as e_commit:
+            result['error'] = f"{STATEMENT_IMPORT_TABLES[table]['label']} chunk {chunk_index + 1}: {type(e_commit).__name__} - {str(e_commit)[:200]}"
+            return result
+        table_result['new'] += num_new; table_result['skipped'] += num_duplicates
+        checkpoint[table] = chunk_index + 1
+        if save_checkpoint: save_checkpoint(checkpoint)
+        if on_chunk: on_chunk(table, table_result)
+    return result
+
 # --- END: Helper Functions --- # เปลี่ยนคอมเมนต์ให้ชัดเจนว่าจบส่วนฟังก์ชันผู้ช่วย
 
 # ===================== SEC 2.1: FIBO TRADE DETAILS (Sidebar) =======================
+mark_startup_section("SEC 2.1/2.2") # One if/elif chain across both sections
 # active_balance_to_use and initial_risk_pct_from_portfolio are determined in SEC 2
 
 if st.session_state.get("mode") == "FIBO":
@@ -1403,6 +3793,7 @@ elif st.session_state.get("mode") == "CUSTOM":
     if save_custom_button: st.session_state.save_custom = True
 
 # ===================== SEC 2.3: STRATEGY SUMMARY (Calculations & Display - Sidebar) =======================
+mark_startup_section("SEC 2.3")
 st.sidebar.markdown("---")
 st.sidebar.subheader("🧾 Strategy Summary")
 
@@ -1655,6 +4046,7 @@ else:
         st.sidebar.info("กรอกข้อมูลให้ครบถ้วนและถูกต้อง หรือเลือกเงื่อนไข (เช่น Fibo Levels) เพื่อคำนวณ Summary")
 
 # ===================== SEC 2.4: SCALING MANAGER (Sidebar) =======================
+mark_startup_section("SEC 2.4")
 with st.sidebar.expander("⚖️ Scaling Manager Settings", expanded=False):
     # Default values for scaling parameters
     scaling_step_default_val = 0.25
@@ -1720,31 +4112,21 @@ with st.sidebar.expander("⚖️ Scaling Manager Settings", expanded=False):
     st.session_state.scaling_mode = scaling_mode
 
 # ===================== SEC 2.4.1: SCALING SUGGESTION LOGIC (Sidebar) =======================
+mark_startup_section("SEC 2.4.1")
 # This section generates risk scaling suggestions based on performance.
 # active_balance_to_use and initial_risk_pct_from_portfolio are from SEC 2.
 
 # Load all planned trade logs (uses cache via load_all_planned_trade_logs_from_gsheets)
 df_all_planned_logs = load_all_planned_trade_logs_from_gsheets() 
-
-# Filter logs for the active portfolio, if one is selected
-df_logs_for_scaling_analysis = pd.DataFrame()
 active_portfolio_id_scaling = st.session_state.get('active_portfolio_id_gs', None)
 
-if active_portfolio_id_scaling and not df_all_planned_logs.empty:
-    if 'PortfolioID' in df_all_planned_logs.columns:
-        df_logs_for_scaling_analysis = df_all_planned_logs[
-            df_all_planned_logs['PortfolioID'] == str(active_portfolio_id_scaling)
-        ].copy() # Use .copy() to avoid SettingWithCopyWarning on later modifications
-    else: # Fallback if PortfolioID column is missing (should not happen with correct setup)
-        df_logs_for_scaling_analysis = df_all_planned_logs.copy()
-        print("Warning: Scaling - PortfolioID column not found in planned logs. Using all logs.")
-elif not df_all_planned_logs.empty: # No active portfolio, use all logs for general analysis
-    df_logs_for_scaling_analysis = df_all_planned_logs.copy()
-# If df_all_planned_logs is empty, df_logs_for_scaling_analysis remains empty.
-
-# Get performance metrics (winrate, gain, total trades for the week)
-# The get_performance function uses a copy of the df, so no SettingWithCopyWarning from there.
-winrate_weekly, gain_weekly, total_trades_weekly = get_performance(df_logs_for_scaling_analysis, mode="week")
+# Keep the daily performance aggregates up to date (PART 1.7). Only rows appended since the last rerun are aggregated.
+st.session_state.perf_window_state = update_performance_windows(st.session_state.get('perf_window_state'), df_all_planned_logs)
+
+# Windows are per portfolio; with no active portfolio (or no PortfolioID column) the aggregate over all logs is used
+perf_window_key_scaling = PERF_WINDOW_ALL_KEY
+if active_portfolio_id_scaling and 'PortfolioID' in df_all_planned_logs.columns:
+    perf_window_key_scaling = str(active_portfolio_id_scaling)
 
 # Determine the current risk % being used in the active trade mode (FIBO or CUSTOM)
 current_risk_in_active_mode = initial_risk_pct_from_portfolio # Default from portfolio or global
@@ -1759,36 +4141,50 @@ max_risk_allowed_ui = st.session_state.get('max_risk_pct', 5.0)
 min_risk_allowed_ui = st.session_state.get('min_risk_pct', 0.5)   
 selected_scaling_mode_ui = st.session_state.get('scaling_mode', 'Manual') 
 
-# --- Scaling Suggestion Logic (based on original File1, using portfolio rules if available) ---
-# This part can be enhanced to use detailed scaling rules from st.session_state.current_portfolio_details
-# For now, it uses a simplified version similar to the original code, but with UI-defined step/min/max.
+# --- Scaling Suggestion Logic (PART 1.8: each portfolio's own ScaleUp_/ScaleDown_ rules) ---
+# Every portfolio is scored in the same pass; the active one uses the live risk %, balance and min/max from the sidebar.
+# The UI Scaling Step is only the fallback when the portfolio has no ScaleUp_/ScaleDown_ increments set.
+scaling_fallback_rules = {
+    'ScaleUp_RiskIncrementPercent': scaling_step_ui, 'ScaleDown_RiskDecrementPercent': scaling_step_ui,
+    'MinRiskPercentAllowed': min_risk_allowed_ui, 'MaxRiskPercentAllowed': max_risk_allowed_ui
+}
+scaling_overrides = {perf_window_key_scaling: {
+    'CurrentRiskPercent': current_risk_in_active_mode, 'Balance': current_active_balance_for_summary,
+    'MinRiskPercentAllowed': min_risk_allowed_ui, 'MaxRiskPercentAllowed': max_risk_allowed_ui
+}}
+df_scaling_evaluation = evaluate_scaling_rules(df_portfolios_gs, st.session_state.perf_window_state, overrides=scaling_overrides, fallback_rules=scaling_fallback_rules)
 
 suggested_new_risk = current_risk_in_active_mode 
 scaling_advice_message = f"Risk ปัจจุบัน (โหมด {st.session_state.get('mode')}): {current_risk_in_active_mode:.2f}%. "
 
-if total_trades_weekly > 0: # Only suggest if there's performance data
-    # Define thresholds (can be made dynamic or from portfolio settings later)
-    # Example: ScaleUp_MinWinRate, ScaleUp_MinGainPercent from portfolio
-    #          ScaleDown_MaxLossPercent, ScaleDown_LowWinRate from portfolio
-    
-    # Simplified logic from original code:
-    gain_threshold_for_scaleup = 0.02 * current_active_balance_for_summary # 2% of current balance as gain target for scale-up
-    
-    if winrate_weekly > 55 and gain_weekly > gain_threshold_for_scaleup: # Scale Up condition
-        suggested_new_risk = min(current_risk_in_active_mode + scaling_step_ui, max_risk_allowed_ui)
-        scaling_advice_message += (f"<font color='lightgreen'>ผลงานดีเยี่ยม! (Winrate: {winrate_weekly:.1f}%, กำไรสัปดาห์: {gain_weekly:,.2f} USD)</font><br>"
+scaling_row_active = df_scaling_evaluation.loc[perf_window_key_scaling] if perf_window_key_scaling in df_scaling_evaluation.index else None
+if scaling_row_active is not None and scaling_row_active['Trades'] > 0: # Only suggest if there's performance data
+    scaling_window_label = SCALING_WINDOW_LABELS.get(scaling_row_active['Window'], scaling_row_active['Window'])
+    scaling_perf_text = f"Winrate {scaling_window_label}: {scaling_row_active['WinRate']:.1f}%, กำไร{scaling_window_label}: {scaling_row_active['Gain']:,.2f} USD ({scaling_row_active['GainPercent']:.2f}%)"
+    suggested_new_risk = float(scaling_row_active['SuggestedRiskPercent'])
+
+    if scaling_row_active['Action'] == "up": # Scale Up condition
+        scaling_advice_message += (f"<font color='lightgreen'>ผลงานดีเยี่ยม! ({scaling_perf_text})</font><br>"
                                    f"<b>แนะนำเพิ่ม Risk% เป็น {suggested_new_risk:.2f}%</b>")
-    elif winrate_weekly < 45 or gain_weekly < 0: # Scale Down condition
-        suggested_new_risk = max(current_risk_in_active_mode - scaling_step_ui, min_risk_allowed_ui)
-        scaling_advice_message += (f"<font color='salmon'>ควรพิจารณาลดความเสี่ยง (Winrate: {winrate_weekly:.1f}%, กำไรสัปดาห์: {gain_weekly:,.2f} USD)</font><br>"
+    elif scaling_row_active['Action'] == "down": # Scale Down condition
+        scaling_advice_message += (f"<font color='salmon'>ควรพิจารณาลดความเสี่ยง ({scaling_perf_text})</font><br>"
                                    f"<b>แนะนำลด Risk% เป็น {suggested_new_risk:.2f}%</b>")
     else: # Maintain current risk
-        scaling_advice_message += f"คง Risk% ปัจจุบัน (Winrate สัปดาห์: {winrate_weekly:.1f}%, กำไร: {gain_weekly:,.2f} USD)"
+        scaling_advice_message += f"คง Risk% ปัจจุบัน ({scaling_perf_text})"
 else:
-    scaling_advice_message += "ยังไม่มีข้อมูล Performance เพียงพอในสัปดาห์นี้ (จากแผนเทรด) หรือ Performance อยู่ในเกณฑ์คงที่."
+    scaling_advice_message += "ยังไม่มีข้อมูล Performance เพียงพอในรอบการตรวจสอบนี้ (จากแผนเทรด) หรือ Performance อยู่ในเกณฑ์คงที่."
 
 st.sidebar.markdown(f"<div style='font-size: 0.9em; padding: 8px; border: 1px solid #444; border-radius: 5px;'>{scaling_advice_message}</div>", unsafe_allow_html=True)
 
+# Other horizons come from the same cumulative sums, so showing them costs no extra scan of the log
+horizon_parts_scaling = []
+for horizon_label, horizon_mode in [("วันนี้", "day"), ("เดือนนี้", "month"), ("20 แผนล่าสุด", "trades")]:
+    wr_h, gain_h, n_h = query_performance_window(st.session_state.perf_window_state, perf_window_key_scaling, mode=horizon_mode, n_trades=20)
+    if n_h > 0:
+        horizon_parts_scaling.append(f"{horizon_label}: WR {wr_h:.0f}% / {gain_h:,.0f} USD ({n_h})")
+if horizon_parts_scaling:
+    st.sidebar.caption(" | ".join(horizon_parts_scaling))
+
 
 # --- Apply Suggested Risk (Button for Manual, Auto-apply for Auto) ---
 # Check if suggested_new_risk is meaningfully different from current_risk_in_active_mode
@@ -1799,6 +4195,8 @@ if abs(suggested_new_risk - current_risk_in_active_mode) > 1e-3: # Use a small e
                 st.session_state.risk_pct_fibo_val_v2 = suggested_new_risk 
             elif st.session_state.get("mode") == "CUSTOM":
                 st.session_state.risk_pct_custom_val_v2 = suggested_new_risk
+            if active_portfolio_id_scaling: # Persist to the portfolio row: one cell write (PART 1.24)
+                update_portfolio_in_gsheets(active_portfolio_id_scaling, {'CurrentRiskPercent': round(suggested_new_risk, 4)}, df_portfolios_gs)
             st.toast(f"ปรับ Risk% ในโหมด {st.session_state.get('mode')} เป็น {suggested_new_risk:.2f}% แล้ว", icon="👍")
             st.rerun()
     elif selected_scaling_mode_ui == "Auto":
@@ -1818,10 +4216,13 @@ if abs(suggested_new_risk - current_risk_in_active_mode) > 1e-3: # Use a small e
             session_key_last_auto_risk = f"last_auto_suggested_risk_{st.session_state.get('mode')}"
             if st.session_state.get(session_key_last_auto_risk, current_risk_in_active_mode) != suggested_new_risk: 
                 st.session_state[session_key_last_auto_risk] = suggested_new_risk
+                if active_portfolio_id_scaling:
+                    update_portfolio_in_gsheets(active_portfolio_id_scaling, {'CurrentRiskPercent': round(suggested_new_risk, 4)}, df_portfolios_gs)
                 st.toast(f"Auto Scaling: ปรับ Risk% ของโหมด {st.session_state.get('mode')} เป็น {suggested_new_risk:.2f}%", icon="⚙️")
                 st.rerun()
 
 # ===================== SEC 2.5: SAVE PLAN ACTION & DRAWDOWN LOCK (Sidebar) =======================
+mark_startup_section("SEC 2.5")
 # This section handles saving the calculated plan and checking drawdown limits.
 # `entry_data_for_saving` is populated in SEC 2.3 (Strategy Summary)
 # `current_active_balance_for_summary` (aliased as active_balance_to_use here for consistency with original context)
@@ -1922,6 +4323,7 @@ if save_button_pressed_this_run:
 
 
 # ===================== SEC 3: MAIN AREA - ENTRY PLAN DETAILS TABLE =======================
+mark_startup_section("SEC 3")
 with st.expander("📋 Entry Table (รายละเอียดแผนเทรด)", expanded=True):
     active_mode_display = st.session_state.get("mode")
     
@@ -2004,197 +4406,375 @@ with st.expander("📋 Entry Table (รายละเอียดแผนเ
             st.error(f"เกิดข้อผิดพลาดในการแสดงตารางแผนเทรด: {e_display_plan}")
             print(f"Error displaying entry plan table: {e_display_plan}")
 
+# ===================== SEC 3.1: MAIN AREA - RISK OF RUIN SIMULATION =======================
+mark_startup_section("SEC 3.1")
+# Monte Carlo (PART 1.11) at the plan's current risk % against the active portfolio's limits
+with st.expander("🎲 Risk of Ruin (Monte Carlo)", expanded=False):
+    portfolio_details_mc = st.session_state.get('current_portfolio_details') or {}
+    risk_pct_mc = st.session_state.get('risk_pct_custom_val_v2' if st.session_state.get('mode') == "CUSTOM" else 'risk_pct_fibo_val_v2', DEFAULT_RISK_PERCENT)
+    balance_mc = st.session_state.get('current_account_balance', DEFAULT_ACCOUNT_BALANCE)
+    initial_balance_mc = pd.to_numeric(portfolio_details_mc.get('InitialBalance'), errors='coerce')
+    initial_balance_mc = float(initial_balance_mc) if pd.notna(initial_balance_mc) and initial_balance_mc > 0 else balance_mc
+    daily_limit_mc = float(pd.to_numeric(portfolio_details_mc.get('DailyLossLimitPercent', 0), errors='coerce') or 0)
+    stopout_mc = float(pd.to_numeric(portfolio_details_mc.get('TotalStopoutPercent', 0), errors='coerce') or 0)
+    target_mc = float(pd.to_numeric(portfolio_details_mc.get('ProfitTargetPercent', 0), errors='coerce') or 0)
+
+    st.caption(f"Risk ต่อเทรด: {risk_pct_mc:.2f}% | Balance: {balance_mc:,.2f} | Daily Loss Limit: {daily_limit_mc:.1f}% | Total Stopout: {stopout_mc:.1f}% | Profit Target: {target_mc:.1f}% (จาก InitialBalance {initial_balance_mc:,.2f})")
+    if not portfolio_details_mc:
+        st.info("ยังไม่ได้เลือก Active Portfolio: จะไม่มีการตรวจ Daily Loss / Stopout / Target (นับเฉพาะ Balance เป็นศูนย์)")
+
+    mc_col1, mc_col2, mc_col3 = st.columns(3)
+    with mc_col1:
+        mc_source = st.radio("ที่มาของผลเทรด", ["Bootstrap จาก Deals จริง", "Win Rate / RR"], key="mc_source_v1")
+        mc_win_rate = st.number_input("Win Rate (%)", min_value=0.0, max_value=100.0, value=50.0, step=1.0, key="mc_win_rate_v1", disabled=mc_source.startswith("Bootstrap"))
+        mc_avg_rr = st.number_input("RR", min_value=0.0, value=float(round(summary_avg_rr, 2)) if summary_avg_rr > 0 else 2.0, step=0.1, key="mc_avg_rr_v1", disabled=mc_source.startswith("Bootstrap"))
+        hist_risk_default_mc = pd.to_numeric(portfolio_details_mc.get('CurrentRiskPercent'), errors='coerce')
+        mc_hist_risk_pct = st.number_input("Risk % ต่อเทรดที่ใช้จริงในอดีต", min_value=0.01, max_value=100.0,
+                                           value=float(hist_risk_default_mc) if pd.notna(hist_risk_default_mc) and hist_risk_default_mc > 0 else DEFAULT_RISK_PERCENT,
+                                           step=0.05, format="%.2f", key="mc_hist_risk_pct_v1", disabled=not mc_source.startswith("Bootstrap"),
+                                           help="ใช้แปลง P/L ของแต่ละเทรดจริงเป็น R (P/L ÷ Balance ตอนเข้า × Risk% นี้) แล้วจึงจำลองที่ Risk% ปัจจุบันของแผน")
+    with mc_col2:
+        mc_n_paths = st.number_input("จำนวนเส้นทางจำลอง", min_value=1000, max_value=2_000_000, value=100_000, step=10_000, key="mc_n_paths_v1")
+        mc_n_trades = st.number_input("จำนวนเทรดต่อเส้นทาง", min_value=1, max_value=5000, value=100, step=10, key="mc_n_trades_v1")
+    with mc_col3:
+        mc_trades_per_day = st.number_input("เทรดต่อวัน", min_value=1, max_value=100, value=3, step=1, key="mc_trades_per_day_v1")
+        mc_n_jobs = st.number_input("จำนวน Process", min_value=1, max_value=max(1, multiprocessing.cpu_count()), value=1, step=1, key="mc_n_jobs_v1")
+
+    if st.button("▶️ Run Simulation", key="mc_run_btn_v1"):
+        r_sample_mc = None
+        if mc_source.startswith("Bootstrap"):
+            df_deals_mc = load_actual_trades_from_gsheets()
+            df_trips_mc = load_round_trip_trades_from_gsheets()
+            active_portfolio_id_mc = st.session_state.get('active_portfolio_id_gs')
+            if active_portfolio_id_mc and not df_trips_mc.empty:
+                df_trips_mc = df_trips_mc[df_trips_mc['PortfolioID'].astype(str) == str(active_portfolio_id_mc)]
+            # One R per closed round trip at the risk % actually used then; the simulation re-applies risk_pct_mc
+            r_sample_mc = round_trip_r_multiples(df_trips_mc, df_deals_mc, mc_hist_risk_pct, reference_balance=initial_balance_mc)
+        if r_sample_mc is not None and len(r_sample_mc) == 0:
+            st.warning("ไม่พบเทรดที่ปิดแล้วสำหรับ Bootstrap (ลองนำเข้า Statement หรือใช้ Win Rate / RR แทน)")
+            st.session_state.mc_results_v1 = None
+        else:
+            with st.spinner(f"กำลังจำลอง {int(mc_n_paths):,} เส้นทาง..."):
+                st.session_state.mc_results_v1 = simulate_risk_of_ruin(
+                    risk_pct_mc, balance_mc, initial_balance=initial_balance_mc, r_sample=r_sample_mc, win_rate=mc_win_rate, avg_rr=mc_avg_rr,
+                    daily_loss_limit_pct=daily_limit_mc, total_stopout_pct=stopout_mc, profit_target_pct=target_mc,
+                    n_paths=mc_n_paths, n_trades=mc_n_trades, trades_per_day=mc_trades_per_day, n_jobs=int(mc_n_jobs)
+                )
+
+    mc_results = st.session_state.get('mc_results_v1')
+    if mc_results:
+        mc_m1, mc_m2, mc_m3, mc_m4 = st.columns(4)
+        mc_m1.metric("โอกาสชน Daily Loss", f"{mc_results['prob_daily_breach'] * 100:.2f}%")
+        mc_m2.metric("โอกาสชน Total Stopout", f"{mc_results['prob_total_breach'] * 100:.2f}%")
+        mc_m3.metric("โอกาสผิดกฎรวม", f"{mc_results['prob_any_breach'] * 100:.2f}%")
+        mc_m4.metric("โอกาสถึง Profit Target", f"{mc_results['prob_target'] * 100:.2f}%")
+        df_mc_percentiles = pd.DataFrame({
+            'Max Drawdown %': mc_results['max_dd_pct_percentiles'],
+            'จำนวนเทรดถึง Target': mc_results['target_trades_percentiles'] or {p: np.nan for p in mc_results['max_dd_pct_percentiles']}
+        })
+        df_mc_percentiles.index = [f"P{p}" for p in df_mc_percentiles.index]
+        st.dataframe(df_mc_percentiles.style.format("{:.2f}", na_rep="-"), use_container_width=True)
+        st.caption("ผลตอบแทนสิ้นสุด (P5 / P25 / P50 / P75 / P95): " + " / ".join(f"{v:+.2f}%" for v in mc_results['final_return_pct_percentiles'].values()) +
+                   f" | {mc_results['n_paths']:,} เส้นทาง × {mc_results['n_trades']:,} เทรด ({mc_results['trades_per_day']} เทรด/วัน)")
+
     # ===================== SEC 5: MAIN AREA - AI ASSISTANT =======================
 # This section uses the active_balance_to_use (via current_active_balance_for_summary) for AI simulation.
+mark_startup_section("SEC 5")
 
-with st.expander("🤖 AI Assistant (วิเคราะห์ข้อมูล)", expanded=False): # Default to not expanded
-    active_portfolio_id_for_ai = st.session_state.get('active_portfolio_id_gs', None)
-    active_portfolio_name_for_ai = st.session_state.get('active_portfolio_name_gs', "ทั่วไป (ไม่ได้เลือกพอร์ต)")
+ai_assistant_expander = st.expander("🤖 AI Assistant (วิเคราะห์ข้อมูล)", expanded=False, key="ai_assistant_expander_v1", on_change="rerun") # Default to not expanded
+if ai_assistant_expander.open: # Nothing below is loaded or computed while the expander is collapsed
+    with ai_assistant_expander:
+        active_portfolio_id_for_ai = st.session_state.get('active_portfolio_id_gs', None)
+        active_portfolio_name_for_ai = st.session_state.get('active_portfolio_name_gs', "ทั่วไป (ไม่ได้เลือกพอร์ต)")
     
-    # Use the balance that's currently active for calculations (from SEC 2/2.3)
-    balance_for_ai_simulation = st.session_state.get('current_account_balance', DEFAULT_ACCOUNT_BALANCE) 
+        # Use the balance that's currently active for calculations (from SEC 2/2.3)
+        balance_for_ai_simulation = st.session_state.get('current_account_balance', DEFAULT_ACCOUNT_BALANCE) 
     
-    report_title_suffix_planned_ai = "(จากข้อมูลแผนเทรดทั้งหมด)"
-    report_title_suffix_actual_ai = "(จากข้อมูลผลการเทรดจริงทั้งหมด)"
-
-    if active_portfolio_id_for_ai:
-        report_title_suffix_planned_ai = f"(พอร์ต: '{active_portfolio_name_for_ai}' - จากแผน)"
-        report_title_suffix_actual_ai = f"(พอร์ต: '{active_portfolio_name_for_ai}' - จากผลจริง)"
-        st.info(f"AI Assistant กำลังวิเคราะห์ข้อมูลสำหรับพอร์ต: **'{active_portfolio_name_for_ai}'** (Balance เริ่มต้นจำลอง: {balance_for_ai_simulation:,.2f} USD)")
-    else:
-        st.info(f"AI Assistant กำลังวิเคราะห์ข้อมูลจากแผนเทรดและผลการเทรดจริงทั้งหมด (ยังไม่ได้เลือก Active Portfolio - Balance เริ่มต้นจำลอง: {balance_for_ai_simulation:,.2f} USD)")
+        report_title_suffix_planned_ai = "(จากข้อมูลแผนเทรดทั้งหมด)"
+        report_title_suffix_actual_ai = "(จากข้อมูลผลการเทรดจริงทั้งหมด)"
 
-    # --- Part 1: Analysis from PlannedTradeLogs ---
-    df_ai_planned_logs_all = load_all_planned_trade_logs_from_gsheets() # Cached
-    df_ai_planned_to_analyze = pd.DataFrame()
-    
-    if active_portfolio_id_for_ai and not df_ai_planned_logs_all.empty:
-        if 'PortfolioID' in df_ai_planned_logs_all.columns:
-            df_ai_planned_to_analyze = df_ai_planned_logs_all[df_ai_planned_logs_all['PortfolioID'] == str(active_portfolio_id_for_ai)].copy()
-    elif not df_ai_planned_logs_all.empty: # No active portfolio, use all
-        df_ai_planned_to_analyze = df_ai_planned_logs_all.copy()
-
-    st.markdown(f"### 📝 AI Intelligence Report {report_title_suffix_planned_ai}")
-    if df_ai_planned_to_analyze.empty:
-        if df_ai_planned_logs_all.empty:
-             st.info("ยังไม่มีข้อมูลแผนเทรดใน Log (Google Sheets) สำหรับวิเคราะห์")
-        elif active_portfolio_id_for_ai:
-             st.info(f"ไม่พบข้อมูลแผนเทรดใน Log สำหรับพอร์ต '{active_portfolio_name_for_ai}'.")
-        else: # Should be covered by first case if all logs are empty
-             st.info("ไม่พบข้อมูลแผนเทรดที่ตรงเงื่อนไขสำหรับวิเคราะห์")
-    else: 
-        # Ensure 'Risk $' is numeric, handle missing values for calculations
-        if 'Risk $' in df_ai_planned_to_analyze.columns:
-            df_ai_planned_to_analyze['Risk $'] = pd.to_numeric(df_ai_planned_to_analyze['Risk $'], errors='coerce').fillna(0.0)
-        else: # If 'Risk $' column doesn't exist, create it with zeros to prevent errors
-            df_ai_planned_to_analyze['Risk $'] = 0.0
-            st.warning("AI (Planned): ไม่พบคอลัมน์ 'Risk $' ในข้อมูลแผนเทรด")
-
-        total_trades_ai_planned_val = df_ai_planned_to_analyze.shape[0]
-        win_trades_ai_planned_val = df_ai_planned_to_analyze[df_ai_planned_to_analyze["Risk $"] > 0].shape[0]
-        winrate_ai_planned_val = (100 * win_trades_ai_planned_val / total_trades_ai_planned_val) if total_trades_ai_planned_val > 0 else 0.0
-        gross_profit_ai_planned_val = df_ai_planned_to_analyze["Risk $"].sum()
-        
-        avg_rr_ai_planned_val = None
-        if "RR" in df_ai_planned_to_analyze.columns:
-            rr_series_planned_ai = pd.to_numeric(df_ai_planned_to_analyze["RR"], errors='coerce').dropna()
-            if not rr_series_planned_ai.empty and rr_series_planned_ai.nunique() > 0 : # Check for non-empty and actual values
-                 avg_rr_ai_planned_val = rr_series_planned_ai[rr_series_planned_ai > 0].mean() # Only positive RRs for average
-
-        # Max Drawdown from PLANNED P/L (simulation)
-        max_drawdown_sim_planned = 0.0
-        if not df_ai_planned_to_analyze.empty:
-            current_balance_sim = balance_for_ai_simulation 
-            peak_balance_sim = balance_for_ai_simulation
-            # Sort by Timestamp if available for more realistic drawdown simulation
-            df_dd_calc_planned = df_ai_planned_to_analyze
-            if "Timestamp" in df_dd_calc_planned.columns and pd.api.types.is_datetime64_any_dtype(df_dd_calc_planned['Timestamp']) and not df_dd_calc_planned['Timestamp'].isnull().all():
-                 df_dd_calc_planned = df_dd_calc_planned.sort_values(by="Timestamp")
-            
-            for pnl_planned_val in df_dd_calc_planned["Risk $"]: # Assumes "Risk $" is P/L of the plan
-                current_balance_sim += pnl_planned_val
-                if current_balance_sim > peak_balance_sim: peak_balance_sim = current_balance_sim
-                drawdown_val = peak_balance_sim - current_balance_sim
-                if drawdown_val > max_drawdown_sim_planned: max_drawdown_sim_planned = drawdown_val
-        
-        # Best/Worst Day (from Planned P/L)
-        win_day_planned, loss_day_planned = "-", "-"
-        if "Timestamp" in df_ai_planned_to_analyze.columns and pd.api.types.is_datetime64_any_dtype(df_ai_planned_to_analyze['Timestamp']) and \
-           not df_ai_planned_to_analyze.empty and not df_ai_planned_to_analyze['Timestamp'].isnull().all():
-            
-            df_daily_pnl_planned = df_ai_planned_to_analyze.copy()
-            df_daily_pnl_planned.dropna(subset=["Timestamp"], inplace=True) # Ensure no NaT Timestamps
-            if not df_daily_pnl_planned.empty:
-                df_daily_pnl_planned["Weekday"] = df_daily_pnl_planned["Timestamp"].dt.day_name()
-                daily_pnl_sum_planned = df_daily_pnl_planned.groupby("Weekday")["Risk $"].sum()
-                if not daily_pnl_sum_planned.empty:
-                    if daily_pnl_sum_planned.max() > 0: win_day_planned = daily_pnl_sum_planned.idxmax()
-                    if daily_pnl_sum_planned.min() < 0: loss_day_planned = daily_pnl_sum_planned.idxmin()
-
-        st.write(f"- **จำนวนแผนเทรดที่วิเคราะห์:** {total_trades_ai_planned_val:,}")
-        st.write(f"- **Winrate (ตามแผน):** {winrate_ai_planned_val:.2f}%")
-        st.write(f"- **กำไร/ขาดทุนสุทธิ (ตามแผน):** {gross_profit_ai_planned_val:,.2f} USD")
-        st.write(f"- **RR เฉลี่ย (ตามแผน, >0):** {avg_rr_ai_planned_val:.2f}" if pd.notna(avg_rr_ai_planned_val) else "N/A")
-        st.write(f"- **Max Drawdown (จำลองจากแผน):** {max_drawdown_sim_planned:,.2f} USD")
-        st.write(f"- **วันที่ทำกำไรดีที่สุด (ตามแผน):** {win_day_planned}")
-        st.write(f"- **วันที่ขาดทุนมากที่สุด (ตามแผน):** {loss_day_planned}")
+        if active_portfolio_id_for_ai:
+            report_title_suffix_planned_ai = f"(พอร์ต: '{active_portfolio_name_for_ai}' - จากแผน)"
+            report_title_suffix_actual_ai = f"(พอร์ต: '{active_portfolio_name_for_ai}' - จากผลจริง)"
+            st.info(f"AI Assistant กำลังวิเคราะห์ข้อมูลสำหรับพอร์ต: **'{active_portfolio_name_for_ai}'** (Balance เริ่มต้นจำลอง: {balance_for_ai_simulation:,.2f} USD)")
+        else:
+            st.info(f"AI Assistant กำลังวิเคราะห์ข้อมูลจากแผนเทรดและผลการเทรดจริงทั้งหมด (ยังไม่ได้เลือก Active Portfolio - Balance เริ่มต้นจำลอง: {balance_for_ai_simulation:,.2f} USD)")
+
+        # Fold any newly appended rows into the materialized metrics (PART 1.12), then read this portfolio's summary
+        if st.session_state.ai_metrics_state is None:
+            st.session_state.ai_metrics_state = _new_ai_metrics_state()
+        ai_metrics_key = str(active_portfolio_id_for_ai) if active_portfolio_id_for_ai else PERF_WINDOW_ALL_KEY
+
+        # --- Part 1: Analysis from PlannedTradeLogs ---
+        df_ai_planned_logs_all = load_all_planned_trade_logs_from_gsheets() # Cached
+        update_ai_metrics(st.session_state.ai_metrics_state, "planned", df_ai_planned_logs_all)
+        ai_planned_summary = summarize_ai_metrics(st.session_state.ai_metrics_state, "planned", ai_metrics_key)
+
+        st.markdown(f"### 📝 AI Intelligence Report {report_title_suffix_planned_ai}")
+        if ai_planned_summary is None:
+            if df_ai_planned_logs_all.empty:
+                 st.info("ยังไม่มีข้อมูลแผนเทรดใน Log (Google Sheets) สำหรับวิเคราะห์")
+            elif active_portfolio_id_for_ai:
+                 st.info(f"ไม่พบข้อมูลแผนเทรดใน Log สำหรับพอร์ต '{active_portfolio_name_for_ai}'.")
+            else: # Should be covered by first case if all logs are empty
+                 st.info("ไม่พบข้อมูลแผนเทรดที่ตรงเงื่อนไขสำหรับวิเคราะห์")
+        else: 
+            if not ai_planned_summary['has_risk_col']:
+                st.warning("AI (Planned): ไม่พบคอลัมน์ 'Risk $' ในข้อมูลแผนเทรด")
+
+            total_trades_ai_planned_val = ai_planned_summary['total_trades']
+            winrate_ai_planned_val = ai_planned_summary['winrate']
+            gross_profit_ai_planned_val = ai_planned_summary['net_pnl']
+            avg_rr_ai_planned_val = ai_planned_summary['avg_rr']
+            # Max Drawdown from PLANNED P/L (simulation, assumes "Risk $" is P/L of the plan, in Timestamp order)
+            max_drawdown_sim_planned = ai_planned_summary['max_drawdown']
+            win_day_planned, loss_day_planned = ai_planned_summary['best_day'], ai_planned_summary['worst_day']
+
+            st.write(f"- **จำนวนแผนเทรดที่วิเคราะห์:** {total_trades_ai_planned_val:,}")
+            st.write(f"- **Winrate (ตามแผน):** {winrate_ai_planned_val:.2f}%")
+            st.write(f"- **กำไร/ขาดทุนสุทธิ (ตามแผน):** {gross_profit_ai_planned_val:,.2f} USD")
+            st.write(f"- **RR เฉลี่ย (ตามแผน, >0):** {avg_rr_ai_planned_val:.2f}" if pd.notna(avg_rr_ai_planned_val) else "N/A")
+            st.write(f"- **Max Drawdown (จำลองจากแผน):** {max_drawdown_sim_planned:,.2f} USD")
+            if max_drawdown_sim_planned > 0:
+                recovery_text_planned_ai = f"ฟื้นตัวใน {ai_planned_summary['recovery_trades']:,} แผน" if ai_planned_summary['recovery_trades'] is not None else "ยังไม่ฟื้นตัว"
+                dd_pct_text_planned_ai = f"{max_drawdown_sim_planned / balance_for_ai_simulation * 100:.2f}% ของ Balance" if balance_for_ai_simulation > 0 else "-"
+                st.write(f"- **Max Drawdown % / ระยะติดลบนานสุด (จำลองจากแผน):** {dd_pct_text_planned_ai} / {ai_planned_summary['max_underwater_trades']:,} แผน ({recovery_text_planned_ai})")
+            st.write(f"- **วันที่ทำกำไรดีที่สุด (ตามแผน):** {win_day_planned}")
+            st.write(f"- **วันที่ขาดทุนมากที่สุด (ตามแผน):** {loss_day_planned}")
         
-        st.markdown("#### 🤖 AI Insight (จากแผนเทรด)")
-        # ... (AI Insight messages logic as in original File1, adapted for new variable names) ...
-        insight_msgs_planned_ai = []
-        if total_trades_ai_planned_val > 0 : 
-            if winrate_ai_planned_val >= 60: insight_msgs_planned_ai.append(f"✅ Winrate (แผน: {winrate_ai_planned_val:.1f}%) สูง: ระบบการวางแผนมีแนวโน้มที่ดี")
-            elif winrate_ai_planned_val < 40 and total_trades_ai_planned_val >=10 : insight_msgs_planned_ai.append(f"⚠️ Winrate (แผน: {winrate_ai_planned_val:.1f}%) ต่ำ: ควรทบทวนกลยุทธ์การวางแผน")
-            if avg_rr_ai_planned_val is not None and avg_rr_ai_planned_val < 1.5 and total_trades_ai_planned_val >=5 : insight_msgs_planned_ai.append(f"📉 RR เฉลี่ย (แผน: {avg_rr_ai_planned_val:.2f}) ต่ำกว่า 1.5: อาจต้องพิจารณาการตั้ง TP/SL เพื่อ Risk:Reward ที่เหมาะสมขึ้น")
-            if balance_for_ai_simulation > 0 and max_drawdown_sim_planned > (balance_for_ai_simulation * 0.10) : insight_msgs_planned_ai.append(f"🚨 Max Drawdown (จำลองจากแผน: {max_drawdown_sim_planned:,.2f} USD) ค่อนข้างสูง ({ (max_drawdown_sim_planned/balance_for_ai_simulation)*100:.1f}% ของ Balance): ควรระมัดระวัง")
-        if not insight_msgs_planned_ai and total_trades_ai_planned_val > 0: insight_msgs_planned_ai = ["ดูเหมือนว่าข้อมูลแผนเทรดที่วิเคราะห์ยังไม่มีจุดที่น่ากังวลเป็นพิเศษ"]
+            st.markdown("#### 🤖 AI Insight (จากแผนเทรด)")
+            # ... (AI Insight messages logic as in original File1, adapted for new variable names) ...
+            insight_msgs_planned_ai = []
+            if total_trades_ai_planned_val > 0 : 
+                if winrate_ai_planned_val >= 60: insight_msgs_planned_ai.append(f"✅ Winrate (แผน: {winrate_ai_planned_val:.1f}%) สูง: ระบบการวางแผนมีแนวโน้มที่ดี")
+                elif winrate_ai_planned_val < 40 and total_trades_ai_planned_val >=10 : insight_msgs_planned_ai.append(f"⚠️ Winrate (แผน: {winrate_ai_planned_val:.1f}%) ต่ำ: ควรทบทวนกลยุทธ์การวางแผน")
+                if avg_rr_ai_planned_val is not None and avg_rr_ai_planned_val < 1.5 and total_trades_ai_planned_val >=5 : insight_msgs_planned_ai.append(f"📉 RR เฉลี่ย (แผน: {avg_rr_ai_planned_val:.2f}) ต่ำกว่า 1.5: อาจต้องพิจารณาการตั้ง TP/SL เพื่อ Risk:Reward ที่เหมาะสมขึ้น")
+                if balance_for_ai_simulation > 0 and max_drawdown_sim_planned > (balance_for_ai_simulation * 0.10) : insight_msgs_planned_ai.append(f"🚨 Max Drawdown (จำลองจากแผน: {max_drawdown_sim_planned:,.2f} USD) ค่อนข้างสูง ({ (max_drawdown_sim_planned/balance_for_ai_simulation)*100:.1f}% ของ Balance): ควรระมัดระวัง")
+            if not insight_msgs_planned_ai and total_trades_ai_planned_val > 0: insight_msgs_planned_ai = ["ดูเหมือนว่าข้อมูลแผนเทรดที่วิเคราะห์ยังไม่มีจุดที่น่ากังวลเป็นพิเศษ"]
         
-        for msg_ai_p in insight_msgs_planned_ai:
-            if "✅" in msg_ai_p: st.success(msg_ai_p)
-            elif "⚠️" in msg_ai_p or "📉" in msg_ai_p: st.warning(msg_ai_p)
-            elif "🚨" in msg_ai_p: st.error(msg_ai_p)
-            else: st.info(msg_ai_p)
-
-    st.markdown("---") # Separator
-
-    # --- Part 2: Analysis from ActualTrades (Deals) ---
-    df_ai_actual_trades_all = load_actual_trades_from_gsheets() # Cached
-    df_ai_actual_to_analyze = pd.DataFrame()
-
-    if active_portfolio_id_for_ai and not df_ai_actual_trades_all.empty:
-        if 'PortfolioID' in df_ai_actual_trades_all.columns:
-            df_ai_actual_to_analyze = df_ai_actual_trades_all[df_ai_actual_trades_all['PortfolioID'] == str(active_portfolio_id_for_ai)].copy()
-    elif not df_ai_actual_trades_all.empty: # No active portfolio, use all
-        df_ai_actual_to_analyze = df_ai_actual_trades_all.copy()
-
-    st.markdown(f"### 📈 AI Intelligence Report {report_title_suffix_actual_ai}")
-    if df_ai_actual_to_analyze.empty:
-        if df_ai_actual_trades_all.empty :
-             st.info("ยังไม่มีข้อมูลผลการเทรดจริงใน Log (Google Sheets) สำหรับวิเคราะห์")
-        elif active_portfolio_id_for_ai:
-             st.info(f"ไม่พบข้อมูลผลการเทรดจริงใน Log สำหรับพอร์ต '{active_portfolio_name_for_ai}'.")
-        else:
-             st.info("ไม่พบข้อมูลผลการเทรดจริงที่ตรงเงื่อนไขสำหรับวิเคราะห์")
+            for msg_ai_p in insight_msgs_planned_ai:
+                if "✅" in msg_ai_p: st.success(msg_ai_p)
+                elif "⚠️" in msg_ai_p or "📉" in msg_ai_p: st.warning(msg_ai_p)
+                elif "🚨" in msg_ai_p: st.error(msg_ai_p)
+                else: st.info(msg_ai_p)
+
+        st.markdown("---") # Separator
+
+        # --- Part 2: Analysis from ActualTrades (Deals) ---
+        df_ai_actual_trades_all = load_actual_trades_from_gsheets() # Cached
+        update_ai_metrics(st.session_state.ai_metrics_state, "actual", df_ai_actual_trades_all)
+        ai_actual_summary = summarize_ai_metrics(st.session_state.ai_metrics_state, "actual", ai_metrics_key)
+
+        st.markdown(f"### 📈 AI Intelligence Report {report_title_suffix_actual_ai}")
+        if ai_actual_summary is None:
+            if df_ai_actual_trades_all.empty :
+                 st.info("ยังไม่มีข้อมูลผลการเทรดจริงใน Log (Google Sheets) สำหรับวิเคราะห์")
+            elif active_portfolio_id_for_ai:
+                 st.info(f"ไม่พบข้อมูลผลการเทรดจริงใน Log สำหรับพอร์ต '{active_portfolio_name_for_ai}'.")
+            else:
+                 st.info("ไม่พบข้อมูลผลการเทรดจริงที่ตรงเงื่อนไขสำหรับวิเคราะห์")
 
-    elif 'Profit_Deal' not in df_ai_actual_to_analyze.columns:
-        st.warning("AI (Actual): ไม่พบคอลัมน์ 'Profit_Deal' ในข้อมูลผลการเทรดจริง ไม่สามารถคำนวณสถิติได้")
-    else:
-        # Ensure 'Profit_Deal' is numeric
-        df_ai_actual_to_analyze['Profit_Deal'] = pd.to_numeric(df_ai_actual_to_analyze['Profit_Deal'], errors='coerce').fillna(0.0)
-
-        # Filter out non-trading deals (e.g., 'balance', 'credit')
-        df_trading_deals_ai = df_ai_actual_to_analyze
-        if 'Type_Deal' in df_ai_actual_to_analyze.columns:
-            df_trading_deals_ai = df_ai_actual_to_analyze[
-                ~df_ai_actual_to_analyze['Type_Deal'].astype(str).str.lower().isin(['balance', 'credit', 'deposit', 'withdrawal']) # Expanded list
-            ].copy()
-        
-        if df_trading_deals_ai.empty:
-            st.info("ไม่พบรายการ Deals ที่เป็นการซื้อขายจริงสำหรับวิเคราะห์ (หลังจากกรอง Balance/Credit/Deposit/Withdrawal)")
+        elif not ai_actual_summary['has_profit_col']:
+            st.warning("AI (Actual): ไม่พบคอลัมน์ 'Profit_Deal' ในข้อมูลผลการเทรดจริง ไม่สามารถคำนวณสถิติได้")
         else:
-            actual_total_deals_val = len(df_trading_deals_ai)
-            actual_winning_deals_df = df_trading_deals_ai[df_trading_deals_ai['Profit_Deal'] > 0]
-            actual_losing_deals_df = df_trading_deals_ai[df_trading_deals_ai['Profit_Deal'] < 0]
-            
-            actual_winning_deals_count_val = len(actual_winning_deals_df)
-            actual_losing_deals_count_val = len(actual_losing_deals_df)
-
-            actual_win_rate_val = (100 * actual_winning_deals_count_val / actual_total_deals_val) if actual_total_deals_val > 0 else 0.0
-            
-            actual_gross_profit_val = actual_winning_deals_df['Profit_Deal'].sum()
-            actual_gross_loss_val = abs(actual_losing_deals_df['Profit_Deal'].sum())
-
-            actual_profit_factor_val = actual_gross_profit_val / actual_gross_loss_val if actual_gross_loss_val > 0 else float('inf') if actual_gross_profit_val > 0 else 0.0
-            
-            actual_avg_profit_deal_val = actual_gross_profit_val / actual_winning_deals_count_val if actual_winning_deals_count_val > 0 else 0.0
-            actual_avg_loss_deal_val = actual_gross_loss_val / actual_losing_deals_count_val if actual_losing_deals_count_val > 0 else 0.0
+            # Non-trading deals (e.g., 'balance', 'credit') are already excluded by the accumulators
+            if ai_actual_summary['total_deals'] == 0:
+                st.info("ไม่พบรายการ Deals ที่เป็นการซื้อขายจริงสำหรับวิเคราะห์ (หลังจากกรอง Balance/Credit/Deposit/Withdrawal)")
+            else:
+                actual_total_deals_val = ai_actual_summary['total_deals']
+                actual_win_rate_val = ai_actual_summary['win_rate']
+                actual_gross_profit_val = ai_actual_summary['gross_profit']
+                actual_gross_loss_val = ai_actual_summary['gross_loss']
+                actual_profit_factor_val = ai_actual_summary['profit_factor']
+                actual_avg_profit_deal_val = ai_actual_summary['avg_profit']
+                actual_avg_loss_deal_val = ai_actual_summary['avg_loss']
             
-            st.write(f"- **จำนวน Deals ซื้อขายจริง:** {actual_total_deals_val:,}")
-            st.write(f"- **Deal-Level Win Rate (ผลจริง):** {actual_win_rate_val:.2f}%")
-            st.write(f"- **กำไรทั้งหมด (Gross Profit - ผลจริง):** {actual_gross_profit_val:,.2f} USD")
-            st.write(f"- **ขาดทุนทั้งหมด (Gross Loss - ผลจริง):** {actual_gross_loss_val:,.2f} USD")
-            st.write(f"- **Profit Factor (Deal-Level - ผลจริง):** {actual_profit_factor_val:.2f}" if actual_profit_factor_val != float('inf') else "∞ (No Losses)" if actual_gross_profit_val > 0 else "0.00 (No Profit/Loss)")
-            st.write(f"- **กำไรเฉลี่ยต่อ Deal ที่ชนะ (ผลจริง):** {actual_avg_profit_deal_val:,.2f} USD")
-            st.write(f"- **ขาดทุนเฉลี่ยต่อ Deal ที่แพ้ (ผลจริง):** {actual_avg_loss_deal_val:,.2f} USD")
-
-            st.markdown("#### 🤖 AI Insight (จากผลการเทรดจริง)")
-            # ... (AI Insight messages logic as in original File1, adapted for new variable names) ...
-            insight_msgs_actual_ai = []
-            if actual_total_deals_val > 0:
-                if actual_win_rate_val >= 50: insight_msgs_actual_ai.append(f"✅ Win Rate (ผลจริง: {actual_win_rate_val:.1f}%) อยู่ในเกณฑ์ดี")
-                else: insight_msgs_actual_ai.append(f"📉 Win Rate (ผลจริง: {actual_win_rate_val:.1f}%) ควรปรับปรุง")
-                if actual_profit_factor_val > 1.5: insight_msgs_actual_ai.append(f"📈 Profit Factor (ผลจริง: {actual_profit_factor_val:.2f}) อยู่ในระดับที่ดี")
-                elif actual_profit_factor_val < 1.0 and actual_total_deals_val >= 10: insight_msgs_actual_ai.append(f"⚠️ Profit Factor (ผลจริง: {actual_profit_factor_val:.2f}) ต่ำกว่า 1 บ่งชี้ว่าขาดทุนมากกว่ากำไร ควรทบทวนกลยุทธ์")
+                st.write(f"- **จำนวน Deals ซื้อขายจริง:** {actual_total_deals_val:,}")
+                st.write(f"- **Deal-Level Win Rate (ผลจริง):** {actual_win_rate_val:.2f}%")
+                st.write(f"- **กำไรทั้งหมด (Gross Profit - ผลจริง):** {actual_gross_profit_val:,.2f} USD")
+                st.write(f"- **ขาดทุนทั้งหมด (Gross Loss - ผลจริง):** {actual_gross_loss_val:,.2f} USD")
+                st.write(f"- **Profit Factor (Deal-Level - ผลจริง):** {actual_profit_factor_val:.2f}" if actual_profit_factor_val != float('inf') else "∞ (No Losses)" if actual_gross_profit_val > 0 else "0.00 (No Profit/Loss)")
+                st.write(f"- **กำไรเฉลี่ยต่อ Deal ที่ชนะ (ผลจริง):** {actual_avg_profit_deal_val:,.2f} USD")
+                st.write(f"- **ขาดทุนเฉลี่ยต่อ Deal ที่แพ้ (ผลจริง):** {actual_avg_loss_deal_val:,.2f} USD")
+
+                # Max Drawdown from ACTUAL deals, in deal time order
+                dd_pct_text_actual_ai = f" ({ai_actual_summary['max_drawdown'] / balance_for_ai_simulation * 100:.2f}% ของ Balance)" if balance_for_ai_simulation > 0 else ""
+                st.write(f"- **Max Drawdown (ผลจริง):** {ai_actual_summary['max_drawdown']:,.2f} USD{dd_pct_text_actual_ai} | ติดลบนานสุด {ai_actual_summary['max_underwater_trades']:,} Deals")
+
+                # Trade-level view: in/out deals paired into round trips (PART 1.13), net of commission/fee/swap
+                df_round_trips_ai = load_round_trip_trades_from_gsheets() # Cached
+                if active_portfolio_id_for_ai and not df_round_trips_ai.empty:
+                    df_round_trips_ai = df_round_trips_ai[df_round_trips_ai['PortfolioID'] == str(active_portfolio_id_for_ai)]
+                df_closed_trips_ai = df_round_trips_ai[df_round_trips_ai['Status'] == 'Closed']
+                if not df_closed_trips_ai.empty:
+                    trip_win_rate_ai = 100 * (df_closed_trips_ai['NetPL'] > 0).mean()
+                    st.write(f"- **Trade-Level Win Rate (ปิดครบ {len(df_closed_trips_ai):,} เทรด):** {trip_win_rate_ai:.2f}% | Net P/L: {df_closed_trips_ai['NetPL'].sum():,.2f} USD | ถือเฉลี่ย: {df_closed_trips_ai['HoldingTime'].mean()}")
+                    open_trips_count_ai = int((df_round_trips_ai['Status'] != 'Closed').sum())
+                    if open_trips_count_ai: st.caption(f"ยังมี {open_trips_count_ai:,} เทรดที่เปิดอยู่/ปิดบางส่วน (ไม่รวมในสถิติ Trade-Level)")
+                    with st.popover("ดูตารางเทรด (Round Trips)"):
+                        st.dataframe(df_round_trips_ai.tail(200), use_container_width=True, hide_index=True)
+
+                # MAE/MFE against the stored price path (PART 1.20); needs the symbol's M1 bars in the Bar Store
+                df_excursions_ai = load_trade_excursions(store_version=bar_store_version()) # Cached per bar store state
+                if active_portfolio_id_for_ai and not df_excursions_ai.empty:
+                    df_excursions_ai = df_excursions_ai[df_excursions_ai['PortfolioID'] == str(active_portfolio_id_for_ai)]
+                excursion_summary_ai = summarize_trade_excursions(df_excursions_ai)
+                if excursion_summary_ai is not None:
+                    if excursion_summary_ai['trades_with_plan'] > 0:
+                        st.write(f"- **MAE / MFE มัธยฐาน (เทียบระยะ SL ตามแผน, {excursion_summary_ai['trades_with_plan']:,} เทรด):** {excursion_summary_ai['median_mae_r']:.2f}R / {excursion_summary_ai['median_mfe_r']:.2f}R | ถึง TP ระหว่างถือ: {excursion_summary_ai['tp_hit_rate']:.1f}%")
+                    else:
+                        st.caption(f"มีข้อมูลราคา {excursion_summary_ai['trades_with_bars']:,} เทรด แต่ยังจับคู่กับแผน (SL/TP) ไม่ได้")
+                    with st.popover("ดู MAE / MFE ต่อเทรด"):
+                        df_excursions_plot_ai = df_excursions_ai.dropna(subset=['MAE_R', 'MFE_R'])
+                        if not df_excursions_plot_ai.empty:
+                            st.plotly_chart(px.scatter(df_excursions_plot_ai.assign(Result=np.where(df_excursions_plot_ai['NetPL'] > 0, 'Win', 'Loss')), x='MAE_R', y='MFE_R', color='Result',
+                                                       hover_data=['Symbol', 'EntryTime', 'NetPL'], title="MAE vs MFE (หน่วย R)"), use_container_width=True)
+                        st.dataframe(df_excursions_ai.dropna(subset=['MAE']).tail(200), use_container_width=True, hide_index=True)
+
+                st.markdown("#### 🤖 AI Insight (จากผลการเทรดจริง)")
+                # ... (AI Insight messages logic as in original File1, adapted for new variable names) ...
+                insight_msgs_actual_ai = []
+                if actual_total_deals_val > 0:
+                    if actual_win_rate_val >= 50: insight_msgs_actual_ai.append(f"✅ Win Rate (ผลจริง: {actual_win_rate_val:.1f}%) อยู่ในเกณฑ์ดี")
+                    else: insight_msgs_actual_ai.append(f"📉 Win Rate (ผลจริง: {actual_win_rate_val:.1f}%) ควรปรับปรุง")
+                    if actual_profit_factor_val > 1.5: insight_msgs_actual_ai.append(f"📈 Profit Factor (ผลจริง: {actual_profit_factor_val:.2f}) อยู่ในระดับที่ดี")
+                    elif actual_profit_factor_val < 1.0 and actual_total_deals_val >= 10: insight_msgs_actual_ai.append(f"⚠️ Profit Factor (ผลจริง: {actual_profit_factor_val:.2f}) ต่ำกว่า 1 บ่งชี้ว่าขาดทุนมากกว่ากำไร ควรทบทวนกลยุทธ์")
+                    if excursion_summary_ai is not None: insight_msgs_actual_ai.extend(excursion_summary_ai['insights']) # SL too tight / TP too far
             
-            if not insight_msgs_actual_ai and actual_total_deals_val > 0 : insight_msgs_actual_ai = ["ข้อมูลผลการเทรดจริงกำลังถูกรวบรวม โปรดตรวจสอบ Insights เพิ่มเติมในอนาคต"]
-            elif not actual_total_deals_val > 0 : insight_msgs_actual_ai = ["ยังไม่มีข้อมูลผลการเทรดจริงเพียงพอสำหรับการสร้าง Insight"]
-
-            for msg_ai_a in insight_msgs_actual_ai:
-                if "✅" in msg_ai_a or "📈" in msg_ai_a : st.success(msg_ai_a)
-                elif "⚠️" in msg_ai_a or "📉" in msg_ai_a: st.warning(msg_ai_a)
-                else: st.info(msg_ai_a)
+                if not insight_msgs_actual_ai and actual_total_deals_val > 0 : insight_msgs_actual_ai = ["ข้อมูลผลการเทรดจริงกำลังถูกรวบรวม โปรดตรวจสอบ Insights เพิ่มเติมในอนาคต"]
+                elif not actual_total_deals_val > 0 : insight_msgs_actual_ai = ["ยังไม่มีข้อมูลผลการเทรดจริงเพียงพอสำหรับการสร้าง Insight"]
+
+                for msg_ai_a in insight_msgs_actual_ai:
+                    if "✅" in msg_ai_a or "📈" in msg_ai_a : st.success(msg_ai_a)
+                    elif "⚠️" in msg_ai_a or "📉" in msg_ai_a: st.warning(msg_ai_a)
+                    else: st.info(msg_ai_a)
+
+# ===================== SEC 5.1: MAIN AREA - SCALING POLICY BACKTEST =======================
+mark_startup_section("SEC 5.1")
+# Replays history through a grid of Auto-mode scaling policies (PART 1.9)
+def _parse_backtest_grid_values(text_value):
+    # "0.1, 0.25, 0.5" -> [0.1, 0.25, 0.5]; invalid entries are skipped
+    parsed_values = []
+    for part_val in str(text_value).split(","):
+        try: parsed_values.append(float(part_val.strip()))
+        except ValueError: continue
+    return parsed_values
+
+with st.expander("🧪 Scaling Policy Backtest (ทดสอบกฎ Scaling ย้อนหลัง)", expanded=False):
+    active_portfolio_id_bt = st.session_state.get('active_portfolio_id_gs', None)
+    balance_for_bt = st.session_state.get('current_account_balance', DEFAULT_ACCOUNT_BALANCE)
+
+    bt_col1, bt_col2, bt_col3 = st.columns(3)
+    with bt_col1:
+        bt_source = st.radio("ข้อมูลที่ใช้ทดสอบ", ["แผนเทรด (Planned Logs)", "ผลเทรดจริง (Round Trips)"], key="backtest_source_v1")
+    with bt_col2:
+        bt_frequency = st.selectbox("ตรวจสอบ Scaling ทุก", ["Weekly", "Daily", "Monthly"], key="backtest_frequency_v1")
+    with bt_col3:
+        bt_n_jobs = st.number_input("จำนวน Process", min_value=1, max_value=max(1, multiprocessing.cpu_count()), value=1, step=1, key="backtest_n_jobs_v1")
+
+    bt_grid_col1, bt_grid_col2 = st.columns(2)
+    with bt_grid_col1:
+        bt_initial_risk_text = st.text_input("Risk % เริ่มต้น (คั่นด้วย ,)", value=f"{st.session_state.get('risk_pct_custom_val_v2' if st.session_state.get('mode') == 'CUSTOM' else 'risk_pct_fibo_val_v2', DEFAULT_RISK_PERCENT)}", key="backtest_initial_risk_v1")
+        bt_step_text = st.text_input("Step % (คั่นด้วย ,)", value="0.1, 0.25, 0.5", key="backtest_step_v1")
+        bt_min_text = st.text_input("Min Risk % (คั่นด้วย ,)", value="0.5", key="backtest_min_risk_v1")
+        bt_max_text = st.text_input("Max Risk % (คั่นด้วย ,)", value="2, 3, 5", key="backtest_max_risk_v1")
+    with bt_grid_col2:
+        bt_up_wr_text = st.text_input("Scale Up เมื่อ Winrate > (คั่นด้วย ,)", value="50, 55, 60", key="backtest_up_winrate_v1")
+        bt_up_gain_text = st.text_input("Scale Up เมื่อ Gain % > (คั่นด้วย ,)", value="1, 2", key="backtest_up_gain_v1")
+        bt_down_wr_text = st.text_input("Scale Down เมื่อ Winrate < (คั่นด้วย ,)", value="40, 45", key="backtest_down_winrate_v1")
+        bt_down_loss_text = st.text_input("Scale Down เมื่อ Gain % ≤ (คั่นด้วย ,, 0 = ขาดทุนใดๆ)", value="0, -2", key="backtest_down_loss_v1")
+
+    if st.button("▶️ Run Backtest", key="backtest_run_btn_v1"):
+        if bt_source.startswith("แผนเทรด"):
+            df_bt_source = load_all_planned_trade_logs_from_gsheets()
+            bt_source_key = "planned"
+        else:
+            df_bt_source = load_actual_trades_from_gsheets()
+            bt_source_key = "actual"
+        if active_portfolio_id_bt and not df_bt_source.empty and 'PortfolioID' in df_bt_source.columns:
+            df_bt_source = df_bt_source[df_bt_source['PortfolioID'].astype(str) == str(active_portfolio_id_bt)]
+        df_bt_trades = prepare_scaling_backtest_trades(df_bt_source, source=bt_source_key, reference_balance=balance_for_bt)
+        df_bt_policies = build_scaling_policy_grid(
+            InitialRiskPercent=_parse_backtest_grid_values(bt_initial_risk_text), StepPercent=_parse_backtest_grid_values(bt_step_text),
+            MinRiskPercent=_parse_backtest_grid_values(bt_min_text), MaxRiskPercent=_parse_backtest_grid_values(bt_max_text),
+            ScaleUpWinRate=_parse_backtest_grid_values(bt_up_wr_text), ScaleUpGainPercent=_parse_backtest_grid_values(bt_up_gain_text),
+            ScaleDownWinRate=_parse_backtest_grid_values(bt_down_wr_text), ScaleDownLossPercent=_parse_backtest_grid_values(bt_down_loss_text)
+        )
+        if df_bt_trades.empty:
+            st.warning("ไม่พบข้อมูลเทรดสำหรับ Backtest (ตรวจสอบ Portfolio / แหล่งข้อมูล)")
+            st.session_state.backtest_results_v1 = None
+        else:
+            with st.spinner(f"กำลังทดสอบ {len(df_bt_policies):,} Policies กับ {len(df_bt_trades):,} เทรด..."):
+                df_bt_results = backtest_scaling_policy_grid(df_bt_trades, df_bt_policies, initial_balance=balance_for_bt, check_frequency=bt_frequency, n_jobs=int(bt_n_jobs))
+            st.session_state.backtest_results_v1 = {'results': df_bt_results, 'trades': df_bt_trades, 'frequency': bt_frequency, 'balance': balance_for_bt}
+
+    bt_state = st.session_state.get('backtest_results_v1')
+    if bt_state and bt_state['results'] is not None and not bt_state['results'].empty:
+        df_bt_results = bt_state['results']
+        bt_rank_by = st.selectbox("จัดอันดับตาม", ["ReturnPercent", "MaxDrawdownPercent", "Return / MaxDD"], key="backtest_rank_by_v1")
+        if bt_rank_by == "MaxDrawdownPercent":
+            df_bt_ranked = df_bt_results.sort_values(["MaxDrawdownPercent", "ReturnPercent"], ascending=[True, False])
+        elif bt_rank_by == "Return / MaxDD":
+            df_bt_ranked = df_bt_results.assign(ReturnToDD=df_bt_results['ReturnPercent'] / df_bt_results['MaxDrawdownPercent'].replace(0, np.nan)).sort_values("ReturnToDD", ascending=False)
+        else:
+            df_bt_ranked = df_bt_results.sort_values("ReturnPercent", ascending=False)
+        st.caption(f"ทดสอบ {len(df_bt_results):,} Policies | {len(bt_state['trades']):,} เทรด | ตรวจสอบ Scaling: {bt_state['frequency']}")
+        st.dataframe(df_bt_ranked.head(20), use_container_width=True, hide_index=True)
+
+        # Re-run the best policy alone to get its equity / risk paths for plotting
+        best_policy_bt = df_bt_ranked.head(1)[SCALING_BACKTEST_POLICY_COLUMNS]
+        bt_period_freq = {"daily": "D", "weekly": "W", "monthly": "M"}.get(bt_state['frequency'].lower(), "W")
+        best_run_bt = run_scaling_policy_backtest(
+            bt_state['trades']['R'].to_numpy(), bt_state['trades']['Time'].dt.to_period(bt_period_freq).astype('int64').to_numpy(),
+            best_policy_bt, initial_balance=bt_state['balance'], return_paths=True
+        )
+        bt_times = pd.concat([pd.Series([bt_state['trades']['Time'].iloc[0]]), bt_state['trades']['Time']], ignore_index=True)
+        fig_bt_equity = px.line(x=bt_times, y=best_run_bt['equity_path'][:, 0], labels={'x': 'Time', 'y': 'Equity'}, title="Equity (Policy อันดับ 1)")
+        st.plotly_chart(fig_bt_equity, use_container_width=True)
+        fig_bt_risk = px.line(x=bt_state['trades']['Time'].iloc[best_run_bt['period_starts']].values, y=best_run_bt['risk_path'][:, 0], labels={'x': 'Time', 'y': 'Risk %'}, title="Risk % ต่อรอบ (Policy อันดับ 1)", line_shape="hv")
+        st.plotly_chart(fig_bt_risk, use_container_width=True)
+
+# ===================== SEC 5.2: MAIN AREA - PLAN VS ACTUAL (SLIPPAGE & ADHERENCE) =======================
+mark_startup_section("SEC 5.2")
+# Entry deals matched to planned legs (PART 1.14); only computed while the expander is open
+plan_vs_actual_expander = st.expander("🎯 Plan vs Actual (Slippage & ความตรงตามแผน)", expanded=False, key="plan_vs_actual_expander_v1", on_change="rerun")
+if plan_vs_actual_expander.open:
+    with plan_vs_actual_expander:
+        pva_col1, pva_col2 = st.columns(2)
+        with pva_col1:
+            pva_window_hours = st.number_input("เวลาหลังบันทึกแผนที่ยังนับว่าเป็นไม้ตามแผน (ชั่วโมง)", min_value=0.5, max_value=24.0 * 30, value=24.0, step=1.0, key="pva_window_hours_v1")
+        with pva_col2:
+            pva_price_tol_pct = st.number_input("ราคาเข้าห่างจาก Entry ได้ไม่เกิน (%)", min_value=0.01, max_value=5.0, value=0.3, step=0.05, format="%.2f", key="pva_price_tol_v1")
+
+        df_pva_matches, df_pva_unmatched = load_plan_vs_actual_from_gsheets(float(pva_window_hours), float(pva_price_tol_pct)) # Cached per settings
+        df_pva_plans = load_all_planned_trade_logs_from_gsheets()
+        active_portfolio_id_pva = st.session_state.get('active_portfolio_id_gs', None)
+        if active_portfolio_id_pva:
+            if not df_pva_matches.empty: df_pva_matches = df_pva_matches[df_pva_matches['PortfolioID'] == str(active_portfolio_id_pva)]
+            if not df_pva_unmatched.empty: df_pva_unmatched = df_pva_unmatched[df_pva_unmatched['PortfolioID'] == str(active_portfolio_id_pva)]
+            if not df_pva_plans.empty and 'PortfolioID' in df_pva_plans.columns: df_pva_plans = df_pva_plans[df_pva_plans['PortfolioID'] == str(active_portfolio_id_pva)]
+
+        df_pva_report = summarize_plan_adherence(df_pva_plans, df_pva_matches, df_pva_unmatched)
+        if df_pva_report.empty:
+            st.info("ยังไม่มีแผนเทรด (PlannedTradeLogs) สำหรับเทียบกับผลเทรดจริง")
+        else:
+            st.markdown("**สรุปตาม Portfolio**")
+            st.dataframe(df_pva_report.style.format({
+                'ExecutionRate': "{:.1f}%", 'AvgSlippage': "{:.5f}", 'MedianSlippageR': "{:.3f}", 'WorseFillRate': "{:.1f}%",
+                'LotAdherenceRate': "{:.1f}%", 'MedianDelayMinutes': "{:.1f}"
+            }, na_rep="-"), use_container_width=True)
+            st.caption("Slippage > 0 = ได้ราคาแย่กว่าแผน | SlippageR = Slippage เทียบระยะ Entry-SL | Lot Adherence = Volume ที่เข้าจริงห่างจาก Lot ในแผนไม่เกิน 10%")
+            if not df_pva_matches.empty:
+                fig_pva_slippage = px.histogram(df_pva_matches.dropna(subset=['SlippageR']), x="SlippageR", color="Symbol", nbins=40, title="การกระจายของ Slippage (หน่วย R)")
+                st.plotly_chart(fig_pva_slippage, use_container_width=True)
+                st.markdown("**ไม้ที่จับคู่กับแผนได้ (ล่าสุด)**")
+                st.dataframe(df_pva_matches.sort_values('DealTime', ascending=False).head(100), use_container_width=True, hide_index=True)
+            if not df_pva_unmatched.empty:
+                st.markdown(f"**ไม้ที่ไม่อยู่ในแผน ({len(df_pva_unmatched):,} Deals)**")
+                st.dataframe(df_pva_unmatched.sort_values('DealTime', ascending=False).head(100), use_container_width=True, hide_index=True)
 
 # ===================== SEC 6: MAIN AREA - STATEMENT IMPORT & PROCESSING =======================
+mark_startup_section("SEC 6")
 # (ที่นี่คือส่วนที่คุณต้องการให้ expander นี้แสดงผลใน UI)
 with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=False):
     st.markdown("### 📊 จัดการ Statement และข้อมูลดิบ")
@@ -2214,6 +4794,30 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
     st.checkbox("⚙️ เปิดโหมด Debug (แสดงข้อมูลที่แยกได้ + Log การทำงานบางส่วนใน Console)",
                 value=st.session_state.get("debug_statement_processing_v2", False), # เก็บค่า debug mode ไว้ใน session state
                 key="debug_statement_processing_v2")
+    st.checkbox("⏱️ แสดง Telemetry (เวลาแต่ละ Section / Loader, จำนวน Google API calls)", key="telemetry_panel_v1")
+    if st.session_state.get("telemetry_panel_v1", False):
+        telemetry_runs = list(st.session_state.get('telemetry_runs_v1', []))
+        if not telemetry_runs:
+            st.info("ยังไม่มีข้อมูล Telemetry (จะเริ่มเก็บตั้งแต่ rerun ถัดไป)")
+        else:
+            # The ring buffer holds completed reruns; the run drawing this panel is still in progress
+            df_telemetry_runs, df_telemetry_calls = summarize_telemetry_runs(telemetry_runs)
+            tele_cols = st.columns(4)
+            tele_cols[0].metric("Rerun p50", f"{np.percentile(df_telemetry_runs['TotalMs'], 50):,.0f} ms")
+            tele_cols[1].metric("Rerun p95", f"{np.percentile(df_telemetry_runs['TotalMs'], 95):,.0f} ms")
+            tele_cols[2].metric("API calls / rerun", f"{df_telemetry_runs['ApiCalls'].mean():,.1f}")
+            tele_cols[3].metric("ข้อมูลรับส่ง / rerun", f"{df_telemetry_runs['Bytes'].mean() / 1024:,.1f} KB")
+            st.caption(f"{len(df_telemetry_runs):,} rerun ล่าสุด (เก็บสูงสุด {TELEMETRY_RING_SIZE}), "
+                       f"{int(df_telemetry_runs['Interrupted'].sum()):,} รอบถูกตัดด้วย rerun (เช่น หลังบันทึกข้อมูล)")
+            st.line_chart(df_telemetry_runs.set_index('Time')[['TotalMs']])
+
+            telemetry_run_no = st.number_input("ดู Flame ของ rerun ที่ (นับจากล่าสุด = 1)", min_value=1, max_value=len(telemetry_runs), value=1, step=1, key="telemetry_run_select_v1")
+            df_flame = build_telemetry_flame(telemetry_runs[-int(telemetry_run_no)])
+            fig_flame = go.Figure(go.Icicle(ids=df_flame['id'], parents=df_flame['parent'], labels=df_flame['label'], values=df_flame['ms'],
+                                            branchvalues='total', tiling=dict(orientation='v'), hovertemplate="%{id}<br>%{value:,.1f} ms<extra></extra>"))
+            fig_flame.update_layout(height=420, margin=dict(t=10, l=10, r=10, b=10))
+            st.plotly_chart(fig_flame, use_container_width=True)
+            st.dataframe(df_telemetry_calls.style.format({'p50 ms': "{:,.1f}", 'p95 ms': "{:,.1f}", 'Bytes': "{:,.0f}"}), use_container_width=True, hide_index=True)
 
     active_portfolio_id_for_stmt_import = st.session_state.get('active_portfolio_id_gs', None)
     active_portfolio_name_for_stmt_import = st.session_state.get('active_portfolio_name_gs', None)
@@ -2232,9 +4836,11 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
         file_hash_stmt = ""
         try:
             uploaded_file_statement.seek(0) # ย้าย pointer ไปที่เริ่มต้นไฟล์
-            file_content_for_hash_stmt = uploaded_file_statement.read() # อ่านเนื้อหาเพื่อคำนวณ hash
+            md5_stmt = hashlib.md5()
+            for file_block_stmt in iter(lambda: uploaded_file_statement.read(1024 * 1024), b""): # อ่านทีละ 1 MB เพื่อคำนวณ hash
+                md5_stmt.update(file_block_stmt)
             uploaded_file_statement.seek(0) # ย้าย pointer กลับไปที่เริ่มต้น
-            file_hash_stmt = hashlib.md5(file_content_for_hash_stmt).hexdigest()
+            file_hash_stmt = md5_stmt.hexdigest()
         except Exception as e_hash_stmt:
             file_hash_stmt = f"hash_error_{random.randint(1000,9999)}" # Fallback ในกรณีที่คำนวณ hash ไม่ได้
             print(f"Warning: Could not compute MD5 hash for file: {e_hash_stmt}")
@@ -2317,6 +4923,7 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
 
                 if sheets_ok_stmt and gc_stmt: # ดำเนินการต่อเมื่อ GSheet ตั้งค่าเรียบร้อย
                     previously_processed_successfully = False
+                    resume_record_stmt = None # batch ล่าสุดของไฟล์เดียวกันที่ยังไม่สำเร็จแต่มี checkpoint -> ทำต่อจาก chunk ล่าสุด
                     try:
                         if WORKSHEET_UPLOAD_HISTORY in ws_stmt_dict and ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].row_count > 1:
                             history_records_stmt = ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].get_all_records(numericise_ignore=['all'])
@@ -2327,87 +4934,112 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
                                 if str(record_stmt.get("PortfolioID","")) == str(active_portfolio_id_for_stmt_import) and \
                                    record_stmt.get("FileName","") == file_name_stmt and \
                                    record_file_size_stmt_val == file_size_stmt and \
-                                   record_stmt.get("FileHash","") == file_hash_stmt and \
-                                   str(record_stmt.get("Status","")).startswith("Success"):
-                                    previously_processed_successfully = True
-                                    break
+                                   record_stmt.get("FileHash","") == file_hash_stmt:
+                                    if str(record_stmt.get("Status","")).startswith("Success"):
+                                        previously_processed_successfully = True
+                                        break
+                                    if record_stmt.get("ImportBatchID") and parse_import_checkpoint(record_stmt.get("Notes")):
+                                        resume_record_stmt = record_stmt
                     except Exception as e_hist_read_stmt:
                         print(f"Warning: Could not read UploadHistory for duplicate file check: {e_hist_read_stmt}")
 
                     if previously_processed_successfully:
                         st.warning(f"⚠️ ไฟล์ '{file_name_stmt}' นี้ เคยถูกประมวลผลสำเร็จสำหรับพอร์ต '{active_portfolio_name_for_stmt_import}' ไปแล้ว จะไม่ดำเนินการใดๆ ซ้ำอีก")
                     else:
-                        import_batch_id_stmt = str(uuid.uuid4())
                         upload_timestamp_stmt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                         initial_log_ok_stmt = False
+                        history_row_idx_stmt = None
+                        resume_checkpoint_stmt = None
                         try:
-                            ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].append_row([
-                                upload_timestamp_stmt, str(active_portfolio_id_for_stmt_import), str(active_portfolio_name_for_stmt_import),
-                                file_name_stmt, file_size_stmt, file_hash_stmt,
-                                "Processing", import_batch_id_stmt, "Attempting to process."
-                            ])
-                            initial_log_ok_stmt = True
+                            if resume_record_stmt:
+                                import_batch_id_stmt = str(resume_record_stmt.get("ImportBatchID"))
+                                resume_checkpoint_stmt = parse_import_checkpoint(resume_record_stmt.get("Notes"))
+                                history_row_idx_stmt = find_upload_history_row(ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY], import_batch_id_stmt)
+                                if history_row_idx_stmt:
+                                    ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].batch_update([{'range': f'G{history_row_idx_stmt}', 'values': [["Processing"]]}])
+                                    initial_log_ok_stmt = True
+                                else:
+                                    resume_checkpoint_stmt = None
+                            if not initial_log_ok_stmt:
+                                import_batch_id_stmt = str(uuid.uuid4())
+                                ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].append_row([
+                                    upload_timestamp_stmt, str(active_portfolio_id_for_stmt_import), str(active_portfolio_name_for_stmt_import),
+                                    file_name_stmt, file_size_stmt, file_hash_stmt,
+                                    "Processing", import_batch_id_stmt, "Attempting to process."
+                                ])
+                                initial_log_ok_stmt = True
+                                history_row_idx_stmt = find_upload_history_row(ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY], import_batch_id_stmt)
                         except Exception as e_log_init_stmt:
                             st.error(f"ไม่สามารถบันทึก Log เริ่มต้นใน {WORKSHEET_UPLOAD_HISTORY}: {e_log_init_stmt}")
 
                         if initial_log_ok_stmt:
                             st.markdown(f"--- \n**Import Batch ID: `{import_batch_id_stmt}`**")
-                            st.info(f"กำลังประมวลผลไฟล์: {file_name_stmt}")
+                            if resume_checkpoint_stmt:
+                                st.info(f"กำลังประมวลผลไฟล์ต่อจากครั้งก่อน: {file_name_stmt} ({format_import_checkpoint(resume_checkpoint_stmt)})")
+                            else:
+                                st.info(f"กำลังประมวลผลไฟล์: {file_name_stmt}")
 
                             processing_errors_stmt = False
                             final_status_stmt = "Failed_Unknown"
                             processing_notes_stmt = []
+                            checkpoint_stmt = resume_checkpoint_stmt
+
+                            def _save_import_checkpoint_stmt(checkpoint):
+                                # บันทึก checkpoint ลง Notes ของ batch นี้หลังแต่ละ chunk ที่เขียนสำเร็จ
+                                try:
+                                    if history_row_idx_stmt:
+                                        ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].batch_update([{'range': f'I{history_row_idx_stmt}', 'values': [[format_import_checkpoint(checkpoint)]]}])
+                                except Exception as e_checkpoint_stmt:
+                                    print(f"Warning: Could not save import checkpoint for batch {import_batch_id_stmt}: {e_checkpoint_stmt}")
 
                             try:
                                 uploaded_file_statement.seek(0)
-                                file_content_bytes_stmt = uploaded_file_statement.getvalue()
-
-                                with st.spinner(f"กำลังแยกส่วนข้อมูลจาก {file_name_stmt}..."):
-                                    # เรียกใช้ Helper Function ที่ประกาศไว้ด้านนอก
-                                    extracted_stmt_data = extract_data_from_report_content_sec6(file_content_bytes_stmt)
+                                st.subheader("💾 กำลังบันทึกข้อมูลส่วนต่างๆไปยัง Google Sheets...")
+                                import_progress_stmt = st.progress(0.0, text=f"กำลังนำเข้า {file_name_stmt}...")
+
+                                def _show_import_progress_stmt(table, table_result):
+                                    done_fraction = min(uploaded_file_statement.tell() / max(file_size_stmt, 1), 1.0)
+                                    import_progress_stmt.progress(done_fraction, text=f"{STATEMENT_IMPORT_TABLES[table]['label']}: เพิ่ม {table_result['new']}, ข้าม {table_result['skipped']} ({done_fraction:.0%})")
+
+                                # อ่านไฟล์ทีละบรรทัดและเขียนทีละ chunk แทนการ parse ทั้งไฟล์แล้ว append ครั้งเดียว
+                                import_result_stmt = import_statement_chunked_sec6(
+                                    uploaded_file_statement, {t: ws_stmt_dict.get(spec['worksheet']) for t, spec in STATEMENT_IMPORT_TABLES.items()},
+                                    active_portfolio_id_for_stmt_import, active_portfolio_name_for_stmt_import, file_name_stmt, import_batch_id_stmt,
+                                    checkpoint=resume_checkpoint_stmt, save_checkpoint=_save_import_checkpoint_stmt, on_chunk=_show_import_progress_stmt
+                                )
+                                import_progress_stmt.progress(1.0, text=f"นำเข้า {file_name_stmt} เสร็จแล้ว" if not import_result_stmt['error'] else f"นำเข้า {file_name_stmt} หยุดกลางคัน")
+                                checkpoint_stmt = import_result_stmt['checkpoint']
 
                                 if st.session_state.get("debug_statement_processing_v2", False):
-                                    st.write("--- DEBUG: Extracted Statement Data ---")
-                                    st.json({k: (v.to_dict() if isinstance(v, pd.DataFrame) else v) for k, v in extracted_stmt_data.items()}, expanded=False)
+                                    st.write("--- DEBUG: Chunked Import Result ---")
+                                    st.json(import_result_stmt, expanded=False)
                                     st.write("--- END DEBUG ---")
 
-                                extraction_successful = extracted_stmt_data and \
-                                                        (any(isinstance(df, pd.DataFrame) and not df.empty
-                                                             for name, df in extracted_stmt_data.items() if name in ['deals', 'orders', 'positions']) or \
-                                                         extracted_stmt_data.get('balance_summary') or extracted_stmt_data.get('results_summary'))
-
-                                if not extraction_successful:
+                                for table_stmt, spec_stmt in reversed(list(STATEMENT_IMPORT_TABLES.items())):
+                                    table_result_stmt = import_result_stmt['tables'][table_stmt]
+                                    processing_notes_stmt.append(f"{spec_stmt['label']}:New={table_result_stmt['new']},Skip={table_result_stmt['skipped']},Resumed={table_result_stmt['resumed']}")
+                                    if table_result_stmt['new'] or table_result_stmt['skipped'] or table_result_stmt['resumed']:
+                                        resumed_note_stmt = f" (ทำไปแล้วรอบก่อน {table_result_stmt['resumed']})" if table_result_stmt['resumed'] else ""
+                                        st.write(f"✔️ ({spec_stmt['worksheet']}) {spec_stmt['label']}: เพิ่ม {table_result_stmt['new']}, ข้าม {table_result_stmt['skipped']}{resumed_note_stmt}.")
+
+                                extraction_successful = import_result_stmt['error'] or \
+                                                        any(t_res['new'] or t_res['skipped'] or t_res['resumed'] for t_res in import_result_stmt['tables'].values()) or \
+                                                        import_result_stmt.get('balance_summary') or import_result_stmt.get('results_summary')
+
+                                if import_result_stmt['error']:
+                                    st.error(f"❌ การบันทึกหยุดที่ {import_result_stmt['error']} — อัปโหลดไฟล์เดิมอีกครั้งเพื่อทำต่อจาก chunk ล่าสุดที่บันทึกแล้ว")
+                                    final_status_stmt = "Failed_PartialSave"
+                                    processing_notes_stmt.append(f"ChunkError: {import_result_stmt['error']}")
+                                    processing_errors_stmt = True
+                                elif not extraction_successful:
                                     st.warning("ไม่สามารถแยกข้อมูลที่มีความหมายจากไฟล์ได้ หรือไฟล์ไม่มีข้อมูล Transactional/Summary.")
                                     final_status_stmt = "Failed_Extraction"
                                     processing_notes_stmt.append("Failed to extract meaningful data.")
                                     processing_errors_stmt = True
 
                                 if not processing_errors_stmt:
-                                    st.subheader("💾 กำลังบันทึกข้อมูลส่วนต่างๆไปยัง Google Sheets...")
-
-                                    deals_data = extracted_stmt_data.get('deals', pd.DataFrame())
-                                    # เรียกใช้ Helper Function ที่ประกาศไว้ด้านนอก
-                                    ok_d_stmt, new_d_stmt, skip_d_stmt = save_deals_to_actual_trades_sec6(ws_stmt_dict.get(WORKSHEET_ACTUAL_TRADES), deals_data, active_portfolio_id_for_stmt_import, active_portfolio_name_for_stmt_import, file_name_stmt, import_batch_id_stmt)
-                                    processing_notes_stmt.append(f"Deals:New={new_d_stmt},Skip={skip_d_stmt},OK={ok_d_stmt}")
-                                    if ok_d_stmt: st.write(f"✔️ ({WORKSHEET_ACTUAL_TRADES}) Deals: เพิ่ม {new_d_stmt}, ข้าม {skip_d_stmt}.")
-                                    else: st.error(f"❌ ({WORKSHEET_ACTUAL_TRADES}) Deals: ล้มเหลว"); processing_errors_stmt = True
-
-                                    orders_data = extracted_stmt_data.get('orders', pd.DataFrame())
-                                    # เรียกใช้ Helper Function ที่ประกาศไว้ด้านนอก
-                                    ok_o_stmt, new_o_stmt, skip_o_stmt = save_orders_to_gsheets_sec6(ws_stmt_dict.get(WORKSHEET_ACTUAL_ORDERS), orders_data, active_portfolio_id_for_stmt_import, active_portfolio_name_for_stmt_import, file_name_stmt, import_batch_id_stmt)
-                                    processing_notes_stmt.append(f"Orders:New={new_o_stmt},Skip={skip_o_stmt},OK={ok_o_stmt}")
-                                    if ok_o_stmt: st.write(f"✔️ ({WORKSHEET_ACTUAL_ORDERS}) Orders: เพิ่ม {new_o_stmt}, ข้าม {skip_o_stmt}.")
-                                    else: st.error(f"❌ ({WORKSHEET_ACTUAL_ORDERS}) Orders: ล้มเหลว"); processing_errors_stmt = True
-
-                                    positions_data = extracted_stmt_data.get('positions', pd.DataFrame())
-                                    # เรียกใช้ Helper Function ที่ประกาศไว้ด้านนอก
-                                    ok_p_stmt, new_p_stmt, skip_p_stmt = save_positions_to_gsheets_sec6(ws_stmt_dict.get(WORKSHEET_ACTUAL_POSITIONS), positions_data, active_portfolio_id_for_stmt_import, active_portfolio_name_for_stmt_import, file_name_stmt, import_batch_id_stmt)
-                                    processing_notes_stmt.append(f"Positions:New={new_p_stmt},Skip={skip_p_stmt},OK={ok_p_stmt}")
-                                    if ok_p_stmt: st.write(f"✔️ ({WORKSHEET_ACTUAL_POSITIONS}) Positions: เพิ่ม {new_p_stmt}, ข้าม {skip_p_stmt}.")
-                                    else: st.error(f"❌ ({WORKSHEET_ACTUAL_POSITIONS}) Positions: ล้มเหลว"); processing_errors_stmt = True
-
-                                    bal_summary_data = extracted_stmt_data.get('balance_summary', {})
-                                    res_summary_data = extracted_stmt_data.get('results_summary', {})
+                                    bal_summary_data = import_result_stmt.get('balance_summary', {})
+                                    res_summary_data = import_result_stmt.get('results_summary', {})
                                     summary_ok_stmt, summary_note_stmt = False, "no_data_to_save"
 
                                     if bal_summary_data or res_summary_data:
@@ -2431,9 +5063,11 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
                                             st.success(f"✔️ อัปเดต Balance สำหรับคำนวณจาก Statement Equity ล่าสุด: {current_latest_equity:,.2f} USD")
                                             processing_notes_stmt.append(f"Updated_Session_Equity={current_latest_equity}")
                                             _equity_updated_successfully_this_cycle = True
-                                            # Clear cache for statement summaries so SEC 1 can pick up new data
+                                            # Clear cache for statement summaries so other views reload; SEC 1's equity index is patched in place
                                             if hasattr(load_statement_summaries_from_gsheets, 'clear'):
                                                 load_statement_summaries_from_gsheets.clear()
+                                            if summary_note_stmt == "saved_new":
+                                                record_latest_equity(load_latest_equity_index(), active_portfolio_id_for_stmt_import, current_latest_equity)
                                         except ValueError:
                                             st.warning("⚠️ ไม่สามารถแปลงค่า Equity จาก Statement เป็นตัวเลขเพื่ออัปเดต session state.")
                                             processing_notes_stmt.append("Warning: Failed to convert Equity from Statement for session state.")
@@ -2459,12 +5093,9 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
 
                             # Update UploadHistory with final status
                             try:
-                                hist_rows_update_stmt = ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].get_all_values()
-                                row_idx_to_update_stmt = None
-                                for r_idx, r_val in reversed(list(enumerate(hist_rows_update_stmt))):
-                                    if len(r_val) > 7 and r_val[7] == import_batch_id_stmt:
-                                        row_idx_to_update_stmt = r_idx + 1; break
+                                row_idx_to_update_stmt = history_row_idx_stmt or find_upload_history_row(ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY], import_batch_id_stmt)
                                 if row_idx_to_update_stmt:
+                                    if checkpoint_stmt: processing_notes_stmt.insert(0, format_import_checkpoint(checkpoint_stmt)) # เก็บไว้เพื่อให้ batch ที่ล้มเหลวทำต่อได้
                                     notes_str_stmt = " | ".join(filter(None, processing_notes_stmt))[:49999]
                                     ws_stmt_dict[WORKSHEET_UPLOAD_HISTORY].batch_update([
                                         {'range': f'G{row_idx_to_update_stmt}', 'values': [[final_status_stmt]]},
@@ -2488,66 +5119,182 @@ with st.expander("📂 Ultimate Chart Dashboard Import & Processing", expanded=F
 
     st.markdown("---") # เส้นคั่นนี้ คือเส้นที่อยู่ด้านล่างสุดของ expander เพื่อปิดส่วนนี้
 
+# ===================== SEC 6.1: MAIN AREA - STATEMENT ANALYTICS FROM DEALS =======================
+mark_startup_section("SEC 6.1")
+# Results metrics recomputed from ActualTrades (PART 1.15) for any range / symbols, next to the imported Results block
+statement_analytics_expander = st.expander("🧮 Statement Analytics (คำนวณจาก Deals)", expanded=False, key="statement_analytics_expander_v1", on_change="rerun")
+if statement_analytics_expander.open:
+    with statement_analytics_expander:
+        active_portfolio_id_sa = st.session_state.get('active_portfolio_id_gs', None)
+        df_deals_sa = load_actual_trades_from_gsheets() # Cached
+        if active_portfolio_id_sa and not df_deals_sa.empty and 'PortfolioID' in df_deals_sa.columns:
+            df_deals_sa = df_deals_sa[df_deals_sa['PortfolioID'] == str(active_portfolio_id_sa)]
+
+        if df_deals_sa.empty or 'Time_Deal' not in df_deals_sa.columns or df_deals_sa['Time_Deal'].isnull().all():
+            st.info("ยังไม่มีข้อมูล Deals สำหรับคำนวณ (นำเข้า Statement ก่อน)")
+        else:
+            first_deal_date_sa, last_deal_date_sa = df_deals_sa['Time_Deal'].min().date(), df_deals_sa['Time_Deal'].max().date()
+            sa_col1, sa_col2 = st.columns(2)
+            with sa_col1:
+                sa_date_range = st.date_input("ช่วงวันที่", value=(first_deal_date_sa, last_deal_date_sa), min_value=first_deal_date_sa, max_value=last_deal_date_sa, key="sa_date_range_v1")
+            with sa_col2:
+                sa_symbol_options = sorted(df_deals_sa['Symbol_Deal'].dropna().astype(str).replace('', np.nan).dropna().unique().tolist()) if 'Symbol_Deal' in df_deals_sa.columns else []
+                sa_symbols = st.multiselect("Symbol (ว่าง = ทั้งหมด)", sa_symbol_options, key="sa_symbols_v1")
+            sa_start = pd.Timestamp(sa_date_range[0]) if len(sa_date_range) > 0 else None
+            sa_end = pd.Timestamp(sa_date_range[-1]) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1) if len(sa_date_range) > 0 else None
+
+            metrics_sa = load_statement_metrics_for_range(active_portfolio_id_sa, sa_start, sa_end, tuple(sorted(sa_symbols))) # Cached per (portfolio, range)
+            if not metrics_sa:
+                st.info("ไม่พบ Deals ในช่วง / Symbol ที่เลือก")
+            else:
+                df_metrics_sa = pd.DataFrame({'คำนวณจาก Deals': pd.Series(metrics_sa, dtype=float)})
+                # The latest imported Results block for this portfolio, for checking the full-history numbers
+                df_summaries_sa = load_statement_summaries_from_gsheets()
+                if active_portfolio_id_sa and not df_summaries_sa.empty and 'PortfolioID' in df_summaries_sa.columns:
+                    df_summaries_sa = df_summaries_sa[df_summaries_sa['PortfolioID'] == str(active_portfolio_id_sa)]
+                    if 'Timestamp' in df_summaries_sa.columns: df_summaries_sa = df_summaries_sa.sort_values('Timestamp')
+                    if not df_summaries_sa.empty:
+                        latest_summary_sa = df_summaries_sa.iloc[-1].reindex(df_metrics_sa.index)
+                        df_metrics_sa['จาก Statement ล่าสุด'] = pd.to_numeric(latest_summary_sa.astype(str).str.replace(r'[\s,%]', '', regex=True), errors='coerce')
+                        df_metrics_sa['ส่วนต่าง'] = df_metrics_sa['คำนวณจาก Deals'] - df_metrics_sa['จาก Statement ล่าสุด']
+                        st.caption("ค่าจาก Statement คือ Results ของไฟล์ล่าสุดที่นำเข้า (ทั้งบัญชี) จึงเทียบกันได้เมื่อเลือกช่วงวันที่ทั้งหมดและไม่กรอง Symbol")
+                st.dataframe(df_metrics_sa.style.format("{:,.2f}", na_rep="-"), use_container_width=True)
+
+
+# ===================== SEC 6.2: MAIN AREA - PRICE HISTORY (BAR STORE) =======================
+mark_startup_section("SEC 6.2")
+# MT5 "Export bars" CSV -> local memory-mapped M1 store + M5/M15/H1/D1 (PART 1.19); used by the Chart Visualizer
+bar_store_expander = st.expander("🗄️ คลังข้อมูลราคา (Bar Store)", expanded=False, key="bar_store_expander_v1", on_change="rerun")
+if bar_store_expander.open:
+    with bar_store_expander:
+        bs_col1, bs_col2 = st.columns([3, 1])
+        with bs_col1:
+            uploaded_bars_file = st.file_uploader("ไฟล์ราคา M1 จาก MT5 (Symbol > Bars > Export, .csv)", type=["csv"], key="bar_store_uploader_v1")
+        with bs_col2:
+            bar_store_symbol = st.text_input("Symbol", value=(os.path.splitext(uploaded_bars_file.name)[0].split('_')[0].upper() if uploaded_bars_file else ""), key=f"bar_store_symbol_v1_{uploaded_bars_file.name if uploaded_bars_file else ''}")
+        if uploaded_bars_file is not None and st.button("นำเข้าข้อมูลราคา", key="bar_store_import_btn_v1", disabled=not bar_store_symbol.strip()):
+            with st.spinner(f"กำลังนำเข้า {bar_store_symbol.upper()} ..."):
+                try:
+                    bar_import_stats = import_mt5_history_csv(uploaded_bars_file, bar_store_symbol)
+                    st.success(f"นำเข้า {bar_import_stats['appended']:,} แท่งใหม่ (อ่าน {bar_import_stats['rows_read']:,} แถว, ข้ามแท่งที่มีอยู่แล้ว {bar_import_stats['skipped']:,})")
+                except Exception as e:
+                    st.error(f"นำเข้าไม่สำเร็จ: {e}")
+        df_bar_store_summary = bar_store_summary()
+        if df_bar_store_summary.empty:
+            st.info("ยังไม่มีข้อมูลราคาในคลัง")
+        else:
+            st.dataframe(df_bar_store_summary, use_container_width=True, hide_index=True)
+            st.caption("นำเข้าไฟล์ใหม่ได้เรื่อย ๆ เฉพาะแท่งที่ใหม่กว่าแท่งล่าสุดในคลังจะถูกเพิ่ม และ Timeframe อื่นจะอัปเดตต่อท้ายให้อัตโนมัติ")
+
 
 # ===================== SEC ??: MAIN AREA - CHART VISUALIZER =======================
-with st.expander("📈 Chart Visualizer", expanded=True):
-    asset_to_display = "OANDA:XAUUSD"
-    current_asset_input = ""
-    if mode == "FIBO":
-        current_asset_input = st.session_state.get("asset", "XAUUSD")
-    elif mode == "CUSTOM":
-        current_asset_input = st.session_state.get("asset_custom", "XAUUSD")
-    
-    if current_asset_input.upper() == "XAUUSD":
+mark_startup_section("SEC ?? (Chart Visualizer)")
+# Local Plotly engine (PART 1.18) when an OHLC file exists for the symbol, otherwise the TradingView widget
+chart_visualizer_expander = st.expander("📈 Chart Visualizer", expanded=True, key="chart_visualizer_expander_v1", on_change="rerun")
+if chart_visualizer_expander.open:
+    with chart_visualizer_expander:
         asset_to_display = "OANDA:XAUUSD"
-    elif current_asset_input.upper() == "EURUSD":
-        asset_to_display = "OANDA:EURUSD"
-    elif current_asset_input:
-        asset_to_display = current_asset_input.upper()
-
-    if 'plot_data' in st.session_state and st.session_state['plot_data']:
-        asset_from_log = st.session_state['plot_data'].get('Asset', asset_to_display)
-        if asset_from_log.upper() == "XAUUSD":
-            asset_to_display = "OANDA:XAUUSD"
-        elif asset_from_log.upper() == "EURUSD":
-            asset_to_display = "OANDA:EURUSD"
-        elif asset_from_log:
-            asset_to_display = asset_from_log.upper()
-        st.info(f"แสดงกราฟ TradingView สำหรับ: {asset_to_display} (จาก Log Viewer)")
-    else:
-        st.info(f"แสดงกราฟ TradingView สำหรับ: {asset_to_display} (จาก Input ปัจจุบัน)")
-
-    tradingview_html = f"""
-    <div class="tradingview-widget-container">
-      <div id="tradingview_legendary"></div>
-      <script type="text/javascript" src="https://s3.tradingview.com/tv.js"></script>
-      <script type="text/javascript">
-      new TradingView.widget({{
-        "width": "100%",
-        "height": 600,
-        "symbol": "{asset_to_display}",
-        "interval": "15",
-        "timezone": "Asia/Bangkok",
-        "theme": "dark",
-        "style": "1",
-        "locale": "th",
-        "toolbar_bg": "#f1f3f6",
-        "enable_publishing": false,
-        "withdateranges": true,
-        "allow_symbol_change": true,
-        "hide_side_toolbar": false,
-        "details": true,
-        "hotlist": true,
-        "calendar": true,
-        "container_id": "tradingview_legendary"
-      }});
-      </script>
-    </div>
-    """
-    st.components.v1.html(tradingview_html, height=620)
+        current_asset_input = ""
+        if mode == "FIBO":
+            current_asset_input = st.session_state.get("asset_fibo_val_v2", "XAUUSD")
+        elif mode == "CUSTOM":
+            current_asset_input = st.session_state.get("asset_custom_val_v2", "XAUUSD")
+        chart_plot_data = st.session_state.get('plot_data') or {}
+        chart_symbol = str(chart_plot_data.get('Asset') or current_asset_input or "XAUUSD").upper()
+        chart_source_label = "จาก Log Viewer" if chart_plot_data else "จาก Input ปัจจุบัน"
+
+        # Bar store (PART 1.19) first, then a loose OHLC file (PART 1.18)
+        chart_store_times = open_bar_store(chart_symbol)['Time']
+        chart_ohlc_path = find_local_ohlc_file(chart_symbol) if len(chart_store_times) == 0 else None
+        df_chart_bars = load_local_ohlc(chart_ohlc_path, os.path.getmtime(chart_ohlc_path)) if chart_ohlc_path else pd.DataFrame()
+        chart_bounds = None
+        if len(chart_store_times) > 0: chart_bounds = (pd.Timestamp(int(chart_store_times[0])), pd.Timestamp(int(chart_store_times[-1])))
+        elif not df_chart_bars.empty: chart_bounds = (df_chart_bars['Time'].iloc[0], df_chart_bars['Time'].iloc[-1])
+        if chart_bounds is not None:
+            chart_first_day, chart_last_day = chart_bounds[0].date(), chart_bounds[1].date()
+            chart_plan_time = pd.to_datetime(chart_plot_data.get('Timestamp'), errors='coerce')
+            if pd.notna(chart_plan_time): # Center on the selected plan
+                chart_default_range = (max(chart_first_day, (chart_plan_time - pd.Timedelta(days=3)).date()), min(chart_last_day, (chart_plan_time + pd.Timedelta(days=3)).date()))
+            else:
+                chart_default_range = (max(chart_first_day, chart_last_day - pd.Timedelta(days=30).to_pytimedelta()), chart_last_day)
+            if chart_default_range[0] > chart_default_range[1]: chart_default_range = (chart_first_day, chart_last_day)
+
+            chart_col1, chart_col2, chart_col3 = st.columns([2, 1, 1])
+            with chart_col1:
+                chart_range = st.date_input("ช่วงวันที่", value=chart_default_range, min_value=chart_first_day, max_value=chart_last_day, key=f"chart_range_v1_{chart_symbol}_{chart_default_range[0]}")
+            with chart_col2:
+                chart_style = st.radio("รูปแบบ", ["candles", "line"], format_func=lambda s: "แท่งเทียน (min/max)" if s == "candles" else "เส้น (LTTB)", horizontal=True, key="chart_style_v1")
+            with chart_col3:
+                chart_max_points = st.number_input("จุดสูงสุดบนกราฟ", min_value=200, max_value=20000, value=3000, step=500, key="chart_max_points_v1")
+            chart_start, chart_end = (chart_range[0], chart_range[-1]) if isinstance(chart_range, (tuple, list)) and chart_range else (chart_default_range[0], chart_default_range[1])
+
+            chart_range_end = pd.Timestamp(chart_end) + pd.Timedelta(days=1)
+            if len(chart_store_times) > 0:
+                chart_timeframe = choose_bar_store_timeframe(chart_symbol, chart_start, chart_range_end, int(chart_max_points))
+                df_chart_range = slice_bars(chart_symbol, chart_start, chart_range_end, chart_timeframe)
+                chart_data_label = f"Bar Store {chart_timeframe}"
+            else:
+                df_chart_range = slice_ohlc(df_chart_bars, chart_start, chart_range_end)
+                chart_data_label = f"ไฟล์: {chart_ohlc_path}"
+            if chart_style == "line":
+                df_chart_plot = df_chart_range.iloc[lttb_downsample_indices(df_chart_range['Time'].to_numpy().astype('datetime64[ns]').astype(np.int64), df_chart_range['Close'].to_numpy(), int(chart_max_points))]
+            else:
+                df_chart_plot = downsample_ohlc_minmax(df_chart_range, int(chart_max_points))
+
+            # Executed deals on this symbol inside the visible range
+            df_chart_deals = load_actual_trades_from_gsheets()
+            if not df_chart_deals.empty and {'Symbol_Deal', 'Time_Deal', 'Price_Deal', 'Type_Deal'}.issubset(df_chart_deals.columns):
+                active_portfolio_id_chart = st.session_state.get('active_portfolio_id_gs', None)
+                chart_deal_mask = (_normalize_symbol(df_chart_deals['Symbol_Deal']) == _normalize_symbol(pd.Series([chart_symbol])).iloc[0]) \
+                    & (df_chart_deals['Time_Deal'] >= pd.Timestamp(chart_start)) & (df_chart_deals['Time_Deal'] < chart_range_end)
+                if active_portfolio_id_chart and 'PortfolioID' in df_chart_deals.columns: chart_deal_mask &= df_chart_deals['PortfolioID'] == str(active_portfolio_id_chart)
+                df_chart_deals = df_chart_deals[chart_deal_mask & df_chart_deals['Type_Deal'].astype(str).str.lower().isin(['buy', 'sell'])]
+            else:
+                df_chart_deals = pd.DataFrame()
+
+            st.plotly_chart(build_ohlc_figure(df_chart_plot, chart_style, plan_levels=chart_plot_data, df_deals=df_chart_deals, title=chart_symbol), use_container_width=True)
+            st.caption(f"{chart_symbol} ({chart_source_label}) | {chart_data_label} | แสดง {len(df_chart_plot):,} จุดจาก {len(df_chart_range):,} แท่ง | Deals: {len(df_chart_deals):,}")
+        else:
+            if chart_symbol == "XAUUSD":
+                asset_to_display = "OANDA:XAUUSD"
+            elif chart_symbol == "EURUSD":
+                asset_to_display = "OANDA:EURUSD"
+            elif chart_symbol:
+                asset_to_display = chart_symbol
+            st.info(f"แสดงกราฟ TradingView สำหรับ: {asset_to_display} ({chart_source_label})")
+            st.caption(f"ไม่พบไฟล์ OHLC ในเครื่องสำหรับ {chart_symbol} (นำเข้า MT5 CSV ที่ 'คลังข้อมูลราคา' หรือวางไฟล์ไว้ที่ {OHLC_DATA_DIR}/{chart_symbol}.parquet หรือ .csv เพื่อใช้กราฟแบบออฟไลน์พร้อมแสดง Entry/SL/TP และ Deals)")
+            tradingview_html = f"""
+            <div class="tradingview-widget-container">
+              <div id="tradingview_legendary"></div>
+              <script type="text/javascript" src="https://s3.tradingview.com/tv.js"></script>
+              <script type="text/javascript">
+              new TradingView.widget({{
+                "width": "100%",
+                "height": 600,
+                "symbol": "{asset_to_display}",
+                "interval": "15",
+                "timezone": "Asia/Bangkok",
+                "theme": "dark",
+                "style": "1",
+                "locale": "th",
+                "toolbar_bg": "#f1f3f6",
+                "enable_publishing": false,
+                "withdateranges": true,
+                "allow_symbol_change": true,
+                "hide_side_toolbar": false,
+                "details": true,
+                "hotlist": true,
+                "calendar": true,
+                "container_id": "tradingview_legendary"
+              }});
+              </script>
+            </div>
+            """
+            st.components.v1.html(tradingview_html, height=620)
 
-    
 # ===================== SEC 7: MAIN AREA - TRADE LOG VIEWER =======================
+mark_startup_section("SEC 7")
+@profile_call("loader")
 @st.cache_data(ttl=120) # Cache ผลลัพธ์ของฟังก์ชันนี้ (ซึ่งรวมการเรียงข้อมูลแล้ว) ไว้ 2 นาที
 def load_planned_trades_from_gsheets_for_viewer():
     # เรียกใช้ฟังก์ชันกลางเพื่อโหลดข้อมูล PlannedTradeLogs (ซึ่งมี cache ของตัวเอง)
@@ -2565,103 +5312,156 @@ def load_planned_trades_from_gsheets_for_viewer():
         return df_logs_viewer.sort_values(by="Timestamp", ascending=False)
     return df_logs_viewer # คืนค่า df เดิมถ้าไม่สามารถเรียงได้
 
-with st.expander("📚 Trade Log Viewer (แผนเทรดจาก Google Sheets)", expanded=False):
-    df_log_viewer_gs = load_planned_trades_from_gsheets_for_viewer()
+# Loaded and indexed only while the expander is open
+log_viewer_expander = st.expander("📚 Trade Log Viewer (แผนเทรดจาก Google Sheets)", expanded=False, key="log_viewer_expander_v1", on_change="rerun")
+if log_viewer_expander.open:
+    with log_viewer_expander:
+        df_log_viewer_gs = load_planned_trades_from_gsheets_for_viewer()
 
-    if df_log_viewer_gs.empty:
-        st.info("ยังไม่มีข้อมูลแผนที่บันทึกไว้ใน Google Sheets หรือ Worksheet 'PlannedTradeLogs' ว่างเปล่า/โหลดไม่สำเร็จ.")
-    else:
-        df_show_log_viewer = df_log_viewer_gs.copy() # ทำงานบนสำเนาเพื่อการกรอง
-
-        # --- Filters UI ---
-        log_filter_cols = st.columns(4)
-        with log_filter_cols[0]:
-            portfolios_in_log = ["ทั้งหมด"]
-            if "PortfolioName" in df_show_log_viewer.columns:
-                 portfolios_in_log.extend(sorted(df_show_log_viewer["PortfolioName"].dropna().unique().tolist()))
-            portfolio_filter_log = st.selectbox("Portfolio", portfolios_in_log, key="log_viewer_portfolio_filter_v1") # Added _v1 to key if needed
-        
-        with log_filter_cols[1]:
-            modes_in_log = ["ทั้งหมด"]
-            if "Mode" in df_show_log_viewer.columns:
-                modes_in_log.extend(sorted(df_show_log_viewer["Mode"].dropna().unique().tolist()))
-            mode_filter_log = st.selectbox("Mode", modes_in_log, key="log_viewer_mode_filter_v1")
-
-        with log_filter_cols[2]:
-            assets_in_log = ["ทั้งหมด"]
-            if "Asset" in df_show_log_viewer.columns:
-                assets_in_log.extend(sorted(df_show_log_viewer["Asset"].dropna().unique().tolist()))
-            asset_filter_log = st.selectbox("Asset", assets_in_log, key="log_viewer_asset_filter_v1")
-
-        with log_filter_cols[3]:
-            date_filter_log = None
-            if 'Timestamp' in df_show_log_viewer.columns and not df_show_log_viewer['Timestamp'].isnull().all():
-                 # Ensure 'Timestamp' is datetime for min/max_value if they were to be used
-                 # For st.date_input, just ensuring the column exists is often enough.
-                 date_filter_log = st.date_input("ค้นหาวันที่ (Log)", value=None, key="log_viewer_date_filter_v1", help="เลือกวันที่เพื่อกรอง Log")
-
-
-        # --- Apply Filters ---
-        if portfolio_filter_log != "ทั้งหมด" and "PortfolioName" in df_show_log_viewer.columns: # Check column existence
-            df_show_log_viewer = df_show_log_viewer[df_show_log_viewer["PortfolioName"] == portfolio_filter_log]
-        if mode_filter_log != "ทั้งหมด" and "Mode" in df_show_log_viewer.columns:
-            df_show_log_viewer = df_show_log_viewer[df_show_log_viewer["Mode"] == mode_filter_log]
-        if asset_filter_log != "ทั้งหมด" and "Asset" in df_show_log_viewer.columns:
-            df_show_log_viewer = df_show_log_viewer[df_show_log_viewer["Asset"] == asset_filter_log]
-        
-        if date_filter_log and 'Timestamp' in df_show_log_viewer.columns:
-            if not pd.api.types.is_datetime64_any_dtype(df_show_log_viewer['Timestamp']): # Ensure datetime
-                df_show_log_viewer['Timestamp'] = pd.to_datetime(df_show_log_viewer['Timestamp'], errors='coerce')
-            # Filter out NaT rows that might result from errors='coerce' before attempting .dt accessor
-            df_show_log_viewer = df_show_log_viewer.dropna(subset=['Timestamp'])
-            if not df_show_log_viewer.empty: # Check if still has data after dropna
-                df_show_log_viewer = df_show_log_viewer[df_show_log_viewer["Timestamp"].dt.date == date_filter_log]
+        if df_log_viewer_gs.empty:
+            st.info("ยังไม่มีข้อมูลแผนที่บันทึกไว้ใน Google Sheets หรือ Worksheet 'PlannedTradeLogs' ว่างเปล่า/โหลดไม่สำเร็จ.")
+        else:
+            # Indexes are rebuilt only when the loaded data changes (PART 1.16); option lists come from them too
+            log_viewer_index = st.session_state.get('log_viewer_index_v1')
+            if log_viewer_index is None or log_viewer_index['version'] != log_viewer_data_version(df_log_viewer_gs):
+                log_viewer_index = build_log_viewer_index(df_log_viewer_gs)
+                st.session_state.log_viewer_index_v1 = log_viewer_index
+            log_viewer_options = {col: ["ทั้งหมด"] + log_viewer_index['categories'].get(col, {}).get('options', []) for col in LOG_VIEWER_INDEX_COLUMNS}
+
+            # --- Filters UI ---
+            log_filter_cols = st.columns(4)
+            with log_filter_cols[0]:
+                portfolio_filter_log = st.selectbox("Portfolio", log_viewer_options["PortfolioName"], key="log_viewer_portfolio_filter_v1") # Added _v1 to key if needed
         
-        st.markdown("---")
-        st.markdown("**Log Details & Actions:**")
+            with log_filter_cols[1]:
+                mode_filter_log = st.selectbox("Mode", log_viewer_options["Mode"], key="log_viewer_mode_filter_v1")
+
+            with log_filter_cols[2]:
+                asset_filter_log = st.selectbox("Asset", log_viewer_options["Asset"], key="log_viewer_asset_filter_v1")
+
+            with log_filter_cols[3]:
+                date_filter_log = None
+                if log_viewer_index['time_sorted'] is not None and len(log_viewer_index['time_sorted']) > 0:
+                     date_filter_log = st.date_input("ค้นหาวันที่ (Log)", value=None, key="log_viewer_date_filter_v1", help="เลือกวันที่เพื่อกรอง Log")
+
+
+            # --- Apply Filters (bitmap intersection + timestamp range) ---
+            log_category_filters = {col: value for col, value in zip(LOG_VIEWER_INDEX_COLUMNS, [portfolio_filter_log, mode_filter_log, asset_filter_log]) if value != "ทั้งหมด"}
+            log_filtered_rows = query_log_viewer_index(log_viewer_index, log_category_filters, date_from=date_filter_log, date_to=date_filter_log)
+            df_show_log_viewer = df_log_viewer_gs.iloc[log_filtered_rows]
         
-        cols_to_display_log_viewer = {
-            "Timestamp": "Timestamp", "PortfolioName": "Portfolio", "Asset": "Asset",
-            "Mode": "Mode", "Direction": "Direction", "Entry": "Entry", "SL": "SL", "TP": "TP",
-            "Lot": "Lot", "Risk $": "Risk $" , "RR": "RR"
-        }
-        actual_cols_to_display_keys = [k for k in cols_to_display_log_viewer.keys() if k in df_show_log_viewer.columns]
+            st.markdown("---")
+            st.markdown("**Log Details & Actions:**")
         
-        num_display_cols = len(actual_cols_to_display_keys)
+            cols_to_display_log_viewer = {
+                "Timestamp": "Timestamp", "PortfolioName": "Portfolio", "Asset": "Asset",
+                "Mode": "Mode", "Direction": "Direction", "Entry": "Entry", "SL": "SL", "TP": "TP",
+                "Lot": "Lot", "Risk $": "Risk $" , "RR": "RR"
+            }
+            actual_cols_to_display_keys = [k for k in cols_to_display_log_viewer.keys() if k in df_show_log_viewer.columns]
         
-        if not df_show_log_viewer.empty:
-            header_cols = st.columns(num_display_cols + 1) 
-            for i, col_key in enumerate(actual_cols_to_display_keys):
-                header_cols[i].markdown(f"**{cols_to_display_log_viewer[col_key]}**")
-            header_cols[num_display_cols].markdown(f"**Action**")
-
-            for index_log, row_log in df_show_log_viewer.iterrows():
-                row_display_cols = st.columns(num_display_cols + 1)
-                for i, col_key in enumerate(actual_cols_to_display_keys):
-                    val = row_log.get(col_key, "-") 
-                    if pd.isna(val): val_display = "-"
-                    elif isinstance(val, float):
-                        if col_key in ['Entry', 'SL', 'TP']: val_display = f"{val:.5f}" if val != 0 else "0.00000"
-                        elif col_key in ['Lot', 'Risk $', 'RR', 'Risk %']: val_display = f"{val:.2f}"
-                        else: val_display = str(val)
-                    elif isinstance(val, pd.Timestamp): val_display = val.strftime("%Y-%m-%d %H:%M")
-                    else: val_display = str(val)
-                    row_display_cols[i].write(val_display)
-
-                log_id_for_key = row_log.get('LogID', index_log) 
-                if row_display_cols[num_display_cols].button(f"📈 Plot", key=f"plot_log_sec7_{log_id_for_key}"): # Unique key
-                    st.session_state['plot_data'] = row_log.to_dict()
-                    st.success(f"เลือกข้อมูลเทรด '{row_log.get('Asset', '-')}' @ Entry '{row_log.get('Entry', '-')}' เตรียมพร้อมสำหรับ Plot บน Chart Visualizer!")
-                    st.rerun() 
-        else:
-            st.info("ไม่พบข้อมูล Log ที่ตรงกับเงื่อนไขการค้นหา")
+            if not df_show_log_viewer.empty:
+                # One grid per page instead of a row of widgets per log: sorting and paging happen here, before rendering
+                log_page_cols = st.columns([2, 1, 1, 1])
+                with log_page_cols[0]:
+                    log_sort_col = st.selectbox("เรียงตาม", actual_cols_to_display_keys, index=0, format_func=lambda c: cols_to_display_log_viewer[c], key="log_viewer_sort_col_v1")
+                with log_page_cols[1]:
+                    log_sort_desc = st.toggle("มากไปน้อย", value=True, key="log_viewer_sort_desc_v1")
+                with log_page_cols[2]:
+                    log_page_size = st.selectbox("แถวต่อหน้า", [25, 50, 100, 250], index=1, key="log_viewer_page_size_v1")
+                total_log_pages = max(1, -(-len(df_show_log_viewer) // log_page_size))
+                with log_page_cols[3]:
+                    log_page_number = st.number_input(f"หน้า (จาก {total_log_pages:,})", min_value=1, max_value=total_log_pages, value=1, step=1, key="log_viewer_page_v1")
+                log_page_number = min(int(log_page_number), total_log_pages)
+
+                df_sorted_log_viewer = df_show_log_viewer.sort_values(by=log_sort_col, ascending=not log_sort_desc, na_position='last', kind='stable')
+                page_start_log = (log_page_number - 1) * log_page_size
+                df_page_log_viewer = df_sorted_log_viewer.iloc[page_start_log:page_start_log + log_page_size]
+
+                log_grid_event = st.dataframe(
+                    df_page_log_viewer[actual_cols_to_display_keys].rename(columns=cols_to_display_log_viewer),
+                    hide_index=True, use_container_width=True, on_select="rerun", selection_mode="single-row",
+                    # The selection is a position on this page, so it is only kept while the page shows the same rows in the same order
+                    key=f"log_viewer_grid_v1_{log_sort_col}_{'desc' if log_sort_desc else 'asc'}_{log_page_number}_{log_page_size}",
+                    column_config={
+                        "Timestamp": st.column_config.DatetimeColumn("Timestamp", format="YYYY-MM-DD HH:mm"),
+                        "Entry": st.column_config.NumberColumn("Entry", format="%.5f"), "SL": st.column_config.NumberColumn("SL", format="%.5f"),
+                        "TP": st.column_config.NumberColumn("TP", format="%.5f"), "Lot": st.column_config.NumberColumn("Lot", format="%.2f"),
+                        "Risk $": st.column_config.NumberColumn("Risk $", format="%.2f"), "RR": st.column_config.NumberColumn("RR", format="%.2f")
+                    }
+                )
+                st.caption(f"แสดง {page_start_log + 1:,}-{page_start_log + len(df_page_log_viewer):,} จาก {len(df_show_log_viewer):,} รายการ | เลือกแถวในตารางแล้วกด Plot")
+
+                selected_log_rows = log_grid_event.selection.rows if log_grid_event is not None else []
+                if selected_log_rows:
+                    row_log = df_page_log_viewer.iloc[selected_log_rows[0]]
+                    if st.button(f"📈 Plot {row_log.get('Asset', '-')} @ {row_log.get('Entry', '-')}", key="plot_log_sec7_selected_v1"):
+                        st.session_state['plot_data'] = row_log.to_dict()
+                        st.success(f"เลือกข้อมูลเทรด '{row_log.get('Asset', '-')}' @ Entry '{row_log.get('Entry', '-')}' เตรียมพร้อมสำหรับ Plot บน Chart Visualizer!")
+                        st.rerun() 
+            else:
+                st.info("ไม่พบข้อมูล Log ที่ตรงกับเงื่อนไขการค้นหา")
         
-        if 'plot_data' in st.session_state and st.session_state['plot_data']:
-            st.sidebar.success(f"ข้อมูลพร้อม Plot: {st.session_state['plot_data'].get('Asset')} @ {st.session_state['plot_data'].get('Entry')}")
-            try:
-                plot_data_str = str(st.session_state['plot_data'])
-                plot_data_display = (plot_data_str[:297] + "...") if len(plot_data_str) > 300 else plot_data_str
-                st.sidebar.json(plot_data_display, expanded=False) 
-            except:
-                st.sidebar.text("ไม่สามารถแสดง plot_data (อาจมีปัญหาการแปลง)")
-
+            if 'plot_data' in st.session_state and st.session_state['plot_data']:
+                st.sidebar.success(f"ข้อมูลพร้อม Plot: {st.session_state['plot_data'].get('Asset')} @ {st.session_state['plot_data'].get('Entry')}")
+                try:
+                    plot_data_str = str(st.session_state['plot_data'])
+                    plot_data_display = (plot_data_str[:297] + "...") if len(plot_data_str) > 300 else plot_data_str
+                    st.sidebar.json(plot_data_display, expanded=False) 
+                except:
+                    st.sidebar.text("ไม่สามารถแสดง plot_data (อาจมีปัญหาการแปลง)")
+
+
+# ===================== SEC 7.1: MAIN AREA - SEARCH LOGS & DEALS =======================
+mark_startup_section("SEC 7.1")
+# Text + numeric range search over PlannedTradeLogs / Deals (PART 1.17); indexes live in session state and only grow on append
+search_expander = st.expander("🔎 ค้นหา Log & Deals", expanded=False, key="search_expander_v1", on_change="rerun")
+if search_expander.open:
+    with search_expander:
+        search_source_labels = {'planned': "แผนเทรด (PlannedTradeLogs)", 'actual': "Deals (ActualTrades)"}
+        search_col1, search_col2 = st.columns([1, 3])
+        with search_col1:
+            search_source = st.radio("ค้นหาใน", list(search_source_labels.keys()), format_func=lambda s: search_source_labels[s], key="search_source_v1")
+        with search_col2:
+            search_query = st.text_input("คำค้นหา", value="", key="search_query_v1", placeholder="เช่น xau ftmo risk>50 rr>=2 หรือ sl profit<0 lot:0.1..1",
+                                         help="คำหลายคำ = ต้องตรงทุกคำ (ค้นจากต้นคำ) | ช่วงตัวเลข: " + ", ".join(f"{alias} ({col})" for alias, col in SEARCH_SOURCES[search_source]['numeric_cols'].items()) + " ใช้ > >= < <= = หรือ a..b")
+
+        df_search_source = load_all_planned_trade_logs_from_gsheets() if search_source == 'planned' else load_actual_trades_from_gsheets()
+        search_indexes = st.session_state.setdefault('search_index_state_v1', {})
+        search_index = update_search_index(search_indexes.setdefault(search_source, _new_search_index(search_source)), df_search_source)
+
+        if df_search_source.empty:
+            st.info("ยังไม่มีข้อมูลให้ค้นหา")
+        elif search_query.strip():
+            search_started = datetime.now()
+            search_result_rows, search_ignored_parts = search_rows(search_index, search_query)
+            search_elapsed_ms = (datetime.now() - search_started).total_seconds() * 1000
+            if search_ignored_parts:
+                st.warning(f"ไม่เข้าใจเงื่อนไข: {', '.join(search_ignored_parts)} (ข้ามไป)")
+            st.caption(f"พบ {len(search_result_rows):,} จาก {len(df_search_source):,} รายการ ({search_elapsed_ms:.1f} ms)")
+            if len(search_result_rows) > 0:
+                st.dataframe(df_search_source.iloc[search_result_rows[::-1][:500]], use_container_width=True, hide_index=True) # Latest appended first
+                if len(search_result_rows) > 500: st.caption("แสดง 500 รายการล่าสุด")
+
+# ===================== SEC 8: MAIN AREA - STARTUP PROFILE (Debug) =======================
+startup_total_ms = finish_telemetry_run()
+
+if os.environ.get(STARTUP_PROFILE_ENV_VAR) == "1" or st.query_params.get("profile") == "1":
+    df_startup_profile = pd.DataFrame(STARTUP_PROFILE_EVENTS, columns=['Kind', 'Name', 'Section', 'Path', 'ms', 'EndMs', 'Rows', 'ApiCalls', 'Bytes'])
+    df_startup_calls = (df_startup_profile[df_startup_profile['Kind'] != 'section']
+                        .groupby(['Kind', 'Name'], sort=False)['ms'].agg(Calls='count', TotalMs='sum', MaxMs='max')
+                        .reset_index().sort_values('TotalMs', ascending=False))
+    df_startup_sections = df_startup_profile[df_startup_profile['Kind'] == 'section'][['Name', 'ms']]
+    print(f"Startup profile: {startup_total_ms:,.0f} ms | " +
+          ", ".join(f"{row.Name} {row.TotalMs:.0f} ms" for row in df_startup_calls.head(5).itertuples()))
+
+    with st.expander(f"⏱️ Startup Profile (รอบนี้ {startup_total_ms:,.0f} ms)", expanded=True):
+        profile_kind_ms = df_startup_calls.groupby('Kind')['TotalMs'].sum()
+        profile_cols = st.columns(4)
+        profile_cols[0].metric("ทั้งหมด", f"{startup_total_ms:,.0f} ms")
+        profile_cols[1].metric("Imports", f"{profile_kind_ms.get('import', 0.0):,.0f} ms")
+        profile_cols[2].metric("GSheets Client", f"{profile_kind_ms.get('client', 0.0):,.0f} ms")
+        profile_cols[3].metric("Loaders", f"{profile_kind_ms.get('loader', 0.0):,.0f} ms")
+        st.caption("เวลาของแต่ละ Section รวมเวลา Loader ที่ถูกเรียกภายใน Section นั้นแล้ว; Loader ที่ cache hit ก็ถูกนับด้วย")
+        st.bar_chart(df_startup_sections.set_index('Name')['ms'], horizontal=True)
+        st.dataframe(df_startup_calls.style.format({'TotalMs': "{:,.1f}", 'MaxMs': "{:,.1f}"}), use_container_width=True, hide_index=True)
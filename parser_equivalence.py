@@ -0,0 +1,366 @@
+# parser_equivalence.py
+# Property-style checks that a candidate statement parser behaves exactly like main.extract_data_from_report_content_sec6,
+# plus a throughput / peak-memory comparison of the two. Cases come from statement_generator.py with random options and
+# random layout mutations aimed at the reference parser's quirks: skipped balance-type / symbol-less deal rows, the
+# count('.') > 1 number repair, "value (paren)" Results cells, the 35-line Results cap, blank-line handling, padded
+# cells, malformed rows, missing tables / blocks, CRLF and bytes input. Every case is reproducible from its seed;
+# a failing case is shrunk (fewer mutations, fewer deals) before it is reported.
+#
+# Usage: python parser_equivalence.py [module:function] [--cases 300] [--seed 0] [--case-seed S]
+#                                     [--deals 200000] [--repeats 3] [--no-throughput]
+#        Without a candidate the reference is checked against itself (harness self-test).
+
+import gc
+import sys
+import time
+import argparse
+import importlib
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+
+import main
+import statement_generator
+
+EXTRACTED_FRAMES = ['deals', 'orders', 'positions']
+EXTRACTED_DICTS = ['balance_summary', 'results_summary']
+
+
+def reference_parser():
+    # The parser as defined in main.py, without the telemetry wrapper
+    return getattr(main.extract_data_from_report_content_sec6, '__wrapped__', main.extract_data_from_report_content_sec6)
+
+
+# --- Layout mutations -----------------------------------------------------------------------------
+# Each takes (lines, rng) and returns new lines; they only use markers the reference parser itself looks for.
+
+def _find(lines, prefix):
+    return next((i for i, line in enumerate(lines) if line.startswith(prefix)), None)
+
+
+def _table_span(lines, header):
+    start = _find(lines, header)
+    if start is None:
+        return None, None
+    end = start + 1
+    while end < len(lines) and lines[end].strip():
+        end += 1
+    return start, end
+
+
+def _mutate_results_filler(lines, rng):
+    # Pushes the last Results rows past the 35-line cap (or not), depending on the count
+    start = _find(lines, "Results")
+    if start is None:
+        return lines
+    filler = [f",,,,,,Note {i}:,,,{i}" for i in range(int(rng.integers(1, 40)))]
+    insert_at = start + 1 + int(rng.integers(0, 8))
+    return lines[:insert_at] + filler + lines[insert_at:]
+
+
+def _mutate_results_blank_line(lines, rng):
+    # Blank lines in the first rows of Results are skipped, later ones end the block
+    start = _find(lines, "Results")
+    if start is None:
+        return lines
+    insert_at = start + 1 + int(rng.integers(0, 8))
+    return lines[:insert_at] + [""] * int(rng.integers(1, 3)) + lines[insert_at:]
+
+
+def _mutate_results_without_title(lines, rng):
+    start = _find(lines, "Results")
+    return lines if start is None else lines[:start] + lines[start + 1:]
+
+
+def _mutate_drop_balance_block(lines, rng):
+    start, end = _find(lines, "Balance:"), _find(lines, "Equity:")
+    return lines if start is None or end is None else lines[:start] + lines[end + 1:]
+
+
+def _mutate_drop_table(lines, rng):
+    header = [statement_generator.POSITIONS_HEADER, statement_generator.ORDERS_HEADER, statement_generator.DEALS_HEADER][int(rng.integers(0, 3))]
+    start, end = _table_span(lines, header)
+    return lines if start is None else lines[:start] + lines[end:]
+
+
+def _mutate_deal_without_symbol(lines, rng):
+    start, end = _table_span(lines, statement_generator.DEALS_HEADER)
+    if start is None or end - start < 2:
+        return lines
+    row_i = int(rng.integers(start + 1, end))
+    cells = lines[row_i].split(',')
+    cells[2] = ""
+    return lines[:row_i] + [",".join(cells)] + lines[row_i + 1:]
+
+
+def _mutate_balance_type_rows(lines, rng):
+    # Balance-type deals with a symbol and upper-case type: still skipped, the type check is case-insensitive
+    start, end = _table_span(lines, statement_generator.DEALS_HEADER)
+    if start is None or end - start < 2:
+        return lines
+    row_i = int(rng.integers(start + 1, end))
+    cells = lines[row_i].split(',')
+    cells[3] = str(rng.choice(statement_generator.BALANCE_ROW_TYPES)).upper()
+    return lines[:row_i] + [",".join(cells)] + lines[row_i + 1:]
+
+
+def _mutate_blank_lines_in_table(lines, rng):
+    header = [statement_generator.POSITIONS_HEADER, statement_generator.ORDERS_HEADER][int(rng.integers(0, 2))]
+    start, end = _table_span(lines, header)
+    if start is None:
+        return lines
+    insert_at = int(rng.integers(start + 1, end + 1))
+    return lines[:insert_at] + [""] + lines[insert_at:]
+
+
+def _mutate_padded_cells(lines, rng):
+    # Leading spaces are dropped by read_csv(skipinitialspace=True), trailing ones survive in the str frames
+    table_rows = [i for i, line in enumerate(lines) if line[:4].isdigit() and ',' in line]
+    if not table_rows:
+        return lines
+    chosen = set(rng.choice(table_rows, min(len(table_rows), int(rng.integers(1, 5))), replace=False).tolist())
+    return [" , ".join(line.split(',')) if i in chosen else line for i, line in enumerate(lines)]
+
+
+def _mutate_extra_field(lines, rng):
+    # One field too many: a later row is dropped with a ParserWarning, but on a table's first row read_csv shifts every
+    # column into the index (the reference then returns a time-string index)
+    table_rows = [i for i, line in enumerate(lines) if line[:4].isdigit() and ',' in line]
+    if not table_rows:
+        return lines
+    row_i = int(rng.choice(table_rows))
+    return lines[:row_i] + [lines[row_i] + ",extra"] + lines[row_i + 1:]
+
+
+def _mutate_short_row(lines, rng):
+    table_rows = [i for i, line in enumerate(lines) if line[:4].isdigit() and ',' in line]
+    if not table_rows:
+        return lines
+    row_i = int(rng.choice(table_rows))
+    cells = lines[row_i].split(',')
+    return lines[:row_i] + [",".join(cells[:int(rng.integers(1, len(cells)))])] + lines[row_i + 1:]
+
+
+def _mutate_truncate(lines, rng):
+    text = "\n".join(lines)
+    return text[:int(rng.integers(0, len(text) + 1))].split('\n')
+
+
+def _mutate_whitespace_lines(lines, rng):
+    return ["   "] + lines + ["", "  \t"]
+
+
+MUTATIONS = {
+    'results_filler': _mutate_results_filler, 'results_blank_line': _mutate_results_blank_line,
+    'results_without_title': _mutate_results_without_title, 'drop_balance_block': _mutate_drop_balance_block,
+    'drop_table': _mutate_drop_table, 'deal_without_symbol': _mutate_deal_without_symbol,
+    'balance_type_rows': _mutate_balance_type_rows, 'blank_lines_in_table': _mutate_blank_lines_in_table,
+    'padded_cells': _mutate_padded_cells, 'extra_field': _mutate_extra_field, 'short_row': _mutate_short_row,
+    'truncate': _mutate_truncate, 'whitespace_lines': _mutate_whitespace_lines,
+}
+ENCODINGS = ['str', 'str_crlf', 'bytes', 'bytes_crlf']
+
+
+def describe_case(case_seed):
+    # Random but reproducible case parameters; build_case turns them into parser input
+    rng = np.random.default_rng(case_seed)
+    symbols = list(statement_generator.SYMBOL_SPECS)
+    chosen_symbols = rng.choice(symbols, int(rng.integers(1, len(symbols) + 1)), replace=False).tolist()
+    n_mutations = int(rng.choice([0, 1, 1, 2, 3]))
+    return {
+        'seed': int(case_seed), 'n_deals': int(rng.choice([0, 1, 2, 3, int(rng.integers(4, 80))])),
+        'symbol_mix': {symbol: float(rng.integers(1, 5)) for symbol in chosen_symbols},
+        'partial_close_ratio': float(rng.choice([0.0, 0.3, 1.0])), 'balance_every': int(rng.choice([0, 3, 20])),
+        'number_format': str(rng.choice(statement_generator.NUMBER_FORMATS)), 'chunk_deals': int(rng.choice([4, 16, 1000])),
+        'mutations': rng.choice(list(MUTATIONS), n_mutations, replace=False).tolist(), 'encoding': str(rng.choice(ENCODINGS)),
+    }
+
+
+def build_case(case):
+    text, _ = statement_generator.statement_text(case['n_deals'], seed=case['seed'], symbol_mix=case['symbol_mix'],
+                                                 partial_close_ratio=case['partial_close_ratio'], balance_every=case['balance_every'],
+                                                 number_format=case['number_format'], chunk_deals=case['chunk_deals'])
+    lines = text.split('\n')
+    mutation_names = list(MUTATIONS)
+    for mutation_name in case['mutations']: # Own stream per mutation, so dropping one while shrinking leaves the others unchanged
+        lines = MUTATIONS[mutation_name](lines, np.random.default_rng([case['seed'], 1, mutation_names.index(mutation_name)]))
+    text = ("\r\n" if case['encoding'].endswith('_crlf') else "\n").join(lines)
+    return text.encode('utf-8') if case['encoding'].startswith('bytes') else text
+
+
+# --- Comparison -----------------------------------------------------------------------------------
+
+def _same_value(expected, actual):
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if isinstance(expected, float) and isinstance(actual, float) and np.isnan(expected) and np.isnan(actual):
+        return True
+    return type(expected) is type(actual) and expected == actual
+
+
+def compare_extracted(expected, actual, check_index=True):
+    # Differences between two extract_data_from_report_content_sec6 results (empty list = identical)
+    if not isinstance(actual, dict):
+        return [f"result is {type(actual).__name__}, expected dict"]
+    differences = []
+    if set(actual) != set(expected):
+        differences.append(f"keys {sorted(actual)} != {sorted(expected)}")
+    for frame_key in EXTRACTED_FRAMES:
+        df_expected, df_actual = expected.get(frame_key), actual.get(frame_key)
+        if not isinstance(df_actual, pd.DataFrame):
+            differences.append(f"{frame_key}: {type(df_actual).__name__}, expected DataFrame")
+            continue
+        if not check_index:
+            df_expected, df_actual = df_expected.reset_index(drop=True), df_actual.reset_index(drop=True)
+        try:
+            pd.testing.assert_frame_equal(df_expected, df_actual, check_dtype=True, check_index_type=check_index, check_column_type=True)
+        except AssertionError as e_frame:
+            differences.append(f"{frame_key}: {' '.join(str(e_frame).split())[:400]}")
+    for dict_key in EXTRACTED_DICTS:
+        dict_expected, dict_actual = expected.get(dict_key, {}), actual.get(dict_key)
+        if not isinstance(dict_actual, dict):
+            differences.append(f"{dict_key}: {type(dict_actual).__name__}, expected dict")
+            continue
+        for key in sorted(set(dict_expected) | set(dict_actual)):
+            if key not in dict_actual or key not in dict_expected or not _same_value(dict_expected[key], dict_actual[key]):
+                differences.append(f"{dict_key}[{key!r}]: expected {dict_expected.get(key, '<missing>')!r}, got {dict_actual.get(key, '<missing>')!r}")
+    return differences
+
+
+def _run_quietly(parser, content):
+    # The reference emits ParserWarnings for malformed rows; both sides are run with them silenced
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            return parser(content), None
+        except Exception as e_parse:
+            return None, f"{type(e_parse).__name__}: {e_parse}"
+
+
+def check_case(candidate, case, reference=None, check_index=True):
+    content = build_case(case)
+    expected, expected_error = _run_quietly(reference or reference_parser(), content)
+    actual, actual_error = _run_quietly(candidate, content)
+    if expected_error or actual_error:
+        return [] if expected_error == actual_error else [f"reference raised {expected_error}, candidate raised {actual_error}"]
+    return compare_extracted(expected, actual, check_index)
+
+
+def shrink_case(candidate, case, reference=None, check_index=True):
+    # Drops mutations, simplifies options and halves the deal count while the case keeps failing
+    changed = True
+    while changed:
+        changed = False
+        simpler_cases = [dict(case, mutations=[m for m in case['mutations'] if m != dropped]) for dropped in case['mutations']]
+        simpler_cases += [dict(case, encoding='str')] if case['encoding'] != 'str' else []
+        simpler_cases += [dict(case, number_format='plain')] if case['number_format'] != 'plain' else []
+        simpler_cases += [dict(case, balance_every=0)] if case['balance_every'] else []
+        simpler_cases += [dict(case, n_deals=case['n_deals'] // 2)] if case['n_deals'] > 1 else []
+        for simpler in simpler_cases:
+            if check_case(candidate, simpler, reference, check_index):
+                case, changed = simpler, True
+                break
+    return case
+
+
+def check_equivalence(candidate, n_cases=300, seed=0, reference=None, check_index=True, max_failures=5):
+    # Returns [(shrunk case, differences)] for failing cases; stops after max_failures
+    failures = []
+    for case_seed in range(seed, seed + n_cases):
+        case = describe_case(case_seed)
+        if check_case(candidate, case, reference, check_index):
+            shrunk = shrink_case(candidate, case, reference, check_index)
+            failures.append((shrunk, check_case(candidate, shrunk, reference, check_index)))
+            if len(failures) >= max_failures:
+                break
+    return failures
+
+
+# --- Throughput -----------------------------------------------------------------------------------
+
+def _timed_parse(parser, content):
+    gc.collect() # Garbage left by the previous parse is not charged to this one
+    t_start = time.perf_counter()
+    result, error = _run_quietly(parser, content)
+    elapsed = time.perf_counter() - t_start
+    if error:
+        raise RuntimeError(error)
+    return elapsed, result
+
+
+def _peak_parse_mb(parser, content):
+    # tracemalloc's peak for one run (tracing slows the parse, so it is never timed)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _run_quietly(parser, content)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def compare_throughput(candidate, n_deals=200_000, repeats=3, reference=None, number_format='space'):
+    # Best wall time per parser. Both get one untimed full-size run first (imports, pandas code paths, heap growth), then
+    # the timed runs alternate (and swap which goes first) so machine drift hits both alike; the reference checked against
+    # itself should come out at ~1.00x
+    content, _ = statement_generator.statement_text(n_deals, number_format=number_format)
+    parsers = {'reference': reference or reference_parser(), 'candidate': candidate}
+    best_times, n_rows = {label: float('inf') for label in parsers}, {}
+    for label, parser in parsers.items():
+        _timed_parse(parser, content)
+    for repeat in range(max(repeats, 1)):
+        for label, parser in (list(parsers.items()) if repeat % 2 == 0 else list(parsers.items())[::-1]):
+            elapsed, result = _timed_parse(parser, content)
+            best_times[label] = min(best_times[label], elapsed)
+            n_rows[label] = sum(len(result[frame_key]) for frame_key in EXTRACTED_FRAMES)
+            del result
+    return {label: {'seconds': best_times[label], 'rows': n_rows[label],
+                    'rows_per_s': n_rows[label] / best_times[label] if best_times[label] else float('inf'),
+                    'peak_mb': _peak_parse_mb(parser, content), 'input_mb': len(content) / 1e6}
+            for label, parser in parsers.items()}
+
+
+def _load_candidate(spec):
+    module_name, _, function_name = spec.partition(':')
+    candidate = getattr(importlib.import_module(module_name), function_name or 'extract_data_from_report_content_sec6')
+    return getattr(candidate, '__wrapped__', candidate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a statement parser against extract_data_from_report_content_sec6")
+    parser.add_argument('candidate', nargs='?', default=None, help="module:function of the candidate parser (default: the reference itself)")
+    parser.add_argument('--cases', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0, help="first case seed")
+    parser.add_argument('--case-seed', type=int, default=None, help="run only this case and print its differences")
+    parser.add_argument('--ignore-index', action='store_true', help="compare frames after reset_index")
+    parser.add_argument('--deals', type=int, default=200_000, help="statement size for the throughput comparison")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs per parser, alternating, after a warm-up run (best is reported)")
+    parser.add_argument('--no-throughput', action='store_true')
+    args = parser.parse_args()
+
+    candidate_fn = _load_candidate(args.candidate) if args.candidate else reference_parser()
+    candidate_name = args.candidate or "reference (self-check)"
+    if args.case_seed is not None:
+        case = describe_case(args.case_seed)
+        print(case)
+        for difference in check_case(candidate_fn, case, check_index=not args.ignore_index) or ["identical"]:
+            print(f"  {difference}")
+        sys.exit(0)
+
+    t_start = time.perf_counter()
+    failures = check_equivalence(candidate_fn, args.cases, args.seed, check_index=not args.ignore_index)
+    print(f"equivalence {candidate_name}: {args.cases} cases from seed {args.seed} in {time.perf_counter() - t_start:.1f} s -> "
+          f"{'identical' if not failures else f'{len(failures)} failing (shrunk)'}")
+    for case, differences in failures:
+        print(f"  case {case}")
+        for difference in differences[:5]:
+            print(f"    {difference}")
+
+    if not args.no_throughput:
+        timings = compare_throughput(candidate_fn, args.deals, args.repeats)
+        print(f"throughput deals={args.deals:,} ({timings['reference']['input_mb']:,.1f} MB statement)")
+        for label, timing in timings.items():
+            print(f"  {label:9}: {timing['seconds'] * 1000:10.1f} ms, {timing['rows_per_s']:12,.0f} rows/s, peak {timing['peak_mb']:8.1f} MB ({timing['rows']:,} rows)")
+        print(f"  speed-up : {timings['reference']['seconds'] / timings['candidate']['seconds']:.2f}x")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,424 @@
+# statement_generator.py
+# Synthetic MT5 "ReportHistory" statements in the CSV layout that main.extract_data_from_report_content_sec6 reads:
+# Positions / Orders / Deals tables, then the Balance block and the Results block. Positions are generated chunk by
+# chunk from a per-chunk seed, so each table is a separate pass over identical positions and memory stays bounded
+# by chunk_deals whether the statement has 10 or 10M deals. Output is yielded / written one chunk of lines at a time.
+#
+# Usage: python statement_generator.py OUT.csv [--deals N] [--seed S] [--symbols XAUUSD:4,EURUSD:3]
+#                                      [--partial-close 0.3] [--balance-every 5000] [--number-format space]
+#                                      [--chunk-deals 50000]      (OUT.csv = - writes to stdout)
+
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+SYMBOL_SPECS = {'XAUUSD': (2300.0, 2), 'EURUSD': (1.08, 5), 'GBPUSD': (1.27, 5), 'USDJPY': (151.0, 3),
+                'US30': (39000.0, 1), 'BTCUSD': (65000.0, 2)} # symbol -> (base price, digits)
+DEFAULT_SYMBOL_MIX = {'XAUUSD': 4, 'EURUSD': 3, 'GBPUSD': 2, 'USDJPY': 1}
+NUMBER_FORMATS = ['plain', 'space', 'dots', 'mixed'] # 1234.56 / 1 234.56 (MT5 default) / 1.234.56 / random per value
+BALANCE_ROW_TYPES = ['balance', 'credit', 'deposit', 'withdrawal', 'correction'] # Deal types the parser skips
+
+POSITIONS_HEADER = "Time,Position,Symbol,Type,Volume,Price,S / L,T / P,Time,Price,Commission,Swap,Profit"
+ORDERS_HEADER = "Open Time,Order,Symbol,Type,Volume,Price,S / L,T / P,Time,State,,Comment"
+DEALS_HEADER = "Time,Deal,Symbol,Type,Direction,Volume,Price,Order,Commission,Fee,Swap,Profit,Balance,Comment"
+
+_FIRST_ORDER_ID = 5_000_000
+_FIRST_POSITION_ID = 1_000_000
+_CHUNK_GAP_MINUTES = 1_200 # Longer than any open->close offset, so chunks never interleave in time
+
+
+def _format_numbers(values, digits, number_format, rng):
+    # MT5 groups thousands with a space; 'dots' gives the 1.234.56 form that main's safe_float_convert repairs.
+    # Whole numbers (digits=0) are never dot-grouped: "1.234" would read back as 1.234
+    grouped = [f"{v:,.{digits}f}" for v in np.asarray(values, dtype=float).tolist()] # Python floats format ~5x faster than numpy scalars
+    if number_format == 'plain' or (number_format == 'dots' and digits == 0):
+        return [s.replace(",", "") for s in grouped]
+    if number_format == 'space':
+        return [s.replace(",", " ") for s in grouped]
+    if number_format == 'dots':
+        return [s.replace(",", ".") for s in grouped]
+    separators = rng.choice(["", " ", "."] if digits else ["", " "], len(grouped)).tolist()
+    return [s.replace(",", sep) for s, sep in zip(grouped, separators)]
+
+
+def _round_to_digits(values, digits):
+    # np.round with a per-element number of decimals (each symbol has its own price digits)
+    scale = 10.0 ** digits
+    return np.round(values * scale) / scale
+
+
+def _format_times(times):
+    # datetime64[s] -> "2025.01.02 03:04:05" without going through pandas' slower strftime
+    if len(times) == 0:
+        return []
+    iso = np.datetime_as_string(times, unit='s')
+    return np.char.replace(np.char.replace(iso, '-', '.'), 'T', ' ').tolist()
+
+
+def _position_chunks(n_deals, seed, symbol_mix, partial_close_ratio, chunk_deals, start_time):
+    # Yields one dict of position / deal arrays per chunk. The last position may be left open so the deal count is exact
+    symbols = list(symbol_mix)
+    weights = np.array([symbol_mix[s] for s in symbols], dtype=float)
+    base_prices = np.array([SYMBOL_SPECS.get(s, (100.0, 2))[0] for s in symbols])
+    digits = np.array([SYMBOL_SPECS.get(s, (100.0, 2))[1] for s in symbols])
+    remaining, chunk_index, next_position_id = n_deals, 0, _FIRST_POSITION_ID
+    chunk_start = np.datetime64(start_time, 's')
+    while remaining > 0:
+        rng = np.random.default_rng([seed, chunk_index])
+        n_candidates = max(1, chunk_deals // 2)
+        n_outs = np.where(rng.random(n_candidates) < partial_close_ratio, 2, 1)
+        deals_used = np.cumsum(1 + n_outs)
+        n_keep = int(np.searchsorted(deals_used, remaining, side='right'))
+        leftover = remaining - (int(deals_used[n_keep - 1]) if n_keep else 0)
+        n_outs = n_outs[:n_keep]
+        if n_keep < n_candidates and leftover > 0:
+            n_outs = np.append(n_outs, leftover - 1) # 1 deal left: an open position, 2 left: a single close
+        n_positions = len(n_outs)
+        remaining -= int(n_positions + n_outs.sum())
+
+        sym_idx = rng.choice(len(symbols), n_positions, p=weights / weights.sum())
+        side_sign = np.where(rng.random(n_positions) < 0.5, 1, -1)
+        volumes = rng.choice([0.02, 0.1, 0.2, 0.5, 1.0, 2.0], n_positions) # Even hundredths so a partial close splits cleanly
+        span_seconds = n_positions * 600
+        open_times = chunk_start + np.sort(rng.integers(0, span_seconds, n_positions)).astype('timedelta64[s]')
+        close_1 = open_times + rng.integers(60, 36_000, n_positions).astype('timedelta64[s]')
+        close_2 = close_1 + rng.integers(60, 36_000, n_positions).astype('timedelta64[s]')
+        open_prices = _round_to_digits(base_prices[sym_idx] * (1 + rng.normal(0, 0.01, n_positions)), digits[sym_idx])
+        edge = side_sign * 0.0001 # Small positive expectancy so commissions don't walk long statements into a negative balance
+        price_1 = _round_to_digits(open_prices * (1 + edge + rng.normal(0, 0.002, n_positions)), digits[sym_idx])
+        price_2 = _round_to_digits(open_prices * (1 + edge + rng.normal(0, 0.002, n_positions)), digits[sym_idx])
+        out_volume = np.where(n_outs == 2, volumes / 2, volumes)
+        profit_1 = np.round(side_sign * (price_1 - open_prices) / open_prices * 100_000 * out_volume, 2)
+        profit_2 = np.round(side_sign * (price_2 - open_prices) / open_prices * 100_000 * out_volume, 2)
+        commissions = -np.round(7.0 * volumes, 2)
+        swaps = np.where(rng.random(n_positions) < 0.2, -np.round(rng.random(n_positions) * volumes * 10, 2), 0.0)
+        has_stops = rng.random(n_positions) < 0.5
+        stop_distance = open_prices * 0.004
+
+        is_out_1, is_out_2 = n_outs >= 1, n_outs == 2
+        open_types = np.where(side_sign > 0, 'buy', 'sell')
+        close_types = np.where(side_sign > 0, 'sell', 'buy')
+        deals = pd.DataFrame({
+            'time': np.concatenate([open_times, close_1[is_out_1], close_2[is_out_2]]),
+            'position': np.concatenate([np.arange(n_positions), np.flatnonzero(is_out_1), np.flatnonzero(is_out_2)]),
+            'type': np.concatenate([open_types, close_types[is_out_1], close_types[is_out_2]]),
+            'direction': np.repeat(['in', 'out', 'out'], [n_positions, is_out_1.sum(), is_out_2.sum()]),
+            'volume': np.concatenate([volumes, out_volume[is_out_1], out_volume[is_out_2]]),
+            'price': np.concatenate([open_prices, price_1[is_out_1], price_2[is_out_2]]),
+            'commission': np.concatenate([commissions, np.zeros(is_out_1.sum() + is_out_2.sum())]),
+            'swap': np.concatenate([np.zeros(n_positions), np.where(is_out_2, 0.0, swaps)[is_out_1], swaps[is_out_2]]),
+            'profit': np.concatenate([np.zeros(n_positions), profit_1[is_out_1], profit_2[is_out_2]]),
+        }).sort_values('time', kind='stable').reset_index(drop=True)
+        deals['symbol'] = np.array(symbols)[sym_idx][deals['position'].to_numpy()]
+        deals['digits'] = digits[sym_idx][deals['position'].to_numpy()]
+
+        yield {
+            'chunk_index': chunk_index, 'n_positions': n_positions, 'position_ids': next_position_id + np.arange(n_positions),
+            'symbols': np.array(symbols)[sym_idx], 'digits': digits[sym_idx], 'side_sign': side_sign, 'volumes': volumes,
+            'open_times': open_times, 'open_prices': open_prices, 'n_outs': n_outs,
+            'close_times': np.where(is_out_2, close_2, close_1), 'close_prices': np.where(is_out_2, price_2, price_1),
+            'commissions': commissions, 'swaps': swaps, 'profits': np.where(is_out_1, profit_1, 0.0) + np.where(is_out_2, profit_2, 0.0),
+            'stop_loss': np.where(has_stops, _round_to_digits(open_prices - side_sign * stop_distance, digits[sym_idx]), np.nan),
+            'take_profit': np.where(has_stops, _round_to_digits(open_prices + side_sign * 2 * stop_distance, digits[sym_idx]), np.nan),
+            'deals': deals,
+        }
+        next_position_id += n_positions
+        chunk_start = open_times[-1] + np.timedelta64(span_seconds + _CHUNK_GAP_MINUTES * 60, 's') if n_positions else chunk_start
+        chunk_index += 1
+
+
+def _format_by_digits(values, digits, number_format, rng):
+    # Per-row digits (prices of different symbols) formatted group by group
+    out = np.empty(len(values), dtype=object)
+    for d in np.unique(digits):
+        mask = digits == d
+        out[mask] = _format_numbers(values[mask], int(d), number_format, rng)
+    return out.tolist()
+
+
+def _optional_prices(values, digits, number_format, rng):
+    present = ~np.isnan(values)
+    out = np.full(len(values), "", dtype=object)
+    if present.any():
+        out[present] = _format_by_digits(values[present], digits[present], number_format, rng)
+    return out.tolist()
+
+
+def _positions_lines(chunk, number_format, rng):
+    closed = chunk['n_outs'] > 0 # Still-open positions are not listed in a history report
+    money = lambda values: _format_numbers(values[closed], 2, number_format, rng)
+    prices = lambda values: _format_by_digits(values[closed], chunk['digits'][closed], number_format, rng)
+    columns = [_format_times(chunk['open_times'][closed]), chunk['position_ids'][closed].tolist(), chunk['symbols'][closed].tolist(),
+               np.where(chunk['side_sign'][closed] > 0, 'buy', 'sell').tolist(), [f"{v:.2f}" for v in chunk['volumes'][closed]],
+               prices(chunk['open_prices']),
+               _optional_prices(chunk['stop_loss'][closed], chunk['digits'][closed], number_format, rng),
+               _optional_prices(chunk['take_profit'][closed], chunk['digits'][closed], number_format, rng),
+               _format_times(chunk['close_times'][closed]), prices(chunk['close_prices']),
+               money(chunk['commissions']), money(chunk['swaps']), money(chunk['profits'])]
+    return [",".join(map(str, row)) for row in zip(*columns)]
+
+
+def _orders_lines(chunk, first_order_id, number_format, rng):
+    deals = chunk['deals']
+    times = _format_times(deals['time'].to_numpy())
+    positions = deals['position'].to_numpy()
+    volumes = [f"{v:.2f} / {v:.2f}" for v in deals['volume']]
+    prices = _format_by_digits(deals['price'].to_numpy(), deals['digits'].to_numpy(), number_format, rng)
+    stops = _optional_prices(chunk['stop_loss'][positions], deals['digits'].to_numpy(), number_format, rng)
+    targets = _optional_prices(chunk['take_profit'][positions], deals['digits'].to_numpy(), number_format, rng)
+    return [f"{t},{first_order_id + i},{sym},{typ},{vol},{price},{sl},{tp},{t},filled,,"
+            for i, (t, sym, typ, vol, price, sl, tp) in enumerate(zip(times, deals['symbol'].tolist(), deals['type'].tolist(), volumes, prices, stops, targets))]
+
+
+def _balance_rows(n_deals_in_chunk, balance_every, rng):
+    # Balance-type rows (deposits, withdrawals, credits, ...) interleaved before ~1 in balance_every trade deals
+    if not balance_every or n_deals_in_chunk == 0:
+        return np.array([], dtype=int), np.array([], dtype=object), np.array([])
+    before_deal = np.flatnonzero(rng.random(n_deals_in_chunk) < 1.0 / balance_every)
+    row_types = rng.choice(BALANCE_ROW_TYPES, len(before_deal))
+    amounts = np.round(rng.uniform(100, 2000, len(before_deal)), 2)
+    amounts = np.where(row_types == 'withdrawal', -amounts, np.where(row_types == 'correction', np.round(amounts / 100 - 10, 2), amounts))
+    return before_deal, row_types, amounts
+
+
+def _deals_lines(chunk, first_deal_id, first_order_id, opening_balance, balance_every, number_format, rng):
+    # Returns (lines, closing balance, credit added, balance rows written, balance of every row for drawdown)
+    deals = chunk['deals']
+    n_trade = len(deals)
+    before_deal, row_types, amounts = _balance_rows(n_trade, balance_every, rng)
+    sort_key = np.concatenate([np.arange(n_trade) * 2 + 1, before_deal * 2])
+    order = np.argsort(sort_key, kind='stable')
+    is_trade = np.concatenate([np.ones(n_trade, dtype=bool), np.zeros(len(before_deal), dtype=bool)])[order]
+    balance_delta = np.concatenate([(deals['profit'] + deals['commission'] + deals['swap']).to_numpy(),
+                                    np.where(row_types == 'credit', 0.0, amounts)])[order]
+    balances = np.round(opening_balance + np.cumsum(balance_delta), 2)
+
+    trade_times = _format_times(deals['time'].to_numpy())
+    trade_prices = _format_by_digits(deals['price'].to_numpy(), deals['digits'].to_numpy(), number_format, rng)
+    trade_commission = _format_numbers(deals['commission'].to_numpy(), 2, number_format, rng)
+    trade_swap = _format_numbers(deals['swap'].to_numpy(), 2, number_format, rng)
+    trade_profit = _format_numbers(deals['profit'].to_numpy(), 2, number_format, rng)
+    balance_amounts = _format_numbers(amounts, 2, number_format, rng)
+    balances_text = _format_numbers(balances, 2, number_format, rng)
+    comments = {'balance': "Deposit", 'deposit': "Deposit", 'withdrawal': "Withdrawal", 'credit': "Credit", 'correction': "Correction"}
+
+    symbols, types, directions = deals['symbol'].tolist(), deals['type'].tolist(), deals['direction'].tolist()
+    volumes, profits = deals['volume'].tolist(), deals['profit'].tolist()
+    lines, trade_i, balance_i = [], 0, 0
+    for row_i, trade_row in enumerate(is_trade.tolist()):
+        deal_id = first_deal_id + row_i
+        if trade_row:
+            comment = "" if directions[trade_i] == 'in' else "tp" if profits[trade_i] > 0 else "sl"
+            lines.append(f"{trade_times[trade_i]},{deal_id},{symbols[trade_i]},{types[trade_i]},{directions[trade_i]},{volumes[trade_i]:.2f},"
+                         f"{trade_prices[trade_i]},{first_order_id + trade_i},{trade_commission[trade_i]},0.00,{trade_swap[trade_i]},"
+                         f"{trade_profit[trade_i]},{balances_text[row_i]},{comment}")
+            trade_i += 1
+        else:
+            row_type = row_types[balance_i]
+            lines.append(f"{trade_times[trade_i]},{deal_id},,{row_type},,,,,0.00,0.00,0.00,{balance_amounts[balance_i]},{balances_text[row_i]},{comments[row_type]}")
+            balance_i += 1
+    credit_added = float(amounts[row_types == 'credit'].sum()) if len(row_types) else 0.0
+    return lines, float(balances[-1]) if len(balances) else opening_balance, credit_added, len(before_deal), balances
+
+
+def _new_results_state(initial_deposit):
+    return {'trades': 0, 'wins': 0, 'losses': 0, 'gross_profit': 0.0, 'gross_loss': 0.0, 'largest_profit': 0.0, 'largest_loss': 0.0,
+            'short_trades': 0, 'short_wins': 0, 'long_trades': 0, 'long_wins': 0, 'sum_results': 0.0, 'sum_sq_results': 0.0,
+            'win_streak': [0, 0.0], 'loss_streak': [0, 0.0], 'win_streaks': [], 'loss_streaks': [],
+            'max_wins': [0, 0.0], 'max_losses': [0, 0.0], 'max_profit_run': [0.0, 0], 'max_loss_run': [0.0, 0],
+            'peak': initial_deposit, 'low': initial_deposit, 'max_dd': [0.0, 0.0], 'max_dd_pct': [0.0, 0.0]}
+
+
+def _close_streak(state, which):
+    count, amount = state[f'{which}_streak']
+    if count:
+        state[f'{which}_streaks'].append(count)
+        best_count = state['max_wins' if which == 'win' else 'max_losses']
+        if count > best_count[0]:
+            best_count[:] = [count, amount]
+        best_amount = state['max_profit_run' if which == 'win' else 'max_loss_run']
+        if abs(amount) > abs(best_amount[0]):
+            best_amount[:] = [amount, count]
+    state[f'{which}_streak'] = [0, 0.0]
+
+
+def _update_results_state(state, chunk, balances):
+    closed = chunk['n_outs'] > 0
+    results = (chunk['profits'] + chunk['commissions'] + chunk['swaps'])[closed]
+    is_long = chunk['side_sign'][closed] > 0
+    state['trades'] += len(results)
+    state['wins'] += int((results > 0).sum())
+    state['losses'] += int((results <= 0).sum())
+    state['gross_profit'] += float(results[results > 0].sum())
+    state['gross_loss'] += float(results[results <= 0].sum())
+    if len(results):
+        state['largest_profit'] = max(state['largest_profit'], float(results.max()))
+        state['largest_loss'] = min(state['largest_loss'], float(results.min()))
+    state['long_trades'] += int(is_long.sum())
+    state['long_wins'] += int((is_long & (results > 0)).sum())
+    state['short_trades'] += int((~is_long).sum())
+    state['short_wins'] += int((~is_long & (results > 0)).sum())
+    state['sum_results'] += float(results.sum())
+    state['sum_sq_results'] += float((results ** 2).sum())
+    for result in results.tolist(): # Streaks carry across chunks
+        which, other = ('win', 'loss') if result > 0 else ('loss', 'win')
+        _close_streak(state, other)
+        state[f'{which}_streak'][0] += 1
+        state[f'{which}_streak'][1] += result
+    if len(balances):
+        peaks = np.maximum.accumulate(np.concatenate([[state['peak']], balances]))[1:]
+        drawdowns = peaks - balances
+        drawdown_pcts = np.where(peaks > 0, drawdowns / peaks * 100, 0.0)
+        i_max, i_pct = int(np.argmax(drawdowns)), int(np.argmax(drawdown_pcts))
+        if drawdowns[i_max] > state['max_dd'][0]:
+            state['max_dd'] = [float(drawdowns[i_max]), float(drawdown_pcts[i_max])]
+        if drawdown_pcts[i_pct] > state['max_dd_pct'][0]:
+            state['max_dd_pct'] = [float(drawdown_pcts[i_pct]), float(drawdowns[i_pct])]
+        state['peak'] = float(peaks[-1])
+        state['low'] = min(state['low'], float(balances.min()))
+
+
+def _results_lines(state, initial_deposit, number_format, rng):
+    _close_streak(state, 'win')
+    _close_streak(state, 'loss')
+    money = lambda v: _format_numbers([v], 2, number_format, rng)[0]
+    pct = lambda part, whole: f"{100.0 * part / whole:.2f}%" if whole else "0.00%"
+    n_trades = state['trades']
+    net_profit = state['gross_profit'] + state['gross_loss']
+    mean_result = state['sum_results'] / n_trades if n_trades else 0.0
+    std_result = np.sqrt(max(state['sum_sq_results'] / n_trades - mean_result ** 2, 0.0)) if n_trades else 0.0
+    avg_streak = lambda streaks: round(sum(streaks) / len(streaks)) if streaks else 0
+    return ["Results",
+            f"Total Net Profit:,,,{money(net_profit)},,,Gross Profit:,,,{money(state['gross_profit'])},,,Gross Loss:,,,{money(state['gross_loss'])}",
+            f"Profit Factor:,,,{state['gross_profit'] / abs(state['gross_loss']) if state['gross_loss'] else 0.0:.2f},,,Expected Payoff:,,,{money(mean_result)}",
+            f"Recovery Factor:,,,{net_profit / state['max_dd'][0] if state['max_dd'][0] else 0.0:.2f},,,Sharpe Ratio:,,,{mean_result / std_result if std_result else 0.0:.2f}",
+            "Balance Drawdown:",
+            f"Balance Drawdown Absolute:,,,{money(max(initial_deposit - state['low'], 0.0))},,,Balance Drawdown Maximal:,,,{money(state['max_dd'][0])} ({state['max_dd'][1]:.2f}%),,,"
+            f"Balance Drawdown Relative:,,,{state['max_dd_pct'][0]:.2f}% ({money(state['max_dd_pct'][1])})",
+            f"Total Trades:,,,{n_trades},,,Short Trades (won %):,,,{state['short_trades']} ({pct(state['short_wins'], state['short_trades'])}),,,"
+            f"Long Trades (won %):,,,{state['long_trades']} ({pct(state['long_wins'], state['long_trades'])})",
+            f",,,,,,Profit Trades (% of total):,,,{state['wins']} ({pct(state['wins'], n_trades)}),,,Loss Trades (% of total):,,,{state['losses']} ({pct(state['losses'], n_trades)})",
+            f",,,,,,Largest profit trade:,,,{money(state['largest_profit'])},,,Largest loss trade:,,,{money(state['largest_loss'])}",
+            f",,,,,,Average profit trade:,,,{money(state['gross_profit'] / state['wins'] if state['wins'] else 0.0)},,,"
+            f"Average loss trade:,,,{money(state['gross_loss'] / state['losses'] if state['losses'] else 0.0)}",
+            f",,,,,,Maximum consecutive wins ($):,,,{state['max_wins'][0]} ({money(state['max_wins'][1])}),,,"
+            f"Maximum consecutive losses ($):,,,{state['max_losses'][0]} ({money(state['max_losses'][1])})",
+            f",,,,,,Maximal consecutive profit (count):,,,{money(state['max_profit_run'][0])} ({state['max_profit_run'][1]}),,,"
+            f"Maximal consecutive loss (count):,,,{money(state['max_loss_run'][0])} ({state['max_loss_run'][1]})",
+            f",,,,,,Average consecutive wins:,,,{avg_streak(state['win_streaks'])},,,Average consecutive losses:,,,{avg_streak(state['loss_streaks'])}"]
+
+
+def iter_statement_chunks(n_deals, seed=42, symbol_mix=None, partial_close_ratio=0.3, balance_every=5_000, number_format='space',
+                          chunk_deals=50_000, initial_deposit=10_000.0, start_time='2025-01-02T00:00:00', summary=None):
+    # Yields the statement as text chunks ("line\nline\n...") of at most ~chunk_deals lines each.
+    # n_deals counts trade deals only (the rows the parser keeps); balance-type rows come on top of it.
+    # When a summary dict is given it is filled after the last chunk with what the parser should find.
+    if number_format not in NUMBER_FORMATS:
+        raise ValueError(f"number_format must be one of {NUMBER_FORMATS}, got {number_format!r}")
+    symbol_mix = symbol_mix or DEFAULT_SYMBOL_MIX
+    chunk_options = (int(n_deals), seed, symbol_mix, partial_close_ratio, max(2, int(chunk_deals)), start_time)
+    format_rng = lambda chunk_index, table: np.random.default_rng([seed, chunk_index, table]) # Only used by 'mixed'
+
+    yield "\n".join(["Trade History Report", "Name:,,,Synthetic Trader", "Account:,,,51234567 (USD, Synthetic-Server, real, Hedge)",
+                     "Company:,,,Synthetic Markets Ltd", f"Date:,,,{start_time.replace('-', '.').replace('T', ' ')}", "",
+                     POSITIONS_HEADER]) + "\n"
+    n_closed_positions = 0
+    for chunk in _position_chunks(*chunk_options):
+        n_closed_positions += int((chunk['n_outs'] > 0).sum())
+        lines = _positions_lines(chunk, number_format, format_rng(chunk['chunk_index'], 0))
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    yield "\n" + ORDERS_HEADER + "\n"
+    next_order_id = _FIRST_ORDER_ID
+    for chunk in _position_chunks(*chunk_options):
+        lines = _orders_lines(chunk, next_order_id, number_format, format_rng(chunk['chunk_index'], 1))
+        next_order_id += len(chunk['deals'])
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    deposit_time = start_time.replace('-', '.').replace('T', ' ')
+    yield "\n".join(["", DEALS_HEADER, f"{deposit_time},1,,balance,,,,,0.00,0.00,0.00,{_format_numbers([initial_deposit], 2, number_format, format_rng(0, 2))[0]},"
+                     f"{_format_numbers([initial_deposit], 2, number_format, format_rng(0, 3))[0]},Initial deposit"]) + "\n"
+    next_deal_id, next_order_id, balance, credit, n_balance_rows = 2, _FIRST_ORDER_ID, float(initial_deposit), 0.0, 1
+    results_state = _new_results_state(initial_deposit)
+    open_position = None
+    for chunk in _position_chunks(*chunk_options):
+        lines, balance, credit_added, n_rows_added, row_balances = _deals_lines(
+            chunk, next_deal_id, next_order_id, balance, balance_every, number_format, format_rng(chunk['chunk_index'], 2))
+        _update_results_state(results_state, chunk, row_balances)
+        next_deal_id += len(lines)
+        next_order_id += len(chunk['deals'])
+        credit += credit_added
+        n_balance_rows += n_rows_added
+        if (chunk['n_outs'] == 0).any():
+            open_position = chunk
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    block_rng = format_rng(0, 4)
+    money = lambda v: _format_numbers([v], 2, number_format, block_rng)[0]
+    floating, margin = 0.0, 0.0
+    if open_position is not None: # The last deal opened a position that is still running at report time
+        i_open = int(np.flatnonzero(open_position['n_outs'] == 0)[0])
+        floating = round(float(open_position['volumes'][i_open]) * 37.5 * (1 if open_position['side_sign'][i_open] > 0 else -1), 2)
+        margin = round(float(open_position['volumes'][i_open]) * 1000.0, 2)
+    equity = round(balance + credit + floating, 2)
+    margin_level = f"{equity / margin * 100:.2f}%" if margin else "0.00%"
+    yield "\n".join(["", f"Balance:,,,{money(balance)},,,Free Margin:,,,{money(equity - margin)}",
+                     f"Credit Facility:,,,{money(credit)},,,Margin:,,,{money(margin)}",
+                     f"Floating P/L:,,,{money(floating)},,,Margin Level:,,,{margin_level}",
+                     f"Equity:,,,{money(equity)}", ""] +
+                    _results_lines(results_state, initial_deposit, number_format, block_rng)) + "\n"
+
+    if summary is not None:
+        summary.update({'deals': int(n_deals), 'balance_rows': n_balance_rows, 'orders': int(n_deals), 'positions': n_closed_positions,
+                        'open_positions': int(open_position is not None), 'balance': round(balance, 2), 'equity': equity, 'credit': round(credit, 2),
+                        'total_trades': results_state['trades'],
+                        'total_net_profit': round(results_state['gross_profit'] + results_state['gross_loss'], 2)})
+
+
+def write_statement(output, n_deals, **options):
+    # output: a path, "-" for stdout, or an open text file. Returns the summary dict
+    summary = {}
+    if hasattr(output, 'write'):
+        for text_chunk in iter_statement_chunks(n_deals, summary=summary, **options):
+            output.write(text_chunk)
+    elif output == "-":
+        return write_statement(sys.stdout, n_deals, **options)
+    else:
+        with open(output, "w", encoding="utf-8", newline="") as out_file:
+            return write_statement(out_file, n_deals, **options)
+    return summary
+
+
+def statement_text(n_deals, **options):
+    # Whole statement as one string plus its summary; for sizes that fit comfortably in memory
+    summary = {}
+    text = "".join(iter_statement_chunks(n_deals, summary=summary, **options))
+    return text, summary
+
+
+def _parse_symbol_mix(text):
+    mix = {}
+    for item in text.split(","):
+        symbol, _, weight = item.partition(":")
+        mix[symbol.strip().upper()] = float(weight) if weight else 1.0
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic MT5 statement CSV")
+    parser.add_argument('output', help="output path, or - for stdout")
+    parser.add_argument('--deals', type=int, default=10_000, help="trade deals to generate (balance rows come on top)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--symbols', type=_parse_symbol_mix, default=None, help="symbol mix, e.g. XAUUSD:4,EURUSD:3,BTCUSD:1")
+    parser.add_argument('--partial-close', type=float, default=0.3, help="share of positions closed in two deals")
+    parser.add_argument('--balance-every', type=int, default=5_000, help="about one balance/credit row per N deals (0 = only the initial deposit)")
+    parser.add_argument('--number-format', choices=NUMBER_FORMATS, default='space')
+    parser.add_argument('--chunk-deals', type=int, default=50_000, help="deals generated and written per chunk")
+    args = parser.parse_args()
+    result = write_statement(args.output, args.deals, seed=args.seed, symbol_mix=args.symbols, partial_close_ratio=args.partial_close,
+                             balance_every=args.balance_every, number_format=args.number_format, chunk_deals=args.chunk_deals)
+    print(result, file=sys.stderr)